@@ -4,6 +4,10 @@ from .__pkginfo__ import version as __version__
 
 
 def run_control():
-    """run control"""
+    """run control, on a control daemon if one is listening"""
+    from control.client import forward
+    ret = forward(sys.argv[1:])
+    if ret is not None:
+        sys.exit(ret)
     from control.control import main
     main(sys.argv[1:])
@@ -0,0 +1,62 @@
+"""
+The asyncio core. Docker, the registries and event subprocesses are talked
+to through coroutines, so a command can have many calls in flight at once,
+and the commands that are coroutines are run to the end by run().
+
+Each thread gets one event loop, kept between calls, and one client per
+docker daemon and registry on that loop, so connections stay open from one
+command to the next in the daemon.
+"""
+
+import asyncio
+import threading
+
+from control.aio.docker import DEFAULT_HOST, AsyncDocker
+from control.aio.events import run_event
+from control.aio.registry import AsyncRegistry
+
+_local = threading.local()
+
+
+def event_loop():
+    """This thread's event loop"""
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _local.loop = asyncio.new_event_loop()
+        _local.clients = {}
+    return loop
+
+
+def run(coro):
+    """Run a coroutine to the end on this thread's event loop"""
+    return event_loop().run_until_complete(coro)
+
+
+def _client(key, make):
+    event_loop()
+    if key not in _local.clients:
+        _local.clients[key] = make()
+    return _local.clients[key]
+
+
+def docker_client(base_url=DEFAULT_HOST):
+    """This thread's AsyncDocker for the daemon at base_url"""
+    return _client(('docker', base_url), lambda: AsyncDocker(base_url))
+
+
+def get_registry(domain, port=None, no_verify=False):
+    """This thread's AsyncRegistry for domain and port"""
+    return _client(('registry', domain, port, no_verify),
+                   lambda: AsyncRegistry(domain, port, no_verify=no_verify))
+
+
+def close():
+    """Hang up every client on this thread, and close its event loop"""
+    loop = getattr(_local, 'loop', None)
+    if loop is None or loop.is_closed():
+        return
+    for client in _local.clients.values():
+        client.close()
+    _local.clients = {}
+    loop.run_until_complete(loop.shutdown_asyncgens())
+    loop.close()
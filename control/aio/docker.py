@@ -0,0 +1,223 @@
+"""
+The docker Engine API as coroutines, for the calls Control's commands make.
+
+Arguments and return values follow docker.Client, and errors are docker-py's
+own NotFound and APIError with the daemon's message as the explanation, so
+the code that makes sense of docker's errors works on both.
+"""
+
+import json
+import logging
+import struct
+
+import docker
+import docker.auth
+import docker.utils
+
+from control.aio.http import HTTPClient
+
+module_logger = logging.getLogger('control.aio.docker')
+module_logger.setLevel(logging.DEBUG)
+
+DEFAULT_HOST = 'unix:///var/run/docker.sock'
+API_VERSION = docker.constants.DEFAULT_DOCKER_API_VERSION
+
+
+def _id(container):
+    """docker.Client takes an inspect dict anywhere it takes an ID"""
+    if isinstance(container, dict):
+        return container.get('Id')
+    return container
+
+
+def _explanation(content):
+    """What the daemon said went wrong, as bytes like docker-py has it"""
+    try:
+        message = json.loads(content.decode('utf-8'))['message']
+    except (ValueError, KeyError, TypeError):
+        return content.strip()
+    return message.encode('utf-8')
+
+
+async def _demultiplex(chunks, tty):
+    """
+    (stream, line) from the chunks of a logs or attach body. Without a tty
+    docker frames each write with its stream and length
+    """
+    buffers = {1: b'', 2: b''}
+    pending = b''
+    async for chunk in chunks:
+        if tty:
+            writes = [(1, chunk)]
+        else:
+            pending += chunk
+            writes = []
+            while len(pending) >= 8:
+                stream, size = struct.unpack('>BxxxL', pending[:8])
+                if len(pending) < 8 + size:
+                    break
+                writes.append((stream if stream in buffers else 1, pending[8:8 + size]))
+                pending = pending[8 + size:]
+        for stream, data in writes:
+            *lines, buffers[stream] = (buffers[stream] + data).split(b'\n')
+            for line in lines:
+                yield stream, line
+    for stream, rest in buffers.items():
+        if rest:
+            yield stream, rest
+
+
+class AsyncDocker:
+    """One docker daemon, talked to over asyncio"""
+
+    def __init__(self, base_url=DEFAULT_HOST, version=API_VERSION, ssl=None, limit=None):
+        self.base_url = base_url
+        self.version = version
+        kwargs = {'limit': limit} if limit else {}
+        self.http = HTTPClient(base_url, ssl=ssl, **kwargs)
+        self._auths = None
+
+    def __repr__(self):
+        return 'AsyncDocker({!r})'.format(self.base_url)
+
+    def close(self):
+        """Hang up on the daemon"""
+        self.http.close()
+
+    async def _request(self, method, path, params=None, body=None, headers=None,
+                       stream=False):
+        response = await self.http.request(
+            method, '/v{}{}'.format(self.version, path), params=params, body=body,
+            headers=headers, stream=stream)
+        if response.status_code >= 400:
+            await response.read()
+            error = docker.errors.NotFound if response.status_code == 404 \
+                else docker.errors.APIError
+            raise error('{} {}'.format(response.status_code, response.reason), response,
+                        explanation=_explanation(response.content))
+        return response
+
+    async def _json(self, method, path, **kwargs):
+        response = await self._request(method, path, **kwargs)
+        return await response.json() if response.content else None
+
+    async def info(self):
+        """docker info"""
+        return await self._json('GET', '/info')
+
+    async def version_info(self):
+        """docker version"""
+        return await self._json('GET', '/version')
+
+    async def inspect_container(self, container):
+        """docker inspect on a container"""
+        return await self._json('GET', '/containers/{}/json'.format(_id(container)))
+
+    async def containers(self, all=False, filters=None):  # pylint: disable=redefined-builtin
+        """docker ps, with filters like {'label': ['key=value']}"""
+        return await self._json('GET', '/containers/json', params={
+            'all': all, 'filters': json.dumps(filters) if filters else None})
+
+    async def images(self, all=False, filters=None):  # pylint: disable=redefined-builtin
+        """docker images, with filters like {'dangling': ['true']}"""
+        return await self._json('GET', '/images/json', params={
+            'all': all, 'filters': json.dumps(filters) if filters else None})
+
+    async def inspect_image(self, image):
+        """docker inspect on an image"""
+        return await self._json('GET', '/images/{}/json'.format(image))
+
+    def create_host_config(self, **kwargs):
+        """The HostConfig for create_container. This one doesn't need the daemon"""
+        return docker.utils.create_host_config(version=self.version, **kwargs)
+
+    async def create_container(self, image, command=None, name=None, **kwargs):
+        """Create a container, taking what docker.Client.create_container takes"""
+        if isinstance(kwargs.get('volumes'), str):
+            kwargs['volumes'] = [kwargs['volumes']]
+        config = docker.utils.create_container_config(self.version, image, command, **kwargs)
+        return await self._json('POST', '/containers/create', params={'name': name},
+                                body=config)
+
+    async def start(self, container):
+        """Start a created container"""
+        await self._request('POST', '/containers/{}/start'.format(_id(container)))
+
+    async def stop(self, container, timeout=10):
+        """Stop a container, killing it if it takes longer than timeout seconds"""
+        await self._request('POST', '/containers/{}/stop'.format(_id(container)),
+                            params={'t': timeout})
+
+    async def kill(self, container, signal=None):
+        """Kill a container"""
+        await self._request('POST', '/containers/{}/kill'.format(_id(container)),
+                            params={'signal': signal})
+
+    async def remove_container(self, container, v=False, force=False):
+        """Remove a container, and its anonymous volumes with v"""
+        await self._request('DELETE', '/containers/{}'.format(_id(container)),
+                            params={'v': v, 'force': force})
+
+    async def create_volume(self, name, labels=None):
+        """Create a named volume. docker hands back the one there is if it exists"""
+        return await self._json('POST', '/volumes/create',
+                                body={'Name': name, 'Labels': labels or {}})
+
+    async def remove_volume(self, name):
+        """Remove a named volume"""
+        await self._request('DELETE', '/volumes/{}'.format(name))
+
+    async def remove_image(self, image, force=False, noprune=False):
+        """Remove an image, or one of its tags"""
+        return await self._json('DELETE', '/images/{}'.format(image),
+                                params={'force': force, 'noprune': noprune})
+
+    async def logs(self, container, follow=False, timestamps=False, tail='all', since=None,
+                   tty=False):
+        """
+        Yield (stream, line) for each line a container wrote, 1 for stdout
+        and 2 for stderr. A container with a tty writes one stream, stdout
+        """
+        response = await self._request(
+            'GET', '/containers/{}/logs'.format(_id(container)), params={
+                'stdout': True, 'stderr': True, 'follow': follow,
+                'timestamps': timestamps, 'tail': tail, 'since': since}, stream=True)
+        async with response:
+            async for stream, line in _demultiplex(response.iter_chunks(), tty):
+                yield stream, line
+
+    async def stats(self, container):
+        """Yield a container's resource usage each time docker samples it"""
+        response = await self._request(
+            'GET', '/containers/{}/stats'.format(_id(container)), params={'stream': True},
+            stream=True)
+        async with response:
+            async for sample in response.objects():
+                yield sample
+
+    async def events(self, filters=None, since=None):
+        """Yield docker's events as they happen, with filters like {'type': ['container']}"""
+        response = await self._request('GET', '/events', params={
+            'since': since, 'filters': json.dumps(filters) if filters else None}, stream=True)
+        async with response:
+            async for event in response.objects():
+                yield event
+
+    def _auth_header(self, repository):
+        """X-Registry-Auth for the registry repository is in, the way docker-py finds it"""
+        if self._auths is None:
+            self._auths = docker.auth.load_config()
+        registry, _ = docker.auth.resolve_repository_name(repository)
+        auth = docker.auth.resolve_authconfig(self._auths, registry)
+        if not auth:
+            return {}
+        return {'X-Registry-Auth': docker.auth.encode_header(auth).decode('ascii')}
+
+    async def pull(self, repository, tag=None):
+        """Pull an image, yielding each line of progress docker sends back"""
+        response = await self._request(
+            'POST', '/images/create', params={'fromImage': repository, 'tag': tag},
+            headers=self._auth_header(repository), stream=True)
+        async with response:
+            async for line in response.objects():
+                yield line
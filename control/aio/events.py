@@ -0,0 +1,65 @@
+"""Run a service's pre/postbuild events as asyncio subprocesses"""
+
+import asyncio
+import logging
+import os
+import sys
+
+module_logger = logging.getLogger('control.aio.events')
+module_logger.setLevel(logging.DEBUG)
+
+
+def event_command(event, env, service):
+    """The shell command for event in env, or None if there isn't one"""
+    try:
+        if isinstance(service.events[event], dict):
+            return service.events[event][env]
+        return service.events[event]
+    except KeyError:
+        return None
+
+
+def _target(stream):
+    """
+    Where an event's output goes: straight to stream when it is a real file,
+    or through a pipe copied into it when it isn't, like the client's socket
+    the daemon redirects sys.stdout to
+    """
+    try:
+        stream.fileno()
+    except (OSError, ValueError):
+        return asyncio.subprocess.PIPE
+    return None
+
+
+async def _copy(reader, stream):
+    if reader is None:
+        return
+    while True:
+        chunk = await reader.read(4096)
+        if not chunk:
+            break
+        stream.write(chunk.decode('utf-8', 'replace'))
+        stream.flush()
+
+
+async def run_event(event, env, service):
+    """
+    Run an event in the directory of the service's dev Dockerfile. Returns
+    whether it worked, which it did if there was nothing to run
+    """
+    cmd = event_command(event, env, service)
+    if cmd is None:
+        return True
+    module_logger.debug('%s for %s: %s', event, service['name'], cmd)
+    out, err = sys.stdout, sys.stderr
+    # Not chdir, since builds on other docker hosts run their events at once
+    process = await asyncio.create_subprocess_shell(
+        cmd, cwd=os.path.dirname(service['dockerfile']['dev']),
+        stdout=_target(out), stderr=_target(err))
+    await asyncio.gather(_copy(process.stdout, out), _copy(process.stderr, err))
+    if await process.wait() != 0:
+        print("{} action for {} failed. Will not "
+              "continue building service.".format(event, service['name']))
+        return False
+    return True
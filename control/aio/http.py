@@ -0,0 +1,265 @@
+"""
+HTTP/1.1 on asyncio streams, which is all the docker daemon and a registry
+need: Unix sockets, and TCP with or without TLS, connections kept alive and
+reused, Content-Length and chunked bodies, and responses that are either
+read whole or streamed a chunk or a JSON object at a time.
+"""
+
+import asyncio
+import codecs
+import json
+import logging
+import urllib.parse
+
+from control.__pkginfo__ import version
+
+module_logger = logging.getLogger('control.aio.http')
+module_logger.setLevel(logging.DEBUG)
+
+# Connections a client has open at once. Requests past that wait their turn
+DEFAULT_LIMIT = 16
+READ_SIZE = 64 * 1024
+USER_AGENT = 'control/{}'.format(version)
+# Docker streams one JSON object after another, not always one to a line
+_decoder = json.JSONDecoder()
+
+
+class Connection:
+    """One socket to the server"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        """Hang up"""
+        self.writer.close()
+
+
+class Response:
+    """
+    The status and headers of a response, and a body to read or stream.
+    Whoever asked for a streamed response closes it, which async with does
+    """
+
+    def __init__(self, client, connection, status, reason, headers, length):
+        self.status_code = status
+        self.reason = reason
+        self.headers = headers
+        # The whole body, once read() has read it
+        self.content = None
+        self._client = client
+        self._connection = connection
+        # Bytes in the body, 'chunked', or None to read until the server hangs up
+        self._length = length
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def iter_chunks(self):
+        """The body, in whatever pieces it arrives"""
+        reader = self._connection.reader
+        try:
+            if self._length == 'chunked':
+                while True:
+                    size = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+                    if not size:
+                        # Trailers end with an empty line
+                        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                            pass
+                        break
+                    data = await reader.readexactly(size)
+                    await reader.readexactly(2)
+                    yield data
+            elif self._length is None:
+                while True:
+                    data = await reader.read(READ_SIZE)
+                    if not data:
+                        break
+                    yield data
+            else:
+                remaining = self._length
+                while remaining:
+                    data = await reader.read(min(remaining, READ_SIZE))
+                    if not data:
+                        raise asyncio.IncompleteReadError(b'', remaining)
+                    remaining -= len(data)
+                    yield data
+        except BaseException:
+            self.close()
+            raise
+        self._done(reusable=self._length is not None and
+                   self.headers.get('connection', '').lower() != 'close')
+
+    async def read(self):
+        """The whole body"""
+        if self.content is None:
+            self.content = b''.join([chunk async for chunk in self.iter_chunks()])
+        return self.content
+
+    async def json(self):
+        """The body, decoded from JSON"""
+        return json.loads((await self.read()).decode('utf-8'))
+
+    async def objects(self):
+        """Each JSON value in a streamed body, as soon as all of it is in"""
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        buffer = ''
+        async for chunk in self.iter_chunks():
+            buffer += decoder.decode(chunk)
+            while True:
+                buffer = buffer.lstrip()
+                if not buffer:
+                    break
+                try:
+                    value, end = _decoder.raw_decode(buffer)
+                except ValueError:
+                    # The rest of it hasn't arrived yet
+                    break
+                buffer = buffer[end:]
+                yield value
+        if buffer.strip():
+            raise ValueError('Stream ended partway through {!r}'.format(buffer[:80]))
+
+    def close(self):
+        """Give up on whatever is left of the body"""
+        self._done(reusable=False)
+
+    def _done(self, reusable):
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        self._client.release(connection, reusable)
+
+
+class HTTPClient:
+    """
+    Requests to one server, over as many as limit kept-alive connections.
+    base_url is unix:///path/to.sock, tcp://host:port, http:// or https://
+    """
+
+    def __init__(self, base_url, ssl=None, limit=DEFAULT_LIMIT, headers=None):
+        scheme, _, rest = base_url.partition('://')
+        self.ssl = ssl
+        if scheme in ('unix', 'http+unix'):
+            self.path = '/' + rest.lstrip('/')
+            self.host = 'localhost'
+        else:
+            url = urllib.parse.urlsplit('//' + rest)
+            self.path = None
+            self.address = (url.hostname, url.port or (443 if scheme == 'https' else 80))
+            self.host = url.netloc
+            if scheme == 'https' and ssl is None:
+                self.ssl = True
+        self.headers = dict(headers or {})
+        self.idle = []
+        self.slots = asyncio.Semaphore(limit)
+
+    def __repr__(self):
+        return 'HTTPClient({!r})'.format(self.path or self.host)
+
+    async def request(self, method, path, params=None, headers=None, body=None, stream=False):
+        """
+        Send a request and wait for the status and headers. Unless stream is
+        True, the body is read as well. Dicts and lists go as JSON
+        """
+        if params:
+            path += '?' + urllib.parse.urlencode(
+                [(key, _param(value)) for key, value in params.items() if value is not None],
+                doseq=True)
+        head = {'Host': self.host, 'User-Agent': USER_AGENT}
+        head.update(self.headers)
+        head.update(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            head.setdefault('Content-Type', 'application/json')
+        if body is not None or method in ('POST', 'PUT'):
+            head['Content-Length'] = str(len(body or b''))
+        message = ['{} {} HTTP/1.1'.format(method, path)]
+        message += ['{}: {}'.format(key, value) for key, value in head.items()]
+        message = ('\r\n'.join(message) + '\r\n\r\n').encode('latin-1') + (body or b'')
+
+        await self.slots.acquire()
+        try:
+            response = await self._exchange(method, message)
+        except BaseException:
+            self.slots.release()
+            raise
+        if not stream:
+            await response.read()
+        return response
+
+    async def _exchange(self, method, message):
+        while True:
+            reused = bool(self.idle)
+            connection = self.idle.pop() if reused else await self._connect()
+            try:
+                connection.writer.write(message)
+                await connection.writer.drain()
+                return await self._response(connection, method)
+            except (ConnectionError, EOFError):
+                connection.close()
+                if not reused:
+                    raise
+                # The server hung up on a connection that sat idle. Try a fresh one
+                module_logger.debug('%r dropped an idle connection', self)
+
+    async def _connect(self):
+        if self.path:
+            reader, writer = await asyncio.open_unix_connection(self.path, limit=READ_SIZE)
+        else:
+            reader, writer = await asyncio.open_connection(
+                *self.address, ssl=self.ssl or None, limit=READ_SIZE,
+                server_hostname=self.address[0] if self.ssl else None)
+        return Connection(reader, writer)
+
+    async def _response(self, connection, method):
+        reader = connection.reader
+        line = await reader.readline()
+        if not line:
+            raise EOFError('no response')
+        # HTTP/1.1 200 OK, where the reason can have spaces or be missing
+        parts = line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ''
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            key = key.strip().lower()
+            headers[key] = '{}, {}'.format(headers[key], value.strip()) \
+                if key in headers else value.strip()
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            length = 0
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            length = 'chunked'
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+        else:
+            length = None
+        return Response(self, connection, status, reason, headers, length)
+
+    def release(self, connection, reusable):
+        """Take a connection back once its response is done with"""
+        if reusable:
+            self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        """Hang up every idle connection"""
+        while self.idle:
+            self.idle.pop().close()
+
+
+def _param(value):
+    """Docker reads booleans in the query as 1 and 0"""
+    if isinstance(value, bool):
+        return int(value)
+    return value
@@ -0,0 +1,206 @@
+"""
+Talk to a V2 registry over asyncio. It answers what control.registry's
+Registry does, and finds certificates and logins in the same places: the
+registry's directory under /etc/docker/certs.d, and ~/.docker/config.json.
+Registries that hand out tokens are asked for one when they want it.
+"""
+
+import json
+import logging
+import os
+import ssl
+import urllib.parse
+
+from control.aio.http import HTTPClient
+from control.metrics import build_metrics
+
+module_logger = logging.getLogger('control.aio.registry')
+module_logger.setLevel(logging.DEBUG)
+
+CERTDIR = '/etc/docker/certs.d'
+# What docker asks for when it pulls, so digests match the ones it records
+SCHEMA2 = 'application/vnd.docker.distribution.manifest.v2+json'
+
+
+def _ssl_context(certdir, no_verify=False):
+    """Trust the registry's CA certificates, and present a client cert if it has one"""
+    context = ssl.create_default_context()
+    if no_verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return context
+    if not os.path.isdir(certdir):
+        return context
+    for name in sorted(os.listdir(certdir)):
+        path = os.path.join(certdir, name)
+        if name.endswith('.crt'):
+            module_logger.debug('trusting %s', path)
+            context.load_verify_locations(path)
+        elif name.endswith('.cert'):
+            key = path[:-len('.cert')] + '.key'
+            if os.path.isfile(key):
+                context.load_cert_chain(path, key)
+    return context
+
+
+def _basic_auth(endpoint):
+    """The Authorization header docker login left for endpoint, if any"""
+    config = os.path.expanduser('~/.docker/config.json')
+    if not os.path.isfile(config):
+        return None
+    with open(config) as f:
+        try:
+            auth = json.load(f)['auths']['https://{}'.format(endpoint)]['auth']
+        except KeyError:
+            return None
+        except ValueError as e:
+            module_logger.warning('Docker config file not valid JSON: %s', e)
+            return None
+    return 'Basic ' + auth
+
+
+def _challenge(header):
+    """The scheme and parameters of a WWW-Authenticate header"""
+    scheme, _, rest = header.partition(' ')
+    params = {}
+    for part in rest.split(','):
+        key, _, value = part.strip().partition('=')
+        if key:
+            params[key] = value.strip('"')
+    return scheme.lower(), params
+
+
+class AsyncRegistry:
+    """A V2 registry, at domain and port"""
+
+    def __init__(self, domain, port=None, certdir=CERTDIR, no_verify=False):
+        self.domain = domain
+        self.port = port
+        self.endpoint = '{}:{}'.format(domain, port) if port else domain
+        self.baseuri = '/v2'
+        self.basic = _basic_auth(self.endpoint)
+        self.context = _ssl_context(os.path.join(certdir, self.endpoint), no_verify)
+        self.http = HTTPClient('https://' + self.endpoint, ssl=self.context)
+        # scope: the bearer token for it
+        self.tokens = {}
+
+    def __repr__(self):
+        return 'AsyncRegistry({!r})'.format(self.endpoint)
+
+    def close(self):
+        """Hang up on the registry"""
+        self.http.close()
+
+    async def get(self, path, scope='', headers=None):
+        """GET path, logging in or fetching a token if the registry asks"""
+        with build_metrics.registry(self.endpoint):
+            response = await self.http.request(
+                'GET', path, headers=dict(headers or {}, **self._auth(scope)))
+        if response.status_code == 401:
+            # Basic auth already went along with the request, if we have any
+            scheme, params = _challenge(response.headers.get('www-authenticate', ''))
+            token = await self._token(params) if scheme == 'bearer' else None
+            if token:
+                self.tokens[scope] = token
+                with build_metrics.registry(self.endpoint):
+                    response = await self.http.request(
+                        'GET', path, headers=dict(headers or {}, **self._auth(scope)))
+        if response.status_code == 401:
+            module_logger.debug('not logged into registry %s', self.endpoint)
+        return response
+
+    def _auth(self, scope):
+        if scope in self.tokens:
+            return {'Authorization': 'Bearer ' + self.tokens[scope]}
+        if self.basic:
+            return {'Authorization': self.basic}
+        return {}
+
+    async def _token(self, params):
+        """A token from the realm the registry pointed at"""
+        if 'realm' not in params:
+            return ''
+        url = urllib.parse.urlsplit(params['realm'])
+        query = {key: params[key] for key in ('service', 'scope') if key in params}
+        realm = self.http if url.netloc == self.endpoint else HTTPClient(
+            '{}://{}'.format(url.scheme, url.netloc), ssl=self.context)
+        try:
+            response = await realm.request(
+                'GET', url.path, params=query,
+                headers={'Authorization': self.basic} if self.basic else None)
+        finally:
+            if realm is not self.http:
+                realm.close()
+        if response.status_code != 200:
+            module_logger.debug('%s would not give a token: %s', params['realm'],
+                                response.status_code)
+            return ''
+        body = await response.json()
+        return body.get('token') or body.get('access_token') or ''
+
+    async def _manifest(self, repo):
+        response = await self.get(
+            '{base}/{image}/manifests/{tag}'.format(base=self.baseuri, image=repo.image,
+                                                     tag=repo.tag),
+            'repository:{}:pull'.format(repo.image))
+        if response.status_code == 200:
+            return await response.json()
+        return None
+
+    async def get_info_of_repo(self, repo):
+        """The manifest of the repo (image and tag), or {}"""
+        return await self._manifest(repo) or {}
+
+    async def get_id_of_repo(self, repo):
+        """The digest of the repo's top layer, or '' if it doesn't exist"""
+        manifest = await self._manifest(repo)
+        if manifest:
+            return manifest['fsLayers'][0]['blobSum']
+        return ''
+
+    async def get_digest_of_repo(self, repo):
+        """The content digest docker would pull the repo at, or '' if it doesn't exist"""
+        response = await self.get(
+            '{base}/{image}/manifests/{tag}'.format(base=self.baseuri, image=repo.image,
+                                                     tag=repo.tag),
+            'repository:{}:pull'.format(repo.image), headers={'Accept': SCHEMA2})
+        if response.status_code != 200:
+            return ''
+        return response.headers.get('docker-content-digest', '')
+
+    async def get_build_date_of_repo(self, repo):
+        """When the repo was built, or '' if it doesn't exist"""
+        manifest = await self._manifest(repo)
+        if not manifest:
+            return ''
+        try:
+            return json.loads(manifest['history'][0]['v1Compatibility'])['created']
+        except (KeyError, IndexError):
+            module_logger.info('Cannot determine age of image %s', repo)
+            return ''
+
+    async def get_tags_of_image(self, image, page_size=None):
+        """
+        Every tag of image, following the registry's pages. page_size asks
+        for that many at a time, where the registry would send them all
+        """
+        tags = []
+        path = '{base}/{image}/tags/list'.format(base=self.baseuri, image=image)
+        if page_size:
+            path += '?n={}'.format(page_size)
+        while path:
+            response = await self.get(path, 'repository:{}:pull'.format(image))
+            if response.status_code != 200:
+                break
+            tags += (await response.json()).get('tags') or []
+            path = _next_page(response.headers.get('link', ''))
+        return tags
+
+
+def _next_page(link):
+    """The path in a Link: <...>; rel="next" header"""
+    for part in link.split(','):
+        target, _, rel = part.partition(';')
+        if 'next' in rel:
+            return target.strip().strip('<>')
+    return None
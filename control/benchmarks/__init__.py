@@ -0,0 +1,15 @@
+"""
+Benchmarks for reading in Controlfiles and turning services into commands.
+
+Nothing here needs docker or a network. Synthetic Controlfile trees are
+generated into a temporary directory, registry calls go to a FakeRegistry
+on localhost, and each benchmark is timed a few times in this process. Run them with
+
+    python -m control.benchmarks --output results.json
+
+and compare against an earlier run with --baseline to fail when something
+got slower than --threshold allows.
+"""
+
+from control.benchmarks.generate import generate_tree, nested_options
+from control.benchmarks.suite import BENCHMARKS, compare, measure, run_suite
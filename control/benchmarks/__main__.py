@@ -0,0 +1,7 @@
+"""python -m control.benchmarks"""
+
+import sys
+
+from control.benchmarks.suite import main
+
+sys.exit(main())
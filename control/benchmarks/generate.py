@@ -0,0 +1,99 @@
+"""
+Write synthetic Controlfile trees that look like a big project's: a chain of
+metaservices nested `depth` deep, each with its own vars and options
+transforms, and services spread across the levels. Every tenth service lives
+in a Controlfile of its own, the way projects split services into their own
+repositories.
+"""
+
+import json
+import os
+from os.path import join
+
+
+def nested_options(level):
+    """The options transforms a metaservice at level applies to its services"""
+    return {
+        'name': {'suffix': '.l{}'.format(level)},
+        'hostname': {'prefix': 'l{}-'.format(level)},
+        'image': {'replace': '{REGISTRY}/{SERVICE}:{TAG}'},
+        'environment': {
+            'union': ['LEVEL_{}={{TAG}}'.format(level)],
+            'suffix': ['DEPTH={}'.format(level)],
+        },
+        'dns_search': {'union': ['l{}.{{DOMAIN}}'.format(level)]},
+        'volumes': {
+            'union': {
+                'shared': ['/var/log/l{}:/var/log/{{SERVICE}}'.format(level)],
+                'dev': ['{{GIT_ROOT}}/l{}:/src/l{}'.format(level, level)],
+            },
+        },
+        'user': {'replace': '{UID}:{GID}'},
+    }
+
+
+def service_definition(index):
+    """A service with a handful of variables to substitute in"""
+    return {
+        'image': 'bench/svc{}:{{TAG}}'.format(index),
+        'required': index % 3 != 0,
+        'dockerfile': {'dev': 'svc{}/Dockerfile.dev'.format(index),
+                       'prod': 'svc{}/Dockerfile'.format(index)},
+        'commands': {'test': 'run-tests {SERVICE}', 'shell': '/bin/sh'},
+        'container': {
+            'name': 'svc{}'.format(index),
+            'hostname': 'svc{}.{{DOMAIN}}'.format(index),
+            'environment': [
+                'SERVICE={SERVICE}',
+                'INDEX={}'.format(index),
+                'BRANCH={TAG}',
+                'UPSTREAM=http://svc{}.{{DOMAIN}}:8080'.format(max(index - 1, 0)),
+            ],
+            'volumes': ['/srv/{SERVICE}:/data', '/cache'],
+            'dns_search': ['{DOMAIN}'],
+            'working_dir': '/srv/{SERVICE}',
+        },
+    }
+
+
+def generate_tree(root, services=100, depth=4):
+    """
+    Write a Controlfile tree with `services` services under root and return
+    the path to its top Controlfile
+    """
+    per_level = [services // depth + (1 if level < services % depth else 0)
+                 for level in range(depth)]
+    index = 0
+    inner = None
+    # Build from the innermost metaservice outwards
+    for level in reversed(range(depth)):
+        meta = {
+            'vars': {
+                'DOMAIN': 'l{}.bench.example.com'.format(level),
+                'TAG': '{{GIT_BRANCH}}-l{}'.format(level) if level else 'latest',
+                'REGISTRY': 'registry{}.example.com:5000'.format(level),
+                'GIT_ROOT': '/work',
+            },
+            'options': nested_options(level),
+            'services': {},
+        }
+        for _ in range(per_level[level]):
+            name = 'svc{}'.format(index)
+            definition = service_definition(index)
+            if index % 10 == 9:
+                os.makedirs(join(root, name), exist_ok=True)
+                with open(join(root, name, 'Controlfile'), 'w') as f:
+                    json.dump(definition, f)
+                definition = {'controlfile': join(root, name, 'Controlfile')}
+            meta['services'][name] = definition
+            index += 1
+        if inner is not None:
+            meta['services']['level{}'.format(level + 1)] = inner
+        inner = meta
+    # The top level only gets vars that every level below can lean on
+    inner['vars']['GIT_BRANCH'] = 'master'
+    os.makedirs(root, exist_ok=True)
+    path = join(root, 'Controlfile')
+    with open(path, 'w') as f:
+        json.dump(inner, f)
+    return path
@@ -0,0 +1,126 @@
+"""
+The options merge and normalize code as it was before options were compiled
+into plans, kept so the benchmarks can time the two side by side and the
+tests can check they give the same services.
+"""
+
+from random import randint
+import logging
+
+from control.substitution import _get_default_of_kind, _pick_most_generic, operations
+
+module_logger = logging.getLogger('control.benchmarks.legacy')  # pylint: disable=invalid-name
+
+
+def normalize_service(service, opers, variables):
+    """
+    Takes a service, and options and applies the transforms to the service.
+
+    Allowed args:
+    - service: must be service object that was created before hand
+    - options: a dict of options that define transforms to a service.
+      The format must conform to a Controlfile metaservice options
+      definition
+    Returns: a service with all the transforms applied and all the variables
+             substituted in.
+    """
+    # We check that the Controlfile only specifies operations we support,
+    # that way we aren't trusting a random user to accidentally get a
+    # random string eval'd.
+    for key, op, val in (
+            (key, op, val)
+            for key, ops in opers.items()
+            for op, val in ops.items() if (op in operations and
+                                           key in service.all_options)):
+        module_logger.log(11, "service '%s' %sing %s with '%s'.",
+                          service.service, op, key, val)
+        try:
+            replacement = operations[op](service[key], val)
+        except KeyError as e:
+            module_logger.debug(e)
+            module_logger.log(11, "service '%s' missing key '%s'",
+                              service.service, key)
+            module_logger.log(11, service.__dict__)
+            replacement = operations[op](_get_default_of_kind(val), val)
+        finally:
+            service[key] = replacement
+    for key in service.keys():
+        try:
+            module_logger.debug('now at %s, passing in %i vars', key, len(variables))
+            service[key] = _substitute_vars(service[key], variables)
+        except KeyError:
+            continue
+    return service['service'], service
+
+
+# used exclusively by visit_every_leaf, but defined outside it so it's only compiled once
+substitute_vars_decision_dict = {
+    # dict, list, str
+    (True, False, False): lambda d, vd: {k: _substitute_vars(v, vd) for k, v in d.items()},
+    (False, True, False): lambda d, vd: [x.format(**_merge_dicts(
+        vd,
+        {'RANDOM': str(randint(0, 10000))}
+    )) for x in d],
+    (False, False, True): lambda d, vd: d.format(**_merge_dicts(
+        vd,
+        {'RANDOM': str(randint(0, 10000))}
+    )),
+    (False, False, False): lambda d, vd: d
+}
+
+
+def _merge_dicts(*args):
+    """
+    Before python 3.5 you can't do foo(**dict_one, **dict_two)
+    so, this function exists.
+    """
+    if len(args) < 1:
+        return {}
+
+    ret = args[0].copy()
+    for d in args[1:]:
+        ret.update(d)
+    return ret
+
+
+def _substitute_vars(d, var_dict):  # pylint: disable=invalid-name
+    """
+    Visit every leaf and substitute any variables that are found. This function
+    is named poorly, it sounds like it should generically visit every and allow
+    a function to be applied to each leaf. It does not. I have no need for that
+    right now. If I find a need this will probably be the place that that goes.
+
+    Arguments:
+    - d does not necessarily need to be a dict
+    - var_dict should be a dictionary of variables that can be kwargs'd into
+      format
+    """
+    # DEBUGGING
+    module_logger.debug('now at %s', str(d))
+    # DEBUGGING
+    return substitute_vars_decision_dict[(
+        isinstance(d, dict),
+        isinstance(d, list),
+        isinstance(d, str)
+    )](d, var_dict)
+
+
+def satisfy_nested_options(outer, inner):
+    """
+    Merge two Controlfile options segments for nested Controlfiles.
+
+    - Merges appends by having "{{layer_two}}{{layer_one}}"
+    - Merges option additions with layer_one.push(layer_two)
+    """
+    merged = {}
+    for key in outer.keys() | inner.keys():
+        val = {}
+        for op in outer.get(key, {}).keys() | inner.get(key, {}).keys():
+            default_value = _pick_most_generic(inner.get(key, {}).get(op, None),
+                                               outer.get(key, {}).get(op, None))
+            joined = operations[op](inner.get(key, {}).get(op, default_value),
+                                    outer.get(key, {}).get(op, default_value))
+            if joined:
+                val[op] = joined
+        merged[key] = val
+    return merged
@@ -0,0 +1,356 @@
+"""
+The benchmarks, the harness that times them, and the regression check.
+
+Every benchmark is a function taking a Workspace and a size, and returning a
+(setup, func) pair. setup is called before each timed run and returns the
+arguments for func, so work like creating fresh services to normalize
+doesn't count against the benchmark. Only func is timed.
+"""
+
+import argparse
+import asyncio
+import copy
+import functools
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from control.benchmarks import legacy
+from control.benchmarks.generate import generate_tree, nested_options, service_definition
+from control.controlfile import Controlfile
+from control import aio
+from control.fakes import FakeDocker, FakeRegistry
+from control.functions import registry_dates
+from control.repository import Repository
+from control.script import render_script
+from control.service import Buildable, Startable, create_service
+from control.status import gather_status
+from control.substitution import compile_options, normalize_service, satisfy_nested_options
+
+module_logger = logging.getLogger('control.benchmarks')
+module_logger.setLevel(logging.DEBUG)
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+DEFAULT_DEPTHS = [2, 8, 32]
+DEFAULT_IMAGES = [1, 10, 50]
+# How much slower than the baseline a benchmark can get before it fails
+DEFAULT_THRESHOLD = 0.25
+
+
+class Workspace:
+    """Generated trees and loaded Controlfiles, shared between benchmarks"""
+
+    def __init__(self, root, depth=4):
+        self.root = root
+        self.depth = depth
+        self.trees = {}
+        self.controlfiles = {}
+        self.registry = None
+        self.docker = None
+
+    def tree(self, size):
+        """The top Controlfile of a tree of size services"""
+        if size not in self.trees:
+            self.trees[size] = generate_tree(
+                os.path.join(self.root, str(size)), size, self.depth)
+        return self.trees[size]
+
+    def controlfile(self, size):
+        """A Controlfile read in from the tree of size services"""
+        if size not in self.controlfiles:
+            self.controlfiles[size] = Controlfile(self.tree(size))
+        return self.controlfiles[size]
+
+    def fake_registry(self):
+        """A FakeRegistry"""
+        if self.registry is None:
+            self.registry = FakeRegistry().start()
+        return self.registry
+
+    def fake_docker(self):
+        """A FakeDocker with nothing on it yet"""
+        if self.docker is None:
+            self.docker = FakeDocker().start()
+        return self.docker
+
+    def round_trips(self):
+        """How many requests the fakes have answered so far"""
+        return sum(fake.round_trips() for fake in (self.registry, self.docker) if fake)
+
+    def close(self):
+        """Hang up on the fakes, and stop them"""
+        aio.close()
+        if self.docker:
+            self.docker.stop()
+            self.docker = None
+        if self.registry:
+            self.registry.stop()
+            self.registry = None
+
+    def variables(self):
+        """Variables like the ones a Controlfile hands down to its services"""
+        return {
+            'DOMAIN': 'bench.example.com', 'TAG': 'latest', 'GIT_ROOT': '/work',
+            'REGISTRY': 'registry.example.com:5000', 'GIT_BRANCH': 'master',
+            'UID': 1000, 'GID': 1000, 'HOSTNAME': 'bench',
+        }
+
+
+def bench_controlfile_init(workspace, size):
+    """Read in a whole Controlfile tree"""
+    path = workspace.tree(size)
+    return tuple, lambda: Controlfile(path)
+
+
+def _normalize(workspace, size, depth, engine):
+    satisfy, compile_plan, normalize = ENGINES[engine]
+    opers = {}
+    for level in reversed(range(depth)):
+        opers = satisfy(outer=opers, inner=nested_options(level))
+    definitions = [service_definition(i) for i in range(size)]
+    location = os.path.join(workspace.root, 'Controlfile')
+    variables = workspace.variables()
+
+    def setup():  # pylint: disable=missing-docstring
+        return ([create_service(copy.deepcopy(d), location) for d in definitions],)
+
+    def func(services):  # pylint: disable=missing-docstring
+        # A Controlfile compiles a metaservice's options once for all its services
+        plan = compile_plan(opers)
+        for service in services:
+            normalize(service, plan, dict(variables, SERVICE=service.service))
+    return setup, func
+
+
+def bench_normalize_service(workspace, size, engine='compiled'):
+    """Apply nested options and substitute variables into size services"""
+    return _normalize(workspace, size, workspace.depth, engine)
+
+
+def bench_normalize_deep(workspace, depth, engine='compiled'):
+    """Apply the options of depth nested metaservices to 100 services"""
+    return _normalize(workspace, 100, depth, engine)
+
+
+def bench_satisfy_nested_options(workspace, depth, engine='compiled'):
+    """Merge the options of depth nested metaservices"""
+    satisfy = ENGINES[engine][0]
+    levels = [nested_options(level) for level in range(depth)]
+
+    def func():  # pylint: disable=missing-docstring
+        opers = {}
+        for inner in reversed(levels):
+            opers = satisfy(outer=opers, inner=inner)
+        return opers
+    return tuple, func
+
+
+def bench_dump_run(workspace, size):
+    """Turn every startable service into a docker run command"""
+    services = [s for s in workspace.controlfile(size).services.values()
+                if isinstance(s, Startable)]
+    return tuple, lambda: [str(s.dump_run()) for s in services]
+
+
+def bench_dump_build(workspace, size):
+    """Turn every buildable service into a docker build command"""
+    services = [s for s in workspace.controlfile(size).services.values()
+                if isinstance(s, Buildable)]
+    return tuple, lambda: [str(s.dump_build()) for s in services]
+
+
+def bench_dump_script(workspace, size):
+    """Write the script for building and starting every service"""
+    ctrl = workspace.controlfile(size)
+    names = sorted(ctrl.services['all'])
+    return tuple, lambda: render_script(ctrl, names, 'default', lambda repo: True)
+
+
+def bench_registry_checks(workspace, images):
+    """
+    Read the build date of images base images from a registry, all at once,
+    the way build checks whether a FROM image is worth pulling
+    """
+    fake = workspace.fake_registry()
+    repos = []
+    for index in range(images):
+        fake.push('base{}'.format(index))
+        repos.append(Repository('base{}'.format(index), 'latest', 'localhost', fake.port))
+    return tuple, lambda: aio.run(registry_dates(repos, no_verify=True))
+
+
+def bench_status(workspace, size):
+    """
+    The status of every startable service, with every other one running,
+    the way `control status` finds it
+    """
+    fake = workspace.fake_docker()
+    client = aio.AsyncDocker(fake.url)
+    services = sorted({s['name']: s for s in workspace.controlfile(size).services.values()
+                       if isinstance(s, Startable)}.values())
+    # Larger sizes share the daemon with the containers of smaller ones
+    running = {container['Name'][1:] for container in fake.containers.values()}
+    starting = [s for s in services[::2] if s['name'] not in running]
+
+    async def start():  # pylint: disable=missing-docstring
+        await asyncio.gather(*(client.create_container(service.image, name=service['name'])
+                               for service in starting))
+    for service in starting:
+        fake.add_image(service.image)
+    aio.run(start())
+    return tuple, lambda: aio.run(gather_status(client, services))
+
+
+# The ways of merging and applying options that can be timed against each
+# other: (satisfy_nested_options, compile, normalize_service). The legacy
+# engine has nothing to compile and normalizes from the plain options
+ENGINES = {
+    'compiled': (satisfy_nested_options, compile_options, normalize_service),
+    'legacy': (legacy.satisfy_nested_options, lambda opers: opers,
+               legacy.normalize_service),
+}
+
+# name: (benchmark, whether it is sized by services, nesting depth or base images)
+BENCHMARKS = {
+    'controlfile_init': (bench_controlfile_init, 'services'),
+    'normalize_service': (bench_normalize_service, 'services'),
+    'normalize_service_legacy': (
+        functools.partial(bench_normalize_service, engine='legacy'), 'services'),
+    'normalize_deep': (bench_normalize_deep, 'depth'),
+    'normalize_deep_legacy': (functools.partial(bench_normalize_deep, engine='legacy'), 'depth'),
+    'satisfy_nested_options': (bench_satisfy_nested_options, 'depth'),
+    'satisfy_nested_options_legacy': (
+        functools.partial(bench_satisfy_nested_options, engine='legacy'), 'depth'),
+    'dump_run': (bench_dump_run, 'services'),
+    'dump_build': (bench_dump_build, 'services'),
+    'dump_script': (bench_dump_script, 'services'),
+    'registry_checks': (bench_registry_checks, 'images'),
+    'status': (bench_status, 'services'),
+}
+
+
+def measure(setup, func, repeat=5, clock=time.perf_counter):
+    """Time func repeat times, calling setup untimed before each run"""
+    timings = []
+    for _ in range(repeat):
+        args = setup()
+        begin = clock()
+        func(*args)
+        timings.append(clock() - begin)
+    return timings
+
+
+def run_suite(root, sizes=None, depths=None, repeat=5, names=None, depth=4, images=None):
+    """
+    Run the benchmarks and return their results, keyed by name[size].
+    Benchmarks that talk to a fake also report their HTTP round trips per run
+    """
+    workspace = Workspace(root, depth)
+    sized = {
+        'services': sizes or DEFAULT_SIZES,
+        'depth': depths or DEFAULT_DEPTHS,
+        'images': images or DEFAULT_IMAGES,
+    }
+    results = {}
+    try:
+        for name, (benchmark, sized_by) in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            for size in sized[sized_by]:
+                setup, func = benchmark(workspace, size)
+                round_trips = workspace.round_trips()
+                timings = measure(setup, func, repeat)
+                round_trips = workspace.round_trips() - round_trips
+                key = '{}[{}]'.format(name, size)
+                results[key] = {
+                    'benchmark': name,
+                    'size': size,
+                    'median': statistics.median(timings),
+                    'min': min(timings),
+                    'max': max(timings),
+                    'repeat': repeat,
+                }
+                if round_trips:
+                    results[key]['round_trips'] = round_trips / repeat
+                module_logger.debug('%s: %.6fs', key, results[key]['median'])
+    finally:
+        workspace.close()
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Find the benchmarks whose median got more than threshold slower than in
+    baseline. Returns (name, baseline median, median) for each
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        before = baseline.get(key)
+        if before and result['median'] > before['median'] * (1 + threshold):
+            regressions.append((key, before['median'], result['median']))
+    return regressions
+
+
+def _parse_ints(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main(argv=None):
+    """Run the suite from the command line. Returns the exit status"""
+    parser = argparse.ArgumentParser(
+        prog='python -m control.benchmarks',
+        description='Time Controlfile loading and command generation')
+    parser.add_argument('--sizes', type=_parse_ints, default=DEFAULT_SIZES,
+                        help='comma separated numbers of services')
+    parser.add_argument('--depths', type=_parse_ints, default=DEFAULT_DEPTHS,
+                        help='comma separated metaservice nesting depths')
+    parser.add_argument('--images', type=_parse_ints, default=DEFAULT_IMAGES,
+                        help='comma separated numbers of base images to check '
+                        'in the registry')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='times to run each benchmark')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='run only this benchmark. Can be given more than once')
+    parser.add_argument('--output', metavar='FILE', help='write results as JSON')
+    parser.add_argument('--baseline', metavar='FILE', help='JSON results of an '
+                        'earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fail if a median is this fraction slower than '
+                        'the baseline. Default %(default)s')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='control-bench-') as root:
+        results = run_suite(root, args.sizes, args.depths, args.repeat, args.only,
+                            images=args.images)
+    width = max(len(key) for key in results)
+    for key, result in results.items():
+        line = '{}  {:10.6f}s  (min {:.6f}s)'.format(
+            key.ljust(width), result['median'], result['min'])
+        if 'round_trips' in result:
+            line += '  {:g} round trips'.format(result['round_trips'])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after in regressions:
+            print('{} regressed: {:.6f}s -> {:.6f}s'.format(key, before, after),
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
@@ -0,0 +1,346 @@
+"""
+Build contexts that are streamed to Docker as they are read off the disk.
+
+docker-py tars the entire build directory into memory before it sends a
+single byte, and does it again for every service that shares the directory.
+A BuildContext walks the directory, leaves out what .dockerignore says to,
+and produces the tar stream a piece at a time so the upload can start right
+away. The rewritten Dockerfile is put into the tar, so it doesn't need to be
+written anywhere on the disk.
+
+The ContextCache keeps the finished tarball for the rest of the run, keyed
+by a hash of the Dockerfile and the name, size, mode and mtime of every file
+in the context. The next service with the same context replays it instead of
+walking the directory again. The image cache, which is shared between
+machines, keys on the content of the files instead, since every checkout
+gets its own mtimes.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import re
+import stat
+import tarfile
+import tempfile
+import threading
+import zlib
+
+module_logger = logging.getLogger('control.buildcontext')
+module_logger.setLevel(logging.DEBUG)
+
+# Where the Dockerfile Control rewrites ends up inside the context
+DOCKERFILE = '.control.Dockerfile'
+CHUNK_SIZE = 64 * 1024
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def _translate(pattern):
+    """
+    Turn a .dockerignore pattern into a regex. Docker uses Go's
+    filepath.Match, plus ** to match any number of directories.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+            # **/ can also match no directories at all
+            if pattern.startswith('/', i):
+                parts[-1] = '(?:.*/)?'
+                i += 1
+            continue
+        c = pattern[i]
+        if c == '*':
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                cls = pattern[i + 1:end].replace('\\', '\\\\')
+                if cls[:1] in ('!', '^'):
+                    cls = '^' + cls[1:]
+                parts.append('[{}]'.format(cls))
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(parts) + r'\Z')
+
+
+class DockerIgnore:
+    """
+    The patterns from a .dockerignore file, compiled once. The last pattern
+    that matches a path decides whether it is excluded, and patterns starting
+    with ! bring paths back in.
+    """
+
+    def __init__(self, lines=()):
+        self.patterns = []
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            exception = line.startswith('!')
+            if exception:
+                line = line[1:].strip()
+            line = os.path.normpath(line).lstrip('/')
+            self.patterns.append((_translate(line), exception))
+        self.has_exceptions = any(exception for _, exception in self.patterns)
+
+    @classmethod
+    def from_directory(cls, path):
+        """Read in the .dockerignore at the top of a build directory"""
+        try:
+            with open(os.path.join(path, '.dockerignore'), 'r') as f:
+                return cls(f.read().splitlines())
+        except FileNotFoundError:
+            return cls()
+
+    def excluded(self, relpath):
+        """Check if a path, relative to the build directory, is left out"""
+        parents = []
+        head = os.path.dirname(relpath)
+        while head:
+            parents.append(head)
+            head = os.path.dirname(head)
+        result = False
+        for regex, exception in self.patterns:
+            if regex.match(relpath) or any(regex.match(p) for p in parents):
+                result = not exception
+        return result
+
+    def prunable(self, relpath):
+        """
+        Check if a directory can be skipped without looking inside it. When
+        there are exceptions, something inside might be brought back in.
+        """
+        return not self.has_exceptions and self.excluded(relpath)
+
+
+class BuildContext:
+    """A build directory, and the Dockerfile to build it with"""
+
+    def __init__(self, path, dockerfile, ignore=None):
+        """
+        Arguments:
+        path       -- the build directory
+        dockerfile -- bytes of the Dockerfile to put in the context
+        ignore     -- a DockerIgnore. Defaults to the one in path
+        """
+        self.path = os.path.abspath(path)
+        self.dockerfile = dockerfile
+        self.ignore = ignore if ignore is not None else DockerIgnore.from_directory(self.path)
+        self._entries = None
+        self._content_key = None
+
+    def entries(self):
+        """
+        Every file, directory and link that goes into the context, as
+        (relative path, lstat result) pairs in a stable order
+        """
+        if self._entries is not None:
+            return self._entries
+        entries = []
+        for root, dirs, files in os.walk(self.path):
+            relroot = os.path.relpath(root, self.path)
+            relroot = '' if relroot == '.' else relroot
+            dirs.sort()
+            kept = []
+            for name in dirs:
+                rel = os.path.join(relroot, name)
+                if self.ignore.prunable(rel):
+                    continue
+                kept.append(name)
+                if not self.ignore.excluded(rel):
+                    entries.append((rel, os.lstat(os.path.join(root, name))))
+            dirs[:] = kept
+            for name in sorted(files):
+                rel = os.path.join(relroot, name)
+                if rel == DOCKERFILE or self.ignore.excluded(rel):
+                    continue
+                try:
+                    entries.append((rel, os.lstat(os.path.join(root, name))))
+                except FileNotFoundError:
+                    continue
+        self._entries = entries
+        return entries
+
+    def key(self):
+        """A hash that changes whenever the tar this context makes would"""
+        digest = hashlib.sha256(self.dockerfile)
+        for rel, st in self.entries():
+            digest.update('{}\0{}\0{}\0{}\n'.format(
+                rel, st.st_mode, st.st_size, st.st_mtime_ns).encode('utf-8'))
+        return digest.hexdigest()
+
+    def content_key(self):
+        """
+        A hash of what is in this context, leaving out mtimes, so that two
+        checkouts of the same commit on different machines get the same key
+        """
+        if self._content_key is not None:
+            return self._content_key
+        digest = hashlib.sha256(self.dockerfile)
+        for rel, st in self.entries():
+            full = os.path.join(self.path, rel)
+            if stat.S_ISLNK(st.st_mode):
+                content = os.readlink(full)
+            elif stat.S_ISREG(st.st_mode):
+                content = _file_digest(full)
+            else:
+                content = ''
+            digest.update('{}\0{}\0{}\0{}\n'.format(
+                rel, st.st_mode, st.st_size, content).encode('utf-8', 'surrogateescape'))
+        self._content_key = digest.hexdigest()
+        return self._content_key
+
+    def size(self):
+        """Bytes of file content in the context, before tar or gzip"""
+        return len(self.dockerfile) + sum(
+            st.st_size for _, st in self.entries() if stat.S_ISREG(st.st_mode))
+
+    @staticmethod
+    def _header(name, st=None, size=0, mode=0o644, linkname=''):
+        info = tarfile.TarInfo(name)
+        if st is not None:
+            info.mode = stat.S_IMODE(st.st_mode)
+            info.mtime = int(st.st_mtime)
+            if stat.S_ISDIR(st.st_mode):
+                info.type = tarfile.DIRTYPE
+            elif stat.S_ISLNK(st.st_mode):
+                info.type = tarfile.SYMTYPE
+                info.linkname = linkname
+            else:
+                info.size = size
+        else:
+            info.mode = mode
+            info.size = size
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def tar(self):
+        """Generate the uncompressed tar of this context a chunk at a time"""
+        yield self._header(DOCKERFILE, size=len(self.dockerfile))
+        yield self.dockerfile
+        yield _padding(len(self.dockerfile))
+        for rel, st in self.entries():
+            full = os.path.join(self.path, rel)
+            if stat.S_ISLNK(st.st_mode):
+                yield self._header(rel, st, linkname=os.readlink(full))
+            elif stat.S_ISDIR(st.st_mode):
+                yield self._header(rel, st)
+            elif stat.S_ISREG(st.st_mode):
+                yield self._header(rel, st, size=st.st_size)
+                written = 0
+                with open(full, 'rb') as f:
+                    while written < st.st_size:
+                        chunk = f.read(min(CHUNK_SIZE, st.st_size - written))
+                        if not chunk:
+                            # The file shrank after it was listed. The header
+                            # promised st_size bytes, so pad it out.
+                            chunk = b'\0' * (st.st_size - written)
+                        written += len(chunk)
+                        yield chunk
+                yield _padding(st.st_size)
+        yield b'\0' * (BLOCK_SIZE * 2)
+
+    def stream(self, compress=False):
+        """Generate the tar, gzipped if compress is set"""
+        if not compress:
+            for chunk in self.tar():
+                if chunk:
+                    yield chunk
+            return
+        gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in self.tar():
+            out = gzip.compress(chunk)
+            if out:
+                yield out
+        yield gzip.flush()
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _padding(size):
+    remainder = size % BLOCK_SIZE
+    return b'\0' * (BLOCK_SIZE - remainder) if remainder else b''
+
+
+class ContextCache:
+    """
+    Keeps the tarballs of build contexts that have been sent in this run.
+    Tarballs are held in memory up to spool_size bytes, and on disk after
+    that. Only the most recent max_entries are kept.
+    """
+
+    def __init__(self, max_entries=16, spool_size=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.spool_size = spool_size
+        self.tarballs = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stream(self, context, compress=False):
+        """
+        Generate the tarball for context, from the cache if the same context
+        has been sent before, otherwise from the disk while saving a copy
+        """
+        key = (context.key(), compress)
+        with self.lock:
+            spool = self.tarballs.get(key)
+            if spool is not None:
+                self.tarballs.move_to_end(key)
+                self.hits += 1
+        if spool is not None:
+            module_logger.debug('build context cache hit for %s', context.path)
+            yield from self._replay(spool)
+            return
+
+        self.misses += 1
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        for chunk in context.stream(compress):
+            spool.write(chunk)
+            yield chunk
+        # Only a context that was sent all the way through is worth keeping
+        with self.lock:
+            self.tarballs[key] = spool
+            while len(self.tarballs) > self.max_entries:
+                self.tarballs.popitem(last=False)[1].close()
+
+    def _replay(self, spool):
+        with self.lock:
+            spool.seek(0)
+            data = spool.read(CHUNK_SIZE)
+            offset = spool.tell()
+        while data:
+            yield data
+            with self.lock:
+                spool.seek(offset)
+                data = spool.read(CHUNK_SIZE)
+                offset = spool.tell()
+
+    def clear(self):
+        """Throw away every cached tarball"""
+        with self.lock:
+            for spool in self.tarballs.values():
+                spool.close()
+            self.tarballs.clear()
+
+
+# Contexts shared between every build in this run
+context_cache = ContextCache()
@@ -50,6 +50,13 @@ def build_parser():
     parser.add_argument(
         '-w', '--wipe', action='store_true', help='Make sure that volumes are '
         'empty after stopping. May require sudo. THIS IS EXTREMELY DANGEROUS')
+    parser.add_argument(
+        '--wipe-helper', default=options.wipe_helper, metavar='IMAGE', help='the '
+        'image to run as root to remove bound directories that --wipe cannot')
+    parser.add_argument(
+        '--wipe-outside-project', action='store_true', default=options.wipe_outside_project,
+        help='let the --wipe-helper remove bound directories outside of the directory of '
+        'the Controlfile too')
     parser.add_argument(
         '--dry-run', action='store_true', help='Pretend to execute actions, '
         'but only log that they happened')
@@ -58,6 +65,11 @@ def build_parser():
     parser.add_argument(
         '--dump', action='store_true', help='dump out the docker command that '
         'will perform the operation that this command would')
+    parser.add_argument(
+        '--dump-format', choices=['commands', 'script'], default=options.dump_format,
+        help='how to dump: the docker commands one at a time, or a shell '
+        'script for the whole run that runs independent steps in parallel. '
+        'script implies --dump')
     parser.add_argument(
         '--cache', action='store_true',
         help='allow the use of the docker cache')
@@ -70,6 +82,62 @@ def build_parser():
     parser.add_argument(
         '--no-pull', action='store_const', const=False, dest='pull', help='do '
         'not pull newer versions of the base image')
+    parser.add_argument(
+        '--follow', action='store_true', default=options.follow, help='with '
+        'logs, keep printing what the containers write. -f does the same for logs')
+    parser.add_argument(
+        '--tail', default=options.tail, metavar='LINES', help='with logs, only '
+        'show this many lines from the end of each container\'s log')
+    parser.add_argument(
+        '--json', action='store_true', default=options.json, help='with stats, '
+        'print each sample as a line of JSON')
+    parser.add_argument(
+        '--no-stream', action='store_true', default=options.no_stream, help='with '
+        'stats, print one sample and stop')
+    parser.add_argument(
+        '--check-registry', action='store_true', default=options.check_registry,
+        help='with status, also ask registries whether they have newer images')
+    parser.add_argument(
+        '--update', action='store_true', help='with lock, ask for the digest '
+        'of every image services are built FROM again, not only new ones')
+    parser.add_argument(
+        '--remove-orphans', action='store_true', default=options.remove_orphans,
+        help='when stopping, also remove the containers of this project that no '
+        'service accounts for, like those of renamed services and holding '
+        'containers custom commands left behind')
+    parser.add_argument(
+        '--keep-old-images', action='store_true', default=options.keep_old_images,
+        help='do not remove the images a build replaces')
+    parser.add_argument(
+        '--older-than', default=options.older_than, metavar='AGE', help='with '
+        'gc, only remove images older than this, e.g. 7d or 12h')
+    parser.add_argument(
+        '--keep-size', default=options.keep_size, metavar='SIZE', help='with '
+        'gc, keep the newest old images of each image name up to this size, e.g. 5G')
+    parser.add_argument(
+        '--metrics-format', choices=['prometheus', 'json'], default=options.metrics_format,
+        help='what build-prod writes its metrics next to IMAGES.txt as: metrics.prom '
+        'for the Prometheus textfile collector, or metrics.json')
+    parser.add_argument(
+        '--image-cache', default=options.image_cache, help='directory, '
+        'possibly shared with other machines, to keep images built by '
+        'build-prod in. Defaults to $CONTROL_IMAGE_CACHE')
+    parser.add_argument(
+        '--image-cache-size', default=options.image_cache_size, help='remove '
+        'the least recently used images when the image cache grows past '
+        'this size, e.g. 50G')
+    parser.add_argument(
+        '--docker-host', action='append', dest='docker_hosts', default=options.docker_hosts,
+        metavar='URL', help='a docker host to spread builds over, unix:// or tcp://. '
+        'Give it more than once, or a comma separated list. Defaults to the '
+        'Controlfile\'s hosts, then DOCKER_HOST. Containers start on the first')
+    parser.add_argument(
+        '--image-transfer', choices=['stream', 'registry'], default=options.image_transfer,
+        help='how to move built images between docker hosts: docker save '
+        'streamed into docker load, or pushed to their registry and pulled')
+    parser.add_argument(
+        '--gzip-context', action='store_true', help='gzip build contexts on '
+        'their way to the docker daemon. Worth it when docker is remote')
     parser.add_argument(
         '--no-volumes', action='store_true', help='override the volumes '
         'mentioned in the Controlfile')
@@ -82,6 +150,13 @@ def build_parser():
     parser.add_argument(
         '--as-me', action='store_true', help='start a container, or command in '
         'a container as your user, rather than as root')
+    parser.add_argument(
+        '--trace', default=options.trace, metavar='FILE', help='write a '
+        'Chrome trace_event file of where the time in this run went. Open it '
+        'in chrome://tracing or ui.perfetto.dev')
+    parser.add_argument(
+        '--no-daemon', action='store_true', help='run in this process even if '
+        'a control daemon is listening')
 
     return parser
 
@@ -12,6 +12,9 @@ TODO: Even more strict refactor into:
 so the file is shorter and the tests don't have to be as redundant as they are.
 """
 
+from operator import itemgetter
+import shlex
+
 from control.exceptions import ControlException
 
 bool_args = [
@@ -80,13 +83,13 @@ def builder(command, *args, **kwargs):
     #     'top', 'unpause', 'update', 'version', 'volume',
     # }
     return {
-        'build': BuildBuilder(command, *args, **kwargs),
-        'exec': ExecBuilder(command, *args, **kwargs),
-        'rm': ContainerBuilder(command, *args, **kwargs),
-        'rmi': ContainerBuilder(command, *args, **kwargs),
-        'run': RunBuilder(command, *args, **kwargs),
-        'stop': ContainerBuilder(command, *args, **kwargs)
-    }[command]
+        'build': BuildBuilder,
+        'exec': ExecBuilder,
+        'rm': ContainerBuilder,
+        'rmi': ContainerBuilder,
+        'run': RunBuilder,
+        'stop': ContainerBuilder,
+    }[command](command, *args, **kwargs)
 
 
 class Builder:
@@ -117,13 +120,37 @@ class Builder:
         self.largs = {}
         self.positional = ''
 
+    def arguments(self):
+        """
+        The (flag, value) pairs on the command line, sorted by flag the way
+        Arguments sort. Flags have a value of ''
+        """
+        return sorted(
+            [(k, '') for k in self.bargs] +
+            [(k, v) for k, v in self.sargs.items()] +
+            [(k, v) for k, vs in self.largs.items() for v in vs],
+            key=itemgetter(0))
+
+    def positionals(self):
+        """The words that go after the flags"""
+        return [self.positional] if self.positional else []
+
+    def argv(self):
+        """The command as a list of words, ready to exec or quote"""
+        words = ['docker', self.cmd]
+        for flag, value in self.arguments():
+            words.append(flag)
+            if value:
+                words.append(str(value))
+        return words + self.positionals()
+
+    def shell(self):
+        """The command on one line, quoted for a shell script"""
+        return ' '.join(shlex.quote(word) for word in self.argv())
+
     def __str__(self):
-        concat_args = self.sep.join(str(x) for x in sorted(
-            [Argument(k) for k, v in self.bargs.items()] +
-            [Argument(k, v) for k, v in self.sargs.items()] +
-            [Argument(k, v)
-             for k, vs in self.largs.items()
-             for v in vs]))
+        concat_args = self.sep.join('{} {}'.format(f, v) if v else f
+                                    for f, v in self.arguments())
         if concat_args:
             return 'docker {cmd}{sep}{args}{sep}{pos}'.format(
                 sep=self.sep,
@@ -151,6 +178,11 @@ class BuildBuilder(Builder):
         self.positional = path
         return self
 
+    def positionals(self):
+        if not self.positional:
+            raise ControlException('No path declared. Cannot create docker build command')
+        return [self.positional]
+
     def __str__(self):
         if not self.positional:
             raise ControlException('No path declared. Cannot create docker build command')
@@ -166,6 +198,7 @@ class RunBuilder(Builder):
         super(RunBuilder, self).__init__(cmd, pretty=pretty)
         self._image = ''
         self._command = ''
+        self._command_words = []
 
     def image(self, name):
         """set the image that the container should be using"""
@@ -176,12 +209,20 @@ class RunBuilder(Builder):
         """run this command from the entrypoint"""
         if isinstance(value, list):
             self._command = ' '.join(value)
+            self._command_words = [str(word) for word in value]
         elif isinstance(value, str):
             self._command = value
+            # The way docker-py splits a command given as a string
+            self._command_words = shlex.split(value)
         else:
             raise TypeError(value)
         return self
 
+    def positionals(self):
+        if not self._image:
+            raise ControlException('No image declared. Cannot create docker run command')
+        return [self._image] + self._command_words
+
     def __str__(self):
         if not self._image:
             raise ControlException('No image declared. Cannot create docker run command')
@@ -203,6 +244,7 @@ class ExecBuilder(Builder):
         super(ExecBuilder, self).__init__(cmd, pretty=pretty)
         self._container = ''
         self._command = ''
+        self._command_words = []
 
     def container(self, name):
         """set the container the exec should be using"""
@@ -213,12 +255,21 @@ class ExecBuilder(Builder):
         """run this command from the entrypoint"""
         if isinstance(value, list):
             self._command = ' '.join(value)
+            self._command_words = [str(word) for word in value]
         elif isinstance(value, str):
             self._command = value
+            self._command_words = shlex.split(value)
         else:
             raise TypeError(value)
         return self
 
+    def positionals(self):
+        if not self._container:
+            raise ControlException('No container declared. Cannot create docker exec command')
+        if not self._command:
+            raise ControlException('No command declared. Cannot create docker exec command')
+        return [self._container] + self._command_words
+
     def __str__(self):
         if not self._container:
             raise ControlException('No container declared. Cannot create docker exec command')
@@ -250,6 +301,12 @@ class ContainerBuilder(Builder):
         self.positional = ' '.join(self._container)
         return super(ContainerBuilder, self).__str__()
 
+    def positionals(self):
+        if not self._container:
+            raise ControlException('No container declared. Cannot create '
+                                   'docker {} command'.format(self.cmd))
+        return list(self._container)
+
     def container(self, value):
         """pass a container (or list of containers) to rm"""
         if value and isinstance(value, list):
@@ -312,9 +369,7 @@ def list_setter(name, arg, doc=None):
         if arg not in self.largs:
             self.largs[arg] = []
 
-        if value and isinstance(value, list):
-            self.largs[arg] += [str(x) for x in value]
-        elif isinstance(value, set):
+        if isinstance(value, (list, set)):
             self.largs[arg] += [str(x) for x in value]
         elif value and isinstance(value, str):
             self.largs[arg].append(value)
@@ -0,0 +1,100 @@
+"""
+Hand a Control invocation to a running `control daemon`.
+
+This module is imported before anything else when Control starts, so it must
+stay cheap: no docker, no requests, no Controlfile parsing. If there is no
+daemon listening, forward returns None and Control runs in-process like it
+always has.
+
+The protocol is one JSON object per line. The client sends a single request:
+    {"args": [...], "cwd": "...", "env": {...}, "tty": bool}
+and the daemon answers with any number of
+    {"stdout": "..."} or {"stderr": "..."}
+followed by a final
+    {"exit": int}
+"""
+
+import json
+import os
+import socket
+import sys
+
+# Commands that cannot run on the other end of a socket. open replaces the
+# process with docker start -a -i, which has to be the user's process. watch
+# runs until it is interrupted, and the daemon runs one command at a time, so
+# it would hold up every other command for good once its client was gone.
+LOCAL_ONLY = {'daemon', 'open', 'watch', '--no-daemon'}
+# Commands that, with one of these flags, follow what they show until they
+# are interrupted, and so have to stay in-process like watch
+FOLLOWING = {'logs': {'-f', '--follow', '--force'}}
+
+
+def local_only(args):
+    """Whether args have to be run in-process"""
+    words = set(args)
+    if words & LOCAL_ONLY:
+        return True
+    if any(command in words and words & flags for command, flags in FOLLOWING.items()):
+        return True
+    # stats streams unless it's told not to
+    return 'stats' in words and '--no-stream' not in words
+
+
+def socket_path():
+    """Where the daemon listens, overridable with CONTROL_SOCKET"""
+    if 'CONTROL_SOCKET' in os.environ:
+        return os.environ['CONTROL_SOCKET']
+    if 'XDG_RUNTIME_DIR' in os.environ:
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'control.sock')
+    return os.path.join(os.path.expanduser('~'), '.cache', 'control', 'control.sock')
+
+
+def connect(path=None):
+    """Connect to the daemon. Returns None if there isn't one listening"""
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def forward(args, path=None, stdout=None, stderr=None):
+    """
+    Run args on the daemon, copying its output to this process's stdout and
+    stderr. Returns the exit code, or None if the command should be run
+    in-process instead.
+    """
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    if local_only(args):
+        return None
+    sock = connect(path)
+    if sock is None:
+        return None
+    with sock, sock.makefile('rwb') as conn:
+        conn.write(json.dumps({
+            'args': args,
+            'cwd': os.getcwd(),
+            'env': dict(os.environ),
+            'tty': stdout.isatty(),
+        }).encode('utf-8') + b'\n')
+        conn.flush()
+        for line in conn:
+            msg = json.loads(line.decode('utf-8'))
+            if 'stdout' in msg:
+                stdout.write(msg['stdout'])
+                stdout.flush()
+            elif 'stderr' in msg:
+                stderr.write(msg['stderr'])
+                stderr.flush()
+            elif 'exit' in msg:
+                return msg['exit']
+    # The daemon went away before finishing. Whatever it was doing may have
+    # been half done, so don't silently run it again in-process.
+    print('control daemon closed the connection', file=stderr)
+    return 1
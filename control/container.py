@@ -1,9 +1,7 @@
 """Handle the concept of a container."""
 
 import logging
-import os
 import re
-import shutil
 
 import docker
 
@@ -14,6 +12,58 @@ from control.exceptions import (
     InvalidVolumeName, TransientVolumeCreation,
     ImageNotFound
 )
+from control.tracing import traced
+from control.wipe import DEFAULT_HELPER_IMAGE, wipe_volumes
+
+
+module_logger = logging.getLogger('control.container')
+module_logger.setLevel(logging.DEBUG)
+
+
+def _service_name(container, *args, **kwargs):  # pylint: disable=unused-argument
+    return {'service': container.service['name']}
+
+
+def without_volumes(container_opts):
+    """Take the volumes and binds out of prepared container options"""
+    module_logger.debug('removing volumes')
+    container_opts.pop('volumes', None)
+    container_opts.get('host_config', {}).pop('Binds', None)
+    return container_opts
+
+
+def create_error(e, image):
+    """The exception to raise for a docker error from creating a container"""
+    explanation = e.explanation.decode('utf-8')
+    if isinstance(e, docker.errors.NotFound):
+        if 'chown' in explanation:
+            return VolumePseudoExists(explanation)
+        elif 'volume not found' in explanation:
+            return TransientVolumeCreation(explanation)
+        elif 'No such image' in explanation:
+            return ImageNotFound(image)
+    elif 'volume name invalid' in explanation:
+        return InvalidVolumeName(explanation)
+    elif 'is already in use by container' in explanation:
+        return ContainerAlreadyExists(explanation)
+    module_logger.debug('Unexpected Docker API Error')
+    module_logger.debug(e)
+    module_logger.debug(e.response)
+    module_logger.debug(explanation)
+    return e
+
+
+def start_error(e, service):
+    """The exception to raise for a docker error from starting a container"""
+    explanation = e.explanation.decode('utf-8')
+    if isinstance(e, docker.errors.NotFound) and explanation == 'get: volume not found':
+        return InvalidVolumeName('volume not found')
+    if re.fullmatch('mkdir .+: operation not permitted', explanation):
+        volume = service.find_volume(explanation.split(':')[0][6:])
+        return ContainerException('Invalid Host Binding in {}: {}'.format(
+            service['name'],
+            volume if len(volume) > 1 else volume[0]))
+    return e
 
 
 class Container:
@@ -28,19 +78,12 @@ class Container:
         self.logger = logging.getLogger('control.container.Container')
         self.volumes = True
 
-    def create(self, prod):
+    @traced('container.create', _service_name)
+    def create(self, prod, labels=None):
         """create a container"""
-        container_opts = self.service.prepare_container_options(prod=prod)
+        container_opts = self.service.prepare_container_options(prod=prod, labels=labels)
         if not self.run_with_volumes():
-            self.logger.debug('removing volumes')
-            try:
-                del container_opts['volumes']
-            except KeyError:
-                self.logger.debug('service %s does not define volumes')
-            try:
-                del container_opts['host_config']['Binds']
-            except KeyError:
-                pass
+            without_volumes(container_opts)
         try:
             self.logger.debug(container_opts)
             return CreatedContainer(
@@ -48,29 +91,8 @@ class Container:
                     self.service.image,
                     **container_opts),
                 self.service)
-        except docker.errors.NotFound as e:
-            if 'chown' in e.explanation.decode('utf-8'):
-                raise VolumePseudoExists(e.explanation.decode('utf-8')) from None
-            elif 'volume not found' in e.explanation.decode('utf-8'):
-                raise TransientVolumeCreation(e.explanation.decode('utf-8')) from None
-            elif 'No such image' in e.explanation.decode('utf-8'):
-                raise ImageNotFound(self.service.image) from None
-
-            self.logger.debug('Unexpected Docker 404')
-            self.logger.debug(e)
-            self.logger.debug(e.response)
-            self.logger.debug(e.explanation.decode('utf-8'))
-            raise
         except docker.errors.APIError as e:
-            if 'volume name invalid' in e.explanation.decode('utf-8'):
-                raise InvalidVolumeName(e.explanation.decode('utf-8'))
-            elif 'is already in use by container' in e.explanation.decode('utf-8'):
-                raise ContainerAlreadyExists(e.explanation.decode('utf-8'))
-            self.logger.debug('Unexpected Docker API Error')
-            self.logger.debug(e)
-            self.logger.debug(e.response)
-            self.logger.debug(e.explanation.decode('utf-8'))
-            raise
+            raise create_error(e, self.service.image) from None
 
     def disable_volumes(self):
         """When the container is created, do not create any volumes or binds"""
@@ -119,37 +141,32 @@ class CreatedContainer(Container):
         """
         self.inspect = dclient.inspect_container(self.inspect['Id'])
 
+    @traced('container.start', _service_name)
     def start(self):
         """Start a created container"""
         try:
             dclient.start(self.inspect['Id'])
-        except docker.errors.NotFound as e:
-            if e.explanation.decode('utf-8') == 'get: volume not found':
-                raise InvalidVolumeName('volume not found')
-            raise
         except docker.errors.APIError as e:
-            server_error = e.explanation.decode('utf-8')
-            if re.fullmatch('mkdir .+: operation not permitted', server_error):
-                volume = self.service.find_volume(server_error.split(':')[0][6:])
-                raise ContainerException('Invalid Host Binding in {}: {}'.format(
-                    self.service['name'],
-                    volume if len(volume) > 1 else volume[0]))
+            raise start_error(e, self.service) from None
         else:
             self.inspect = dclient.inspect_container(self.inspect['Id'])
         return self.inspect['State']['Running']
 
+    @traced('container.stop', _service_name)
     def stop(self):
         """stop a running container"""
         dclient.stop(self.inspect['Id'], timeout=self.service.expected_timeout)
         self.inspect = dclient.inspect_container(self.inspect['Id'])
         return not self.inspect['State']['Running']
 
+    @traced('container.kill', _service_name)
     def kill(self):
         """kill a running container"""
         dclient.kill(self.inspect['Id'])
         self.inspect = dclient.inspect_container(self.inspect['Id'])
         return not self.inspect['State']['Running']
 
+    @traced('container.remove', _service_name)
     def remove(self):
         """remove a stopped container"""
         dclient.remove_container(self.inspect['Id'], v=True)
@@ -189,35 +206,13 @@ class CreatedContainer(Container):
         """Return the inspect dict for the top exec"""
         return dclient.exec_inspect(self.get_exec())
 
-    def remove_volumes(self):
-        """Any volumes that were in use by the container will be removed"""
-        if self.logger.isEnabledFor(logging.DEBUG):
-            self.logger.debug('Docker has removed these volumes:')
-            for v in (v['Source']
-                      for v in self.inspect['Mounts']
-                      if not os.path.isdir(v['Source'])):
-                self.logger.debug('  %s', v)
-            self.logger.debug('Attempting to remove these volume locations:')
-            for v in (v['Source']
-                      for v in self.inspect['Mounts']
-                      if os.path.isdir(v['Source'])):
-                self.logger.debug('  %s', v)
-        for vol in self.inspect['Mounts']:
-            if vol['Source'].startswith('/var/lib/docker/volumes'):
-                self.logger.debug('having docker remove %s', vol['Source'])
-                try:
-                    dclient.remove_volume(vol['Name'])
-                except docker.errors.APIError as e:
-                    if 'no such volume' in e.explanation.decode('utf-8'):
-                        continue
-                    self.logger.warning('cannot remove volume: %s',
-                                        e.explanation.decode('utf-8'))
-            elif os.path.isdir(vol['Source']):
-                self.logger.debug('removing %s', vol['Source'])
-                try:
-                    shutil.rmtree(vol['Source'])
-                except PermissionError as e:
-                    self.logger.warning('Cannot remove directory %s: %s',
-                                        vol['Source'], e)
-            else:
-                self.logger.debug('docker removed volume %s', vol['Source'])
+    @traced('container.remove_volumes', _service_name)
+    def remove_volumes(self, helper_image=DEFAULT_HELPER_IMAGE, root=None, anywhere=False):
+        """
+        Any volumes that were in use by the container will be removed.
+        Returns a WipeSummary
+        """
+        summary = wipe_volumes([self.inspect], dclient, helper_image=helper_image,
+                               root=root, anywhere=anywhere)
+        self.logger.info('%s', summary)
+        return summary
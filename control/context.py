@@ -0,0 +1,130 @@
+"""
+The settings one run of Control works from.
+
+main parses the command line into a RunContext and hands it to the command,
+which passes it along to everything it calls. A RunContext can't be changed.
+A command that needs different settings, like build-prod turning the cache
+off, makes a new one with replace(), so builds, starts and commands running
+at the same time never see each other's settings.
+
+Overrides from the command line, like --image, and the holding entrypoint a
+custom command runs its container with, are made to copies of the services.
+The services of a Controlfile, which the daemon keeps between commands, are
+never changed.
+"""
+
+import argparse
+import copy
+import functools
+import logging
+from os.path import abspath
+
+from control.cli_args import build_parser
+from control.options import options
+
+module_logger = logging.getLogger('control.context')
+module_logger.setLevel(logging.DEBUG)
+
+
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+class RunContext:
+    """
+    The options of one run, read as attributes like the argparse Namespace
+    they came from. overrides maps service names to the values their copies
+    get when the context is applied to a Controlfile
+    """
+
+    def __init__(self, values, overrides=None):
+        object.__setattr__(self, '_values', {k: _freeze(v) for k, v in values.items()})
+        object.__setattr__(self, '_overrides', {
+            name: dict(changes) for name, changes in (overrides or {}).items()})
+
+    @classmethod
+    def parse(cls, argv):
+        """A context from command line arguments, on top of the defaults in options"""
+        # argparse leaves alone what the namespace already has, which is how
+        # cache and pull stay None unless they're given
+        parsed = build_parser().parse_args(argv, namespace=argparse.Namespace(**vars(options)))
+        return cls(vars(parsed))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            # copy and pickle look for hooks before _values is there
+            raise AttributeError(name)
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RunContext is read only, use replace() to change {}'.format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError('RunContext is read only, cannot delete {}'.format(name))
+
+    def __repr__(self):
+        return 'RunContext({!r})'.format(self._values)
+
+    def as_dict(self):
+        """The options, as a dict that can be changed without touching this context"""
+        return dict(self._values)
+
+    def replace(self, **changes):
+        """A context like this one, with some options changed"""
+        return RunContext(dict(self._values, **changes), self._overrides)
+
+    @property
+    def overrides(self):
+        """service name: the values it is overridden with"""
+        return {name: dict(changes) for name, changes in self._overrides.items()}
+
+    def override(self, service, **changes):
+        """A context like this one, that gives the named service the changes"""
+        overrides = self.overrides
+        overrides.setdefault(service, {}).update(changes)
+        return RunContext(self._values, overrides)
+
+    def apply(self, ctrl):
+        """
+        ctrl, or a copy of it whose overridden services are copies with the
+        overrides made to them
+        """
+        if not self._overrides:
+            return ctrl
+        applied = copy.copy(ctrl)
+        applied.services = dict(ctrl.services)
+        for name, changes in self._overrides.items():
+            if name in applied.services:
+                applied.services[name] = applied.services[name].copy(**changes)
+        return applied
+
+
+def cli_overrides(context):
+    """
+    context, overriding its service with what --image, --name and
+    --dockerfile ask for. They only make sense when there is one service
+    """
+    services = context.services
+    for key, value in (
+            ('image', context.image),
+            ('name', context.name),
+            ('dockerfile', context.dockerfile and {'dev': abspath(context.dockerfile),
+                                                   'prod': abspath(context.dockerfile)})):
+        if not value:
+            continue
+        if len(services) == 1:
+            context = context.override(services[0], **{key: value})
+        else:
+            module_logger.info('Ignoring %s specified in arguments. Too many services.', key)
+    return context
+
+
+@functools.lru_cache(maxsize=1)
+def defaults():
+    """The context of a run given no arguments"""
+    return RunContext.parse([])
@@ -17,13 +17,14 @@ import signal
 import sys
 from os.path import abspath, dirname, exists, join, split
 
-from control.cli_args import build_parser
 from control.exceptions import InvalidControlfile
+from control.context import RunContext, cli_overrides
 from control.controlfile import Controlfile
 from control.dclient import dclient
 from control.functions import function_dispatch
-from control.options import options
+from control.labels import session_id
 from control.service import MetaService
+from control.tracing import span, tracer
 
 module_logger = logging.getLogger('control')
 module_logger.setLevel(logging.DEBUG)
@@ -38,34 +39,64 @@ def sigint_handler(sig, frame):  # pylint: disable=unused-argument
     sys.exit(130)
 
 
-def main(args):
-    """create the parser and decide how to run"""
+def main(args, loader=None):
+    """
+    create the parser and decide how to run
+
+    loader is called with the Controlfile location and --as-me to get a
+    Controlfile. The daemon passes in its cache here. When it is not given
+    Control is running in its own process, and owns the signal handlers.
+    """
     # Shut up requests because the user has to make a conscious choice to be
     # insecure
-    global options
     import requests
     from requests.packages.urllib3.exceptions import InsecureRequestWarning
     requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
     console_loghandler = logging.StreamHandler()
-    signal.signal(signal.SIGINT, sigint_handler)
+    if loader is None:
+        signal.signal(signal.SIGINT, sigint_handler)
+        loader = Controlfile
 
-    parser = build_parser()
-    parser.parse_args(args, namespace=options)
+    context = RunContext.parse(args)
     console_loghandler.setLevel(logging.INFO)
-    if options.debug:
+    if context.debug:
         console_loghandler.setLevel(logging.DEBUG)
     module_logger.addHandler(console_loghandler)
     module_logger.debug("switching to debug logging")
+    if context.trace:
+        tracer.start()
+    try:
+        with span('control.run', command=context.command or 'default'):
+            ret = run(context, loader)
+    finally:
+        module_logger.removeHandler(console_loghandler)
+        if context.trace:
+            tracer.stop()
+            tracer.write(context.trace)
+
+    if not ret:
+        sys.exit(1)
+
+
+def run(context, loader):
+    """
+    Find the Controlfile, work out the services, and dispatch the command
+    with the context it runs in
+    """
+    if context.command == 'daemon':
+        from control.daemon import serve
+        return serve()
 
     # Read in a Controlfile if one exists
-    ctrlfile_location = abspath(options.controlfile)
+    ctrlfile_location = abspath(context.controlfile)
     while dirname(ctrlfile_location) != '/' and not exists(ctrlfile_location):
         s = split(ctrlfile_location)
         ctrlfile_location = join(dirname(s[0]), s[1])
     module_logger.debug('controlfile location: %s', ctrlfile_location)
     try:
-        ctrl = Controlfile(ctrlfile_location, options.as_me)
+        with span('controlfile.load', path=ctrlfile_location):
+            ctrl = loader(ctrlfile_location, context.as_me)
     except FileNotFoundError as error:
         module_logger.critical(error)
         sys.exit(2)
@@ -78,42 +109,15 @@ def main(args):
         sys.exit(2)
 
     # If no services were specified on the command line, default to required
-    if len(options.services) == 0:
+    services = context.services
+    if len(services) == 0:
         module_logger.debug('No options specified. Using required service list')
-        options.services = ctrl.required_services()
+        services = ctrl.required_services()
     # Flatten the service list by replacing metaservices with their service lists
     module_logger.debug(ctrl.services.keys())
-    # module_logger.debug(ctrl.services['js'])
-    # for name in (name
-    #              for name in options.services
-    #              if isinstance(ctrl.services[name], MetaService)):
-    #     options.services += ctrl.services[name].services
-    #     options.services.remove(name)
-    options.services = flatten(
-        ctrl.services[name].services for name in options.services)
-
-    # Override image name if only one service discovered
-    if options.image and len(options.services) == 1:
-        ctrl.services[options.services[0]]['image'] = options.image
-        module_logger.debug(vars(ctrl.services[options.services[0]]))
-    elif options.image and len(options.services) > 1:
-        module_logger.info('Ignoring image specified in arguments. Too many services.')
-    # Override container name if only one service
-    if options.name and len(options.services) == 1:
-        ctrl.services[options.services[0]]['name'] = options.name
-        module_logger.debug(vars(ctrl.services[options.services[0]]))
-    elif options.name and len(options.services) > 1:
-        module_logger.info('Ignoring container name specified in arguments. '
-                           'Too many services to start')
-    # Override dockerfile location if only one service discovered
-    if options.dockerfile and len(options.services) == 1:
-        ctrl.services[options.services[0]]['dockerfile'] = options.image
-        module_logger.debug(vars(ctrl.services[options.services[0]]))
-    elif options.dockerfile and len(options.services) > 1:
-        module_logger.info('Ignoring dockerfile specified in arguments. Too many services.')
-    module_logger.debug(vars(options))
-
-    ret = function_dispatch(options, ctrl)
+    context = cli_overrides(context.replace(services=flatten(
+        ctrl.services[name].services for name in services), session=session_id()))
+    module_logger.debug(context)
 
-    if not ret:
-        sys.exit(1)
+    # The overrides go on copies of the services, never on the Controlfile's
+    return function_dispatch(context, context.apply(ctrl))
@@ -10,7 +10,10 @@ import uuid
 
 from control.exceptions import InvalidControlfile
 from control.service import MetaService, Startable, ImageService, create_service
-from control.substitution import normalize_service, satisfy_nested_options, _substitute_vars
+from control.substitution import compile_options, normalize_service, _substitute_vars
+# Still imported from here by older code
+from control.substitution import satisfy_nested_options  # pylint: disable=unused-import
+from control.tracing import span, traced
 
 dn = os.path.dirname
 module_logger = logging.getLogger('control.controlfile')
@@ -57,6 +60,10 @@ class Controlfile:
         options for meta-services.
         """
         self.logger = logging.getLogger('control.controlfile.Controlfile')
+        self.location = controlfile_location
+        # Every file this Controlfile was built from, and its mtime, so a
+        # long running process can tell when it needs to be read in again
+        self.files = {}
         self.services = {
             "required": MetaService({'service': 'required', 'required': True, 'services': []},
                                     controlfile_location),
@@ -72,9 +79,10 @@ class Controlfile:
             "HOSTNAME": socket.gethostname(),
         }
         git = {}
-        with subprocess.Popen(['git', 'rev-parse', '--show-toplevel'],
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE) as p:
+        with span('controlfile.git'), \
+                subprocess.Popen(['git', 'rev-parse', '--show-toplevel'],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE) as p:
             p.wait()
             if p.returncode == 0:
                 root_dir, _ = p.communicate()
@@ -95,12 +103,17 @@ class Controlfile:
                         commit, _ = q.communicate()
                         git['GIT_COMMIT'] = commit.decode('utf-8').strip()
                         git['GIT_SHORT_COMMIT'] = git['GIT_COMMIT'][:7]
+                # Checkouts and commits append to the HEAD reflog, which
+                # changes the git variables without touching a Controlfile
+                self._record(os.path.join(root_dir, '.git', 'logs', 'HEAD'))
         variables.update(git)
         variables.update(os.environ)
 
-        data = self.read_in_file(controlfile_location)
+        data = self._read(controlfile_location)
         if not data:
             raise InvalidControlfile(controlfile_location, "empty Controlfile")
+        # The docker hosts to spread builds over, see control.hosts
+        self.hosts = data.get('hosts', []) if 'services' in data else []
         # Check if this is a single service Controlfile, if it is, wrap in a
         # metaservice.
         if 'services' not in data:
@@ -130,6 +143,32 @@ class Controlfile:
             raise InvalidControlfile(controlfile, str(error)) from None
         return data
 
+    def _read(self, controlfile):
+        """Read in a Controlfile and remember when it was last changed"""
+        self._record(controlfile)
+        return self.read_in_file(controlfile)
+
+    def _record(self, path):
+        try:
+            self.files[path] = os.stat(path).st_mtime
+        except FileNotFoundError:
+            pass
+
+    def changed(self):
+        """
+        Check if any of the files this Controlfile was read in from have been
+        modified or removed since they were read
+        """
+        for path, mtime in self.files.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except FileNotFoundError:
+                return True
+        return False
+
+    @traced('controlfile.create_service',
+            lambda self, data, service_name, *args: {'service': service_name})
     @CountCalls
     def create_service(self, data, service_name, options, variables, ctrlfile):
         """
@@ -144,7 +183,7 @@ class Controlfile:
         while 'controlfile' in data:
             ctrlfile = data['controlfile']
             # TODO write a test that gets a FileNotFound thrown from here
-            data = self.read_in_file(ctrlfile)
+            data = self._read(ctrlfile)
         data['service'] = service_name
 
         services_in_data = 'services' in data
@@ -157,7 +196,8 @@ class Controlfile:
         if services_in_data and not services_is_list:
             self.logger.debug('found Metaservice %s', data['service'])
             metaservice = MetaService(data, ctrlfile)
-            opers = satisfy_nested_options(outer=options, inner=data.get('options', {}))
+            # Compiled once here, and applied to every service underneath
+            opers = compile_options(options).merge(data.get('options', {}))
             nvars = copy.deepcopy(variables)
             nvars.update(_substitute_vars(data.get('vars', {}), variables))
             nvars.update(os.environ)
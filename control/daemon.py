@@ -0,0 +1,169 @@
+"""
+A long running Control process that the control CLI hands its work to.
+
+Starting Control pays for Python startup, importing docker-py and requests,
+reading every Controlfile, running git, and setting up a docker client and
+registry sessions. `control daemon` pays for that once and then serves
+commands over a Unix socket (see control.client for the protocol). The CLI
+forwards to it when it is listening and runs in-process when it isn't.
+
+Commands are run one at a time. Each command gets its own RunContext, but
+Control runs commands relative to the current directory and environment, so
+the daemon adopts the client's directory and environment for the length of
+each command. Output is sent back over the socket, including the output of
+the prebuild and postbuild events a command runs.
+"""
+
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import traceback
+
+from control.client import connect, socket_path
+from control.controlfile import Controlfile
+from control.exceptions import ControlException
+
+module_logger = logging.getLogger('control.daemon')
+module_logger.setLevel(logging.DEBUG)
+
+# Environment variables that differ between every shell, and would otherwise
+# keep the Controlfile cache from ever being hit
+VOLATILE_ENV = {'_', 'OLDPWD', 'PWD', 'SHLVL', 'TERM_SESSION_ID', 'WINDOWID'}
+
+
+class ControlfileCache:
+    """
+    Keeps parsed Controlfiles around between commands. A Controlfile is read
+    in again when any of the files it came from change, or when the
+    environment it was read with is different.
+    """
+
+    def __init__(self):
+        self.controlfiles = {}
+
+    def load(self, location, force_user=False):
+        """
+        Return the Controlfile at location. Every command is handed the same
+        one, so commands make their changes to copies, with RunContext.apply
+        """
+        key = (
+            location,
+            bool(force_user),
+            frozenset((k, v) for k, v in os.environ.items() if k not in VOLATILE_ENV),
+        )
+        ctrl = self.controlfiles.get(key)
+        if ctrl is None or ctrl.changed():
+            module_logger.debug('reading in %s', location)
+            ctrl = self.controlfiles[key] = Controlfile(location, force_user)
+        return ctrl
+
+
+class SocketWriter(io.TextIOBase):
+    """Send everything written to this file to the client as one message type"""
+
+    def __init__(self, conn, key, tty):
+        super().__init__()
+        self.conn = conn
+        self.key = key
+        self.tty = tty
+
+    def write(self, text):
+        self.conn.write(json.dumps({self.key: text}).encode('utf-8') + b'\n')
+        return len(text)
+
+    def flush(self):
+        self.conn.flush()
+
+    def isatty(self):
+        return self.tty
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """Runs one command for one client"""
+
+    def handle(self):
+        from control.control import main
+
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        out = SocketWriter(self.wfile, 'stdout', request.get('tty', False))
+        err = SocketWriter(self.wfile, 'stderr', request.get('tty', False))
+        # sys.stdout, sys.stderr, the working directory and the environment
+        # belong to the whole process. Swapping them for each command is only
+        # safe because ControlServer handles one request at a time, so it
+        # must not be made a threading server
+        saved_cwd = os.getcwd()
+        saved_env = dict(os.environ)
+        code = 0
+        try:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            with redirect_stdout(out), redirect_stderr(err):
+                try:
+                    main(request['args'], loader=self.server.controlfiles.load)
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else int(e.code is not None)
+                except (Exception, ControlException):  # pylint: disable=broad-except
+                    traceback.print_exc()
+                    code = 1
+        finally:
+            os.chdir(saved_cwd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+        try:
+            self.wfile.write(json.dumps({'exit': code}).encode('utf-8') + b'\n')
+        except OSError:
+            module_logger.debug('client went away before the command finished')
+
+
+class ControlServer(socketserver.UnixStreamServer):
+    """
+    A Unix socket server that owns the Controlfile cache. It runs one
+    command at a time, since commands take over the process's stdout,
+    working directory and environment
+    """
+
+    def __init__(self, path):
+        self.controlfiles = ControlfileCache()
+        super().__init__(path, ControlHandler)
+
+
+def make_server(path=None):
+    """
+    Create the server, replacing a socket left behind by a daemon that did
+    not shut down cleanly. Returns None if another daemon is already running.
+    """
+    path = path or socket_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        sock = connect(path)
+        if sock is not None:
+            sock.close()
+            return None
+        os.unlink(path)
+    return ControlServer(path)
+
+
+def _terminate(sig, frame):  # pylint: disable=unused-argument
+    sys.exit(0)
+
+
+def serve(path=None):
+    """Run the daemon until it is killed"""
+    server = make_server(path)
+    if server is None:
+        print('control daemon is already running', file=sys.stderr)
+        return False
+    signal.signal(signal.SIGTERM, _terminate)
+    print('control daemon listening on {}'.format(server.server_address))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(server.server_address)
+    return True
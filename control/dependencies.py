@@ -0,0 +1,143 @@
+"""
+Work out which services are built FROM which other services.
+
+A service depends on another when the FROM line of its Dockerfile (or its
+fromline override) names the image the other service builds. Containers
+depend on the containers they link to or take volumes from, for the order
+they start in.
+"""
+
+import logging
+
+from control.repository import Repository
+from control.service import Buildable
+
+module_logger = logging.getLogger('control.dependencies')
+module_logger.setLevel(logging.DEBUG)
+
+
+def read_dockerfile(service, env, pins=None):
+    """
+    Read the Dockerfile the service uses in env ('dev' or 'prod'), replacing
+    the FROM line with the service's fromline if it has one. pins maps FROM
+    images to the digests Controlfile.lock has for them, and a pinned FROM
+    line is rewritten to build FROM the digest.
+
+    Returns the upstream Repository and the bytes of the Dockerfile that
+    should be built. The Repository is None if there is no FROM line.
+    """
+    upstream = None
+    lines = []
+    with open(service['dockerfile'][env], 'r') as f:
+        for line in f:
+            if line.startswith('FROM'):
+                if service.fromline[env]:
+                    line = service.fromline[env].rstrip('\n') + '\n'
+                words = line.split()
+                upstream = Repository.match(words[1])
+                if pins and not upstream.digest and upstream.repo in pins:
+                    upstream = upstream.pin(pins[upstream.repo])
+                    line = ' '.join([words[0], upstream.reference] + words[2:]) + '\n'
+                module_logger.debug('discovered upstream as %s', upstream)
+            lines.append(line)
+    return upstream, ''.join(lines).encode('utf-8')
+
+
+def upstream_of(service, env, pins=None):
+    """Return the Repository a service is built FROM, or None if unknown"""
+    if not isinstance(service, Buildable) or not service['dockerfile'][env]:
+        return None
+    try:
+        return read_dockerfile(service, env, pins)[0]
+    except OSError:
+        return None
+
+
+def build_graph(ctrl, env='dev'):
+    """
+    Map the name of every buildable service in the Controlfile to the set of
+    services whose images it is built FROM
+    """
+    buildable = {name: service
+                 for name, service in ctrl.services.items()
+                 if isinstance(service, Buildable) and name == service.service}
+    images = {Repository.match(service.image).repo: name
+              for name, service in buildable.items()}
+    graph = {}
+    for name, service in buildable.items():
+        upstream = upstream_of(service, env)
+        graph[name] = set()
+        if upstream and upstream.repo in images and images[upstream.repo] != name:
+            graph[name].add(images[upstream.repo])
+    return graph
+
+
+def dependents(graph, names):
+    """Return names and every service that is built FROM them, transitively"""
+    found = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for name, deps in graph.items():
+            if name not in found and deps & found:
+                found.add(name)
+                changed = True
+    return found
+
+
+def build_order(graph, names):
+    """
+    Order names so that each service comes after the services it is built
+    FROM. Services with no ordering between them are sorted by name.
+    """
+    return [name for wave in build_waves(graph, names) for name in wave]
+
+
+def build_waves(graph, names):
+    """
+    Group names into waves: every service in a wave is only built FROM
+    services in earlier waves, so a wave's builds can all run at once.
+    Each wave is sorted by name.
+    """
+    names = set(names)
+    done = set()
+    waves = []
+    while names - done:
+        ready = sorted(n for n in names - done
+                       if not (graph.get(n, set()) & names) - done)
+        if not ready:
+            module_logger.warning('services are built FROM each other: %s',
+                                  ', '.join(sorted(names - done)))
+            ready = sorted(names - done)
+        waves.append(ready)
+        done.update(ready)
+    return waves
+
+
+def _container_refs(service):
+    """The containers a service's container links to or borrows from"""
+    host_config = service.host_config
+    links = host_config.get('links') or []
+    if isinstance(links, dict):
+        links = list(links)
+    # (name, alias) pairs, or name:alias
+    refs = [link[0] if isinstance(link, (list, tuple)) else link.split(':')[0]
+            for link in links]
+    refs += [source.split(':')[0] for source in host_config.get('volumes_from') or []]
+    for mode in ('network_mode', 'ipc_mode', 'pid_mode'):
+        value = host_config.get(mode) or ''
+        if value.startswith('container:'):
+            refs.append(value[len('container:'):])
+    return refs
+
+
+def start_graph(ctrl, names):
+    """
+    Map each of names to the services among names whose containers have to
+    be running before it starts: the ones it links to, takes volumes from,
+    or shares a namespace with
+    """
+    containers = {ctrl.services[name]['name']: name for name in names}
+    return {name: {containers[ref] for ref in _container_refs(ctrl.services[name])
+                   if ref in containers and containers[ref] != name}
+            for name in names}
@@ -94,3 +94,12 @@ class ImageNotFound(ControlException):
 
     def __str__(self):
         return '''Image does not exist: {}'''.format(self.image)
+
+
+# Docker host exceptions
+class HostUnavailable(ControlException):
+    def __init__(self, urls):
+        self.urls = urls
+
+    def __str__(self):
+        return 'Cannot reach any docker host: {}'.format(', '.join(self.urls))
@@ -0,0 +1,9 @@
+"""
+Stand-ins for the services Control talks to, served from a thread in the
+same process. They let the orchestration code be tested and benchmarked on
+a machine without a docker daemon or a registry.
+"""
+
+from control.fakes.docker import FakeDocker
+from control.fakes.registry import CertDir, FakeRegistry
+from control.fakes.server import FakeServer, UnixHTTPConnection
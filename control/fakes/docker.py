@@ -0,0 +1,938 @@
+"""
+A stand-in Docker Engine that speaks enough of the remote API for Control:
+containers, exec, logs, stats, build, pull, images, volumes, events, and
+the system endpoints. It keeps everything in memory, nothing actually runs,
+and it can be made slow or made to fail with the FakeServer knobs.
+
+    with FakeDocker(images=['busybox:latest']) as fake:
+        client = docker.Client(base_url=fake.url)
+
+Pulls succeed for any image unless `remote` is given, in which case only the
+images added to it (or with add_remote) can be pulled.
+"""
+
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import re
+import shlex
+import struct
+import tarfile
+import time
+import zlib
+
+from control.fakes.server import FakeServer, HTTPError, Response
+
+LAYER_SIZE = 1024 * 1024
+RAW_STREAM = 'application/vnd.docker.raw-stream'
+
+
+def _timestamp(when):
+    """RFC 3339 with nanoseconds, the way docker writes times"""
+    return datetime.datetime.fromtimestamp(when, datetime.timezone.utc) \
+        .strftime('%Y-%m-%dT%H:%M:%S.%f000Z')
+
+
+def normalize(name):
+    """Add :latest to image names without a tag or digest"""
+    if '@' in name or ':' in name.rsplit('/', 1)[-1]:
+        return name
+    return name + ':latest'
+
+
+def _digest(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _frame(stream, data):
+    """A frame of docker's multiplexed stdout/stderr stream"""
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+def _lines(items):
+    for item in items:
+        yield json.dumps(item).encode('utf-8') + b'\r\n'
+
+
+def _parse_labels(text):
+    """The key=value pairs of a Dockerfile LABEL instruction"""
+    labels = {}
+    for word in shlex.split(text):
+        key, _, value = word.partition('=')
+        labels[key] = value
+    return labels
+
+
+def _filters(request):
+    return json.loads(request.param('filters') or '{}')
+
+
+def _labels_match(labels, wanted):
+    for label in wanted:
+        key, sep, value = label.partition('=')
+        if key not in labels or (sep and labels[key] != value):
+            return False
+    return True
+
+
+class FakeDocker(FakeServer):
+    """An in-memory Docker Engine on a Unix socket"""
+
+    path_prefix = r'^/v[0-9.]+'
+
+    routes = [
+        ('GET', r'/_ping', 'system.ping', '_ping'),
+        ('GET', r'/version', 'system.version', '_version'),
+        ('GET', r'/info', 'system.info', '_info'),
+        ('GET', r'/system/df', 'system.df', '_df'),
+        ('GET', r'/events', 'system.events', '_events'),
+
+        ('GET', r'/containers/json', 'containers.list', '_containers_list'),
+        ('POST', r'/containers/create', 'containers.create', '_containers_create'),
+        ('GET', r'/containers/(?P<id>[^/]+)/json', 'containers.inspect', '_containers_inspect'),
+        ('POST', r'/containers/(?P<id>[^/]+)/start', 'containers.start', '_containers_start'),
+        ('POST', r'/containers/(?P<id>[^/]+)/stop', 'containers.stop', '_containers_stop'),
+        ('POST', r'/containers/(?P<id>[^/]+)/kill', 'containers.kill', '_containers_kill'),
+        ('POST', r'/containers/(?P<id>[^/]+)/restart', 'containers.restart',
+         '_containers_restart'),
+        ('POST', r'/containers/(?P<id>[^/]+)/wait', 'containers.wait', '_containers_wait'),
+        ('GET', r'/containers/(?P<id>[^/]+)/logs', 'containers.logs', '_containers_logs'),
+        ('GET', r'/containers/(?P<id>[^/]+)/stats', 'containers.stats', '_containers_stats'),
+        ('DELETE', r'/containers/(?P<id>[^/]+)', 'containers.remove', '_containers_remove'),
+
+        ('POST', r'/containers/(?P<id>[^/]+)/exec', 'exec.create', '_exec_create'),
+        ('POST', r'/exec/(?P<id>[^/]+)/start', 'exec.start', '_exec_start'),
+        ('GET', r'/exec/(?P<id>[^/]+)/json', 'exec.inspect', '_exec_inspect'),
+
+        ('POST', r'/build', 'images.build', '_build'),
+        ('GET', r'/images/json', 'images.list', '_images_list'),
+        ('POST', r'/images/create', 'images.pull', '_images_pull'),
+        ('POST', r'/images/load', 'images.load', '_images_load'),
+        ('GET', r'/images/(?P<name>.+)/json', 'images.inspect', '_images_inspect'),
+        ('GET', r'/images/(?P<name>.+)/get', 'images.get', '_images_get'),
+        ('POST', r'/images/(?P<name>.+)/tag', 'images.tag', '_images_tag'),
+        ('DELETE', r'/images/(?P<name>.+)', 'images.remove', '_images_remove'),
+
+        ('GET', r'/volumes', 'volumes.list', '_volumes_list'),
+        ('POST', r'/volumes/create', 'volumes.create', '_volumes_create'),
+        ('GET', r'/volumes/(?P<name>[^/]+)', 'volumes.inspect', '_volumes_inspect'),
+        ('DELETE', r'/volumes/(?P<name>[^/]+)', 'volumes.remove', '_volumes_remove'),
+    ]
+
+    def __init__(self, address=None, images=None, remote=None, name='fake-docker',
+                 ncpu=4, **kwargs):
+        super().__init__(address, **kwargs)
+        self.name = name
+        self.ncpu = ncpu
+        self.containers = {}
+        self.images = {}
+        self.tags = {}
+        self.volumes = {}
+        self.execs = {}
+        self.event_log = []
+        self.logs = {}
+        self.builds = []
+        self.pulls = []
+        self.remote = None if remote is None else {}
+        # Extra seconds each build step or pulled layer takes
+        self.step_latency = 0.0
+        self.layer_latency = 0.0
+        self.stats_interval = 0.1
+        # Called with the container and the command; returns (exit code, output)
+        self.exec_handler = lambda container, cmd: (0, b'')
+        self._ids = itertools.count(1)
+        for image in images or []:
+            self.add_image(image)
+        for image in remote or []:
+            self.add_remote(image)
+
+    # Setting up state for tests
+
+    def _new_id(self, *parts):
+        return _digest(next(self._ids), *parts)
+
+    def add_image(self, name, size=3 * LAYER_SIZE, labels=None, parent='', created=None,
+                  layers=3, digest=None):
+        """Put an image on this host as if it had been pulled. Returns its ID"""
+        name = normalize(name)
+        image_id = 'sha256:' + (digest or self._new_id(name))
+        with self.lock:
+            self.images[image_id] = {
+                'Id': image_id,
+                'RepoTags': [],
+                'RepoDigests': [],
+                'Parent': parent,
+                'Created': created or time.time(),
+                'Size': size,
+                'Labels': dict(labels or {}),
+                'Layers': [_digest(image_id, i) for i in range(layers)],
+            }
+            self._tag(image_id, name)
+        return image_id
+
+    def add_remote(self, name, size=3 * LAYER_SIZE, layers=3, labels=None):
+        """Make an image available to pull"""
+        name = normalize(name)
+        self.remote = self.remote if self.remote is not None else {}
+        self.remote[name] = {
+            'size': size, 'layers': layers, 'labels': dict(labels or {}),
+            'digest': 'sha256:' + _digest('remote', name, size, layers),
+        }
+
+    def emit_log(self, container, line, stream=1):
+        """Have a container write a line to stdout (1) or stderr (2)"""
+        with self.changed:
+            cid = self._container(container)['Id']
+            if isinstance(line, str):
+                line = line.encode('utf-8')
+            self.logs.setdefault(cid, []).append((time.time(), stream, line))
+            self.changed.notify_all()
+
+    def image(self, ref):
+        """The image record for a tag, ID, or digest reference"""
+        with self.lock:
+            return self.images[self._image_id(ref)]
+
+    def container(self, ref):
+        """The container record for a name or ID"""
+        with self.lock:
+            return self._container(ref)
+
+    # Lookups. These expect the lock to be held
+
+    def _image_id(self, ref):
+        if ref in self.images:
+            return ref
+        if normalize(ref) in self.tags:
+            return self.tags[normalize(ref)]
+        if '@' in ref:
+            for image_id, image in self.images.items():
+                if ref in image['RepoDigests']:
+                    return image_id
+        short = ref[7:] if ref.startswith('sha256:') else ref
+        if re.fullmatch('[0-9a-f]{4,64}', short):
+            found = [i for i in self.images if i[7:].startswith(short)]
+            if len(found) == 1:
+                return found[0]
+        raise HTTPError(404, 'No such image: {}'.format(ref))
+
+    def _container(self, ref):
+        ref = ref.lstrip('/')
+        if ref in self.containers:
+            return self.containers[ref]
+        for container in self.containers.values():
+            if container['Name'] == '/' + ref:
+                return container
+        found = [c for i, c in self.containers.items() if i.startswith(ref)]
+        if len(found) == 1:
+            return found[0]
+        raise HTTPError(404, 'No such container: {}'.format(ref))
+
+    def _volume(self, name):
+        try:
+            return self.volumes[name]
+        except KeyError:
+            raise HTTPError(404, 'get {}: no such volume'.format(name)) from None
+
+    def _tag(self, image_id, tag):
+        tag = normalize(tag)
+        old = self.tags.get(tag)
+        if old and old != image_id and old in self.images:
+            self.images[old]['RepoTags'].remove(tag)
+        self.tags[tag] = image_id
+        if tag not in self.images[image_id]['RepoTags']:
+            self.images[image_id]['RepoTags'].append(tag)
+
+    def _event(self, kind, action, actor, attributes=None, **extra):
+        now = time.time()
+        event = dict({
+            'Type': kind,
+            'Action': action,
+            'Actor': {'ID': actor, 'Attributes': dict(attributes or {})},
+            'status': action,
+            'id': actor,
+            'time': int(now),
+            'timeNano': int(now * 1e9),
+        }, **extra)
+        self.event_log.append(event)
+        self.changed.notify_all()
+
+    def _container_event(self, container, action):
+        attributes = dict(container['Config'].get('Labels') or {},
+                          name=container['Name'][1:], image=container['Config']['Image'])
+        self._event('container', action, container['Id'], attributes,
+                    **{'from': container['Config']['Image']})
+
+    def _volume_users(self, name):
+        return [c['Id'] for c in self.containers.values()
+                if any(m.get('Name') == name for m in c['Mounts'])]
+
+    def _new_volume(self, name=None, labels=None, anonymous=False):
+        name = name or self._new_id('volume')
+        if name not in self.volumes:
+            self.volumes[name] = {
+                'Name': name,
+                'Driver': 'local',
+                'Mountpoint': '/var/lib/docker/volumes/{}/_data'.format(name),
+                'Labels': dict(labels or {}),
+                'Scope': 'local',
+                'CreatedAt': _timestamp(time.time()),
+                'Anonymous': anonymous,
+                'Size': 0,
+            }
+            self._event('volume', 'create', name, {'driver': 'local'})
+        return self.volumes[name]
+
+    # System
+
+    def _ping(self, request):
+        return Response(200, b'OK', {'Content-Type': 'text/plain'})
+
+    def _version(self, request):
+        return {'Version': '1.12.6', 'ApiVersion': '1.24', 'MinAPIVersion': '1.12',
+                'Os': 'linux', 'Arch': 'amd64', 'KernelVersion': '4.4.0',
+                'GoVersion': 'go1.6.4', 'GitCommit': 'fake'}
+
+    def _info(self, request):
+        with self.lock:
+            running = sum(c['State']['Running'] for c in self.containers.values())
+            return {'ID': self.name, 'Name': self.name, 'NCPU': self.ncpu,
+                    'MemTotal': 8 * 1024 ** 3, 'Driver': 'overlay2',
+                    'ServerVersion': '1.12.6', 'Containers': len(self.containers),
+                    'ContainersRunning': running,
+                    'ContainersStopped': len(self.containers) - running,
+                    'Images': len(self.images)}
+
+    def _df(self, request):
+        with self.lock:
+            return {
+                'LayersSize': sum(i['Size'] for i in self.images.values()),
+                'Images': [self._image_summary(i) for i in self.images.values()],
+                'Containers': [self._container_summary(c) for c in self.containers.values()],
+                'Volumes': [dict(self._volume_view(v), UsageData={
+                    'Size': v['Size'], 'RefCount': len(self._volume_users(v['Name']))})
+                            for v in self.volumes.values()],
+            }
+
+    def _events(self, request):
+        since = float(request.param('since') or time.time())
+        until = request.param('until')
+        until = float(until) if until else None
+        filters = _filters(request)
+
+        def wanted(event):  # pylint: disable=missing-docstring
+            attributes = event['Actor']['Attributes']
+            return (event['timeNano'] >= since * 1e9 and
+                    (until is None or event['time'] <= until) and
+                    event['Type'] in filters.get('type', [event['Type']]) and
+                    event['Action'] in filters.get('event', [event['Action']]) and
+                    _labels_match(attributes, filters.get('label', [])) and
+                    (not filters.get('container') or
+                     event['Type'] == 'container' and
+                     (event['id'] in filters['container'] or
+                      attributes.get('name') in filters['container'])))
+
+        def stream():  # pylint: disable=missing-docstring
+            seen = 0
+            while True:
+                with self.lock:
+                    events = self.event_log[seen:]
+                    seen = len(self.event_log)
+                for event in events:
+                    if wanted(event):
+                        yield json.dumps(event).encode('utf-8') + b'\n'
+                if until is not None and time.time() >= until:
+                    return
+                if self.stopping:
+                    return
+                timeout = 1.0 if until is None else max(0.0, until - time.time())
+                self.wait_for(lambda: len(self.event_log) > seen, timeout)
+        return Response(200, stream(), {'Content-Type': 'application/json'})
+
+    # Containers
+
+    def _container_summary(self, container):
+        return {
+            'Id': container['Id'],
+            'Names': [container['Name']],
+            'Image': container['Config']['Image'],
+            'ImageID': container['Image'],
+            'Command': ' '.join(container['Config'].get('Cmd') or []),
+            'Created': int(container['CreatedTime']),
+            'State': container['State']['Status'],
+            'Status': 'Up' if container['State']['Running'] else 'Exited ({})'.format(
+                container['State']['ExitCode']),
+            'Labels': container['Config'].get('Labels') or {},
+            'Ports': [],
+            'Mounts': container['Mounts'],
+        }
+
+    def _containers_list(self, request):
+        filters = _filters(request)
+        show_all = request.flag('all')
+        with self.lock:
+            found = []
+            for container in sorted(self.containers.values(),
+                                    key=lambda c: c['CreatedTime'], reverse=True):
+                state = container['State']['Status']
+                if not (show_all or container['State']['Running']) and \
+                        'status' not in filters:
+                    continue
+                if 'status' in filters and state not in filters['status']:
+                    continue
+                if not _labels_match(container['Config'].get('Labels') or {},
+                                     filters.get('label', [])):
+                    continue
+                if 'name' in filters and not any(
+                        re.search(n, container['Name'][1:]) for n in filters['name']):
+                    continue
+                if 'id' in filters and not any(
+                        container['Id'].startswith(i) for i in filters['id']):
+                    continue
+                found.append(self._container_summary(container))
+        return found
+
+    def _containers_create(self, request):
+        config = request.json()
+        name = request.param('name')
+        with self.lock:
+            image_id = self._image_id(config.get('Image', ''))
+            if name and any(c['Name'] == '/' + name for c in self.containers.values()):
+                other = next(c['Id'] for c in self.containers.values()
+                             if c['Name'] == '/' + name)
+                raise HTTPError(409, 'Conflict. The name "/{}" is already in use by '
+                                'container {}. You have to remove (or rename) that '
+                                'container to be able to reuse that name.'.format(name, other))
+            cid = self._new_id('container', name)
+            host_config = config.get('HostConfig') or {}
+            mounts = []
+            bound = set()
+            for bind in host_config.get('Binds') or []:
+                source, _, rest = bind.partition(':')
+                destination, _, mode = rest.partition(':')
+                bound.add(destination)
+                if source.startswith('/'):
+                    mounts.append({'Type': 'bind', 'Source': source, 'Destination': destination,
+                                   'Mode': mode, 'RW': mode != 'ro'})
+                else:
+                    volume = self._new_volume(source)
+                    mounts.append({'Type': 'volume', 'Name': source,
+                                   'Source': volume['Mountpoint'], 'Destination': destination,
+                                   'Driver': 'local', 'Mode': mode, 'RW': mode != 'ro'})
+            for destination in sorted(config.get('Volumes') or {}):
+                if destination not in bound:
+                    volume = self._new_volume(anonymous=True)
+                    mounts.append({'Type': 'volume', 'Name': volume['Name'],
+                                   'Source': volume['Mountpoint'], 'Destination': destination,
+                                   'Driver': 'local', 'Mode': '', 'RW': True})
+            now = time.time()
+            self.containers[cid] = {
+                'Id': cid,
+                'Name': '/' + (name or 'fake_{}'.format(cid[:8])),
+                'Created': _timestamp(now),
+                'CreatedTime': now,
+                'Image': image_id,
+                'Config': dict(config, Labels=config.get('Labels') or {}),
+                'HostConfig': host_config,
+                'Mounts': mounts,
+                'State': {'Status': 'created', 'Running': False, 'Paused': False,
+                          'Restarting': False, 'Pid': 0, 'ExitCode': 0,
+                          'StartedAt': '0001-01-01T00:00:00Z',
+                          'FinishedAt': '0001-01-01T00:00:00Z'},
+                'RestartCount': 0,
+            }
+            self._container_event(self.containers[cid], 'create')
+        return Response(201, {'Id': cid, 'Warnings': None})
+
+    def _containers_inspect(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+            return {k: v for k, v in container.items() if k != 'CreatedTime'}
+
+    def _start(self, container):
+        state = container['State']
+        state.update(Status='running', Running=True, Pid=next(self._ids) + 1000,
+                     ExitCode=0, StartedAt=_timestamp(time.time()))
+        self._container_event(container, 'start')
+
+    def _halt(self, container, code, actions):
+        state = container['State']
+        state.update(Status='exited', Running=False, Pid=0, ExitCode=code,
+                     FinishedAt=_timestamp(time.time()))
+        for action in actions:
+            self._container_event(container, action)
+
+    def _containers_start(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+            if container['State']['Running']:
+                return Response(304)
+            self._start(container)
+        return Response(204)
+
+    def _containers_stop(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+            if not container['State']['Running']:
+                return Response(304)
+            self._halt(container, 0, ['kill', 'die', 'stop'])
+        return Response(204)
+
+    def _containers_kill(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+            if not container['State']['Running']:
+                raise HTTPError(409, 'Container {} is not running'.format(container['Id']))
+            self._halt(container, 137, ['kill', 'die'])
+        return Response(204)
+
+    def _containers_restart(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+            if container['State']['Running']:
+                self._halt(container, 0, ['kill', 'die', 'stop'])
+            container['RestartCount'] += 1
+            self._start(container)
+            self._container_event(container, 'restart')
+        return Response(204)
+
+    def _containers_wait(self, request):
+        with self.lock:
+            cid = self._container(request.args['id'])['Id']
+        self.wait_for(lambda: cid not in self.containers or
+                      not self.containers[cid]['State']['Running'], None)
+        with self.lock:
+            return {'StatusCode': self._container(cid)['State']['ExitCode']}
+
+    def _containers_remove(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+            if container['State']['Running'] and not request.flag('force'):
+                raise HTTPError(409, 'You cannot remove a running container {}. Stop the '
+                                'container before attempting removal or use -f'.format(
+                                    container['Id']))
+            if container['State']['Running']:
+                self._halt(container, 137, ['kill', 'die'])
+            del self.containers[container['Id']]
+            self.logs.pop(container['Id'], None)
+            if request.flag('v'):
+                for mount in container['Mounts']:
+                    volume = self.volumes.get(mount.get('Name'))
+                    if volume and volume['Anonymous'] and not self._volume_users(volume['Name']):
+                        del self.volumes[volume['Name']]
+                        self._event('volume', 'destroy', volume['Name'])
+            self._container_event(container, 'destroy')
+        return Response(204)
+
+    def _containers_logs(self, request):
+        want = {1} if request.flag('stdout') else set()
+        want |= {2} if request.flag('stderr') else set()
+        timestamps = request.flag('timestamps')
+        follow = request.flag('follow')
+        tail = request.param('tail', 'all')
+        since = float(request.param('since') or 0)
+        with self.lock:
+            container = self._container(request.args['id'])
+            cid = container['Id']
+            tty = container['Config'].get('Tty', False)
+            backlog = [l for l in self.logs.get(cid, []) if l[0] >= since]
+            seen = len(self.logs.get(cid, []))
+        if tail != 'all':
+            backlog = backlog[len(backlog) - int(tail):] if int(tail) else []
+
+        def encode(entry):  # pylint: disable=missing-docstring
+            when, stream, line = entry
+            if timestamps:
+                line = _timestamp(when).encode('utf-8') + b' ' + line
+            return line if tty else _frame(stream, line)
+
+        def stream():  # pylint: disable=missing-docstring
+            nonlocal seen
+            for entry in backlog:
+                if entry[1] in want:
+                    yield encode(entry)
+            while follow and not self.stopping:
+                def more():  # pylint: disable=missing-docstring
+                    return (cid not in self.containers or
+                            not self.containers[cid]['State']['Running'] or
+                            len(self.logs.get(cid, [])) > seen)
+                self.wait_for(more, 1.0)
+                with self.lock:
+                    entries = self.logs.get(cid, [])[seen:]
+                    seen += len(entries)
+                    alive = cid in self.containers and \
+                        self.containers[cid]['State']['Running']
+                for entry in entries:
+                    if entry[1] in want:
+                        yield encode(entry)
+                if not alive:
+                    return
+        return Response(200, stream(), {'Content-Type': RAW_STREAM})
+
+    def _stats(self, container, tick):
+        usage = 10 ** 7 * tick
+        return {
+            'read': _timestamp(time.time()),
+            'cpu_stats': {'cpu_usage': {'total_usage': usage, 'percpu_usage': [usage]},
+                          'system_cpu_usage': 10 ** 8 * tick, 'online_cpus': self.ncpu},
+            'precpu_stats': {'cpu_usage': {'total_usage': max(usage - 10 ** 7, 0)},
+                             'system_cpu_usage': 10 ** 8 * max(tick - 1, 0)},
+            'memory_stats': {'usage': 50 * 1024 * 1024, 'limit': 8 * 1024 ** 3},
+            'networks': {'eth0': {'rx_bytes': 1500 * tick, 'tx_bytes': 500 * tick}},
+            'blkio_stats': {'io_service_bytes_recursive': []},
+            'pids_stats': {'current': 1 if container['State']['Running'] else 0},
+        }
+
+    def _containers_stats(self, request):
+        with self.lock:
+            container = self._container(request.args['id'])
+        if not request.flag('stream') and request.param('stream') is not None:
+            return self._stats(container, 1)
+
+        def stream():  # pylint: disable=missing-docstring
+            for tick in itertools.count(1):
+                yield json.dumps(self._stats(container, tick)).encode('utf-8') + b'\n'
+                if self.stopping or not container['State']['Running']:
+                    return
+                self.wait_for(lambda: not container['State']['Running'],
+                              self.stats_interval)
+        return Response(200, stream(), {'Content-Type': 'application/json'})
+
+    # Exec
+
+    def _exec_create(self, request):
+        config = request.json()
+        with self.lock:
+            container = self._container(request.args['id'])
+            if not container['State']['Running']:
+                raise HTTPError(409, 'Container {} is not running'.format(container['Id']))
+            exec_id = self._new_id('exec')
+            cmd = config.get('Cmd') or []
+            self.execs[exec_id] = {
+                'ID': exec_id, 'ContainerID': container['Id'], 'Running': False,
+                'ExitCode': None, 'OpenStdout': bool(config.get('AttachStdout')),
+                'ProcessConfig': {'entrypoint': cmd[0] if cmd else '', 'arguments': cmd[1:],
+                                  'tty': bool(config.get('Tty'))},
+            }
+            self._container_event(container, 'exec_create: ' + ' '.join(cmd))
+        return Response(201, {'Id': exec_id})
+
+    def _exec_start(self, request):
+        with self.lock:
+            try:
+                execd = self.execs[request.args['id']]
+            except KeyError:
+                raise HTTPError(404, 'No such exec instance: {}'.format(
+                    request.args['id'])) from None
+            container = self._container(execd['ContainerID'])
+            config = execd['ProcessConfig']
+            self._container_event(container, 'exec_start: ' + ' '.join(
+                [config['entrypoint']] + config['arguments']))
+        code, output = self.exec_handler(container, [config['entrypoint']] + config['arguments'])
+        with self.lock:
+            execd['ExitCode'] = code
+        if request.json().get('Detach'):
+            return Response(200, b'')
+        body = output if config['tty'] else _frame(1, output) if output else b''
+        return Response(200, body, {'Content-Type': RAW_STREAM})
+
+    def _exec_inspect(self, request):
+        with self.lock:
+            try:
+                return dict(self.execs[request.args['id']])
+            except KeyError:
+                raise HTTPError(404, 'No such exec instance: {}'.format(
+                    request.args['id'])) from None
+
+    # Images
+
+    def _image_summary(self, image):
+        return {
+            'Id': image['Id'],
+            'ParentId': image['Parent'],
+            'RepoTags': image['RepoTags'] or ['<none>:<none>'],
+            'RepoDigests': image['RepoDigests'],
+            'Created': int(image['Created']),
+            'Size': image['Size'],
+            'VirtualSize': image['Size'],
+            'SharedSize': -1,
+            'Labels': image['Labels'],
+            'Containers': -1,
+        }
+
+    def _images_list(self, request):
+        filters = _filters(request)
+        with self.lock:
+            found = []
+            for image in sorted(self.images.values(), key=lambda i: -i['Created']):
+                dangling = not image['RepoTags']
+                if 'dangling' in filters and \
+                        dangling != (filters['dangling'][0].lower() == 'true'):
+                    continue
+                if not _labels_match(image['Labels'], filters.get('label', [])):
+                    continue
+                found.append(self._image_summary(image))
+        return found
+
+    def _images_inspect(self, request):
+        with self.lock:
+            image = self.images[self._image_id(request.args['name'])]
+            return {
+                'Id': image['Id'],
+                'RepoTags': image['RepoTags'],
+                'RepoDigests': image['RepoDigests'],
+                'Parent': image['Parent'],
+                'Created': _timestamp(image['Created']),
+                'Size': image['Size'],
+                'VirtualSize': image['Size'],
+                'Config': {'Labels': image['Labels'], 'Env': [], 'Cmd': None},
+                'ContainerConfig': {'Labels': image['Labels']},
+                'RootFS': {'Type': 'layers', 'Layers': image['Layers']},
+            }
+
+    def _images_tag(self, request):
+        with self.lock:
+            image_id = self._image_id(request.args['name'])
+            tag = request.param('repo') + ':' + (request.param('tag') or 'latest')
+            self._tag(image_id, tag)
+            self._event('image', 'tag', image_id, {'name': tag})
+        return Response(201)
+
+    def _images_remove(self, request):
+        ref = request.args['name']
+        force = request.flag('force')
+        with self.lock:
+            image_id = self._image_id(ref)
+            image = self.images[image_id]
+            tag = normalize(ref)
+            if tag in image['RepoTags'] and len(image['RepoTags']) > 1:
+                image['RepoTags'].remove(tag)
+                del self.tags[tag]
+                self._event('image', 'untag', image_id, {'name': tag})
+                return [{'Untagged': tag}]
+            users = [c['Id'] for c in self.containers.values() if c['Image'] == image_id]
+            if users and not force:
+                raise HTTPError(409, 'conflict: unable to remove repository reference "{}" '
+                                '(must force) - container {} is using its referenced image '
+                                '{}'.format(ref, users[0][:12], image_id[7:19]))
+            if any(i['Parent'] == image_id for i in self.images.values()):
+                raise HTTPError(409, 'conflict: unable to delete {} (cannot be forced) - '
+                                'image has dependent child images'.format(image_id[7:19]))
+            removed = []
+            for tag in image['RepoTags']:
+                del self.tags[tag]
+                removed.append({'Untagged': tag})
+                self._event('image', 'untag', image_id, {'name': tag})
+            del self.images[image_id]
+            removed.append({'Deleted': image_id})
+            self._event('image', 'delete', image_id)
+        return removed
+
+    def _images_get(self, request):
+        with self.lock:
+            image = dict(self.images[self._image_id(request.args['name'])])
+        data = json.dumps(image).encode('utf-8')
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w') as tar:
+            info = tarfile.TarInfo('fake-image.json')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            # Pad the tarball out to about the size of the image
+            info = tarfile.TarInfo('layer.tar')
+            info.size = min(image['Size'], 4 * LAYER_SIZE)
+            tar.addfile(info, io.BytesIO(b'\0' * info.size))
+        data = out.getvalue()
+        return Response(200, (data[i:i + 65536] for i in range(0, len(data), 65536)),
+                        {'Content-Type': 'application/x-tar'})
+
+    def _images_load(self, request):
+        try:
+            with tarfile.open(fileobj=io.BytesIO(request.body), mode='r:*') as tar:
+                image = json.loads(tar.extractfile('fake-image.json').read().decode('utf-8'))
+        except (tarfile.TarError, KeyError, ValueError):
+            raise HTTPError(500, 'invalid image tarball') from None
+        with self.lock:
+            tags = image['RepoTags']
+            image['RepoTags'] = []
+            self.images[image['Id']] = image
+            for tag in tags:
+                self._tag(image['Id'], tag)
+            self._event('image', 'load', image['Id'])
+        return Response(200, b''.join(_lines(
+            [{'stream': 'Loaded image: {}\n'.format(t)} for t in tags] or
+            [{'stream': 'Loaded image ID: {}\n'.format(image['Id'])}])))
+
+    def _pull(self, name):
+        """Pull name, yielding the progress lines docker would"""
+        name = normalize(name)
+        repo = name.rsplit(':', 1)[0]
+        with self.lock:
+            missing = self.remote is not None and name not in self.remote
+            remote = (self.remote or {}).get(name) or {
+                'size': 3 * LAYER_SIZE, 'layers': 3, 'labels': {},
+                'digest': 'sha256:' + _digest('remote', name)}
+            self.pulls.append(name)
+            current = self.tags.get(name)
+            up_to_date = current and repo + '@' + remote['digest'] in \
+                self.images[current]['RepoDigests']
+        if missing:
+            message = 'Error: image {} not found'.format(repo)
+            yield {'error': message, 'errorDetail': {'message': message}}
+            return
+        digest = remote['digest']
+        yield {'status': 'Pulling from ' + repo, 'id': name.rsplit(':', 1)[1]}
+        if up_to_date:
+            yield {'status': 'Digest: ' + digest}
+            yield {'status': 'Status: Image is up to date for ' + name}
+            return
+        layer_size = remote['size'] // max(remote['layers'], 1)
+        for layer in range(remote['layers']):
+            layer_id = _digest(digest, layer)[:12]
+            yield {'status': 'Pulling fs layer', 'progressDetail': {}, 'id': layer_id}
+            for done in (layer_size // 2, layer_size):
+                if self.layer_latency:
+                    time.sleep(self.layer_latency / 2)
+                yield {'status': 'Downloading', 'id': layer_id, 'progressDetail': {
+                    'current': done, 'total': layer_size}}
+            yield {'status': 'Download complete', 'progressDetail': {}, 'id': layer_id}
+            yield {'status': 'Pull complete', 'progressDetail': {}, 'id': layer_id}
+        with self.lock:
+            image_id = self.add_image(name, remote['size'], remote['labels'],
+                                      layers=remote['layers'],
+                                      digest=_digest(digest))
+            self.images[image_id]['RepoDigests'] = [repo + '@' + digest]
+            self._event('image', 'pull', name)
+        yield {'status': 'Digest: ' + digest}
+        yield {'status': 'Status: Downloaded newer image for ' + name}
+
+    def _images_pull(self, request):
+        name = request.param('fromImage')
+        if request.param('tag'):
+            name = name + ':' + request.param('tag')
+        return Response(200, _lines(self._pull(name)), {'Content-Type': 'application/json'})
+
+    def _build(self, request):
+        body = request.body
+        if body[:2] == b'\x1f\x8b':
+            body = zlib.decompress(body, 31)
+        tags = request.query.get('t', [])
+        labels = json.loads(request.param('labels') or '{}')
+        dockerfile_name = request.param('dockerfile') or 'Dockerfile'
+        nocache = request.flag('nocache')
+        return Response(200, _lines(self._run_build(body, tags, labels, dockerfile_name,
+                                                    nocache, request.flag('pull'))),
+                        {'Content-Type': 'application/json'})
+
+    def _run_build(self, body, tags, labels, dockerfile_name, nocache, pull):
+        """Go through a Dockerfile, yielding the lines docker would"""
+        try:
+            with tarfile.open(fileobj=io.BytesIO(body), mode='r:*') as tar:
+                dockerfile = tar.extractfile(dockerfile_name).read().decode('utf-8')
+        except (tarfile.TarError, KeyError, AttributeError):
+            message = 'Cannot locate specified Dockerfile: {}'.format(dockerfile_name)
+            yield {'error': message, 'errorDetail': {'message': message}}
+            return
+        steps = [line.strip() for line in dockerfile.splitlines()
+                 if line.strip() and not line.strip().startswith('#')]
+        parent = None
+        image_labels = {}
+        for number, step in enumerate(steps, 1):
+            yield {'stream': 'Step {}/{} : {}\n'.format(number, len(steps), step)}
+            instruction, _, rest = step.partition(' ')
+            instruction = instruction.upper()
+            if instruction == 'FROM':
+                base = rest.split()[0]
+                with self.lock:
+                    present = normalize(base) in self.tags or base in self.images
+                if pull or not present:
+                    for line in self._pull(base):
+                        if 'error' in line:
+                            yield line
+                            return
+                with self.lock:
+                    parent = self.images[self._image_id(base)]
+                    image_labels.update(parent['Labels'])
+            elif parent is None:
+                message = 'Please provide a source image with `from` prior to commit'
+                yield {'error': message, 'errorDetail': {'message': message}}
+                return
+            elif instruction == 'LABEL':
+                image_labels.update(_parse_labels(rest))
+            if self.step_latency:
+                time.sleep(self.step_latency)
+            yield {'stream': ' ---> {}\n'.format(_digest(parent['Id'], number)[:12])}
+        if parent is None:
+            message = 'No source image provided with `FROM`'
+            yield {'error': message, 'errorDetail': {'message': message}}
+            return
+        image_labels.update(labels)
+        key = [parent['Id'], dockerfile, hashlib.sha256(body).hexdigest(),
+               json.dumps(image_labels, sort_keys=True)]
+        if nocache:
+            key.append(next(self._ids))
+        image_id = 'sha256:' + _digest(*key)
+        with self.lock:
+            if image_id not in self.images:
+                self.images[image_id] = {
+                    'Id': image_id, 'RepoTags': [], 'RepoDigests': [],
+                    'Parent': parent['Id'], 'Created': time.time(),
+                    'Size': parent['Size'] + len(body), 'Labels': image_labels,
+                    'Layers': parent['Layers'] + [_digest(image_id)],
+                }
+            for tag in tags:
+                self._tag(image_id, tag)
+                self._event('image', 'tag', image_id, {'name': normalize(tag)})
+            self.builds.append({'tags': tags, 'dockerfile': dockerfile,
+                                'context_size': len(body), 'id': image_id})
+        yield {'stream': 'Successfully built {}\n'.format(image_id[7:19])}
+        for tag in tags:
+            yield {'stream': 'Successfully tagged {}\n'.format(normalize(tag))}
+
+    # Volumes
+
+    def _volume_view(self, volume):
+        return {k: v for k, v in volume.items() if k not in ('Anonymous', 'Size')}
+
+    def _volumes_list(self, request):
+        filters = _filters(request)
+        with self.lock:
+            found = []
+            for volume in self.volumes.values():
+                if 'dangling' in filters and \
+                        bool(self._volume_users(volume['Name'])) == \
+                        (filters['dangling'][0].lower() == 'true'):
+                    continue
+                if not _labels_match(volume['Labels'], filters.get('label', [])):
+                    continue
+                if 'name' in filters and not any(n in volume['Name'] for n in filters['name']):
+                    continue
+                found.append(self._volume_view(volume))
+        return {'Volumes': found, 'Warnings': None}
+
+    def _volumes_create(self, request):
+        config = request.json()
+        with self.lock:
+            volume = self._new_volume(config.get('Name'), config.get('Labels'))
+            return Response(201, self._volume_view(volume))
+
+    def _volumes_inspect(self, request):
+        with self.lock:
+            return self._volume_view(self._volume(request.args['name']))
+
+    def _volumes_remove(self, request):
+        name = request.args['name']
+        with self.lock:
+            self._volume(name)
+            users = self._volume_users(name)
+            if users:
+                raise HTTPError(409, 'remove {}: volume is in use - [{}]'.format(
+                    name, ', '.join(users)))
+            del self.volumes[name]
+            self._event('volume', 'destroy', name)
+        return Response(204)
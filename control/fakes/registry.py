@@ -0,0 +1,328 @@
+"""
+A stand-in Docker V2 registry over TLS: manifests in schema 1 and 2, blobs,
+tags/list and _catalog with pagination, HEAD requests with digests, and
+basic or token auth challenges.
+
+    with CertDir() as certs, FakeRegistry() as fake:
+        fake.push('app', 'dev')
+        certs.add(fake.endpoint)
+        reg = Registry('localhost', fake.port, certdir=certs.path)
+
+The certificate it serves is for localhost and 127.0.0.1, and CertDir lays
+it out the way docker and Registry look for it under /etc/docker/certs.d.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import ssl
+import tempfile
+import time
+import urllib.parse
+
+from control.fakes.docker import _digest, _timestamp
+from control.fakes.server import FakeServer, HTTPError, Response
+
+CERTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'certs')
+CERT = os.path.join(CERTS, 'localhost.crt')
+KEY = os.path.join(CERTS, 'localhost.key')
+
+SCHEMA1 = 'application/vnd.docker.distribution.manifest.v1+json'
+SCHEMA2 = 'application/vnd.docker.distribution.manifest.v2+json'
+CONFIG = 'application/vnd.docker.container.image.v1+json'
+LAYER = 'application/vnd.docker.image.rootfs.diff.tar.gzip'
+
+
+def server_context():
+    """A TLS context serving the bundled localhost certificate"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(CERT, KEY)
+    return context
+
+
+def _sha256(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def _blob(*parts, size=1024):
+    """Deterministic bytes to stand in for a layer"""
+    seed = _digest(*parts).encode('ascii')
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+class CertDir:
+    """
+    A temporary directory laid out like /etc/docker/certs.d, holding the
+    fake registry's certificate for each endpoint added to it
+    """
+
+    def __init__(self, *endpoints):
+        self._temp_dir = tempfile.TemporaryDirectory(prefix='control-certs-')
+        self.path = self._temp_dir.name
+        for endpoint in endpoints:
+            self.add(endpoint)
+
+    def add(self, endpoint):
+        """Trust the fake registry at endpoint. Returns the cert's path"""
+        directory = os.path.join(self.path, endpoint)
+        os.makedirs(directory, exist_ok=True)
+        return shutil.copy(CERT, os.path.join(directory, 'ca.crt'))
+
+    def cleanup(self):
+        """Remove the directory"""
+        self._temp_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+        return False
+
+
+class FakeRegistry(FakeServer):
+    """
+    An in-memory V2 registry on a TCP port, over TLS unless ssl_context is
+    given as None.
+
+    auth is None, 'basic' or 'bearer'. With basic, requests must carry the
+    username and password of one of users. With bearer, they must carry a
+    token from /token, which wants basic auth too if there are users.
+    """
+
+    routes = [
+        ('GET', r'/', 'registry.root', '_root'),
+        ('GET', r'/token', 'registry.token', '_token'),
+        ('GET', r'/v2/', 'registry.base', '_base'),
+        ('GET', r'/v2/_catalog', 'registry.catalog', '_catalog'),
+        ('GET', r'/v2/(?P<name>.+?)/tags/list', 'registry.tags', '_tags'),
+        ('GET', r'/v2/(?P<name>.+?)/manifests/(?P<reference>[^/]+)',
+         'registry.manifests', '_manifests'),
+        ('GET', r'/v2/(?P<name>.+?)/blobs/(?P<digest>[^/]+)', 'registry.blobs', '_blobs'),
+    ]
+
+    def __init__(self, address=None, auth=None, users=None, **kwargs):
+        if 'ssl_context' not in kwargs:
+            kwargs['ssl_context'] = server_context()
+        super().__init__(address or ('127.0.0.1', 0), **kwargs)
+        self.auth = auth
+        self.users = dict(users or {})
+        # name: {tag: schema 2 digest}
+        self.repositories = {}
+        # digest: (media type, bytes)
+        self.manifests = {}
+        self.blobs = {}
+        # The schema 1 manifest of each schema 2 manifest, for old clients
+        self.schema1 = {}
+        self.tokens = {}
+
+    @property
+    def port(self):
+        """The port the registry is listening on"""
+        return str(self.address[1])
+
+    @property
+    def endpoint(self):
+        """host:port, the way images and certs.d name the registry"""
+        return 'localhost:' + self.port
+
+    # Setting up state for tests
+
+    def push(self, name, tag='latest', created=None, layers=2, labels=None,
+             layer_size=1024):
+        """Put an image in the registry. Returns its schema 2 digest"""
+        created = _timestamp(time.time() if created is None else created)
+        with self.lock:
+            layer_digests = []
+            for index in range(layers):
+                data = _blob(name, tag, created, index, size=layer_size)
+                digest = _sha256(data)
+                self.blobs[digest] = data
+                layer_digests.append(digest)
+            config = json.dumps({
+                'architecture': 'amd64',
+                'os': 'linux',
+                'created': created,
+                'config': {'Labels': labels or {}},
+                'rootfs': {'type': 'layers', 'diff_ids': layer_digests},
+            }, sort_keys=True).encode('utf-8')
+            config_digest = _sha256(config)
+            self.blobs[config_digest] = config
+
+            manifest = json.dumps({
+                'schemaVersion': 2,
+                'mediaType': SCHEMA2,
+                'config': {'mediaType': CONFIG, 'size': len(config),
+                           'digest': config_digest},
+                'layers': [{'mediaType': LAYER, 'size': layer_size, 'digest': digest}
+                           for digest in layer_digests],
+            }, indent=3).encode('utf-8')
+            digest = _sha256(manifest)
+            self.manifests[digest] = (SCHEMA2, manifest)
+
+            # Schema 1 lists layers top first, each with its v1 history entry
+            history = []
+            parent = None
+            for index, layer in enumerate(layer_digests):
+                v1_id = _digest(layer, parent)
+                entry = {'id': v1_id, 'created': created}
+                if parent:
+                    entry['parent'] = parent
+                if index == len(layer_digests) - 1:
+                    entry.update(architecture='amd64', os='linux',
+                                 config={'Labels': labels or {}})
+                history.insert(0, {'v1Compatibility': json.dumps(entry)})
+                parent = v1_id
+            old = json.dumps({
+                'schemaVersion': 1,
+                'name': name,
+                'tag': tag,
+                'architecture': 'amd64',
+                'fsLayers': [{'blobSum': layer} for layer in reversed(layer_digests)],
+                'history': history,
+            }, indent=3).encode('utf-8')
+            old_digest = _sha256(old)
+            self.manifests[old_digest] = (SCHEMA1, old)
+            self.schema1[digest] = old_digest
+
+            self.repositories.setdefault(name, {})[tag] = digest
+        return digest
+
+    def remove(self, name, tag):
+        """Untag an image"""
+        with self.lock:
+            del self.repositories[name][tag]
+
+    # Auth
+
+    def _challenge(self, scope):
+        if self.auth == 'basic':
+            return 'Basic realm="fake-registry"'
+        challenge = 'Bearer realm="{}/token",service="fake-registry"'.format(self.url)
+        if scope:
+            challenge += ',scope="{}"'.format(scope)
+        return challenge
+
+    def _basic_ok(self, request):
+        if not self.users:
+            return True
+        kind, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if kind.lower() != 'basic':
+            return False
+        try:
+            user, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+        except ValueError:
+            return False
+        return self.users.get(user) == password
+
+    def _authorize(self, request, scope):
+        if not self.auth:
+            return
+        if self.auth == 'basic':
+            allowed = self._basic_ok(request)
+        else:
+            kind, _, token = request.headers.get('Authorization', '').partition(' ')
+            with self.lock:
+                allowed = kind.lower() == 'bearer' and token in self.tokens and \
+                    (not scope or scope in self.tokens[token])
+        if not allowed:
+            raise HTTPError(401, 'authentication required', 'UNAUTHORIZED',
+                            {'WWW-Authenticate': self._challenge(scope)})
+
+    # The API
+
+    def error(self, status, message, code=None):
+        if code is None:
+            code = {401: 'UNAUTHORIZED', 404: 'NAME_UNKNOWN'}.get(status, 'UNKNOWN')
+        return Response(status, {'errors': [{'code': code, 'message': message,
+                                             'detail': None}]})
+
+    def _root(self, request):
+        return Response(200, b'')
+
+    def _token(self, request):
+        if self.auth != 'bearer':
+            raise HTTPError(404, 'no token service', 'UNSUPPORTED')
+        if not self._basic_ok(request):
+            raise HTTPError(401, 'bad credentials', 'UNAUTHORIZED',
+                            {'WWW-Authenticate': 'Basic realm="fake-registry"'})
+        with self.lock:
+            token = _digest('token', len(self.tokens), request.query.get('scope'))
+            self.tokens[token] = set(request.query.get('scope', []))
+        return {'token': token, 'access_token': token, 'expires_in': 300,
+                'issued_at': _timestamp(time.time())}
+
+    def _base(self, request):
+        self._authorize(request, '')
+        return Response(200, {}, {'Docker-Distribution-API-Version': 'registry/2.0'})
+
+    def _page(self, request, items, path):
+        """A page of items, and the headers with a Link to the next one if there is one"""
+        items = sorted(items)
+        last = request.param('last')
+        if last:
+            items = [item for item in items if item > last]
+        headers = {}
+        count = request.param('n')
+        if count and int(count) < len(items):
+            items = items[:int(count)]
+            headers['Link'] = '<{}?{}>; rel="next"'.format(
+                path, urllib.parse.urlencode({'n': count, 'last': items[-1]}))
+        return items, headers
+
+    def _catalog(self, request):
+        self._authorize(request, 'registry:catalog:*')
+        with self.lock:
+            names = list(self.repositories)
+        names, headers = self._page(request, names, '/v2/_catalog')
+        return Response(200, {'repositories': names}, headers)
+
+    def _tags(self, request):
+        name = request.args['name']
+        self._authorize(request, 'repository:{}:pull'.format(name))
+        with self.lock:
+            if name not in self.repositories:
+                raise HTTPError(404, 'repository name not known to registry', 'NAME_UNKNOWN')
+            tags = list(self.repositories[name])
+        tags, headers = self._page(request, tags, '/v2/{}/tags/list'.format(name))
+        return Response(200, {'name': name, 'tags': tags}, headers)
+
+    def _manifests(self, request):
+        name = request.args['name']
+        reference = request.args['reference']
+        self._authorize(request, 'repository:{}:pull'.format(name))
+        with self.lock:
+            tags = self.repositories.get(name)
+            if tags is None:
+                raise HTTPError(404, 'repository name not known to registry', 'NAME_UNKNOWN')
+            if reference.startswith('sha256:'):
+                digest = reference
+                if digest not in self.manifests:
+                    raise HTTPError(404, 'manifest unknown', 'MANIFEST_UNKNOWN')
+            else:
+                if reference not in tags:
+                    raise HTTPError(404, 'manifest unknown', 'MANIFEST_UNKNOWN')
+                digest = tags[reference]
+                # Clients that don't ask for schema 2 get it rewritten to 1
+                if SCHEMA2 not in request.headers.get('Accept', ''):
+                    digest = self.schema1[digest]
+            media_type, manifest = self.manifests[digest]
+        return Response(200, manifest, {
+            'Content-Type': media_type,
+            'Docker-Content-Digest': digest,
+            'Docker-Distribution-API-Version': 'registry/2.0',
+            'Etag': '"{}"'.format(digest),
+        })
+
+    def _blobs(self, request):
+        self._authorize(request, 'repository:{}:pull'.format(request.args['name']))
+        with self.lock:
+            data = self.blobs.get(request.args['digest'])
+        if data is None:
+            raise HTTPError(404, 'blob unknown to registry', 'BLOB_UNKNOWN')
+        return Response(200, data, {
+            'Content-Type': 'application/octet-stream',
+            'Docker-Content-Digest': request.args['digest'],
+        })
@@ -0,0 +1,355 @@
+"""
+The HTTP plumbing shared by the fake services: a threaded server on a Unix
+socket or TCP port (optionally TLS), a route table, streamed responses, and
+knobs for making requests slow or making them fail.
+"""
+
+import collections
+import http.client
+import http.server
+import json
+import logging
+import os
+import random
+import re
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import urllib.parse
+import zlib
+
+module_logger = logging.getLogger('control.fakes')
+module_logger.setLevel(logging.DEBUG)
+
+
+class Request:
+    """What a route handler gets to look at"""
+
+    def __init__(self, method, path, query, headers, body, args):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+        self.args = args
+
+    def param(self, name, default=None):
+        """The first value of a query parameter"""
+        return self.query.get(name, [default])[0]
+
+    def flag(self, name):
+        """Query parameters docker uses as booleans"""
+        return self.param(name, '0').lower() not in ('0', 'false', '')
+
+    def json(self):
+        """The body, decoded as JSON"""
+        return json.loads(self.body.decode('utf-8')) if self.body else {}
+
+
+class Response:
+    """
+    A reply to send. body can be bytes, something to encode as JSON, or an
+    iterator of bytes to stream with chunked encoding.
+    """
+
+    def __init__(self, status=200, body=b'', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+
+
+class HTTPError(Exception):
+    """
+    Raised by handlers to answer with an error. code is the service's own
+    name for the error, and headers are sent along with it
+    """
+
+    def __init__(self, status, message, code=None, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.code = code
+        self.headers = dict(headers or {})
+
+
+class Fault:
+    """An injected failure, for the next `times` requests to an endpoint"""
+
+    def __init__(self, status, message, times):
+        self.status = status
+        self.message = message
+        self.times = times
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        module_logger.log(5, format, *args)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+            body = zlib.decompress(body, 31)
+        return body
+
+    def _dispatch(self):
+        url = urllib.parse.urlsplit(self.path)
+        request = Request(self.command, url.path,
+                          urllib.parse.parse_qs(url.query, keep_blank_values=True),
+                          self.headers, self._read_body(), {})
+        response = self.server.fake.handle(request)
+        self._send(response)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_PATCH = _dispatch
+
+    def _send(self, response):
+        body = response.body
+        headers = response.headers
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        self.send_response(response.status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if isinstance(body, bytes):
+            if 'Content-Length' not in headers:
+                self.send_header('Content-Length', str(len(body)))
+            try:
+                self.end_headers()
+                if body and self.command != 'HEAD':
+                    self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
+        try:
+            self.end_headers()
+            for chunk in body:
+                if chunk:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                    self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Clients that open many connections at once shouldn't be turned away
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler wants a (host, port) to log
+        return request, ('local', 0)
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class FakeServer:
+    """
+    A fake HTTP service running on a thread in this process.
+
+    Subclasses list their endpoints in `routes` as (method, path regex,
+    endpoint name, handler method name). Every request counts against its
+    endpoint name in `requests`, waits `latency` seconds (or the endpoint's
+    entry in `latency_for`), and then fails if a fault was queued for the
+    endpoint with fail(), or at random with probability `failure_rate`.
+    Requests that match no route count as 'unrouted'.
+
+    address is a Unix socket path or a (host, port) pair. None means a
+    socket in a new temporary directory.
+    """
+
+    routes = []
+    # Docker strips an API version from the front of every path
+    path_prefix = None
+
+    def __init__(self, address=None, ssl_context=None, latency=0.0, seed=None):
+        self.address = address
+        self.ssl_context = ssl_context
+        self.latency = latency
+        self.latency_for = {}
+        self.failure_rate = 0.0
+        self.random = random.Random(seed)
+        self.faults = collections.defaultdict(collections.deque)
+        self.requests = collections.Counter()
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.stopping = False
+        self._temp_dir = None
+        self._server = None
+        self._thread = None
+        self._routes = [(method, re.compile(pattern + '$'), name, getattr(self, handler))
+                        for method, pattern, name, handler in self.routes]
+
+    def start(self):
+        """Start serving on a background thread"""
+        if self.address is None:
+            self._temp_dir = tempfile.TemporaryDirectory(prefix='control-fake-')
+            self.address = os.path.join(self._temp_dir.name, 'fake.sock')
+        if isinstance(self.address, str):
+            self._server = _UnixServer(self.address, _Handler)
+        else:
+            self._server = _TCPServer(self.address, _Handler)
+            self.address = self._server.server_address[:2]
+        if self.ssl_context:
+            self._server.socket = self.ssl_context.wrap_socket(
+                self._server.socket, server_side=True)
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05},
+                                        name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving, and end any streams that are still open"""
+        with self.changed:
+            self.stopping = True
+            self.changed.notify_all()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+        if self._temp_dir:
+            self._temp_dir.cleanup()
+            self._temp_dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    @property
+    def url(self):
+        """How a client should address this server"""
+        if isinstance(self.address, str):
+            return 'unix://' + self.address
+        scheme = 'https' if self.ssl_context else 'http'
+        return '{}://{}:{}'.format(scheme, *self.address)
+
+    def fail(self, endpoint, status=500, message='injected failure', times=1):
+        """Make the next `times` requests to endpoint fail with status"""
+        with self.lock:
+            self.faults[endpoint].append(Fault(status, message, times))
+
+    def round_trips(self, prefix=''):
+        """How many requests have been made to endpoints starting with prefix"""
+        with self.lock:
+            return sum(n for name, n in self.requests.items() if name.startswith(prefix))
+
+    def error(self, status, message, code=None):
+        """The Response for an error. Subclasses speak their service's format"""
+        return Response(status, {'message': message})
+
+    def _failed(self, e):
+        response = self.error(e.status, e.message, e.code)
+        response.headers.update(e.headers)
+        return response
+
+    def _fault_for(self, name):
+        with self.lock:
+            queue = self.faults.get(name)
+            if queue:
+                fault = queue[0]
+                fault.times -= 1
+                if fault.times <= 0:
+                    queue.popleft()
+                return fault
+            if self.failure_rate and self.random.random() < self.failure_rate:
+                return Fault(500, 'injected random failure', 1)
+        return None
+
+    def route(self, method, path):
+        """Find the endpoint for a request. Returns (name, handler, args)"""
+        if self.path_prefix:
+            path = re.sub(self.path_prefix, '', path, count=1)
+        allowed = False
+        for route_method, pattern, name, handler in self._routes:
+            match = pattern.match(path)
+            if not match:
+                continue
+            if route_method == method or (method == 'HEAD' and route_method == 'GET'):
+                return name, handler, {k: urllib.parse.unquote_plus(v)
+                                       for k, v in match.groupdict().items()}
+            allowed = True
+        raise HTTPError(405 if allowed else 404, 'page not found')
+
+    def handle(self, request):
+        """Answer a request"""
+        try:
+            name, handler, request.args = self.route(request.method, request.path)
+        except HTTPError as e:
+            # Still a round trip, even if it went nowhere
+            with self.lock:
+                self.requests['unrouted'] += 1
+            return self._failed(e)
+        with self.lock:
+            self.requests[name] += 1
+        delay = self.latency_for.get(name, self.latency)
+        if delay:
+            time.sleep(delay)
+        fault = self._fault_for(name)
+        if fault:
+            return self.error(fault.status, fault.message)
+        try:
+            response = handler(request)
+        except HTTPError as e:
+            return self._failed(e)
+        if not isinstance(response, Response):
+            response = Response(200, response)
+        return response
+
+    def wait_for(self, predicate, timeout):
+        """
+        For streaming handlers: wait until predicate() is true, the server is
+        stopping, or timeout passes. Returns predicate()
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.stopping or predicate(), timeout)
+            return predicate()
+
+    def notify(self):
+        """Wake up streaming handlers after the fake's state changed"""
+        with self.changed:
+            self.changed.notify_all()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """An http.client connection to a server on a Unix socket"""
+
+    def __init__(self, path, timeout=10):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
@@ -1,33 +1,61 @@
 """The high level operations that Control can perform"""
 
+import asyncio
+import functools
 import json
 import logging
 import os
-from subprocess import Popen
 import sys
-import tempfile
 
 import dateutil.parser as dup
 import docker
 
+from control import aio, labels
+from control.buildcontext import DOCKERFILE, BuildContext, context_cache
 from control.cli_builder import builder
-from control.container import Container, CreatedContainer
+from control.container import (Container, CreatedContainer, create_error, start_error,
+                               without_volumes)
+from control.controlfile import Controlfile
 from control.dclient import dclient
+from control.dependencies import (build_graph, build_order, build_waves, dependents,
+                                  read_dockerfile, start_graph, upstream_of)
 from control.exceptions import (ContainerDoesNotExist, ContainerException,
-                                ImageNotFound)
-from control.options import options
-from control.registry import Registry
+                                HostUnavailable, ImageNotFound, InvalidControlfile)
+from control.gc import collect, parse_age, remove_superseded, tagged
+from control.history import record_run, run_timer
+from control.hosts import host_pool
+from control.imagecache import input_hash, load_image, open_image_cache, parse_size, save_image
+from control.labels import image_labels, label_dockerfile
+from control.lockfile import lockable, read_lock, resolve, write_lock
+from control.logs import follow_logs, show_logs
+from control.manifest import MANIFEST, ImageManifest
+from control.metrics import build_metrics
+from control.progress import progress
+from control.registry import get_registry
 from control.repository import Repository
-from control.service import Startable
+from control.scheduling import build_schedule, build_scheduler
+from control.script import SCRIPT_COMMANDS, render_script
+from control.service import Buildable, ImageService, Startable
+from control.stats import as_json as stats_json, render as render_stats, watch_stats
+from control.status import gather_status, render as render_status
+from control.tracing import span, traced
+from control.watch import drain, wait_for_changes, watcher
+from control.wipe import wipe_volumes
 
 
 module_logger = logging.getLogger('control.functions')
 module_logger.setLevel(logging.DEBUG)
 
+# Commands that print a timing table at the end and go into the build history
+TIMED_COMMANDS = {'build', 'build-prod', 'default', 'rere'}
 
-def image_is_newer(base):
+
+@traced('registry.image_is_newer', lambda base, args, client=None, remote_dates=None: {
+    'image': base.repo})
+def image_is_newer(base, args, client=None, remote_dates=None):
     """
-    Check if the image in the registry is newer
+    Check if the image in the registry is newer. remote_dates has the
+    registry's build dates already looked up by registry_dates
     TODO: I don't think this is needed at all
     """
     module_logger.debug('is_image_newer')
@@ -37,98 +65,238 @@ def image_is_newer(base):
     elif not base.registry:
         return True  # Giving up on any kind of intelligence in dealing with the Hub.
 
-    module_logger.debug('Contacting registry at %s', base.registry)
-    reg = Registry(base.domain, base.port)
+    if remote_dates and base.repo in remote_dates:
+        remote_date = remote_dates[base.repo]
+    else:
+        module_logger.debug('Contacting registry at %s', base.registry)
+        remote_date = get_registry(base.domain, base.port, args.no_verify,
+                                   bool(args.pull)).get_build_date_of_repo(base)
     try:
-        remote_date = dup.parse(reg.get_build_date_of_repo(base))
+        remote_date = dup.parse(remote_date)
     except ValueError:
         module_logger.debug('Image does not exist in registry')
         return False
     try:
-        local_date = dup.parse(dclient.inspect_image(base.repo)['Created'])
+        local_date = dup.parse((client or dclient).inspect_image(base.repo)['Created'])
     except docker.errors.NotFound:
         module_logger.warning('Image does not exist locally')
         return True
     return remote_date > local_date
 
 
-def pulling(repo):
+async def registry_dates(upstreams, no_verify=False):
+    """
+    When each of upstreams was built, asking all of their registries at
+    once. Only the dates a registry gave are kept, so anything that went
+    wrong is found and reported by image_is_newer the usual way
+    """
+    repos = {upstream.repo: upstream for upstream in upstreams
+             if upstream.registry and upstream.image != 'scratch'}
+    with span('registry.dates', images=len(repos)):
+        dates = await asyncio.gather(*(
+            aio.get_registry(upstream.domain, upstream.port, no_verify)
+            .get_build_date_of_repo(upstream)
+            for upstream in repos.values()), return_exceptions=True)
+    found = {}
+    for repo, date in zip(repos, dates):
+        if isinstance(date, Exception):
+            module_logger.debug('cannot ask the registry about %s: %s', repo, date)
+        elif date:
+            found[repo] = date
+    return found
+
+
+def local_image(image, client=None):
+    """How an image on this docker host inspects, or None if it isn't here"""
+    try:
+        return (client or dclient).inspect_image(image)
+    except docker.errors.NotFound:
+        return None
+
+
+def local_image_id(image, client=None):
+    """The ID of an image on this docker host, or None if it isn't here"""
+    inspect = local_image(image, client)
+    return inspect and inspect['Id']
+
+
+def pulling(repo, args):
     """We make use of the difference between None and False, so explicit
     checking against False or True is necessary.
     """
 
-    if options.pull is False:  # We actually do need to check the difference of None and False
+    if args.pull is False:  # We actually do need to check the difference of None and False
         return False
-    elif (options.command in ['default', 'build'] and
+    elif (args.command in ['default', 'build'] and
           not repo.registry and
-          not options.pull):
+          not args.pull):
         return False
     return True
 
 
-def pull_image(image):
+@traced('docker.pull', lambda image, client=None: {'image': image.repo})
+def pull_image(image, client=None):
     """
     Pulling an image, since this is used in build, build_prod, start
 
     image should be a Repository.
     """
     module_logger.info('pulling image %s', image.repo)
-    for line in (json.loads(l.decode('utf-8').strip()) for l in dclient.pull(
-            stream=True,
-            repository=image.get_pull_image_name(),
-            tag=image.tag)):
-        print_formatted(line)
+    try:
+        for line in (json.loads(l.decode('utf-8').strip()) for l in (client or dclient).pull(
+                stream=True,
+                repository=image.get_pull_image_name(),
+                tag=image.get_pull_tag())):
+            progress.feed(image.repo, line)
+    finally:
+        progress.close(image.repo)
     module_logger.debug('End of Pull Image')
 
 
-def print_formatted(line):
-    """Strip off all the useless stuff that Docker doesn't bother to parse out."""
-    module_logger.debug('bytes: %s', line)
-    if len(line) == 1:
-        print(list(line.values())[0].strip())
-        return
-    if 'error' in line.keys():
-        print('\x1b[31m{}\x1b[0m'.format(line['error'].strip()))
-    if 'id' in line.keys() and ('progressDetail' not in line.keys() or not line['progressDetail']):
-        print('{}: {}'.format(line['id'], line['status']))
-        return
-
-
 def function_dispatch(args, ctrl):
     """Decide which function to call"""
+    if args.dump_format == 'script':
+        return dump_script(args, ctrl)
+    if args.command in TIMED_COMMANDS and not (args.dump or args.dry_run):
+        return timed_dispatch(args, ctrl)
     try:
-        return dispatch_dict[options.command](args, ctrl)
+        return dispatch_dict[args.command](args, ctrl)
     except KeyError as e:
         module_logger.debug('dispatch keyerror: %s', e)
     return command(args, ctrl)
 
 
+def dump_script(args, ctrl):
+    """Print a shell script that does what the command would"""
+    if args.command not in SCRIPT_COMMANDS:
+        print('There is no script for {}. Try one of: {}'.format(
+            args.command, ', '.join(sorted(SCRIPT_COMMANDS))))
+        return False
+    # The defaults build and build-prod would pick for themselves
+    if args.command == 'build-prod':
+        args = prod_defaults(args)
+    elif args.cache is None:
+        args = args.replace(cache=True)
+    args = args.replace(dump=True)
+    print(render_script(ctrl, args.services, args.command,
+                        functools.partial(pulling, args=args), args.version, args=args), end='')
+    return True
+
+
+def timed_dispatch(args, ctrl):
+    """
+    Run the command, then print how long each service spent in each phase
+    and save it in the build history
+    """
+    run_timer.start(args.command)
+    ok = False
+    try:
+        ok = dispatch_dict[args.command](args, ctrl)
+    finally:
+        seconds = run_timer.stop()
+        if run_timer.timings:
+            print(run_timer.table(seconds))
+        record_run(ctrl.location, run_timer, seconds, ok)
+    return ok
+
+
+@traced('run_event', lambda event, env, service: {
+    'event': event, 'env': env, 'service': service['name']})
 def run_event(event, env, service):
     """run pre/postbuild, etc. events"""
-    try:
-        if isinstance(service.events[event], dict):
-            cmd = service.events[event][env]
+    return aio.run(aio.run_event(event, env, service))
+
+
+def docker_build(name, service, context, args, client=None):
+    """
+    Send a service's BuildContext to docker, streaming the output. Returns
+    False if the build failed.
+    """
+    build_args = {
+        'fileobj': context_cache.stream(context, compress=args.gzip_context),
+        'custom_context': True,
+        'encoding': 'gzip' if args.gzip_context else None,
+        'tag': service['image'],
+        'nocache': not args.cache,
+        'rm': args.no_rm,
+        'pull': False,
+        'dockerfile': DOCKERFILE,
+    }
+    module_logger.debug('docker build args: %s', build_args)
+    with span('docker.build', service=name, image=service['image']) as trace:
+        try:
+            for line in (json.loads(l.decode('utf-8').strip())
+                         for l in (client or dclient).build(**build_args)):
+                progress.feed(name, line)
+                if 'error' in line.keys():
+                    trace.set(error=line['error'].strip())
+                    return False
+        finally:
+            progress.close(name)
+    return True
+
+
+def build_service(name, service, args, client=None, remote_dates=None, pins=None):
+    """
+    Build one development image. Returns True once it's built, None if
+    there was nothing to build, and False if the build failed. pins are the
+    digests from Controlfile.lock
+    """
+    if not service.dev_buildable():
+        upstream = Repository.match(service.image)
+        if not pulling(upstream, args):
+            return None
+        with run_timer.phase(name, 'pull'):
+            pull_image(upstream, client)
+
+    print('building {}'.format(name))
+    module_logger.debug(type(service))
+    module_logger.debug(service.__dict__)
+    module_logger.debug(service['image'])
+    module_logger.debug(service['controlfile'])
+    module_logger.debug(service['dockerfile']['dev'])
+
+    with run_timer.phase(name, 'prebuild'):
+        if not run_event('prebuild', 'dev', service):
+            return None
+    module_logger.debug('End of prebuild')
+
+    # Crack open the Dockerfile to read the FROM line to check about pulling
+    upstream, dockerfile = read_dockerfile(service, 'dev', pins)
+    if not upstream:
+        module_logger.warning('Dockerfile does not exist\n'
+                              'Not continuing with this service')
+        return None
+    dockerfile = label_dockerfile(dockerfile, image_labels(service))
+
+    context = BuildContext(os.path.dirname(service['dockerfile']['dev']), dockerfile)
+
+    with run_timer.phase(name, 'pull'):
+        if upstream.digest:
+            # Pinned, so there's nothing newer to ask the registry about
+            if pulling(upstream, args) and not local_image_id(upstream.reference, client):
+                pull_image(upstream, client)
+        elif pulling(upstream, args) and not image_is_newer(upstream, args, client,
+                                                            remote_dates):
+            pull_image(upstream, client)
+    if not args.dry_run:
+        if args.dump:
+            print(service.dump_build(args=args).pull(pulling(upstream, args)))
         else:
-            cmd = service.events[event]
-    except KeyError:
-        return True  # There is no event for this event, or for this env
-
-    path = os.getcwd()
-    os.chdir(os.path.dirname(service['dockerfile']['dev']))
-    with Popen(cmd, shell=True) as p:
-        p.wait()
-        if p.returncode != 0:
-            print("{} action for {} failed. Will not "
-                  "continue building service.".format(event, service['name']))
-            return False
-    os.chdir(path)
+            with run_timer.phase(name, 'build'):
+                if not docker_build(name, service, context, args, client):
+                    return False
+
+    with run_timer.phase(name, 'postbuild'):
+        if not run_event('postbuild', 'dev', service):
+            print('{}: Your environment may not have been cleaned up'.format(name))
     return True
 
 
 def build(args, ctrl):  # TODO: DRY it up
     """build a development image"""
     if args.cache is None:
-        args.cache = True
+        args = args.replace(cache=True)
     module_logger.debug('running docker build')
     if len(args.services) > 1:
         print('building services: {}'.format(", ".join(sorted(args.services))))
@@ -137,211 +305,415 @@ def build(args, ctrl):  # TODO: DRY it up
     module_logger.debug(ctrl.services['all'])
     module_logger.debug(ctrl.services['required'])
 
-    for name, service in sorted(((name, ctrl.services[name]) for name in args.services)):
-        if not service.dev_buildable():
-            upstream = Repository.match(service.image)
-            if not pulling(upstream):
-                continue
-            pull_image(upstream)
+    try:
+        pool = build_pool(args, ctrl)
+    except HostUnavailable as e:
+        module_logger.critical(e)
+        return False
+    pins = read_lock(ctrl)
+    upstreams = (upstream_of(ctrl.services[name], 'dev', pins) for name in args.services)
+    remote_dates = aio.run(registry_dates(
+        [upstream for upstream in upstreams
+         if upstream and not upstream.digest and pulling(upstream, args)],
+        args.no_verify))
+    before = previous_images(args, ctrl, args.services)
+    if pool:
+        ok = build_on_pool(pool, ctrl, args.services, 'dev',
+                           lambda name, host: build_service(
+                               name, ctrl.services[name], args, host.client, remote_dates,
+                               pins))
+    else:
+        ok = True
+        for name in build_schedule(ctrl, args.services, 'dev'):
+            if build_service(name, ctrl.services[name], args, remote_dates=remote_dates,
+                             pins=pins) is False:
+                ok = False
+                break
+    drop_previous_images(ctrl, args.services, before)
+    return ok
 
-        print('building {}'.format(name))
-        module_logger.debug(type(service))
-        module_logger.debug(service.__dict__)
-        module_logger.debug(service['image'])
-        module_logger.debug(service['controlfile'])
-        module_logger.debug(service['dockerfile']['dev'])
 
-        if not run_event('prebuild', 'dev', service):
-            continue
-        module_logger.debug('End of prebuild')
-
-        # Crack open the Dockerfile to read the FROM line to check about pulling
-        with tempfile.NamedTemporaryFile() as tmpfile:
-            upstream = None
-            with open(service['dockerfile']['dev'], 'r') as f:
-                for line in f:
-                    if line.startswith('FROM') and service.fromline['dev']:
-                        upstream = Repository.match(service.fromline['dev'].split()[1])
-                        module_logger.debug('discovered upstream as %s', upstream)
-                        tmpfile.write(bytes(service.fromline['dev'], 'utf-8'))
-                    elif line.startswith('FROM'):
-                        upstream = Repository.match(line.split()[1])
-                        module_logger.debug('discovered upstream as %s', upstream)
-                        tmpfile.write(bytes(line, 'utf-8'))
-                    else:
-                        tmpfile.write(bytes(line, 'utf-8'))
-                if not upstream:
-                    module_logger.warning('Dockerfile does not exist\n'
-                                          'Not continuing with this service')
-                    continue
-            tmpfile.flush()
-
-            if pulling(upstream) and not image_is_newer(upstream):
-                pull_image(upstream)
-            if not args.dry_run:
-                build_args = {
-                    'path': os.path.dirname(service['dockerfile']['dev']),
-                    'tag': service['image'],
-                    'nocache': not args.cache,
-                    'rm': args.no_rm,
-                    'pull': False,
-                    'dockerfile': tmpfile.name,
-                }
-                module_logger.debug('docker build args: %s', build_args)
-                if options.dump:
-                    print(service.dump_build().pull(pulling(upstream)))
-                else:
-                    for line in (json.loads(
-                            l.decode('utf-8').strip())
-                                 for l in dclient.build(**build_args)):
-                        print_formatted(line)
-                        if 'error' in line.keys():
-                            return False
+def build_prod_service(name, service, args, cache, client=None, pins=None, manifest=None):
+    """
+    Build one production image, or load it from the image cache. Returns
+    True once it's there, None if there was nothing to build, and False if
+    it failed. pins are the digests from Controlfile.lock. The image built
+    is added to manifest
+    """
+    print('building {}'.format(name))
 
-        if not run_event('postbuild', 'dev', service):
+    with run_timer.phase(name, 'prebuild'):
+        if not run_event('prebuild', 'prod', service):
+            return False
+    module_logger.debug('End of prebuild')
+
+    # Crack open the Dockerfile to read the FROM line to check about pulling
+    upstream, dockerfile = read_dockerfile(service, 'prod', pins)
+    if not upstream:
+        module_logger.warning('Dockerfile does not exist\n'
+                              'Not continuing with this service')
+        return None
+    dockerfile = label_dockerfile(dockerfile, image_labels(service))
+
+    context = BuildContext(os.path.dirname(service['dockerfile']['prod']), dockerfile)
+
+    if not args.dry_run:
+        previous_id = local_image_id(service['image'], client)
+        if not pulling(upstream, args):
+            with run_timer.phase(name, 'pull'):
+                pull_image(upstream, client)
+            build_metrics.set(name, pull_bytes=progress.bytes_pulled(upstream.repo))
+        build_metrics.set(name, context_bytes=context.size())
+        with run_timer.phase(name, 'build'), build_metrics.timed(name):
+            key = None
+            upstream_image = local_image(upstream.reference, client)
+            if upstream_image and (cache or manifest is not None):
+                key = input_hash(service, context, upstream_image['Id'])
+            if cache and key and load_image(cache, key, client or dclient):
+                print('{}: loaded from the image cache'.format(name))
+                build_metrics.set(name, cache_hit=1)
+            elif not docker_build(name, service, context, args, client):
+                return False
+            else:
+                build_metrics.set(name, cache_hit=0)
+                if not upstream_image and (cache or manifest is not None):
+                    # The build pulled the upstream itself, so now we can know its ID
+                    upstream_image = local_image(upstream.reference, client)
+                    if upstream_image:
+                        key = input_hash(service, context, upstream_image['Id'])
+                if cache and key:
+                    save_image(cache, key, service['image'], client or dclient)
+        if build_metrics.running or manifest is not None:
+            image = None
+            try:
+                image = (client or dclient).inspect_image(service['image'])
+                build_metrics.set(name, image_bytes=image['Size'])
+            except docker.errors.APIError as e:
+                module_logger.debug('cannot inspect %s: %s', service['image'], e)
+            if manifest is not None:
+                manifest.add(name, service['image'], image, previous_id, upstream,
+                             upstream_image, key)
+
+    with run_timer.phase(name, 'postbuild'):
+        if not run_event('postbuild', 'prod', service):
             print('{}: Your environment may not have been cleaned up'.format(name))
+            return False
+    module_logger.debug('End of postbuild')
     return True
 
 
-def build_prod(args, ctrl):
-    """Build an image that has everything in it for production"""
+def prod_defaults(args):
+    """args, with the pull and cache build-prod uses when they weren't given"""
     if args.pull is None:
-        args.pull = True
+        args = args.replace(pull=True)
     if args.cache is None:
-        args.cache = False
-    if args.debug or args.dry_run:
-        print('running production build')
+        args = args.replace(cache=False)
+    return args
 
-    for name, service in sorted(((name, ctrl.services[name]) for name in args.services if ctrl.services[name].prod_buildable())):
-        print('building {}'.format(name))
 
-        if not run_event('prebuild', 'prod', service):
-            return False
-        module_logger.debug('End of prebuild')
-
-        # Crack open the Dockerfile to read the FROM line to check about pulling
-        with tempfile.NamedTemporaryFile() as tmpfile:
-            upstream = None
-            with open(service['dockerfile']['prod'], 'r') as f:
-                module_logger.debug('changing from line: %s', service.fromline['prod'])
-                for line in f:
-                    if line.startswith('FROM') and service.fromline['prod']:
-                        upstream = Repository.match(service.fromline['prod'].split()[1])
-                        module_logger.debug('discovered upstream as %s', upstream)
-                        tmpfile.write(bytes(service.fromline['prod'], 'utf-8'))
-                    elif line.startswith('FROM'):
-                        upstream = Repository.match(line.split()[1])
-                        module_logger.debug('discovered upstream as %s', upstream)
-                        tmpfile.write(bytes(line, 'utf-8'))
-                    else:
-                        tmpfile.write(bytes(line, 'utf-8'))
-                if not upstream:
-                    module_logger.warning('Dockerfile does not exist\n'
-                                          'Not continuing with this service')
-                    continue
-            tmpfile.flush()
-
-            if not args.dry_run:
-                if not pulling(upstream):
-                    pull_image(upstream)
-                build_args = {
-                    'path': os.path.dirname(service['dockerfile']['prod']),
-                    'tag': service['image'],
-                    'nocache': not args.cache,
-                    'rm': args.no_rm,
-                    'pull': False,
-                    'dockerfile': tmpfile.name,
-                }
-                module_logger.debug('docker build args: %s', build_args)
-                for line in (json.loads(l.decode('utf-8').strip())
-                             for l in dclient.build(**build_args)):
-                    print_formatted(line)
-                    if 'error' in line.keys():
-                        return False
+def build_prod(args, ctrl):
+    """Build an image that has everything in it for production"""
+    args = prod_defaults(args)
+    if args.dry_run or args.dump:
+        return _build_prod(args, ctrl)
+    build_metrics.start()
+    ok = False
+    try:
+        ok = _build_prod(args, ctrl)
+    finally:
+        build_metrics.stop(ok)
+        try:
+            path = build_metrics.write(fmt=args.metrics_format)
+        except OSError as e:
+            module_logger.warning('could not write the build metrics: %s', e)
+        else:
+            print('wrote build metrics to {}'.format(path))
+    return ok
 
-        if not run_event('postbuild', 'prod', service):
-            print('{}: Your environment may not have been cleaned up'.format(name))
-            return False
-        module_logger.debug('End of postbuild')
-    print('writing IMAGES.txt')
+
+def _build_prod(args, ctrl):
+    if args.debug or args.dry_run:
+        print('running production build')
+    try:
+        cache = open_image_cache(args.image_cache or os.environ.get('CONTROL_IMAGE_CACHE'),
+                                 parse_size(args.image_cache_size))
+    except ValueError as e:
+        module_logger.critical(e)
+        return False
+
+    names = [name for name in args.services if ctrl.services[name].prod_buildable()]
+    pins = read_lock(ctrl)
+    try:
+        pool = build_pool(args, ctrl)
+    except HostUnavailable as e:
+        module_logger.critical(e)
+        return False
+    before = previous_images(args, ctrl, names)
+    manifest = ImageManifest()
+    if pool:
+        ok = build_on_pool(pool, ctrl, names, 'prod',
+                           lambda name, host: build_prod_service(
+                               name, ctrl.services[name], args, cache, host.client, pins,
+                               manifest))
+    else:
+        ok = True
+        for name in build_schedule(ctrl, names, 'prod'):
+            if build_prod_service(name, ctrl.services[name], args, cache,
+                                  pins=pins, manifest=manifest) is False:
+                ok = False
+                break
+    drop_previous_images(ctrl, names, before)
+    if not ok:
+        return False
+    print('writing IMAGES.txt and {}'.format(MANIFEST))
     if not args.dry_run:
+        # Only the services that were built, not the ones there was nothing to build for
         with open('IMAGES.txt', 'w') as f:
-            f.write('\n'.join([ctrl.services[x]['image'] for x in args.services]))
-            f.write('\n')
+            f.write(''.join(ctrl.services[x]['image'] + '\n'
+                            for x in args.services if x in manifest))
+        manifest.write(metrics=build_metrics)
     return True
 
 
-def start(args, ctrl):
-    """starting containers"""
-    no_err = True
-    for service in sorted((ctrl.services[name]
-                           for name in args.services
-                           if isinstance(ctrl.services[name], Startable))):
+def _image_services(ctrl, names):
+    return [ctrl.services[name] for name in names
+            if isinstance(ctrl.services[name], ImageService)]
 
-        container = Container(service)
-        if options.no_volumes:
-            container.disable_volumes()
 
-        upstream = Repository.match(service.image)
-        if module_logger.isEnabledFor(logging.DEBUG):
-            module_logger.debug('pull deciders')
-            module_logger.debug('not container.image_exists(): %s', not container.image_exists())
-            module_logger.debug('not service.buildable(): %s', not service.buildable())
-            module_logger.debug('pulling(upstream): %s', pulling(upstream))
-            should_pull = not container.image_exists() and not service.buildable() and pulling(upstream)
-        if not options.dump and should_pull:
-            pull_image(upstream)
-        elif options.dump and should_pull:
-            # TODO: print pull command
-            pass
+def previous_images(args, ctrl, names):
+    """
+    What the services' image names point at before a build, so the images
+    they stop pointing at can be removed. None when old images are kept
+    """
+    if args.keep_old_images or args.dry_run or args.dump:
+        return None
+    try:
+        return aio.run(tagged(aio.docker_client(), _image_services(ctrl, names)))
+    except (OSError, docker.errors.APIError) as e:
+        module_logger.debug('cannot list images, keeping old ones: %s', e)
+        return None
+
+
+def drop_previous_images(ctrl, names, before):
+    """Remove the images from previous_images that were replaced and aren't used"""
+    if not before:
+        return
+    with span('gc.superseded', images=len(before)):
+        summary = aio.run(remove_superseded(aio.docker_client(),
+                                            _image_services(ctrl, names), before))
+    module_logger.info('%s', summary)
+
 
+def build_pool(args, ctrl):
+    """
+    The pool of docker hosts to build on, or None to build one at a time on
+    the usual docker host
+    """
+    if args.dry_run or args.dump:
+        return None
+    pool = host_pool(ctrl, args.docker_hosts, args.image_transfer)
+    if len(pool) < 2:
+        return None
+    print('building across {} docker hosts: {}'.format(
+        len(pool), ', '.join(host.name for host in pool.hosts)))
+    return pool
+
+
+def build_on_pool(pool, ctrl, names, env, build_one):
+    """
+    Build names across the pool, then bring the images to the primary host.
+    build_one(name, host) builds a single service
+    """
+    graph = build_graph(ctrl, env)
+    produces = {name: ctrl.services[name]['image'] for name in names}
+    needs = {name: [produces[dep] for dep in graph.get(name, ()) if dep in produces]
+             for name in names}
+    if not pool.run(build_scheduler(ctrl, names, env), build_one, produces, needs):
+        return False
+    with span('hosts.gather', images=len(produces)):
+        moved = pool.gather(produces[name] for name in sorted(names))
+    if moved:
+        print('moved {} images to {}'.format(len(moved), pool.primary.name))
+    return True
+
+
+async def _pull(client, name, image):
+    """pull_image, as a coroutine, counted against name's pull time"""
+    module_logger.info('pulling image %s', image.repo)
+    with run_timer.phase(name, 'pull'), span('docker.pull', image=image.repo):
         try:
-            # TODO: if a container exists but the options don't match, log out that
-            # we are starting a container that does not match the merged controlfile
-            # and cli options
-            container = CreatedContainer(service['name'], service)
-        except ContainerDoesNotExist:
-            pass  # This will probably be the majority case
-        if options.dump:
-            print(container.service.dump_run(prod=options.prod))
-        else:
-            print('Starting {}'.format(service['name']))
+            async for line in client.pull(image.get_pull_image_name(), tag=image.get_pull_tag()):
+                progress.feed(image.repo, line)
+        finally:
+            progress.close(image.repo)
+
+
+async def _image_exists(client, image):
+    try:
+        await client.inspect_image(image)
+    except docker.errors.NotFound as e:
+        if 'No such image' in e.explanation.decode('utf-8'):
+            return False
+        raise
+    return True
+
+
+async def _start_container(client, service, args, owner=None):
+    """
+    Create and start one service's container, and the named volumes it
+    mounts, labeled with owner. Returns whether it worked
+    """
+    print('Starting {}'.format(service['name']))
+    try:
+        with run_timer.phase(service['name'], 'start'), \
+                span('container.start', service=service['name']):
+            container_opts = service.prepare_container_options(prod=args.prod,
+                                                               client=client, labels=owner)
+            if args.no_volumes:
+                without_volumes(container_opts)
+            elif owner:
+                await asyncio.gather(*(client.create_volume(volume, labels=owner)
+                                       for volume in service.named_volumes(args.prod)))
+            module_logger.debug(container_opts)
             try:
-                container = container.create(prod=options.prod)
-                container.start()
-            except ContainerException as e:
-                module_logger.debug('outer start containerexception caught')
-                module_logger.critical(e)
-                no_err = False
-            except ImageNotFound as e:
-                module_logger.critical(e)
-                no_err = False
+                created = await client.create_container(service.image, **container_opts)
+            except docker.errors.APIError as e:
+                raise create_error(e, service.image) from None
+            try:
+                await client.start(created['Id'])
+            except docker.errors.APIError as e:
+                raise start_error(e, service) from None
+    except (ContainerException, ImageNotFound) as e:
+        module_logger.critical(e)
+        return False
+    except docker.errors.APIError as e:
+        # Anything else docker refuses, like a port that is already taken,
+        # fails this service instead of escaping the gather with the others
+        module_logger.critical('%s: %s', service['name'], e)
+        return False
+    return True
+
+
+async def async_start(args, ctrl, client=None):
+    """
+    starting containers: every missing image is pulled at once, then the
+    containers start together, after whatever they link to
+    """
+    client = client or aio.docker_client()
+    services = {name: ctrl.services[name] for name in args.services
+                if isinstance(ctrl.services[name], Startable)}
+    if args.dump:
+        for service in sorted(services.values()):
+            print(service.dump_run(prod=args.prod))
+        return True
+
+    pulls = {}
+    exists = await asyncio.gather(*(_image_exists(client, service.image)
+                                    for service in services.values()))
+    for service, found in zip(services.values(), exists):
+        upstream = Repository.match(service.image)
+        module_logger.debug('%s pull deciders: image exists %s, buildable %s, pulling %s',
+                            service['name'], found, service.buildable(),
+                            pulling(upstream, args))
+        if not found and not service.buildable() and pulling(upstream, args):
+            pulls.setdefault(upstream.repo, (service['name'], upstream))
+    await asyncio.gather(*(_pull(client, name, upstream) for name, upstream in pulls.values()))
+
+    no_err = True
+    for wave in build_waves(start_graph(ctrl, services), services):
+        started = await asyncio.gather(*(
+            _start_container(client, services[name], args,
+                             labels.container_labels(ctrl, services[name], args))
+            for name in wave))
+        no_err = no_err and all(started)
     return no_err
 
 
-def stop(args, ctrl):
-    """stopping containers"""
-    module_logger.debug(", ".join(sorted(args.services)))
-    for service in sorted((ctrl.services[name]
-                           for name in args.services
-                           if isinstance(ctrl.services[name], Startable))):
+def start(args, ctrl):
+    """starting containers"""
+    return aio.run(async_start(args, ctrl))
+
+
+async def _stop_container(client, service, force, found=None):
+    """
+    Stop and remove one service's container, the one found if a list call
+    found it. Returns its inspect from before
+    """
+    name = service['name']
+    if not name:
+        module_logger.info('%s does not exist.', service.service)
+        return None
+    with run_timer.phase(name, 'stop'):
         try:
-            container = CreatedContainer(service['name'], service)
-            if options.force:
-                module_logger.info('Killing %s', service['name'])
-                container.kill()
+            inspect = await client.inspect_container(found['Id'] if found else name)
+            if force:
+                module_logger.info('Killing %s', name)
+                if inspect['State']['Running']:
+                    await client.kill(inspect['Id'])
             else:
-                module_logger.info('Stopping %s', service['name'])
-                container.stop()
-            module_logger.info('Removing %s', service['name'])
-            container.remove()
-            if options.wipe:
-                container.remove_volumes()
-        except ContainerDoesNotExist:
-            module_logger.info('%s does not exist.', service['name'])
+                module_logger.info('Stopping %s', name)
+                await client.stop(inspect['Id'], timeout=service.expected_timeout)
+            module_logger.info('Removing %s', name)
+            await client.remove_container(inspect['Id'], v=True)
+        except docker.errors.NotFound:
+            module_logger.info('%s does not exist.', name)
+            return None
+    return inspect
+
+
+async def _stop_orphan(client, container, force):
+    """Stop and remove a container no service accounts for any more"""
+    name = labels.container_name(container)
+    module_logger.info('Removing orphaned container %s', name)
+    try:
+        inspect = await client.inspect_container(container['Id'])
+        if force:
+            if inspect['State']['Running']:
+                await client.kill(inspect['Id'])
+        else:
+            await client.stop(inspect['Id'])
+        await client.remove_container(inspect['Id'], v=True)
+    except docker.errors.NotFound:
+        return None
+    return inspect
+
+
+async def async_stop(args, ctrl, client=None):
+    """
+    stopping containers, all at once. The project's containers come from one
+    list call, and services without a labeled container, like ones started
+    before containers were labeled, are looked up by name
+    """
+    module_logger.debug(", ".join(sorted(args.services)))
+    client = client or aio.docker_client()
+    containers = await labels.project_containers(client, ctrl)
+    by_name = {labels.container_name(container): container for container in containers}
+    stopping = [_stop_container(client, ctrl.services[name], args.force,
+                                by_name.get(ctrl.services[name]['name']))
+                for name in sorted(args.services)
+                if isinstance(ctrl.services[name], Startable)]
+    if args.remove_orphans:
+        stopping.extend(_stop_orphan(client, container, args.force)
+                        for container in labels.orphans(containers, ctrl, args.session))
+    inspects = await asyncio.gather(*stopping)
+    # The volumes of every container go together once they're all removed
+    removed = [inspect for inspect in inspects if inspect]
+    if args.wipe and removed:
+        with span('wipe', containers=len(removed)):
+            summary = await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(wipe_volumes, removed, dclient,
+                                        helper_image=args.wipe_helper,
+                                        root=labels.project_root(ctrl),
+                                        anywhere=args.wipe_outside_project))
+        module_logger.info('%s', summary)
     return True
 
 
+def stop(args, ctrl):
+    """stopping containers"""
+    return aio.run(async_stop(args, ctrl))
+
+
 def restart(args, ctrl):
     """stop containers, and start them again"""
     if not stop(args, ctrl):
@@ -355,46 +727,219 @@ def opencontainer(args, ctrl):
         print('Cannot open more than 1 service in 1 call')
         return False
     name = args.services[0]
-    serv = ctrl.services[name]
+    # The container is opened from a copy of the service, so the service
+    # keeps its own entrypoint and command
+    changes = {'stdin_open': True, 'tty': True}
     try:
         if isinstance(ctrl.services[name]['open'], list):
-            (
-                ctrl.services[name]['entrypoint'],
-                ctrl.services[name]['command']) = (
-                    ctrl.services[name]['open'][0],
-                    ctrl.services[name]['open'][1:])
+            changes['entrypoint'], changes['command'] = (
+                ctrl.services[name]['open'][0],
+                ctrl.services[name]['open'][1:])
         elif isinstance(ctrl.services[name]['open'], str):
             # split on the first space
-            ctrl.services[name]['entrypoint'], \
-                ctrl.services[name]['command'] = \
+            changes['entrypoint'], changes['command'] = \
                 ctrl.services[name]['open'].partition(' ')[::2]
     except KeyError:
         print("'open' not defined for service. Using /bin/sh as entrypoint")
-        ctrl.services[name]['entrypoint'] = '/bin/sh'
-        ctrl.services[name]['command'] = ''
-    ctrl.services[name]['stdin_open'] = True
-    ctrl.services[name]['tty'] = True
-    if options.dump:
+        changes['entrypoint'] = '/bin/sh'
+        changes['command'] = ''
+    serv = ctrl.services[name].copy(**changes)
+    if args.dump:
         print(serv.dump_run())
         return True
 
     try:
-        container = CreatedContainer(ctrl.services[name]['name'], ctrl.services[name])
+        container = CreatedContainer(serv['name'], serv)
     except ContainerDoesNotExist:
         pass  # We need the container to not exist
     else:
         if not (container.stop() and container.remove()):
-            print('could not stop {}'.format(ctrl.services[name]['name']))
+            print('could not stop {}'.format(serv['name']))
             return False
-    container = Container(ctrl.services[name]).create(prod=options.prod)
-    os.execlp('docker', 'docker', 'start', '-a', '-i', ctrl.services[name]['name'])
+    container = Container(serv).create(prod=args.prod, labels=labels.container_labels(
+        ctrl, serv, args, role='open'))
+    os.execlp('docker', 'docker', 'start', '-a', '-i', serv['name'])
+
+
+async def async_lock(args, ctrl, client=None):
+    """
+    Pin the images services are built FROM in Controlfile.lock. Only new
+    images are looked up, unless --update asks for all of them again
+    """
+    client = client or aio.docker_client()
+    old = read_lock(ctrl)
+    upstreams = lockable(ctrl)
+    wanted = [upstream for repo, upstream in sorted(upstreams.items())
+              if args.update or repo not in old]
+    with span('lock.resolve', images=len(wanted)):
+        found = await resolve(wanted, client, args.no_verify)
+    no_err = True
+    pins = {}
+    for repo in sorted(upstreams):
+        if repo in found:
+            pins[repo] = found[repo]
+            if old.get(repo) != found[repo]:
+                print('{} {}'.format(repo, found[repo]))
+        elif repo in old:
+            pins[repo] = old[repo]
+            if args.update:
+                print('{}: could not find its digest, keeping {}'.format(repo, old[repo]))
+        else:
+            print('{}: could not find its digest. Is it pulled?'.format(repo))
+            no_err = False
+    if args.dry_run:
+        return no_err
+    path = write_lock(ctrl, pins)
+    print('pinned {} images in {}'.format(len(pins), path))
+    return no_err
+
+
+def lock(args, ctrl):
+    """pin the images services are built FROM"""
+    return aio.run(async_lock(args, ctrl))
 
 
 def default(args, ctrl):
     """build containers and restart them"""
-    if build(args, ctrl):
-        return restart(args, ctrl)
-    return False
+    if not build(args, ctrl):
+        return False
+    ok = restart(args, ctrl)
+    # The containers have let go of the images the build replaced
+    if not (args.keep_old_images or args.dry_run or args.dump):
+        summary = aio.run(collect(aio.docker_client(), _image_services(ctrl, args.services)))
+        module_logger.info('%s', summary)
+    return ok
+
+
+def gc(args, ctrl):
+    """remove the images builds of the services replaced, that nothing uses"""
+    try:
+        older_than = parse_age(args.older_than)
+        keep_size = parse_size(args.keep_size)
+    except ValueError as e:
+        module_logger.critical(e)
+        return False
+    result = aio.run(collect(aio.docker_client(), _image_services(ctrl, args.services),
+                             older_than, keep_size, dry_run=args.dry_run))
+    if args.dry_run:
+        for image in result:
+            print('would remove {} ({})'.format(
+                image['Id'], image['Labels'].get(labels.IMAGE)))
+        return True
+    print(result)
+    return True
+
+
+def status(args, ctrl):
+    """show whether each service is running, stale or drifted, all at once"""
+    services = [ctrl.services[name] for name in args.services
+                if isinstance(ctrl.services[name], Startable)]
+    statuses = aio.run(gather_status(aio.docker_client(), services, args.prod,
+                                     args.check_registry, args.no_verify))
+    print(render_status(statuses))
+    return True
+
+
+def logs(args, ctrl):
+    """show the logs of the services' containers, interleaved, following them with -f"""
+    names = {ctrl.services[name].service: ctrl.services[name]['name']
+             for name in args.services if isinstance(ctrl.services[name], Startable)}
+    # -f is --force everywhere else, but docker logs taught everyone it follows
+    if args.follow or args.force:
+        try:
+            aio.run(follow_logs(aio.docker_client(), names, args.tail))
+        except KeyboardInterrupt:
+            pass
+        return True
+    aio.run(show_logs(aio.docker_client(), names, args.tail))
+    return True
+
+
+def stats(args, ctrl):
+    """show the resources the services, and the metaservices they're in, use"""
+    names = {name: ctrl.services[name]['name'] for name in args.services
+             if isinstance(ctrl.services[name], Startable)}
+
+    def emit(services, metaservices):  # pylint: disable=missing-docstring
+        if args.json:
+            print(stats_json(services, metaservices), flush=True)
+        else:
+            print(render_stats(services, metaservices) + '\n', flush=True)
+    try:
+        aio.run(watch_stats(aio.docker_client(), ctrl, names, emit,
+                            count=1 if args.no_stream else None))
+    except (KeyboardInterrupt, BrokenPipeError):
+        # Whoever was reading the stats is gone, so stop sampling for them
+        pass
+    return True
+
+
+def _watched_paths(ctrl, names):
+    """Every path a change to would mean rebuilding one of the named services"""
+    paths = {path for path in ctrl.files if '.git' not in path.split(os.sep)}
+    for name in names:
+        paths.add(os.path.dirname(ctrl.services[name]['dockerfile']['dev']))
+    return paths
+
+
+def _changed_services(ctrl, names, paths):
+    """Work out which of the named services the changed paths belong to"""
+    changed = set()
+    for name in names:
+        service = ctrl.services[name]
+        context = os.path.dirname(service['dockerfile']['dev'])
+        if any(path == service.controlfile or
+               path.startswith(context + os.sep)
+               for path in paths):
+            changed.add(name)
+    return changed
+
+
+def watch(args, ctrl):
+    """
+    Watch the Dockerfiles, build contexts and Controlfiles of services, and
+    rebuild and restart the services that change, along with the services
+    that are built FROM them.
+    """
+    names = sorted(name for name in args.services
+                   if isinstance(ctrl.services[name], Buildable) and
+                   ctrl.services[name]['dockerfile']['dev'])
+    if not names:
+        print('No buildable services to watch')
+        return False
+    files = watcher()
+    for path in _watched_paths(ctrl, names):
+        files.add(path)
+    print('watching {}'.format(', '.join(names)))
+
+    while True:
+        paths = wait_for_changes(files)
+        module_logger.debug('changed: %s', sorted(paths))
+        if paths & ctrl.files.keys():
+            print('Controlfile changed, reading it in again')
+            try:
+                ctrl = args.apply(Controlfile(ctrl.location, args.as_me))
+            except InvalidControlfile as e:
+                module_logger.critical(e)
+                continue
+            names = [name for name in names if name in ctrl.services]
+        changed = _changed_services(ctrl, names, paths)
+        if not changed:
+            continue
+        graph = build_graph(ctrl, 'dev')
+        order = build_order(graph, dependents(graph, changed))
+        print('rebuilding {}'.format(', '.join(order)))
+        built = []
+        for name in order:
+            if not build(args.replace(services=[name]), ctrl):
+                print('{} failed to build. Waiting for the next change'.format(name))
+                break
+            built.append(name)
+        # Whatever the builds wrote to their contexts isn't a change to rebuild for
+        drain(files)
+        restart(args.replace(services=[
+            name for name in built
+            if name in names and isinstance(ctrl.services[name], Startable)]), ctrl)
 
 
 def command(args, ctrl):
@@ -407,15 +952,15 @@ def command(args, ctrl):
     services = sorted(
         ctrl.services[name]
         for name in args.services
-        if (options.command in ctrl.services[name].commands.keys() or
+        if (args.command in ctrl.services[name].commands.keys() or
             '*' in ctrl.services[name].commands.keys()))
     for service in services:
         if len(services) > 1:
             module_logger.info('running command in %s', service['name'])
-        cmd = service.commands[options.command
-                               if options.command in service.commands.keys()
+        cmd = service.commands[args.command
+                               if args.command in service.commands.keys()
                                else '*'
-                              ].format(COMMAND=options.command)
+                              ].format(COMMAND=args.command)
 
         # Check if the container is running. If we need to run the command
         # exclusively, take down the container.
@@ -427,8 +972,8 @@ def command(args, ctrl):
         put_it_back = False
         try:
             container = CreatedContainer(service['name'], service)
-            if options.replace:
-                if options.dump:
+            if args.replace:
+                if args.dump:
                     print(
                         builder('stop').container(service['name']).time(service.expected_timeout)
                     )
@@ -446,23 +991,19 @@ def command(args, ctrl):
             else:
                 kill_it = False
         except ContainerDoesNotExist:
-            module_logger.debug("saving service: ('%s', '%s')",
-                                service['entrypoint'],
-                                service['command'])
-            saved_entcmd = (service['entrypoint'], service['command'], service['stdin_open'])
-            service['entrypoint'] = '/bin/cat'
-            service['command'] = ''
-            service['stdin_open'] = True
-            service['tty'] = True
-            container = Container(service)
+            # The holding container is made from a copy of the service, so
+            # the service keeps its entrypoint for when it is put back
+            holder = service.copy(entrypoint='/bin/cat', command='', stdin_open=True, tty=True)
+            container = Container(holder)
             kill_it = True
             # TODO: when does this get printed?
-            # if not options.dump:
-            #     print(service.dump_run())
+            # if not args.dump:
+            #     print(holder.dump_run())
             # else:
-            if not options.dump:
+            if not args.dump:
                 try:
-                    container = container.create(prod=options.prod)
+                    container = container.create(prod=args.prod, labels=labels.container_labels(
+                        ctrl, holder, args, role='holder'))
                     container.start()
                 except ImageNotFound as e:
                     module_logger.critical(e)
@@ -479,16 +1020,16 @@ def command(args, ctrl):
         # We take the generator that docker gives us for the exec output and
         # print it to the console. The Exec spawned a TTY so programs that care
         # will output color.
-        if options.dump and not kill_it:
+        if args.dump and not kill_it:
             print(builder('exec', pretty=False).container(service['name']).command(cmd).tty())
-        elif options.dump:
+        elif args.dump:
             ent_, _, cmd_ = cmd.partition(' ')
-            run = service.dump_run() \
+            run = holder.dump_run() \
                 .entrypoint(ent_) \
                 .command(cmd_) \
                 .rm() \
                 .tty() \
-                .interactive(saved_entcmd[2])
+                .interactive(service['stdin_open'])
             print(run)
         else:
             gen = (l.decode('utf-8') for l in container.exec(cmd))
@@ -501,8 +1042,8 @@ def command(args, ctrl):
         # spawned the container running a command that just holds the container
         # open, if we replaced a running container we need to take down this
         # dummy container and start it with its normal entrypoint
-        if (put_it_back or kill_it) and not options.dump:
-            if options.force:
+        if (put_it_back or kill_it) and not args.dump:
+            if args.force:
                 module_logger.debug('Killing %s', service['name'])
                 container.kill()
             else:
@@ -510,30 +1051,18 @@ def command(args, ctrl):
                 container.stop()
             module_logger.debug('Removing %s', service['name'])
             container.remove()
-            if options.wipe:
-                container.remove_volumes()
+            if args.wipe:
+                container.remove_volumes(helper_image=args.wipe_helper,
+                                         root=labels.project_root(ctrl),
+                                         anywhere=args.wipe_outside_project)
         if put_it_back:
-            if saved_entcmd[0]:
-                service['entrypoint'] = saved_entcmd[0]
-            else:
-                del service['entrypoint']
-            if saved_entcmd[1]:
-                service['command'] = saved_entcmd[1]
-            else:
-                del service['command']
-            if isinstance(saved_entcmd[2], bool):
-                service['stdin_open'] = saved_entcmd[2]
-            else:
-                del service['stdin_open']
-            module_logger.debug("retrieved service: ('%s', '%s')",
-                                service['entrypoint'],
-                                service['command'])
             container = Container(service)
-            if options.dump:
+            if args.dump:
                 print(service.dump_run())
             else:
                 try:
-                    container = container.create(prod=options.prod)
+                    container = container.create(prod=args.prod, labels=labels.container_labels(
+                        ctrl, service, args))
                     container.start()
                 except ContainerException as e:
                     module_logger.debug('outer start containerexception caught')
@@ -551,4 +1080,10 @@ dispatch_dict = {
     "build": build,
     "build-prod": build_prod,
     "default": default,
+    "watch": watch,
+    "lock": lock,
+    "gc": gc,
+    "status": status,
+    "logs": logs,
+    "stats": stats,
 }
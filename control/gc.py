@@ -0,0 +1,161 @@
+"""
+Remove the images Control built that nothing uses any more.
+
+Building a service takes its image name away from the image built before,
+which is left behind untagged. build records what each name pointed at
+before it started, and once the new images are in place removes the old
+ones that no container is using. rere does the same after the containers
+have been restarted onto the new images. `control gc` goes through every
+superseded image of the services, with --older-than and --keep-size to
+keep some around to roll back to.
+
+Only images carrying Control's labels are ever removed, and removals go to
+docker all at once.
+"""
+
+import asyncio
+import logging
+import re
+import time
+
+import docker
+
+from control import labels
+from control.progress import format_bytes
+from control.repository import Repository
+
+module_logger = logging.getLogger('control.gc')
+module_logger.setLevel(logging.DEBUG)
+
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+
+def parse_age(age):
+    """Turn an age like '7d' or '12h' into a number of seconds"""
+    if age is None or isinstance(age, (int, float)):
+        return age
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*', age.lower())
+    if not match:
+        raise ValueError('Cannot understand age {}'.format(age))
+    return float(match.group(1)) * AGE_UNITS[match.group(2) or 's']
+
+
+def _tags(image):
+    return [tag for tag in image.get('RepoTags') or [] if tag != '<none>:<none>']
+
+
+async def tagged(client, services):
+    """image name: the ID it points at, for the services' images Control built"""
+    names = {Repository.match(service.image).repo for service in services}
+    found = {}
+    for image in await client.images(filters={'label': [labels.IMAGE]}):
+        for tag in _tags(image):
+            if tag in names:
+                found[tag] = image['Id']
+    return found
+
+
+class GCSummary:
+    """What a collection removed, what it had to keep, and the space it freed"""
+
+    def __init__(self):
+        self.removed = []
+        # image ID: why it is still there
+        self.kept = {}
+        self.freed = 0
+
+    def __str__(self):
+        if not self.removed:
+            summary = 'No images to remove'
+        else:
+            summary = 'Removed {} image{}, freeing up to {}'.format(
+                len(self.removed), '' if len(self.removed) == 1 else 's',
+                format_bytes(self.freed))
+        if self.kept:
+            summary += '. Kept {} still in use'.format(len(self.kept))
+        return summary
+
+
+async def _remove(client, image, summary):
+    try:
+        await client.remove_image(image['Id'])
+    except docker.errors.APIError as e:
+        # Used by a container, or by an image built FROM it
+        summary.kept[image['Id']] = e.explanation.decode('utf-8', 'replace')
+        module_logger.debug('keeping %s: %s', image['Id'], summary.kept[image['Id']])
+    else:
+        summary.removed.append(image['Id'])
+        summary.freed += image.get('Size') or 0
+
+
+async def remove_images(client, images):
+    """Remove the images all at once, keeping any docker won't let go of"""
+    summary = GCSummary()
+    await asyncio.gather(*(_remove(client, image, summary) for image in images))
+    return summary
+
+
+async def remove_superseded(client, services, before):
+    """
+    Remove the images the services' names pointed at before a build, given
+    as tagged() returned them, which they no longer do
+    """
+    after = await tagged(client, services)
+    old = {image_id for name, image_id in before.items() if after.get(name) != image_id}
+    if not old:
+        return GCSummary()
+    images = [image for image in await client.images(filters={'label': [labels.IMAGE]})
+              if image['Id'] in old and not _tags(image)]
+    return await remove_images(client, images)
+
+
+def superseded(images, containers, services):
+    """
+    The untagged images Control built for the services, that no container
+    is using, newest first
+    """
+    names = {Repository.match(service.image).repo for service in services}
+    in_use = {container.get('ImageID') for container in containers}
+    return sorted((image for image in images
+                   if (image.get('Labels') or {}).get(labels.IMAGE) in names and
+                   not _tags(image) and image['Id'] not in in_use),
+                  key=lambda image: -image['Created'])
+
+
+def apply_policy(images, older_than=None, keep_size=None, now=None):
+    """
+    Which of the superseded images, newest first, to remove: those older
+    than older_than seconds, past the newest keep_size bytes of them
+    """
+    now = time.time() if now is None else now
+    room = keep_size
+    chosen = []
+    for image in images:
+        if older_than is not None and now - image['Created'] < older_than:
+            continue
+        size = image.get('Size') or 0
+        if room is not None and size <= room:
+            room -= size
+            continue
+        # Only the newest are kept, so nothing older fits either
+        room = None
+        chosen.append(image)
+    return chosen
+
+
+async def collect(client, services, older_than=None, keep_size=None, dry_run=False):
+    """
+    Remove the superseded images of the services that the policy picks for
+    each of their image names. One list call each for images and containers. Returns a GCSummary, or
+    the images that would go with dry_run
+    """
+    images, containers = await asyncio.gather(
+        client.images(filters={'label': [labels.IMAGE]}), client.containers(all=True))
+    by_name = {}
+    for image in superseded(images, containers, services):
+        by_name.setdefault(image['Labels'][labels.IMAGE], []).append(image)
+    chosen = [image for name in sorted(by_name)
+              for image in apply_policy(by_name[name], older_than, keep_size)]
+    if dry_run:
+        return chosen
+    return await remove_images(client, chosen)
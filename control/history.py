@@ -0,0 +1,200 @@
+"""
+Time each phase of a build or start for every service, print a summary at the
+end of the run, and keep every run in a small SQLite database.
+
+The history is what lets us notice a build getting slower over a few weeks,
+and it is where the scheduler finds out which builds take the longest.
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import statistics
+import threading
+import time
+
+from control.tracing import span
+
+module_logger = logging.getLogger('control.history')
+module_logger.setLevel(logging.DEBUG)
+
+PHASES = ['prebuild', 'pull', 'build', 'postbuild', 'stop', 'start']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    command TEXT NOT NULL,
+    project TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    ok INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run INTEGER NOT NULL REFERENCES runs(id),
+    service TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_service ON timings (service, phase);
+"""
+
+
+def history_path():
+    """Where the history lives, overridable with CONTROL_HISTORY"""
+    if 'CONTROL_HISTORY' in os.environ:
+        return os.environ['CONTROL_HISTORY']
+    cache = os.environ.get('XDG_CACHE_HOME',
+                           os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache, 'control', 'history.sqlite')
+
+
+class RunTimer:
+    """
+    Adds up the wall time each service spends in each phase of one run.
+    Outside of a run, phase() does nothing, so stop and start can be timed
+    without restart printing a table of its own.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.command = None
+        self.began = None
+        self.started = None
+        self.timings = {}
+
+    @property
+    def running(self):
+        """Whether a run is being timed"""
+        return self.started is not None
+
+    def start(self, command):
+        """Start timing a run of command"""
+        with self.lock:
+            self.command = command
+            self.began = time.time()
+            self.started = self.clock()
+            self.timings = {}
+
+    def stop(self):
+        """
+        Stop timing. Returns the wall time of the whole run. What was timed
+        is kept, to be recorded
+        """
+        with self.lock:
+            seconds = self.clock() - self.started
+            self.started = None
+            return seconds
+
+    def add(self, service, phase, seconds):
+        """Count seconds against a service's phase"""
+        with self.lock:
+            key = (service, phase)
+            self.timings[key] = self.timings.get(key, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, service, phase):
+        """Time the body as part of service's phase"""
+        if not self.running:
+            yield
+            return
+        begin = self.clock()
+        try:
+            with span('phase.{}'.format(phase), service=service):
+                yield
+        finally:
+            self.add(service, phase, self.clock() - begin)
+
+    def table(self, total=None):
+        """The timings as a table of services by phases"""
+        with self.lock:
+            timings = dict(self.timings)
+        phases = [p for p in PHASES if any(k[1] == p for k in timings)]
+        phases += sorted({k[1] for k in timings} - set(phases))
+        services = sorted({k[0] for k in timings})
+        rows = [['service'] + phases + ['total']]
+        for service in services:
+            seconds = [timings.get((service, p)) for p in phases]
+            rows.append([service] + [_seconds(s) for s in seconds] +
+                        [_seconds(sum(s for s in seconds if s is not None))])
+        if total is not None:
+            rows.append(['wall time'] + [''] * len(phases) + [_seconds(total)])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return '\n'.join(
+            '  '.join([row[0].ljust(widths[0])] +
+                      [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])])
+            .rstrip()
+            for row in rows)
+
+
+def _seconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds >= 60:
+        return '{}m{:04.1f}s'.format(int(seconds // 60), seconds % 60)
+    return '{:.1f}s'.format(seconds)
+
+
+class History:
+    """Past runs in an SQLite database"""
+
+    def __init__(self, path=None):
+        self.path = path or history_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Several Controls can finish at the same time
+        self.db = sqlite3.connect(self.path, timeout=10)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """Close the database"""
+        self.db.close()
+
+    def record(self, project, timer, seconds, ok):
+        """Save the run timer has just timed"""
+        with self.db:
+            run = self.db.execute(
+                'INSERT INTO runs (started, command, project, seconds, ok) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (timer.began, timer.command or '', project, seconds, int(bool(ok)))
+            ).lastrowid
+            self.db.executemany(
+                'INSERT INTO timings (run, service, phase, seconds) VALUES (?, ?, ?, ?)',
+                ((run, service, phase, secs)
+                 for (service, phase), secs in sorted(timer.timings.items())))
+        return run
+
+    def durations(self, project, phase='build', limit=20):
+        """The most recent times each service took in phase, newest first"""
+        found = {}
+        for service, seconds in self.db.execute(
+                'SELECT service, timings.seconds FROM timings '
+                'JOIN runs ON runs.id = timings.run '
+                'WHERE runs.project = ? AND timings.phase = ? AND runs.ok '
+                'ORDER BY runs.started DESC', (project, phase)):
+            times = found.setdefault(service, [])
+            if len(times) < limit:
+                times.append(seconds)
+        return found
+
+    def medians(self, project, phase='build', limit=20):
+        """The median of the most recent times each service took in phase"""
+        return {service: statistics.median(times)
+                for service, times in self.durations(project, phase, limit).items()}
+
+
+def record_run(project, timer, seconds, ok, path=None):
+    """Save a run to the history, without letting a bad database stop Control"""
+    try:
+        history = History(path)
+        try:
+            history.record(project, timer, seconds, ok)
+        finally:
+            history.close()
+    except (sqlite3.Error, OSError) as e:
+        module_logger.warning('could not save the run to the build history: %s', e)
+
+
+# The run in progress in this process
+run_timer = RunTimer()
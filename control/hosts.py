@@ -0,0 +1,332 @@
+"""
+Spread builds over several docker hosts.
+
+The hosts come from --docker-host, the Controlfile's top level "hosts" list,
+or a comma separated DOCKER_HOST, in that order. Each one is a URL, unix://
+or tcp://, or in the Controlfile an object like
+
+    {"url": "tcp://build2:2376", "tls": true, "cert_path": "~/.docker/build2",
+     "builds": 4}
+
+TCP hosts use TLS when the entry says so or DOCKER_TLS_VERIFY is set, with
+certificates from cert_path or DOCKER_CERT_PATH. The first host is the
+primary one, the one containers are started on.
+
+The build scheduler hands services that are ready to a worker, which builds
+each one on the host with the lowest load: the builds it's running, and the
+containers it was already running, over the builds it has room for. When a
+service is built FROM an image we built on another host, that image is
+moved over first, either streamed from `docker save` into `docker load` or
+pushed to its registry and pulled. Once everything is built, the images are
+moved to the primary host.
+"""
+
+import json
+import logging
+import os
+import threading
+
+import docker
+import docker.tls
+
+from control.dclient import dclient
+from control.exceptions import ControlException, HostUnavailable
+from control.repository import Repository
+
+module_logger = logging.getLogger('control.hosts')
+module_logger.setLevel(logging.DEBUG)
+
+DEFAULT_HOST = 'unix:///var/run/docker.sock'
+# How many of a host's CPUs a build gets when the host doesn't say how many
+# builds it takes
+CPUS_PER_BUILD = 2
+# How much of a build slot each container a host was already running takes up
+CONTAINER_LOAD = 0.25
+TRANSFERS = ('stream', 'registry')
+
+
+def _tls_config(entry):
+    """The TLSConfig for a host entry, or False for plain connections"""
+    verify = entry.get('tls')
+    if verify is None:
+        verify = bool(os.environ.get('DOCKER_TLS_VERIFY'))
+    if not verify or not entry['url'].startswith('tcp://'):
+        return False
+    cert_path = os.path.expanduser(entry.get('cert_path') or
+                                   os.environ.get('DOCKER_CERT_PATH') or '~/.docker')
+    return docker.tls.TLSConfig(
+        client_cert=(os.path.join(cert_path, 'cert.pem'), os.path.join(cert_path, 'key.pem')),
+        ca_cert=os.path.join(cert_path, 'ca.pem'),
+        verify=True,
+        assert_hostname=False)
+
+
+class DockerHost:
+    """One docker daemon in the pool, and how busy it is"""
+
+    def __init__(self, url, client=None, builds=None, name=None):
+        self.url = url
+        self.client = client
+        self.name = name or url
+        self.builds = builds
+        self.active = 0
+        # Containers the host was running before we got to it
+        self.busy = 0
+
+    @classmethod
+    def from_entry(cls, entry):
+        """A host from a URL or a Controlfile entry"""
+        if isinstance(entry, str):
+            entry = {'url': entry}
+        url = entry['url']
+        if url == DEFAULT_HOST and dclient is not None:
+            client = dclient
+        else:
+            client = docker.Client(base_url=url, tls=_tls_config(entry))
+        return cls(url, client, entry.get('builds'), entry.get('name'))
+
+    def refresh(self):
+        """Ask the daemon how big and how busy it is"""
+        info = self.client.info()
+        if not self.builds:
+            self.builds = max(1, info.get('NCPU', 1) // CPUS_PER_BUILD)
+        self.busy = info.get('ContainersRunning', 0)
+        module_logger.debug('%s takes %d builds and is running %d containers',
+                            self.name, self.builds, self.busy)
+
+    @property
+    def load(self):
+        """How full the host is, where 1 is every build slot in use"""
+        return (self.active + self.busy * CONTAINER_LOAD) / max(self.builds or 1, 1)
+
+    def __repr__(self):
+        return 'DockerHost({!r})'.format(self.name)
+
+
+def host_entries(args_hosts=None, controlfile_hosts=None, environ=None):
+    """The host entries to use, from the first place that names any"""
+    environ = os.environ if environ is None else environ
+    for entries in (args_hosts, controlfile_hosts):
+        if entries:
+            found = []
+            for entry in entries:
+                if isinstance(entry, str):
+                    found += [url.strip() for url in entry.split(',') if url.strip()]
+                else:
+                    found.append(entry)
+            return found
+    urls = [url.strip() for url in environ.get('DOCKER_HOST', '').split(',') if url.strip()]
+    return urls or [DEFAULT_HOST]
+
+
+class HostPool:
+    """
+    The docker hosts builds can go to, which of them have which images, and
+    how to move images between them
+    """
+
+    def __init__(self, hosts, transfer='stream'):
+        if transfer not in TRANSFERS:
+            raise ValueError('Cannot move images by {}'.format(transfer))
+        self.hosts = list(hosts)
+        self.transfer = transfer
+        self.lock = threading.Condition()
+        # image: the hosts it is on, for the images we built
+        self.locations = {}
+        # (image, host): an Event set once the image has been moved there
+        self.moving = {}
+        self.transfers = []
+
+    def __len__(self):
+        return len(self.hosts)
+
+    @property
+    def primary(self):
+        """The host containers are started on"""
+        return self.hosts[0]
+
+    @property
+    def capacity(self):
+        """How many builds can run across the pool at once"""
+        return sum(host.builds or 1 for host in self.hosts)
+
+    def refresh(self):
+        """Drop hosts that can't be reached, and size up the rest"""
+        reachable = []
+        for host in self.hosts:
+            try:
+                host.refresh()
+            except (docker.errors.APIError, OSError, ValueError) as e:
+                module_logger.warning('Cannot reach docker host %s, leaving it out: %s',
+                                      host.name, e)
+                continue
+            reachable.append(host)
+        if not reachable:
+            raise HostUnavailable([host.url for host in self.hosts])
+        self.hosts = reachable
+        return self
+
+    def acquire(self, images=()):
+        """
+        Take a build slot on the least loaded host, waiting for one if every
+        host is full. Among hosts that are as loaded as each other, the one
+        already holding more of images wins, so less has to be moved
+        """
+        with self.lock:
+            while True:
+                free = [host for host in self.hosts if host.active < (host.builds or 1)]
+                if free:
+                    break
+                self.lock.wait()
+            host = min(free, key=lambda h: (
+                h.load,
+                -sum(h in self.locations.get(image, ()) for image in images),
+                self.hosts.index(h)))
+            host.active += 1
+            return host
+
+    def release(self, host):
+        """Give back a build slot"""
+        with self.lock:
+            host.active -= 1
+            self.lock.notify_all()
+
+    def built(self, image, host):
+        """Remember that image was built on host"""
+        with self.lock:
+            self.locations[image] = {host}
+
+    def ensure(self, image, host):
+        """
+        Make sure host has image, if it's one we built somewhere else.
+        Returns whether it had to be moved
+        """
+        with self.lock:
+            holders = self.locations.get(image)
+            if not holders or host in holders:
+                return False
+            moving = self.moving.get((image, host))
+            if moving is None:
+                source = sorted(holders, key=self.hosts.index)[0]
+                self.moving[(image, host)] = threading.Event()
+        if moving is not None:
+            # Another build is already bringing it over
+            moving.wait()
+            return False
+        module_logger.info('Moving %s from %s to %s', image, source.name, host.name)
+        try:
+            if self.transfer == 'registry':
+                self._through_registry(image, source, host)
+            else:
+                self._stream(image, source, host)
+            with self.lock:
+                self.locations[image].add(host)
+                self.transfers.append((image, source, host))
+        finally:
+            with self.lock:
+                self.moving.pop((image, host)).set()
+        return True
+
+    def gather(self, images):
+        """Move the images we built to the primary host"""
+        moved = []
+        for image in images:
+            if self.ensure(image, self.primary):
+                moved.append(image)
+        return moved
+
+    @staticmethod
+    def _stream(image, source, host):
+        """docker save on one host, straight into docker load on the other"""
+        data = source.client.get_image(image)
+        try:
+            # Older docker-py hands back the whole response
+            stream = data.raw if hasattr(data, 'raw') else data
+            host.client.load_image(stream)
+        finally:
+            if hasattr(data, 'close'):
+                data.close()
+
+    @staticmethod
+    def _through_registry(image, source, host):
+        """Push from one host, and pull on the other"""
+        repo = Repository.match(image)
+        if not repo.registry:
+            raise ControlException('{} has no registry to move it through'.format(image))
+        for action in (source.client.push, host.client.pull):
+            for line in action(repo.get_pull_image_name(), tag=repo.tag, stream=True):
+                for status in _statuses(line):
+                    if 'error' in status:
+                        raise ControlException('Moving {} through {} failed: {}'.format(
+                            image, repo.registry, status['error']))
+
+    def run(self, scheduler, build, produces, needs):
+        """
+        Build everything the scheduler hands out, as many at once as the
+        pool has room for.
+
+        build(name, host) builds one service on host and returns True if
+        its image, produces[name], is there now, None if it was skipped, or
+        False to stop every build. needs[name] lists the images it is built
+        FROM. Returns whether nothing failed
+        """
+        state = threading.Condition()
+        failed = []
+
+        def worker():  # pylint: disable=missing-docstring
+            while True:
+                with state:
+                    while True:
+                        if failed or not scheduler.pending:
+                            return
+                        name = scheduler.take()
+                        if name:
+                            break
+                        state.wait()
+                images = needs.get(name, ())
+                host = self.acquire(images)
+                try:
+                    for image in images:
+                        self.ensure(image, host)
+                    result = build(name, host)
+                except Exception as e:  # pylint: disable=broad-except
+                    # Anything a build throws has to stop the run here, or
+                    # the other workers wait on it forever
+                    module_logger.critical('building %s on %s failed: %s', name, host.name, e)
+                    result = False
+                finally:
+                    self.release(host)
+                with state:
+                    if result is False:
+                        failed.append(name)
+                    else:
+                        # Where the image is has to be known before anything
+                        # built FROM it can be handed out
+                        if result:
+                            self.built(produces[name], host)
+                        scheduler.finish(name)
+                    state.notify_all()
+
+        workers = [threading.Thread(target=worker, name='build-{}'.format(index), daemon=True)
+                   for index in range(max(1, min(self.capacity, len(scheduler.names))))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return not failed
+
+
+def _statuses(line):
+    """The JSON objects in a line of docker's progress stream"""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    return [json.loads(part) for part in line.splitlines() if part.strip()]
+
+
+def host_pool(ctrl=None, hosts=None, transfer='stream'):
+    """The pool of hosts for this run, sized up and with unreachable ones left out"""
+    entries = host_entries(hosts, getattr(ctrl, 'hosts', None))
+    pool = HostPool([DockerHost.from_entry(entry) for entry in entries], transfer)
+    if len(pool) > 1:
+        pool.refresh()
+    return pool
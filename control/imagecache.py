@@ -0,0 +1,190 @@
+"""
+Share built images between machines that can see the same filesystem.
+
+After build-prod builds an image, it is `docker save`d into the cache under a
+hash of everything that went into building it. Before building, Control
+checks the cache for that hash and `docker load`s the image instead of
+building it again. On a CI fleet with an NFS share, only the first agent
+pays for a build.
+
+Backends are looked up by the scheme of the cache location, so other places
+to keep images can be added to `backends`. A location with no scheme is a
+directory.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+
+import docker
+
+module_logger = logging.getLogger('control.imagecache')
+module_logger.setLevel(logging.DEBUG)
+
+CHUNK_SIZE = 1024 * 1024
+SIZE_SUFFIXES = {'': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3, 't': 1000 ** 4}
+# fcntl locks belong to the process, so threads also need to take turns
+_thread_lock = threading.Lock()
+
+
+def parse_size(size):
+    """Turn a size like '20G' or '500m' into a number of bytes"""
+    if size is None or isinstance(size, int):
+        return size
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*', size.lower())
+    if not match:
+        raise ValueError('Cannot understand size {}'.format(size))
+    return int(float(match.group(1)) * SIZE_SUFFIXES[match.group(2)])
+
+
+def input_hash(service, context, upstream_id):
+    """
+    Hash everything that goes into building an image: the content of the
+    build context and Dockerfile, the exact image it is built FROM, and the
+    tag it will have
+    """
+    digest = hashlib.sha256()
+    for part in (context.content_key(), upstream_id, service['image']):
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """The interface an image cache backend provides"""
+
+    def fetch(self, key):
+        """Return an open file with the saved image for key, or None"""
+        raise NotImplementedError
+
+    def store(self, key, stream):
+        """Save the image tarball read from the file-like stream under key"""
+        raise NotImplementedError
+
+
+class DirectoryCache(ImageCache):
+    """
+    Keeps saved images as files in a directory, which can be shared over NFS.
+
+    A lock file in the directory keeps agents from evicting an image while
+    another is moving it into place. Whenever an image is used its mtime is
+    touched, and when the cache grows past max_size the images that were
+    used longest ago are removed.
+    """
+
+    def __init__(self, root, max_size=None):
+        self.root = os.path.abspath(root)
+        self.max_size = parse_size(max_size)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        """Where the image for key lives"""
+        return os.path.join(self.root, key[:2], '{}.tar'.format(key))
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold the cache's lock file. fcntl locks work over NFSv4"""
+        with _thread_lock, open(os.path.join(self.root, '.lock'), 'a') as lockfile:
+            fcntl.lockf(lockfile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lockfile, fcntl.LOCK_UN)
+
+    def fetch(self, key):
+        path = self.path(key)
+        with self.lock():
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                return None
+            os.utime(path)
+        # Once it is open, eviction can unlink it without harming this read
+        return f
+
+    def store(self, key, stream):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        # Write somewhere private first, so nobody loads half an image
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    f.write(chunk)
+            with self.lock():
+                os.replace(tmp, self.path(key))
+                self._evict()
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+
+    def entries(self):
+        """(last used, size, path) of every image in the cache"""
+        found = []
+        for directory in os.scandir(self.root):
+            if not directory.is_dir() or directory.name.startswith('.'):
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.tar'):
+                    st = entry.stat()
+                    found.append((st.st_mtime, st.st_size, entry.path))
+        return found
+
+    def _evict(self):
+        if self.max_size is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            module_logger.debug('evicting %s from the image cache', path)
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
+
+
+backends = {
+    'dir': DirectoryCache,
+    'file': DirectoryCache,
+}
+
+
+def open_image_cache(location, max_size=None):
+    """Create the cache for a location like /mnt/cache or dir:///mnt/cache"""
+    if not location:
+        return None
+    scheme, sep, rest = location.partition('://')
+    if not sep:
+        scheme, rest = 'dir', location
+    try:
+        return backends[scheme](rest, max_size)
+    except KeyError:
+        raise ValueError('Unknown image cache type {}'.format(scheme)) from None
+
+
+def load_image(cache, key, client):
+    """docker load the image saved under key. Returns False on a miss"""
+    f = cache.fetch(key)
+    if f is None:
+        return False
+    with f:
+        try:
+            client.load_image(f)
+        except docker.errors.APIError as e:
+            module_logger.warning('cached image could not be loaded: %s', e)
+            return False
+    return True
+
+
+def save_image(cache, key, image, client):
+    """docker save image into the cache under key"""
+    try:
+        cache.store(key, client.get_image(image))
+    except (docker.errors.APIError, OSError) as e:
+        module_logger.warning('could not save %s to the image cache: %s', image, e)
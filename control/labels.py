@@ -0,0 +1,128 @@
+"""
+The labels Control puts on what it makes, so it can find its own images,
+containers and volumes again without guessing at names.
+
+Containers and the named volumes they use are labeled with the project
+(the directory of the Controlfile), the service and the Controlfile that
+defines it, a hash of the service's container configuration, and the
+session of the run that made them. One list call filtered on the project
+finds every container Control made for it, including ones a renamed
+service or a crashed custom command left behind.
+
+Images get theirs from a LABEL instruction on the end of the Dockerfile
+Control sends, which every docker Control supports. They only name the
+service and its image, never a path on this machine or the session, so the
+same build is the same image everywhere and the image cache still hits.
+"""
+
+import hashlib
+import json
+import os
+from os.path import abspath, dirname
+import uuid
+
+from control.repository import Repository
+from control.service import Startable
+
+PREFIX = 'com.petrode.control'
+# The service an image was built for, and the image name it was built as
+SERVICE = PREFIX + '.service'
+IMAGE = PREFIX + '.image'
+PROJECT = PREFIX + '.project'
+CONTROLFILE = PREFIX + '.controlfile'
+CONFIG = PREFIX + '.config-hash'
+SESSION = PREFIX + '.session'
+# What a container is for, when it isn't the service itself, like 'holder'
+ROLE = PREFIX + '.role'
+
+SESSION_ENV = 'CONTROL_SESSION_UUID'
+
+
+def session_id():
+    """The session a run labels what it makes with, from CONTROL_SESSION_UUID or new"""
+    return os.environ.get(SESSION_ENV) or str(uuid.uuid4())
+
+
+def project_root(ctrl):
+    """The directory of the Controlfile, which names the project"""
+    return dirname(abspath(ctrl.location))
+
+
+def config_hash(service, prod):
+    """
+    A hash of what the service's container is created with, to tell whether
+    a container was made from the Controlfile as it is now
+    """
+    # prepare_container_options leaves the split volumes in the container
+    # and host_config, so they come from volumes_for instead
+    config = {
+        'image': service.image,
+        'container': {k: v for k, v in service.container.items() if k != 'volumes'},
+        'host_config': {k: v for k, v in service.host_config.items() if k != 'binds'},
+        'volumes': sorted(service.volumes_for(prod)),
+        'env_file': service.env_file,
+    }
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def container_labels(ctrl, service, args, role=None):
+    """The labels a container, or a volume, made for service in this run gets"""
+    found = {
+        PROJECT: project_root(ctrl),
+        SERVICE: service.service,
+        CONTROLFILE: abspath(service.controlfile),
+        CONFIG: config_hash(service, args.prod),
+    }
+    if args.session:
+        found[SESSION] = args.session
+    if role:
+        found[ROLE] = role
+    return found
+
+
+def project_filter(ctrl):
+    """The list filter for everything labeled with the Controlfile's project"""
+    return {'label': ['{}={}'.format(PROJECT, project_root(ctrl))]}
+
+
+async def project_containers(client, ctrl):
+    """Every container made for the Controlfile's project, running or not, in one call"""
+    return await client.containers(all=True, filters=project_filter(ctrl))
+
+
+def container_name(container):
+    """The name of a container from a list call"""
+    return (container.get('Names') or ['/'])[0].lstrip('/')
+
+
+def orphans(containers, ctrl, session=None):
+    """
+    The project's containers no service accounts for: those of services the
+    Controlfile doesn't have any more, those named something their service
+    no longer names its container, and holding containers custom commands
+    of other sessions left behind
+    """
+    found = []
+    for container in containers:
+        labels = container.get('Labels') or {}
+        service = ctrl.services.get(labels.get(SERVICE))
+        if not isinstance(service, Startable) or \
+                container_name(container) != service['name'] or \
+                (labels.get(ROLE) == 'holder' and labels.get(SESSION) != session):
+            found.append(container)
+    return found
+
+
+def image_labels(service):
+    """The labels an image built for service gets"""
+    return {SERVICE: service.service, IMAGE: Repository.match(service.image).repo}
+
+
+def label_dockerfile(dockerfile, labels):
+    """The bytes of a Dockerfile with a LABEL instruction for labels on the end"""
+    line = 'LABEL ' + ' '.join('{}={}'.format(json.dumps(key), json.dumps(value))
+                               for key, value in sorted(labels.items()))
+    if dockerfile and not dockerfile.endswith(b'\n'):
+        dockerfile += b'\n'
+    return dockerfile + line.encode('utf-8') + b'\n'
@@ -0,0 +1,112 @@
+"""
+Controlfile.lock pins the images services are built FROM to the content
+digests they had when `control lock` ran.
+
+Builds FROM a pinned image build FROM its digest and don't ask its registry
+whether there is a newer one, so a build only changes when its inputs or
+the lock do. `control lock` pins the images that aren't pinned yet, and
+`control lock --update` asks for every digest again. Images the Controlfile
+builds itself are never pinned.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from os.path import dirname, join
+
+import docker
+
+from control import aio
+from control.dependencies import upstream_of
+from control.repository import Repository
+from control.service import Buildable
+
+module_logger = logging.getLogger('control.lockfile')
+module_logger.setLevel(logging.DEBUG)
+
+LOCKFILE = 'Controlfile.lock'
+LOCK_VERSION = 1
+
+
+def lock_path(ctrl):
+    """Where the Controlfile's lock is, next to it"""
+    return join(dirname(ctrl.location), LOCKFILE)
+
+
+def read_lock(ctrl):
+    """FROM image: digest, from the Controlfile's lock. Empty if there isn't one"""
+    path = lock_path(ctrl)
+    try:
+        with open(path) as f:
+            pins = json.load(f)['images']
+    except FileNotFoundError:
+        return {}
+    except (ValueError, KeyError, TypeError) as e:
+        module_logger.warning('%s is not a lock Control can read, ignoring it: %s', path, e)
+        return {}
+    return {repo: digest for repo, digest in pins.items()
+            if isinstance(digest, str) and digest.startswith('sha256:')}
+
+
+def write_lock(ctrl, pins):
+    """Replace the Controlfile's lock with pins"""
+    path = lock_path(ctrl)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'version': LOCK_VERSION, 'images': pins}, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp, path)
+    return path
+
+
+def lockable(ctrl):
+    """
+    repo: Repository for every image a service is built FROM, in dev or prod,
+    that the Controlfile doesn't build itself
+    """
+    buildable = {name: service for name, service in ctrl.services.items()
+                 if isinstance(service, Buildable) and name == service.service}
+    built = {Repository.match(service.image).repo for service in buildable.values()}
+    found = {}
+    for service in buildable.values():
+        for env in ('dev', 'prod'):
+            upstream = upstream_of(service, env)
+            # FROM lines that name a digest are pinned already
+            if upstream and not upstream.digest and upstream.image != 'scratch' and \
+                    upstream.repo not in built:
+                found[upstream.repo] = upstream
+    return found
+
+
+async def digest_of(upstream, client, no_verify=False):
+    """
+    The digest upstream's registry has for it. Images from the Hub are only
+    looked up on the docker host, at the digest docker pulled them at
+    """
+    if upstream.registry:
+        registry = aio.get_registry(upstream.domain, upstream.port, no_verify)
+        return await registry.get_digest_of_repo(upstream)
+    try:
+        inspect = await client.inspect_image(upstream.repo)
+    except docker.errors.NotFound:
+        return ''
+    prefix = upstream.get_pull_image_name() + '@'
+    for reference in inspect.get('RepoDigests') or []:
+        if reference.startswith(prefix):
+            return reference[len(prefix):]
+    return ''
+
+
+async def resolve(upstreams, client, no_verify=False):
+    """repo: digest for each of upstreams, asking for all of them at once"""
+    upstreams = list(upstreams)
+    digests = await asyncio.gather(*(digest_of(upstream, client, no_verify)
+                                     for upstream in upstreams), return_exceptions=True)
+    found = {}
+    for upstream, digest in zip(upstreams, digests):
+        if isinstance(digest, Exception):
+            module_logger.debug('cannot find the digest of %s: %s', upstream, digest)
+        elif digest:
+            found[upstream.repo] = digest
+    return found
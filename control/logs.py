@@ -0,0 +1,216 @@
+"""
+`control logs`: the logs of many containers at once, on one event loop.
+
+Each container's log is read by its own coroutine into one bounded queue,
+so a terminal that can't keep up stops the reading, and docker stops
+sending, rather than lines piling up in memory. Lines are printed in the
+order of their docker timestamps, prefixed with their service. Following
+holds each line back for WINDOW seconds, so a line that arrives a little
+late on another connection still goes in its place.
+
+A followed container that stops ends its log stream. Following watches
+docker's events for the services' containers starting again, restarted or
+made anew under the same name, and picks their logs up from where they
+stopped.
+"""
+
+import asyncio
+import calendar
+import heapq
+import itertools
+import logging
+import sys
+import time
+
+import docker
+
+module_logger = logging.getLogger('control.logs')
+module_logger.setLevel(logging.DEBUG)
+
+# Lines read but not printed yet, before the readers wait for the printer
+QUEUE_SIZE = 1000
+# How long following holds a line back for lines from other containers
+WINDOW = 0.1
+
+
+def parse_timestamp(text):
+    """Seconds since the epoch from docker's RFC 3339 timestamps, to the nanosecond"""
+    base, _, fraction = text.rstrip('Z').partition('.')
+    seconds = calendar.timegm(time.strptime(base, '%Y-%m-%dT%H:%M:%S'))
+    return seconds + float('0.' + (fraction or '0'))
+
+
+class LogLine:
+    """A line from a service's container, ordered by when docker got it"""
+
+    _order = itertools.count()
+
+    def __init__(self, service, when, line, stream=1):
+        self.service = service
+        self.when = when
+        self.line = line
+        self.stream = stream
+        # Lines docker stamped the same keep the order they were read in
+        self.seq = next(self._order)
+        self.arrived = time.monotonic()
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    @classmethod
+    def parse(cls, service, raw, stream=1, previous=0.0):
+        """
+        A line docker sent with timestamps on. A line of a write that had
+        more than one gets the time of the line before it
+        """
+        stamp, _, line = raw.partition(b' ')
+        try:
+            when = parse_timestamp(stamp.decode('ascii'))
+        except ValueError:
+            when, line = previous, raw
+        return cls(service, when, line.decode('utf-8', 'replace').rstrip('\r'), stream)
+
+
+class LogPrinter:
+    """Prints lines with the service they came from in front"""
+
+    def __init__(self, services, out=None):
+        self.width = max((len(name) for name in services), default=0)
+        self.out = out or sys.stdout
+
+    def print(self, line):
+        """Write one line"""
+        self.out.write('{} | {}\n'.format(line.service.ljust(self.width), line.line))
+        self.out.flush()
+
+
+async def read_log(client, service, name, queue, follow, tail='all', since=None):
+    """
+    Queue the lines of the container called name. Returns the time of the
+    last line, or since if there weren't any. A container that isn't there
+    has no lines
+    """
+    try:
+        inspect = await client.inspect_container(name)
+    except docker.errors.NotFound:
+        module_logger.debug('%s has no container %s', service, name)
+        return since
+    last = since
+    previous = 0.0
+    async for stream, raw in client.logs(
+            inspect['Id'], follow=follow, timestamps=True, tail=tail,
+            tty=inspect['Config'].get('Tty', False),
+            since=int(since) if since else None):
+        line = LogLine.parse(service, raw, stream, previous)
+        previous = line.when
+        # since only goes to the second, so lines already printed come again
+        if since is not None and line.when <= since:
+            continue
+        last = line.when
+        await queue.put(line)
+    return last
+
+
+async def _printer(queue, printer, window):
+    """Print queued lines in timestamp order, once they've been held for window"""
+    held = []
+    try:
+        while True:
+            try:
+                heapq.heappush(held, await asyncio.wait_for(queue.get(), window))
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            while held and held[0].arrived <= now - window:
+                printer.print(heapq.heappop(held))
+    finally:
+        # What was read before following stopped still gets printed
+        while not queue.empty():
+            heapq.heappush(held, queue.get_nowait())
+        while held:
+            printer.print(heapq.heappop(held))
+
+
+async def show_logs(client, names, tail='all', out=None):
+    """
+    Print what the containers, by service: container name, wrote so far,
+    interleaved by timestamp
+    """
+    printer = LogPrinter(names, out)
+    queue = asyncio.Queue()
+    await asyncio.gather(*(read_log(client, service, name, queue, False, tail)
+                           for service, name in names.items()))
+    lines = []
+    while not queue.empty():
+        lines.append(queue.get_nowait())
+    for line in sorted(lines):
+        printer.print(line)
+
+
+async def follow_logs(client, names, tail='all', out=None, window=WINDOW, stop=None):
+    """
+    Print what the containers, by service: container name, write as they
+    write it, picking a container up again when it starts again, until stop
+    is set or out can't be written to
+    """
+    printer = LogPrinter(names, out)
+    queue = asyncio.Queue(QUEUE_SIZE)
+    stop = stop or asyncio.Event()
+    readers = {}
+    began = {}
+    turns = {service: asyncio.Lock() for service in names}
+    picking = []
+
+    def follow(service, since=None):  # pylint: disable=missing-docstring
+        began[service] = time.time()
+        readers[service] = asyncio.ensure_future(read_log(
+            client, service, names[service], queue, True,
+            tail if since is None else 'all', since))
+
+    async def pick_up(service, when):
+        """Follow service's container again once its last reader is done"""
+        # One service waiting on its old reader doesn't hold up the others,
+        # and its own starts are picked up in order
+        async with turns[service]:
+            # From a little before docker sent the event, not from when it
+            # got here, since a busy loop can take a while to get to it
+            since = when - 1
+            try:
+                # The reader of the container that stopped may not have
+                # seen the end of its log yet
+                since = await readers[service] or since
+            except docker.errors.APIError as e:
+                module_logger.debug('lost the log of %s: %s', service, e)
+            follow(service, since)
+
+    async def watch(subscribed):  # pylint: disable=missing-docstring
+        by_name = {name: service for service, name in names.items()}
+        filters = {'type': ['container'], 'event': ['start'], 'container': sorted(by_name)}
+        # Events from before watching got connected are replayed, so that a
+        # container that starts again in between isn't missed
+        async for event in client.events(filters=filters, since=int(subscribed)):
+            service = by_name.get(event['Actor']['Attributes'].get('name'))
+            if service is None:
+                continue
+            when = event.get('timeNano', 0) / 1e9 or event.get('time') or time.time()
+            if not readers[service].done() and when < began[service]:
+                # The reader following it now started after this container did
+                continue
+            picking[:] = [task for task in picking if not task.done()]
+            picking.append(asyncio.ensure_future(pick_up(service, when)))
+
+    tasks = [asyncio.ensure_future(_printer(queue, printer, window))]
+    # The printer only stops when it can't write any more, like when whoever
+    # was reading went away, and then there is no point following
+    tasks[0].add_done_callback(lambda task: stop.set())
+    subscribed = time.time()
+    for service in names:
+        follow(service)
+    tasks.append(asyncio.ensure_future(watch(subscribed)))
+    try:
+        await stop.wait()
+    finally:
+        tasks += picking
+        for task in tasks + list(readers.values()):
+            task.cancel()
+        await asyncio.gather(*tasks, *readers.values(), return_exceptions=True)
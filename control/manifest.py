@@ -0,0 +1,96 @@
+"""
+images.json, the manifest build-prod writes next to IMAGES.txt.
+
+IMAGES.txt only lists the image names of the services build-prod built.
+images.json says which image each of them got: its ID, the digest its
+registry knows it by if it has been pushed, the image and digest it was
+built FROM, the input hash of everything that went into it, how long it
+took and how big it is. changed is false when the image name already
+pointed at the same image before the build, so jobs that push or deploy
+can leave those images alone.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from control.repository import Repository
+
+module_logger = logging.getLogger('control.manifest')
+module_logger.setLevel(logging.DEBUG)
+
+MANIFEST = 'images.json'
+
+
+def repo_digest(inspect, name):
+    """The digest of the inspected image in the repository name, or None"""
+    prefix = name + '@'
+    for reference in (inspect or {}).get('RepoDigests') or []:
+        if reference.startswith(prefix):
+            return reference[len(prefix):]
+    return None
+
+
+class ImageManifest:
+    """The images one build-prod built, by service"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images = {}
+
+    def __contains__(self, service):
+        with self.lock:
+            return service in self.images
+
+    def add(self, service, image, inspect, previous_id=None, upstream=None,
+            upstream_inspect=None, input_hash=None):
+        """
+        Record that service built the image name image, which inspects as
+        inspect. previous_id is what the name pointed at before the build,
+        and upstream the Repository it was built FROM
+        """
+        inspect = inspect or {}
+        upstream_digest = None
+        if upstream:
+            upstream_digest = upstream.digest or repo_digest(
+                upstream_inspect, upstream.get_pull_image_name())
+        entry = {
+            'image': image,
+            'id': inspect.get('Id'),
+            'digest': repo_digest(inspect, Repository.match(image).get_pull_image_name()),
+            'changed': inspect.get('Id') is None or inspect.get('Id') != previous_id,
+            'upstream': upstream.repo if upstream else None,
+            'upstream_digest': upstream_digest,
+            'input_hash': input_hash,
+            'size': inspect.get('Size'),
+        }
+        with self.lock:
+            self.images[service] = entry
+
+    def as_json(self, metrics=None):
+        """
+        The manifest as JSON, with the build seconds and image cache hits
+        of metrics, the BuildMetrics of the same run
+        """
+        with self.lock:
+            images = {service: dict(entry) for service, entry in self.images.items()}
+        measured = {}
+        if metrics is not None:
+            with metrics.lock:
+                measured = {service: dict(values)
+                            for service, values in metrics.services.items()}
+        for service, entry in images.items():
+            values = measured.get(service, {})
+            entry['build_seconds'] = values.get('build_seconds')
+            entry['cache_hit'] = bool(values['cache_hit']) if 'cache_hit' in values else None
+        return json.dumps({'images': images}, indent=2, sort_keys=True) + '\n'
+
+    def write(self, directory='.', metrics=None):
+        """Write images.json into directory. Returns the path"""
+        path = os.path.join(directory, MANIFEST)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.as_json(metrics))
+        os.replace(tmp, path)
+        return path
@@ -0,0 +1,174 @@
+"""
+Metrics of a build-prod run, written next to IMAGES.txt for CI to keep.
+
+For each service: how long its image took to build or load from the image
+cache, the size of its build context, the bytes pulled for its FROM image,
+whether the image cache saved building it, and the size of the image. For
+each registry Control talked to: how many requests it made, and how long
+they took. The file is in Prometheus' textfile format, for the node
+exporter's textfile collector, or JSON.
+
+Like the run timer, metrics are only kept while a build-prod is running,
+and builds on a pool of docker hosts record into them from many threads.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+module_logger = logging.getLogger('control.metrics')
+module_logger.setLevel(logging.DEBUG)
+
+FORMATS = {'prometheus': 'metrics.prom', 'json': 'metrics.json'}
+
+# name: (help, the per service value it comes from)
+SERVICE_METRICS = [
+    ('control_build_seconds', 'Seconds building the image or loading it from the image cache',
+     'build_seconds'),
+    ('control_build_context_bytes', 'Bytes of file content in the build context',
+     'context_bytes'),
+    ('control_build_pull_bytes', 'Bytes pulled for the image the service is built FROM',
+     'pull_bytes'),
+    ('control_build_cache_hit', '1 if the image came from the image cache instead of a build',
+     'cache_hit'),
+    ('control_build_image_bytes', 'Size of the built image', 'image_bytes'),
+]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class BuildMetrics:
+    """What one build-prod measured, by service and by registry"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.running = False
+        self.finished = None
+        self.ok = None
+        self.services = {}
+        self.registries = {}
+
+    def start(self):
+        """Start keeping metrics for a run"""
+        with self.lock:
+            self.running = True
+            self.finished = None
+            self.ok = None
+            self.services = {}
+            self.registries = {}
+
+    def stop(self, ok):
+        """Stop keeping metrics, for a run that did or didn't work"""
+        with self.lock:
+            self.running = False
+            self.finished = time.time()
+            self.ok = bool(ok)
+
+    def set(self, service, **values):
+        """Record values for a service"""
+        if not self.running:
+            return
+        with self.lock:
+            self.services.setdefault(service, {}).update(values)
+
+    @contextlib.contextmanager
+    def timed(self, service, key='build_seconds'):
+        """Record how long the body takes as the service's key"""
+        begin = self.clock()
+        try:
+            yield
+        finally:
+            self.set(service, **{key: self.clock() - begin})
+
+    def registry_request(self, registry, seconds):
+        """Count a request to a registry that took seconds"""
+        if not self.running:
+            return
+        with self.lock:
+            count, total = self.registries.get(registry, (0, 0.0))
+            self.registries[registry] = (count + 1, total + seconds)
+
+    @contextlib.contextmanager
+    def registry(self, registry):
+        """Count the body as a request to registry"""
+        begin = self.clock()
+        try:
+            yield
+        finally:
+            self.registry_request(registry, self.clock() - begin)
+
+    def prometheus(self):
+        """The metrics in Prometheus' text format"""
+        with self.lock:
+            services = {name: dict(values) for name, values in self.services.items()}
+            registries = dict(self.registries)
+        lines = []
+
+        def metric(name, text, kind, samples):  # pylint: disable=missing-docstring
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{{{}}} {}'.format(name, ','.join(
+                    '{}="{}"'.format(k, _escape(v)) for k, v in labels), value))
+
+        for name, text, key in SERVICE_METRICS:
+            metric(name, text, 'gauge', [
+                ((('service', service),), _number(values[key]))
+                for service, values in sorted(services.items()) if key in values])
+        metric('control_registry_requests_total', 'Requests made to the registry', 'counter', [
+            ((('registry', registry),), count)
+            for registry, (count, _) in sorted(registries.items())])
+        metric('control_registry_request_seconds_total',
+               'Seconds spent waiting on requests to the registry', 'counter', [
+                   ((('registry', registry),), _number(total))
+                   for registry, (_, total) in sorted(registries.items())])
+        if self.finished is not None:
+            lines.append('# HELP control_build_success 1 if the build-prod worked')
+            lines.append('# TYPE control_build_success gauge')
+            lines.append('control_build_success {}'.format(int(self.ok)))
+            lines.append('# HELP control_build_last_run_timestamp_seconds When the build-prod '
+                         'finished')
+            lines.append('# TYPE control_build_last_run_timestamp_seconds gauge')
+            lines.append('control_build_last_run_timestamp_seconds {}'.format(
+                _number(self.finished)))
+        return '\n'.join(line for line in lines if line) + '\n'
+
+    def as_json(self):
+        """The metrics as JSON"""
+        with self.lock:
+            return json.dumps({
+                'ok': self.ok,
+                'finished': self.finished,
+                'services': self.services,
+                'registries': {registry: {'requests': count, 'seconds': total}
+                               for registry, (count, total) in self.registries.items()},
+            }, indent=2, sort_keys=True) + '\n'
+
+    def write(self, directory='.', fmt='prometheus'):
+        """Write the metrics into directory in fmt. Returns the path"""
+        path = os.path.join(directory, FORMATS[fmt])
+        text = self.prometheus() if fmt == 'prometheus' else self.as_json()
+        # The textfile collector can read the file at any moment
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+        return path
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        return '{:.6f}'.format(value).rstrip('0').rstrip('.')
+    return value
+
+
+# The build-prod in progress in this process
+build_metrics = BuildMetrics()
@@ -8,12 +8,32 @@ options = argparse.Namespace()
 opts = vars(options)
 opts['debug'] = False
 opts['image'] = None
+opts['image_cache'] = None
+opts['image_cache_size'] = None
+opts['image_transfer'] = 'stream'
+opts['keep_old_images'] = False
+opts['keep_size'] = None
+opts['older_than'] = None
 opts['controlfile'] = 'Controlfile'
 opts['dockerfile'] = None
+opts['docker_hosts'] = None
+opts['dump_format'] = 'commands'
+opts['follow'] = False
+opts['gzip_context'] = False
 opts['cache'] = None
+opts['check_registry'] = False
+opts['json'] = False
+opts['metrics_format'] = 'prometheus'
 opts['name'] = None
+opts['no_stream'] = False
 opts['no_rm'] = True
 opts['no_verify'] = False
 opts['pull'] = None
+opts['remove_orphans'] = False
+opts['session'] = None
+opts['tail'] = 'all'
+opts['trace'] = None
 opts['version'] = version
+opts['wipe_helper'] = 'busybox:latest'
+opts['wipe_outside_project'] = False
 opts['services'] = []
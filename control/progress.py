@@ -0,0 +1,235 @@
+"""
+Fold the JSON status streams that Docker sends back from pulls and builds
+into something a human can read.
+
+Docker sends a status message for every chunk of every layer it downloads.
+Printing each of those is how a pull of a big image turns into tens of
+megabytes of CI log. Progress keeps the latest state of each layer, keyed by
+the layer id, and only shows the summary:
+
+- On a TTY there is a live view at the bottom of the terminal with one line
+  per pull or build that is streaming, redrawn at most every redraw_interval
+  seconds.
+- Anywhere else a summary line is written for each stream every
+  summary_interval seconds, and once more when the stream finishes.
+
+Anything that is not layer progress (build output, errors, the final
+"Status:" of a pull) is printed as it arrives, above the live view.
+
+Several streams can be fed at the same time from different threads. Each
+stream is identified by a source name, usually the service or image name.
+"""
+
+from collections import OrderedDict
+import logging
+import sys
+import threading
+import time
+
+module_logger = logging.getLogger('control.progress')
+module_logger.setLevel(logging.DEBUG)
+
+# Layers in these states will not change any more
+FINISHED_STATES = {
+    'Already exists',
+    'Pull complete',
+}
+
+
+def format_bytes(num):
+    """Turn a byte count into something short and human readable"""
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(num) < 1000.0:
+            return '{:.1f} {}'.format(num, unit) if unit != 'B' else '{} B'.format(int(num))
+        num /= 1000.0
+    return '{:.1f} TB'.format(num)
+
+
+class Layer:
+    """The last known state of a single layer in a pull"""
+
+    def __init__(self):
+        self.status = ''
+        self.current = 0
+        self.total = 0
+
+    def update(self, status, detail):
+        """Apply one status message from the Docker stream"""
+        self.status = status
+        if status == 'Downloading' and detail:
+            self.current = detail.get('current', self.current)
+            self.total = detail.get('total', self.total) or self.total
+        elif status in {'Download complete', 'Pull complete'} and self.total:
+            self.current = self.total
+
+    def finished(self):
+        """Query whether this layer has stopped changing"""
+        return self.status in FINISHED_STATES
+
+
+class Stream:
+    """Everything that is known about one pull or build"""
+
+    def __init__(self, source):
+        self.source = source
+        self.layers = OrderedDict()
+        self.last_summary = 0.0
+
+    def current(self):
+        """Bytes downloaded so far across every layer"""
+        return sum(l.current for l in self.layers.values())
+
+    def total(self):
+        """Bytes that will be downloaded across every layer that reported a size"""
+        return sum(l.total for l in self.layers.values())
+
+    def summary(self):
+        """A one line description of where this stream is at"""
+        done = sum(1 for l in self.layers.values() if l.finished())
+        ret = '{}: {}/{} layers'.format(self.source, done, len(self.layers))
+        if self.total():
+            ret += ', {}/{}'.format(format_bytes(self.current()),
+                                    format_bytes(self.total()))
+        active = [l.status for l in self.layers.values() if not l.finished()]
+        if active:
+            ret += ' ({})'.format(active[-1].lower())
+        return ret
+
+
+class Progress:
+    """
+    Aggregates Docker's JSON status streams per layer id. See the module
+    docstring for how output is rendered.
+    """
+
+    def __init__(self, stream=None, tty=None, redraw_interval=0.1,
+                 summary_interval=10.0, clock=time.monotonic):
+        """
+        Keyword arguments:
+        stream           -- file to write to. Defaults to whatever sys.stdout
+                            is at the time of writing
+        tty              -- force the live view on or off. Defaults to
+                            checking if stream is a TTY
+        redraw_interval  -- minimum seconds between redraws of the live view
+        summary_interval -- seconds between summary lines when not on a TTY
+        clock            -- monotonic time source, replaceable for tests
+        """
+        self._stream = stream
+        self._tty = tty
+        self.redraw_interval = redraw_interval
+        self.summary_interval = summary_interval
+        self.clock = clock
+        self.streams = OrderedDict()
+        self.finished = {}
+        self.lock = threading.RLock()
+        self.drawn_lines = 0
+        self.last_redraw = 0.0
+
+    @property
+    def out(self):
+        """The file that output will be written to"""
+        return self._stream if self._stream is not None else sys.stdout
+
+    def is_tty(self):
+        """Query whether the live view is in use"""
+        if self._tty is not None:
+            return self._tty
+        try:
+            return self.out.isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def feed(self, source, line):
+        """
+        Take one decoded JSON message from a Docker stream. source names the
+        stream that the message came from.
+
+        Returns the message so callers can keep checking for errors.
+        """
+        module_logger.log(9, 'bytes: %s', line)
+        with self.lock:
+            stream = self.streams.get(source)
+            if stream is None:
+                stream = self.streams[source] = Stream(source)
+                stream.last_summary = self.clock()
+
+            if 'error' in line:
+                self._print('\x1b[31m{}\x1b[0m'.format(line['error'].strip())
+                            if self.is_tty() else line['error'].strip(), source)
+            elif 'id' in line and 'status' in line:
+                stream.layers.setdefault(line['id'], Layer()).update(
+                    line['status'],
+                    line.get('progressDetail'))
+            elif 'stream' in line:
+                text = line['stream'].rstrip()
+                if text:
+                    self._print(text, source)
+            elif 'status' in line:
+                self._print(line['status'].strip(), source)
+            elif len(line) == 1 and isinstance(list(line.values())[0], str):
+                self._print(list(line.values())[0].strip(), source)
+            self._refresh(stream)
+        return line
+
+    def close(self, source):
+        """The stream named source will not receive any more messages"""
+        with self.lock:
+            stream = self.streams.pop(source, None)
+            if stream is None:
+                return
+            self.finished[source] = stream.current()
+            if stream.layers:
+                self._print(stream.summary(), None)
+            elif self.is_tty():
+                self._redraw()
+
+    def bytes_pulled(self, source):
+        """Bytes downloaded by the stream named source, finished or not"""
+        with self.lock:
+            if source in self.streams:
+                return self.streams[source].current()
+            return self.finished.get(source, 0)
+
+    def _prefix(self, text, source):
+        if source is not None and len(self.streams) > 1:
+            return '{}| {}'.format(source, text)
+        return text
+
+    def _print(self, text, source):
+        """Print a line above the live view"""
+        if self.is_tty():
+            self._clear()
+            print(self._prefix(text, source), file=self.out)
+            self._draw()
+        else:
+            print(self._prefix(text, source), file=self.out)
+
+    def _refresh(self, stream):
+        now = self.clock()
+        if self.is_tty():
+            if now - self.last_redraw >= self.redraw_interval:
+                self._redraw()
+        elif stream.layers and now - stream.last_summary >= self.summary_interval:
+            stream.last_summary = now
+            print(stream.summary(), file=self.out)
+
+    def _clear(self):
+        if self.drawn_lines:
+            self.out.write('\x1b[{}F\x1b[J'.format(self.drawn_lines))
+            self.drawn_lines = 0
+
+    def _draw(self):
+        lines = [s.summary() for s in self.streams.values() if s.layers]
+        for line in lines:
+            print(line, file=self.out)
+        self.drawn_lines = len(lines)
+        self.last_redraw = self.clock()
+        self.out.flush()
+
+    def _redraw(self):
+        self._clear()
+        self._draw()
+
+
+# The one aggregator every pull and build in this run writes through
+progress = Progress()
@@ -8,11 +8,26 @@ import sys
 
 import requests
 
-from control.options import options
+from control.metrics import build_metrics
 
 module_logger = logging.getLogger('control.registry')
 module_logger.setLevel(logging.DEBUG)
 
+# Registries that have already been set up, so the TLS handshake, cert
+# discovery and login check are only paid once per process
+_registries = {}
+
+
+def get_registry(domain, port=None, no_verify=False, strict=False):
+    """
+    Return a Registry for domain and port, reusing one that was already
+    created in this process if the verification settings still match
+    """
+    key = (domain, port, no_verify)
+    if key not in _registries:
+        _registries[key] = Registry(domain, port, no_verify=no_verify, strict=strict)
+    return _registries[key]
+
 
 class Registry:
     """
@@ -21,7 +36,8 @@ class Registry:
     Insecure registries, V1 registries, and the Docker Hub are not supported.
     """
 
-    def __init__(self, domain, port=None, certdir='/etc/docker/certs.d'):
+    def __init__(self, domain, port=None, certdir='/etc/docker/certs.d', no_verify=False,
+                 strict=False):
         """
         Take a domain name and a string port number and create a Registry object.
 
@@ -34,6 +50,9 @@ class Registry:
         domain -- the base domain name to connect to. Do not include the
                   protocol to communicate over.
         port   -- a string argument that is the port to connect to (optional)
+        no_verify -- don't check the registry's certificate (optional)
+        strict -- exit if the registry can't be logged into, for when the
+                  run has to pull (optional)
         """
         self.log = logging.getLogger('control.registry.Registry')
         self.domain = domain
@@ -61,7 +80,7 @@ class Registry:
                     pass
                 except ValueError as e:
                     self.log.warning('Docker config file not valid JSON: %s', e)
-        if options.no_verify:
+        if no_verify:
             self.certfile = False
             self.use_cert = True
         elif os.path.isdir(certdir):
@@ -86,14 +105,14 @@ class Registry:
             r = self.get('https://{}/v0'.format(self.endpoint))
             if r.status_code == 401:
                 print('You are not logged into registry {}\nRun docker login'.format(self.endpoint))
-                if options.pull:
+                if strict:
                     sys.exit(3)
             elif r.status_code not in [200, 404]:
                 print('{} {}'.format(r.status_code, r.text))
-                if options.pull:
+                if strict:
                     sys.exit(3)
         except requests.exceptions.SSLError:
-            if not options.no_verify:
+            if not no_verify:
                 self.log.warning('Cannot verify that you are connecting to the registry you think you are')
         except requests.exceptions.ConnectionError as e:
             # TODO: pass through error
@@ -109,9 +128,10 @@ class Registry:
         actively discouraged.
         """
 
-        if self.use_cert:
-            return self.session.get(uri, verify=self.certfile)
-        return self.session.get(uri)
+        with build_metrics.registry(self.endpoint):
+            if self.use_cert:
+                return self.session.get(uri, verify=self.certfile)
+            return self.session.get(uri)
 
     def get_info_of_repo(self, repo):
         """Return the json object of the specific repo (image and tag)"""
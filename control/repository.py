@@ -11,10 +11,13 @@ class Repository:
     repo.port   --- the port the registry is hosted at
     repo.image  --- the name of the image, "ubuntu" as an example
     repo.tag    --- the specific tag referenced, "14.04" as an example
+    repo.digest --- the content digest the image is pinned to, or None
 
     These values are calculated as niceties
     repo.registry --- the full endpoint ready to be wrapped in 'https://{}/' calls
     repo.repo     --- the full name as specified in a FROM line
+    repo.reference --- what to pull and build FROM: repo, or the image at its
+                       digest when it is pinned
 
     Repository also exposes a Repository.match(str) method which can bes used
     without instantiation which will return a Repository object if you only
@@ -30,9 +33,10 @@ class Repository:
                          r'(?::(?P<port>\d{1,5}))?'
                          r'/)?'
                          r'(?P<image>[-_./\w]+)'
-                         r'(?::(?P<tag>[-_.\w]+))?')
+                         r'(?::(?P<tag>[-_.\w]+))?'
+                         r'(?:@(?P<digest>sha256:[0-9a-f]{64}))?')
 
-    def __init__(self, image, tag='latest', domain=None, port=None):
+    def __init__(self, image, tag='latest', domain=None, port=None, digest=None):
         """Builds a repository object.
 
         If you only have the combined string version (like from a FROM line of
@@ -44,12 +48,14 @@ class Repository:
         Repository('my-image', 'dev', 'docker.example.com')
         Repository('my-image', 'dev', 'docker.example.com', '5000')
         Repository('my-image', domain='docker.example.com', port='5002')
+        Repository('ubuntu', digest='sha256:...')
         """
 
         self.domain = domain
         self.port = port
         self.image = image
         self.tag = tag
+        self.digest = digest
         if domain and port:
             self.registry = '{}:{}'.format(self.domain, self.port)
         elif domain:
@@ -62,9 +68,22 @@ class Repository:
         else:
             self.repo = '{}:{}'.format(self.image, self.tag)
 
+        if digest:
+            self.reference = '{}@{}'.format(self.get_pull_image_name(), digest)
+        else:
+            self.reference = self.repo
+
     def __str__(self):
         return self.repo
 
+    def pin(self, digest):
+        """The same image and tag, pinned to digest"""
+        return Repository(self.image, self.tag, self.domain, self.port, digest)
+
+    def get_pull_tag(self):
+        """The tag to pull, which is the digest when the image is pinned"""
+        return self.digest or self.tag
+
     def get_pull_image_name(self):
         """
         This function exists because docker pull is the worst API endpoint.
@@ -83,10 +102,12 @@ class Repository:
         Repository.match('docker.example.com/my-image:dev')
         Repository.match('docker.example.com:5000/my-image:dev')
         Repository.match('docker.example.com/my-image')
+        Repository.match('my-image@sha256:...')
         """
 
         match = Repository.matcher.search(text)
         return Repository(domain=match.group('domain'),
                           port=match.group('port'),
                           image=match.group('image'),
-                          tag=match.group('tag') or 'latest')
+                          tag=match.group('tag') or 'latest',
+                          digest=match.group('digest'))
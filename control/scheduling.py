@@ -0,0 +1,153 @@
+"""
+Decide what order to build services in.
+
+Services have to wait for the services they are built FROM. Among the ones
+that are ready, the one at the head of the longest chain of remaining work
+goes first, so the long pole starts as early as it can. How long a service
+takes comes from the median of its recent runs in the build history, and
+services with no history are guessed to take as long as a typical service.
+"""
+
+import heapq
+import logging
+import sqlite3
+import statistics
+
+from control.dependencies import build_graph
+from control.history import History
+
+module_logger = logging.getLogger('control.scheduling')
+module_logger.setLevel(logging.DEBUG)
+
+# How long to guess a service takes when nothing has any history
+DEFAULT_SECONDS = 60.0
+# The phases that make up building one service
+BUILD_PHASES = ('prebuild', 'pull', 'build', 'postbuild')
+
+
+def remaining_paths(graph, names, weights):
+    """
+    For each of names, the seconds from starting it until the last service
+    built FROM it, directly or not, is done
+    """
+    names = set(names)
+    children = {name: set() for name in names}
+    for name in names:
+        for dep in graph.get(name, ()):
+            if dep in names and dep != name:
+                children[dep].add(name)
+    paths = {}
+    visiting = set()
+
+    def path(name):  # pylint: disable=missing-docstring
+        if name not in paths:
+            # A cycle is broken at the point it comes back around
+            visiting.add(name)
+            paths[name] = weights[name] + max(
+                (path(child) for child in children[name] if child not in visiting),
+                default=0.0)
+            visiting.discard(name)
+        return paths[name]
+    for name in sorted(names):
+        path(name)
+    return paths
+
+
+class Scheduler:
+    """
+    Hands out services that are ready to build, longest remaining path
+    first. take() and finish() can be called from several builders at once
+    as long as they take turns.
+    """
+
+    def __init__(self, graph, names, weights=None, default=DEFAULT_SECONDS):
+        self.names = set(names)
+        weights = weights or {}
+        self.weights = {name: weights.get(name, default) for name in self.names}
+        self.deps = {name: {dep for dep in graph.get(name, ())
+                            if dep in self.names and dep != name}
+                     for name in self.names}
+        self.priority = remaining_paths(graph, self.names, self.weights)
+        self.finished = set()
+        self.taken = set()
+        self.ready = []
+        for name in self.names:
+            if not self.deps[name]:
+                self._push(name)
+
+    def _push(self, name):
+        # Longest path first, ties go alphabetically like they always did
+        heapq.heappush(self.ready, (-self.priority[name], name))
+
+    @property
+    def pending(self):
+        """Whether any service has not been taken yet"""
+        return len(self.taken) < len(self.names)
+
+    def take(self):
+        """
+        The next service to build, or None if everything left is waiting
+        for a service that is still building
+        """
+        if not self.ready and self.pending and self.taken == self.finished:
+            # Nothing is building and nothing is ready: they are built FROM
+            # each other. Carry on with the most important one anyway
+            stuck = sorted(self.names - self.taken)
+            module_logger.warning('services are built FROM each other: %s',
+                                  ', '.join(stuck))
+            self._push(min(stuck, key=lambda n: (-self.priority[n], n)))
+        if not self.ready:
+            return None
+        _, name = heapq.heappop(self.ready)
+        self.taken.add(name)
+        return name
+
+    def finish(self, name):
+        """Mark name as built, which may make other services ready"""
+        self.finished.add(name)
+        for other in sorted(self.names - self.taken):
+            if self.deps[other] <= self.finished and \
+                    (-self.priority[other], other) not in self.ready:
+                self._push(other)
+
+    def order(self):
+        """Every service in the order one builder would build them"""
+        order = []
+        while self.pending:
+            name = self.take()
+            order.append(name)
+            self.finish(name)
+        return order
+
+
+def history_weights(project, path=None):
+    """
+    The median time each service in project has taken to build, and a
+    default for services without any history
+    """
+    weights = {}
+    try:
+        history = History(path)
+        try:
+            for phase in BUILD_PHASES:
+                for name, seconds in history.medians(project, phase).items():
+                    weights[name] = weights.get(name, 0.0) + seconds
+        finally:
+            history.close()
+    except (sqlite3.Error, OSError) as e:
+        module_logger.debug('no build history to schedule with: %s', e)
+    default = statistics.median(weights.values()) if weights else DEFAULT_SECONDS
+    return weights, default
+
+
+def build_scheduler(ctrl, names, env='dev', path=None):
+    """A Scheduler for building names, weighted by their build history"""
+    weights, default = history_weights(ctrl.location, path)
+    return Scheduler(build_graph(ctrl, env), names, weights, default)
+
+
+def build_schedule(ctrl, names, env='dev', path=None):
+    """The order to build names in, long poles first"""
+    order = build_scheduler(ctrl, names, env, path).order()
+    module_logger.debug('build order: %s', order)
+    return order
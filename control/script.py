@@ -0,0 +1,178 @@
+"""
+Write out what a command would do as a shell script instead of doing it.
+
+The script pulls the base images first, then builds services in waves, where
+nothing in a wave is built FROM anything else in it, and then starts the
+containers. Steps in a wave run in the background, up to $PARALLEL at a time,
+and a wave waits for all of its steps before the next one begins. Nothing in
+the script depends on the time or on what docker has, so it only changes when
+the Controlfile or Dockerfiles do.
+"""
+
+import logging
+import os
+
+from control.cli_builder import builder
+from control.context import defaults
+from control.dependencies import build_graph, build_waves, upstream_of
+from control.repository import Repository
+from control.service import Buildable, Startable
+
+module_logger = logging.getLogger('control.script')
+module_logger.setLevel(logging.DEBUG)
+
+# The commands there is a script for, and the parts of the script they get
+SCRIPT_COMMANDS = {
+    'build': ('build',),
+    'build-prod': ('build', 'images'),
+    'start': ('remove', 'run'),
+    'restart': ('remove', 'run'),
+    'stop': ('remove',),
+    'default': ('build', 'remove', 'run'),
+    'rere': ('build', 'remove', 'run'),
+}
+
+DEFAULT_PARALLEL = 4
+
+HEADER = """#!/bin/sh
+# control {command}, for {count} services. Written by control {version}
+#
+# Steps in the same wave run at once, up to $PARALLEL at a time.
+set -e
+PARALLEL=${{PARALLEL:-{parallel}}}
+pids=''
+
+# Run a step in the background, first waiting for the oldest step if
+# $PARALLEL of them are already running
+step() {{
+    "$@" &
+    pids="$pids $!"
+    set -- $pids
+    if [ "$#" -ge "$PARALLEL" ]; then
+        wait "$1" || exit 1
+        shift
+        pids="$*"
+    fi
+}}
+
+# Wait for every step in the wave, stopping if one of them failed
+end_wave() {{
+    for pid in $pids; do
+        wait "$pid" || exit 1
+    done
+    pids=''
+}}
+"""
+
+
+def _wave(lines, title, commands):
+    lines.append('')
+    lines.append('# ' + title)
+    lines.extend('step ' + command for command in commands)
+    lines.append('end_wave')
+
+
+def _build_lines(ctrl, names, env, pulling, args):
+    """The pulls and builds for the named services, in waves"""
+    built = [name for name in names
+             if isinstance(ctrl.services[name], Buildable) and
+             ctrl.services[name]['dockerfile'][env]]
+    images = {Repository.match(ctrl.services[name].image).repo for name in built}
+    pulls = set()
+    for name in built:
+        upstream = upstream_of(ctrl.services[name], env)
+        if upstream and upstream.repo not in images and pulling(upstream):
+            pulls.add(upstream.repo)
+    # Services with nothing to build still want their image
+    for name in names:
+        service = ctrl.services[name]
+        if name not in built and isinstance(service, Startable):
+            upstream = Repository.match(service.image)
+            if pulling(upstream):
+                pulls.add(upstream.repo)
+
+    lines = []
+    if pulls:
+        lines += ['', '# Pull base images',
+                  'xargs -n 1 -P "$PARALLEL" docker pull <<\'IMAGES\'']
+        lines += sorted(pulls)
+        lines.append('IMAGES')
+    waves = build_waves(build_graph(ctrl, env), built)
+    for number, wave in enumerate(waves, 1):
+        _wave(lines, 'Build wave {} of {}: {}'.format(number, len(waves), ', '.join(wave)),
+              (_build_command(ctrl.services[name], env, args) for name in wave))
+    return lines
+
+
+def _build_command(service, env, args):
+    # Build from the Dockerfile's directory, which is the context control
+    # itself sends to docker. Base images were pulled at the top
+    return service.dump_build(prod=env == 'prod', pretty=False, args=args) \
+        .path(os.path.dirname(service['dockerfile'][env])) \
+        .pull(False) \
+        .shell()
+
+
+def _startable(ctrl, names):
+    return sorted(ctrl.services[name] for name in names
+                  if isinstance(ctrl.services[name], Startable))
+
+
+def _remove_lines(ctrl, names, force):
+    """Stop and remove the containers, whether or not they exist"""
+    containers = [service['name'] for service in _startable(ctrl, names)]
+    if not containers:
+        return []
+    lines = ['', '# Stop and remove the containers']
+    if not force:
+        lines.append(_container_command('stop', containers, force) + ' || true')
+    lines.append(_container_command('rm', containers, force) + ' || true')
+    return lines
+
+
+def _container_command(command, containers, force):
+    rep = builder(command, pretty=False).container(containers)
+    if command == 'rm':
+        rep = rep.force(force)
+    return rep.shell()
+
+
+def _run_lines(ctrl, names, prod):
+    lines = []
+    services = _startable(ctrl, names)
+    if services:
+        _wave(lines, 'Start the containers',
+              (service.dump_run(prod=prod, pretty=False).shell()
+               for service in services))
+    return lines
+
+
+def _images_lines(ctrl, names):
+    lines = ['', '# The images to push', "cat > IMAGES.txt <<'IMAGES'"]
+    lines += [ctrl.services[name]['image'] for name in names]
+    lines.append('IMAGES')
+    return lines
+
+
+def render_script(ctrl, names, command, pulling, version='', parallel=DEFAULT_PARALLEL,
+                  args=None):
+    """
+    The shell script for running command on the named services. pulling
+    decides whether a base image should be pulled, like functions.pulling,
+    and args is the run's context, for --force, --prod and the build options
+    """
+    args = args or defaults()
+    parts = SCRIPT_COMMANDS[command]
+    lines = [HEADER.format(command=command, count=len(names), version=version,
+                           parallel=parallel).rstrip('\n')]
+    env = 'prod' if command == 'build-prod' else 'dev'
+    for part in parts:
+        if part == 'build':
+            lines += _build_lines(ctrl, names, env, pulling, args)
+        elif part == 'remove':
+            lines += _remove_lines(ctrl, names, args.force)
+        elif part == 'run':
+            lines += _run_lines(ctrl, names, args.prod)
+        elif part == 'images':
+            lines += _images_lines(ctrl, names)
+    return '\n'.join(lines) + '\n'
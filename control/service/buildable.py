@@ -6,8 +6,8 @@ import logging
 from os.path import abspath, dirname, isfile, join
 
 from control.cli_builder import builder
+from control.context import defaults
 from control.repository import Repository
-from control.options import options
 from control.service.service import ImageService
 
 
@@ -109,16 +109,20 @@ class Buildable(ImageService):
 
         self.logger.debug('Found Buildable %s', self.service)
 
-    def dump_build(self, prod=False, pretty=True):
-        """dump out a CLI version of how this image would be built"""
+    def dump_build(self, prod=False, pretty=True, args=None):
+        """
+        dump out a CLI version of how this image would be built, with the
+        pull, rm and cache options of args, the run's context
+        """
+        args = args or defaults()
         rep = builder('build', pretty=pretty) \
             .tag(self.image) \
             .path(dirname(self.controlfile)) \
             .file(self.dockerfile['prod'] if prod else self.dockerfile['dev']) \
-            .pull(options.pull) \
-            .rm(options.no_rm) \
-            .force_rm(options.force) \
-            .no_cache(not options.cache)
+            .pull(args.pull) \
+            .rm(args.no_rm) \
+            .force_rm(args.force) \
+            .no_cache(not args.cache)
         return rep
 
     def buildable(self):
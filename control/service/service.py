@@ -1,5 +1,6 @@
 """Define a base class for a Service"""
 
+import copy
 import logging
 
 from control.exceptions import InvalidControlfile
@@ -55,6 +56,19 @@ class Service:
         """
         return list(self.service_options)
 
+    def copy(self, **changes):
+        """
+        A copy of the service with changes made to it. The copy gets its own
+        dicts and lists, so the changes don't reach this service
+        """
+        service = copy.copy(self)
+        for key, value in vars(self).items():
+            if isinstance(value, (dict, list)):
+                service.__dict__[key] = copy.copy(value)
+        for key, value in changes.items():
+            service[key] = value
+        return service
+
     def __len__(self):
         return 0
 
@@ -97,6 +97,31 @@ class Startable(ImageService):
         abbreviations.keys()
     )
 
+    # The RunBuilder setter that dumps each container and host_config option
+    dump_container_args = {
+        'command': 'command',
+        'cpu_shares': 'cpu_shares',
+        'detach': 'detach',
+        'entrypoint': 'entrypoint',
+        'environment': 'env',
+        'hostname': 'hostname',
+        'name': 'name',
+        'ports': 'publish',
+        'stdin_open': 'interactive',
+        'tty': 'tty',
+        'user': 'user',
+        'working_dir': 'workdir',
+    }
+    dump_host_config_args = {
+        'devices': 'device',
+        'dns': 'dns',
+        'dns_search': 'dns_search',
+        'extra_hosts': 'add_host',
+        'ipc_mode': 'ipc',
+        'links': 'link',
+        'volumes_from': 'volumes_from',
+    }
+
     defaults = {
         "dns": [],
         "dns_search": [],
@@ -196,30 +221,9 @@ class Startable(ImageService):
         if self.env_file:
             rep = rep.env_file(self.env_file)
         for k, v in self.container.items():
-            rep = {
-                'command': rep.command,
-                'cpu_shares': rep.cpu_shares,
-                'detach': rep.detach,
-                'entrypoint': rep.entrypoint,
-                'environment': rep.env,
-                'hostname': rep.hostname,
-                'name': rep.name,
-                'ports': rep.publish,
-                'stdin_open': rep.interactive,
-                'tty': rep.tty,
-                'user': rep.user,
-                'working_dir': rep.workdir,
-            }[k](v)
+            rep = getattr(rep, self.dump_container_args[k])(v)
         for k, v in self.host_config.items():
-            rep = {
-                'devices': rep.device,
-                'dns': rep.dns,
-                'dns_search': rep.dns_search,
-                'extra_hosts': rep.add_host,
-                'ipc_mode': rep.ipc,
-                'links': rep.link,
-                'volumes_from': rep.volumes_from,
-            }[k](v)
+            rep = getattr(rep, self.dump_host_config_args[k])(v)
         return rep.detach()
 
     def find_volume(self, substr):
@@ -239,10 +243,17 @@ class Startable(ImageService):
         else:
             return self.volumes['shared'] + self.volumes['dev']
 
-    def prepare_container_options(self, prod):
+    def named_volumes(self, prod):
+        """The names of the named volumes the container mounts"""
+        return sorted({source for source, _, rest in (
+            x.partition(':') for x in self.volumes_for(prod))
+                       if rest and not source.startswith(('/', '.', '~', '$'))})
+
+    def prepare_container_options(self, prod, client=None, labels=None):
         """
         Call this function to dump out a single dict ready to be passed to
-        docker.Client.create_container
+        docker.Client.create_container, or client's create_container. labels
+        go on top of the labels from the Controlfile
         """
         # FOR WHEN YOU CAN UPGRADE TO 3.5
         # hc = dclient.create_host_config(**self.host_config)
@@ -252,9 +263,14 @@ class Startable(ImageService):
             self.volumes_for(prod))
         self.logger.debug('container: %s', self.container)
         self.logger.debug('host_config: %s', self.host_config)
-        hc = dclient.create_host_config(**self.host_config)
+        hc = (client or dclient).create_host_config(**self.host_config)
         r = self.container.copy()
         r['host_config'] = hc
+        if labels:
+            own = r.get('labels') or {}
+            if isinstance(own, list):
+                own = {x: '' for x in own}
+            r['labels'] = dict(own, **labels)
         if self.env_file and isfile(self.env_file):
             # Apply env vars in this order so that envs defined in
             # the Controlfile take precedence over the envfile
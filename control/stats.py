@@ -0,0 +1,151 @@
+"""
+`control stats`: the CPU, memory, network and block I/O of the services'
+containers, added up per service and per metaservice.
+
+Every container's stats stream is read at once on one event loop, and each
+keeps only its latest sample. Every interval the latest samples are added
+up for each service, and for each metaservice of the Controlfile, like
+required, optional or the ones the Controlfile defines, over the services
+in it that were asked about.
+"""
+
+import asyncio
+import json
+import logging
+
+import docker
+
+from control.progress import format_bytes
+from control.service import MetaService
+
+module_logger = logging.getLogger('control.stats')
+module_logger.setLevel(logging.DEBUG)
+
+INTERVAL = 2.0
+COLUMNS = ('NAME', 'CPU %', 'MEM', 'MEM LIMIT', 'NET RX', 'NET TX', 'BLOCK READ', 'BLOCK WRITE')
+
+
+class Usage:
+    """Resources used by one container, or added up over many"""
+
+    fields = ('cpu', 'memory', 'memory_limit', 'rx', 'tx', 'read', 'write', 'containers')
+
+    def __init__(self, **values):
+        for field in self.fields:
+            setattr(self, field, values.get(field, 0))
+
+    @classmethod
+    def from_sample(cls, sample):
+        """The usage in one of docker's stats samples"""
+        cpu = sample.get('cpu_stats') or {}
+        precpu = sample.get('precpu_stats') or {}
+        cpu_delta = (cpu.get('cpu_usage', {}).get('total_usage', 0) -
+                     precpu.get('cpu_usage', {}).get('total_usage', 0))
+        system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+        cpus = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or
+                                             []) or 1
+        memory = sample.get('memory_stats') or {}
+        networks = (sample.get('networks') or {}).values()
+        blkio = (sample.get('blkio_stats') or {}).get('io_service_bytes_recursive') or []
+        return cls(
+            cpu=cpu_delta / system_delta * cpus * 100.0 if system_delta > 0 and
+            cpu_delta > 0 else 0.0,
+            memory=memory.get('usage', 0),
+            memory_limit=memory.get('limit', 0),
+            rx=sum(network.get('rx_bytes', 0) for network in networks),
+            tx=sum(network.get('tx_bytes', 0) for network in networks),
+            read=sum(entry['value'] for entry in blkio if entry.get('op') == 'Read'),
+            write=sum(entry['value'] for entry in blkio if entry.get('op') == 'Write'),
+            containers=1)
+
+    def __add__(self, other):
+        return Usage(**{field: getattr(self, field) + getattr(other, field)
+                        for field in self.fields})
+
+    def as_dict(self):
+        """The usage as plain values"""
+        found = {field: getattr(self, field) for field in self.fields}
+        found['cpu'] = round(self.cpu, 2)
+        return found
+
+    def row(self, name):
+        """A line of the table"""
+        return (name, '{:.2f}'.format(self.cpu), format_bytes(self.memory),
+                format_bytes(self.memory_limit), format_bytes(self.rx), format_bytes(self.tx),
+                format_bytes(self.read), format_bytes(self.write))
+
+
+def groups(ctrl, names):
+    """metaservice: the services of names in it, for the Controlfile's metaservices"""
+    found = {}
+    for name, service in sorted(ctrl.services.items()):
+        if isinstance(service, MetaService):
+            members = [member for member in service.services if member in names]
+            if members:
+                found[name] = members
+    return found
+
+
+def aggregate(latest, grouped):
+    """
+    The usage of each service with a sample in latest, and of each
+    metaservice in grouped added up over its services
+    """
+    services = dict(latest)
+    metaservices = {}
+    for name, members in grouped.items():
+        usages = [latest[member] for member in members if member in latest]
+        if usages:
+            metaservices[name] = sum(usages[1:], usages[0])
+    return services, metaservices
+
+
+async def read_stats(client, service, name, latest):
+    """Keep the latest sample of the container called name in latest, until it stops"""
+    try:
+        async for sample in client.stats(name):
+            latest[service] = Usage.from_sample(sample)
+    except docker.errors.NotFound:
+        module_logger.debug('%s has no container %s', service, name)
+    latest.pop(service, None)
+
+
+async def watch_stats(client, ctrl, names, emit, interval=INTERVAL, count=None):
+    """
+    Read the stats of the containers, by service: container name, and hand
+    emit the per service and per metaservice usage every interval, count
+    times or until the containers have all stopped
+    """
+    latest = {}
+    grouped = groups(ctrl, names)
+    readers = [asyncio.ensure_future(read_stats(client, service, name, latest))
+               for service, name in names.items()]
+    try:
+        emitted = 0
+        while count is None or emitted < count:
+            await asyncio.sleep(interval)
+            if all(reader.done() for reader in readers):
+                break
+            emit(*aggregate(latest, grouped))
+            emitted += 1
+    finally:
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+
+def render(services, metaservices):
+    """The usage as a table, services first, then metaservices"""
+    rows = [COLUMNS] + [services[name].row(name) for name in sorted(services)]
+    rows += [metaservices[name].row('[{}]'.format(name)) for name in sorted(metaservices)]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in rows)
+
+
+def as_json(services, metaservices):
+    """The usage as one line of JSON"""
+    return json.dumps({
+        'services': {name: usage.as_dict() for name, usage in services.items()},
+        'metaservices': {name: usage.as_dict() for name, usage in metaservices.items()},
+    }, sort_keys=True)
@@ -0,0 +1,138 @@
+"""
+What `control status` shows for each service: whether its container is
+running and for how long, whether it runs the image the last build made,
+and whether the Controlfile has changed the container's configuration
+since it was made.
+
+Everything comes from one list call for containers and one for images, so
+200 services take as long as 2. --check-registry also asks the registries
+of the services' images for their digests, all at once, to show the images
+a registry has something newer for.
+"""
+
+import asyncio
+import logging
+import time
+
+from control import labels
+from control.lockfile import resolve
+from control.repository import Repository
+
+module_logger = logging.getLogger('control.status')
+module_logger.setLevel(logging.DEBUG)
+
+COLUMNS = ('SERVICE', 'CONTAINER', 'STATE', 'UPTIME', 'IMAGE', 'CONFIG')
+
+
+class ServiceStatus:
+    """
+    The state of one service's container. stale, behind and drifted are
+    None when there is nothing to tell them by
+    """
+
+    def __init__(self, service, container, state='missing', uptime=None, stale=None,
+                 behind=None, drifted=None):
+        self.service = service
+        self.container = container
+        self.state = state
+        self.uptime = uptime
+        self.stale = stale
+        self.behind = behind
+        self.drifted = drifted
+
+    def image(self):
+        """How the container's image compares with the built and registry ones"""
+        if self.stale:
+            return 'stale'
+        if self.behind:
+            return 'behind registry'
+        if self.stale is None:
+            return '-'
+        return 'current'
+
+    def config(self):
+        """Whether the container was made from the Controlfile as it is now"""
+        if self.drifted is None:
+            return '-'
+        return 'drifted' if self.drifted else 'ok'
+
+
+def format_uptime(seconds):
+    """Seconds as the largest two units, like 3h12m"""
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    units = (('d', 86400), ('h', 3600), ('m', 60), ('s', 1))
+    largest = next(i for i, (_, size) in enumerate(units) if seconds >= size or size == 1)
+    parts = []
+    for unit, size in units[largest:largest + 2]:
+        parts.append('{}{}'.format(seconds // size, unit))
+        seconds %= size
+    return ''.join(parts)
+
+
+def _digests(image):
+    return {reference.partition('@')[2] for reference in image.get('RepoDigests') or []}
+
+
+def service_status(service, containers, images, prod=False, remote=None, now=None):
+    """
+    The status of service, from containers by name and images by tag as the
+    list calls return them, and the digests remote found in registries
+    """
+    now = time.time() if now is None else now
+    name = service['name']
+    container = containers.get(name)
+    if container is None:
+        return ServiceStatus(service.service, name)
+    repo = Repository.match(service.image).repo
+    image = images.get(repo)
+    # Daemons older than API 1.23 only say Up or Exited in the Status
+    state = container.get('State') or (
+        'running' if container.get('Status', '').startswith('Up') else 'exited')
+    found = ServiceStatus(service.service, name, state)
+    if state == 'running':
+        # Control starts containers as it creates them
+        found.uptime = max(0, now - container['Created'])
+    if image is not None:
+        found.stale = container.get('ImageID') != image['Id']
+        if remote and repo in remote:
+            found.behind = remote[repo] not in _digests(image)
+    config = (container.get('Labels') or {}).get(labels.CONFIG)
+    if config:
+        found.drifted = config != labels.config_hash(service, prod)
+    return found
+
+
+async def gather_status(client, services, prod=False, check_registry=False,
+                        no_verify=False):
+    """The status of every service, in the order given"""
+    containers, images = await asyncio.gather(client.containers(all=True), client.images())
+    by_name = {}
+    for container in containers:
+        for name in container.get('Names') or []:
+            by_name.setdefault(name.lstrip('/'), container)
+    by_tag = {}
+    for image in images:
+        for tag in image.get('RepoTags') or []:
+            by_tag[tag] = image
+    remote = None
+    if check_registry:
+        upstreams = {}
+        for service in services:
+            repository = Repository.match(service.image)
+            if repository.registry and repository.repo in by_tag:
+                upstreams[repository.repo] = repository
+        remote = await resolve(upstreams.values(), client, no_verify)
+    now = time.time()
+    return [service_status(service, by_name, by_tag, prod, remote, now) for service in services]
+
+
+def render(statuses):
+    """The statuses as a table"""
+    rows = [COLUMNS] + [
+        (s.service, s.container, s.state, format_uptime(s.uptime), s.image(), s.config())
+        for s in statuses]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in rows)
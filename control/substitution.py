@@ -135,6 +135,95 @@ operations = {
 }
 
 
+# The kind of the most common types, so the hot paths can skip isinstance
+_KIND_OF_TYPE = {
+    str: Kind.singular,
+    int: Kind.singular,
+    bool: Kind.singular,
+    list: Kind.list,
+    dict: Kind.dict,
+    type(None): Kind.none,
+}
+
+
+def _kind(value):
+    return _KIND_OF_TYPE.get(type(value)) or _determine_kind(value)
+
+
+def _replace_with(val):
+    return (lambda x, y: y) if val else (lambda x, y: x)
+
+
+class CompiledOptions:
+    """
+    A metaservice's options, flattened into a plan of (key, steps) that can be
+    applied to each of its services without working out which operation to
+    use for every value again.
+
+    Each step is (op, val, table, missing). table maps the kind of the
+    service's current value to the operation to run, and missing gives the
+    value to use when the service doesn't have one yet. A kind that isn't in
+    the table raises KeyError, which is treated the same as a missing value,
+    just like normalize_service always has.
+    """
+
+    def __init__(self, opers):
+        self.options = opers
+        self.plan = []
+        for key, ops in opers.items():
+            steps = []
+            for op, val in ops.items():
+                # We check that the Controlfile only specifies operations we
+                # support, that way we aren't trusting a random user to
+                # accidentally get a random string eval'd.
+                if op not in operations:
+                    continue
+                if op == 'replace':
+                    table = dict.fromkeys(Kind, _replace_with(val))
+                else:
+                    kind = _determine_kind(val)
+                    table = {k: operations[(k, kind, op)] for k in Kind
+                             if (k, kind, op) in operations}
+                steps.append((op, val, table, self._missing(op, val)))
+            if steps:
+                self.plan.append((key, steps))
+
+    @staticmethod
+    def _missing(op, val):
+        return lambda: operations[op](_get_default_of_kind(val), val)
+
+    def merge(self, inner):
+        """The plan for a metaservice nested inside this one"""
+        return CompiledOptions(satisfy_nested_options(outer=self.options, inner=inner))
+
+    def apply(self, service):
+        """Apply the transforms to a service, in place"""
+        logging_steps = module_logger.isEnabledFor(11)
+        for key, steps in self.plan:
+            if key not in service.all_options:
+                continue
+            for op, val, table, missing in steps:
+                if logging_steps:
+                    module_logger.log(11, "service '%s' %sing %s with '%s'.",
+                                      service.service, op, key, val)
+                try:
+                    current = service[key]
+                    replacement = table[_kind(current)](current, val)
+                except KeyError:
+                    module_logger.log(11, "service '%s' missing key '%s'",
+                                      service.service, key)
+                    replacement = missing()
+                service[key] = replacement
+        return service
+
+
+def compile_options(opers):
+    """Compile a Controlfile options segment, unless it already is"""
+    if isinstance(opers, CompiledOptions):
+        return opers
+    return CompiledOptions(opers)
+
+
 def normalize_service(service, opers, variables):
     """
     Takes a service, and options and applies the transforms to the service.
@@ -143,30 +232,13 @@ def normalize_service(service, opers, variables):
     - service: must be service object that was created before hand
     - options: a dict of options that define transforms to a service.
       The format must conform to a Controlfile metaservice options
-      definition
+      definition. It can also be CompiledOptions, so a metaservice's options
+      are only compiled once for all of its services
     Returns: a service with all the transforms applied and all the variables
              substituted in.
     """
-    # We check that the Controlfile only specifies operations we support,
-    # that way we aren't trusting a random user to accidentally get a
-    # random string eval'd.
-    for key, op, val in (
-            (key, op, val)
-            for key, ops in opers.items()
-            for op, val in ops.items() if (op in operations and
-                                           key in service.all_options)):
-        module_logger.log(11, "service '%s' %sing %s with '%s'.",
-                          service.service, op, key, val)
-        try:
-            replacement = operations[op](service[key], val)
-        except KeyError as e:
-            module_logger.debug(e)
-            module_logger.log(11, "service '%s' missing key '%s'",
-                              service.service, key)
-            module_logger.log(11, service.__dict__)
-            replacement = operations[op](_get_default_of_kind(val), val)
-        finally:
-            service[key] = replacement
+    compile_options(opers).apply(service)
+    variables = _Variables(variables)
     for key in service.keys():
         try:
             module_logger.debug('now at %s, passing in %i vars', key, len(variables))
@@ -176,36 +248,34 @@ def normalize_service(service, opers, variables):
     return service['service'], service
 
 
+class _Variables(dict):
+    """
+    The variables to format into strings. Every string that asks for RANDOM
+    gets a new random number, used everywhere in that string, even if a
+    variable by that name was handed in.
+    """
+
+    def __init__(self, variables):
+        super().__init__(variables)
+        self.pop('RANDOM', None)
+
+    def format(self, string):
+        """Format the variables into string"""
+        if 'RANDOM' not in string:
+            return string.format_map(self)
+        return string.format_map(dict(self, RANDOM=str(randint(0, 10000))))
+
+
 # used exclusively by visit_every_leaf, but defined outside it so it's only compiled once
 substitute_vars_decision_dict = {
     # dict, list, str
     (True, False, False): lambda d, vd: {k: _substitute_vars(v, vd) for k, v in d.items()},
-    (False, True, False): lambda d, vd: [x.format(**_merge_dicts(
-        vd,
-        {'RANDOM': str(randint(0, 10000))}
-    )) for x in d],
-    (False, False, True): lambda d, vd: d.format(**_merge_dicts(
-        vd,
-        {'RANDOM': str(randint(0, 10000))}
-    )),
+    (False, True, False): lambda d, vd: [vd.format(x) for x in d],
+    (False, False, True): lambda d, vd: vd.format(d),
     (False, False, False): lambda d, vd: d
 }
 
 
-def _merge_dicts(*args):
-    """
-    Before python 3.5 you can't do foo(**dict_one, **dict_two)
-    so, this function exists.
-    """
-    if len(args) < 1:
-        return {}
-
-    ret = args[0].copy()
-    for d in args[1:]:
-        ret.update(d)
-    return ret
-
-
 def _substitute_vars(d, var_dict):  # pylint: disable=invalid-name
     """
     Visit every leaf and substitute any variables that are found. This function
@@ -216,10 +286,12 @@ def _substitute_vars(d, var_dict):  # pylint: disable=invalid-name
     Arguments:
     - d does not necessarily need to be a dict
     - var_dict should be a dictionary of variables that can be kwargs'd into
-      format
+      format. Passing in _Variables saves copying it for every leaf
     """
+    if not isinstance(var_dict, _Variables):
+        var_dict = _Variables(var_dict)
     # DEBUGGING
-    module_logger.debug('now at %s', str(d))
+    module_logger.debug('now at %s', d)
     # DEBUGGING
     return substitute_vars_decision_dict[(
         isinstance(d, dict),
@@ -228,6 +300,28 @@ def _substitute_vars(d, var_dict):  # pylint: disable=invalid-name
     )](d, var_dict)
 
 
+def _merge_op(op, inner_ops, outer_ops):
+    """
+    Join one operation of two nested options segments. A side that doesn't
+    have the operation starts from an empty value of the most generic kind
+    """
+    x = inner_ops.get(op)
+    y = outer_ops.get(op)
+    x_kind = _kind(x)
+    y_kind = _kind(y)
+    kind = x_kind if x_kind.value >= y_kind.value else y_kind
+    default = DEFAULT_KIND_MAPPING[kind]
+    if op not in inner_ops:
+        x, x_kind = default(), kind
+    if op not in outer_ops:
+        y, y_kind = default(), kind
+    if op == 'replace':
+        return y if y else x
+    if op not in operations:
+        raise KeyError(op)
+    return operations[(x_kind, y_kind, op)](x, y)
+
+
 def satisfy_nested_options(outer, inner):
     """
     Merge two Controlfile options segments for nested Controlfiles.
@@ -236,13 +330,13 @@ def satisfy_nested_options(outer, inner):
     - Merges option additions with layer_one.push(layer_two)
     """
     merged = {}
+    empty = {}
     for key in outer.keys() | inner.keys():
+        inner_ops = inner.get(key, empty)
+        outer_ops = outer.get(key, empty)
         val = {}
-        for op in outer.get(key, {}).keys() | inner.get(key, {}).keys():
-            default_value = _pick_most_generic(inner.get(key, {}).get(op, None),
-                                               outer.get(key, {}).get(op, None))
-            joined = operations[op](inner.get(key, {}).get(op, default_value),
-                                    outer.get(key, {}).get(op, default_value))
+        for op in outer_ops.keys() | inner_ops.keys():
+            joined = _merge_op(op, inner_ops, outer_ops)
             if joined:
                 val[op] = joined
         merged[key] = val
@@ -0,0 +1,335 @@
+"""Test the asyncio clients against the fake docker daemon and registry"""
+
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import os
+from os.path import join
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import docker
+
+from control import aio
+from control.aio.http import DEFAULT_LIMIT
+from control.container import create_error
+from control.context import RunContext
+from control.controlfile import Controlfile
+from control.exceptions import ContainerAlreadyExists, ImageNotFound
+from control.fakes import CertDir, FakeDocker, FakeRegistry
+from control.functions import async_start, async_stop, registry_dates, run_event
+from control.repository import Repository
+
+
+class AioTest(unittest.TestCase):
+    """Runs coroutines on this thread's loop, and closes it afterwards"""
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+
+    @staticmethod
+    def run_coro(coro):
+        """Shorthand for aio.run"""
+        return aio.run(coro)
+
+
+class TestDocker(AioTest):
+    """AsyncDocker against a fake daemon with busybox already pulled"""
+
+    def setUp(self):
+        super().setUp()
+        self.fake = FakeDocker(images=['busybox:latest'], remote=['postgres:9.5']).start()
+        self.addCleanup(self.fake.stop)
+        self.client = aio.AsyncDocker(self.fake.url)
+        self.addCleanup(self.client.close)
+
+    def test_keep_alive(self):
+        """Requests share connections, up to the limit at once"""
+        self.run_coro(self.client.info())
+        self.assertEqual(self.run_coro(self.client.info())['NCPU'], 4)
+        self.assertEqual(len(self.client.http.idle), 1)
+
+        async def many():  # pylint: disable=missing-docstring
+            return await asyncio.gather(*(self.client.info() for _ in range(40)))
+        self.assertEqual(len(self.run_coro(many())), 40)
+        self.assertLessEqual(len(self.client.http.idle), DEFAULT_LIMIT)
+        self.assertEqual(self.fake.requests['system.info'], 42)
+
+    def test_dropped_connection(self):
+        """A kept-alive connection the other end dropped is replaced"""
+        self.run_coro(self.client.info())
+        self.client.http.idle[0].writer.transport.abort()
+        self.assertEqual(self.run_coro(self.client.info())['NCPU'], 4)
+
+    def test_lifecycle(self):
+        """Containers are created, started, stopped and removed"""
+        host_config = self.client.create_host_config(
+            binds={'cache': {'bind': '/cache', 'mode': 'rw'}})
+        created = self.run_coro(self.client.create_container(
+            'busybox', command='true', name='web', volumes=['/cache', '/data'],
+            host_config=host_config))
+        self.run_coro(self.client.start(created))
+        self.assertTrue(self.run_coro(self.client.inspect_container('web'))['State']['Running'])
+        self.run_coro(self.client.stop(created['Id'], timeout=1))
+        self.assertFalse(self.fake.container('web')['State']['Running'])
+        self.run_coro(self.client.remove_container('web', v=True))
+        self.assertEqual(list(self.fake.volumes), ['cache'])
+        self.run_coro(self.client.remove_volume('cache'))
+        self.assertEqual(self.fake.volumes, {})
+
+    def test_errors(self):
+        """Errors are docker-py's, with what the daemon said"""
+        with self.assertRaises(docker.errors.NotFound) as caught:
+            self.run_coro(self.client.inspect_container('nope'))
+        self.assertEqual(caught.exception.explanation, b'No such container: nope')
+        self.assertIn('404', str(caught.exception))
+        self.run_coro(self.client.create_container('busybox', name='web'))
+        with self.assertRaises(docker.errors.APIError) as caught:
+            self.run_coro(self.client.create_container('busybox', name='web'))
+        self.assertIsInstance(create_error(caught.exception, 'busybox'), ContainerAlreadyExists)
+        with self.assertRaises(docker.errors.NotFound) as caught:
+            self.run_coro(self.client.create_container('missing', name='other'))
+        self.assertIsInstance(create_error(caught.exception, 'missing'), ImageNotFound)
+
+    def test_pull(self):
+        """Pull progress streams in as it comes"""
+        async def pull(image):  # pylint: disable=missing-docstring
+            return [line async for line in self.client.pull(image, tag='9.5')]
+        lines = self.run_coro(pull('postgres'))
+        self.assertEqual(lines[-1], {'status': 'Status: Downloaded newer image for '
+                                               'postgres:9.5'})
+        self.assertTrue(self.fake.image('postgres:9.5'))
+        self.assertIn('error', self.run_coro(pull('mysql'))[-1])
+        # The connection went back for the next request
+        self.assertEqual(len(self.client.http.idle), 1)
+
+
+class TestCommands(AioTest):
+    """start and stop as coroutines, with a database the api links to"""
+
+    def setUp(self):
+        super().setUp()
+        self.fake = FakeDocker(images=['busybox:latest'], remote=['postgres:9.5']).start()
+        self.addCleanup(self.fake.stop)
+        self.client = aio.AsyncDocker(self.fake.url)
+        self.addCleanup(self.client.close)
+        with tempfile.TemporaryDirectory() as directory:
+            controlfile = join(directory, 'Controlfile')
+            with open(controlfile, 'w') as f:
+                json.dump({'services': {
+                    'db': {'image': 'postgres:9.5', 'container': {}},
+                    'api': {'image': 'busybox', 'container': {
+                        'links': {'db': 'db'}, 'volumes': ['/data']}},
+                }}, f)
+            self.ctrl = Controlfile(controlfile)
+        self.args = RunContext.parse(['start', 'api', 'db'])
+
+    def command(self, coro):
+        """Run a command, keeping what it prints"""
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            result = self.run_coro(coro)
+        return result, out.getvalue()
+
+    def actions(self, action):
+        """The names of the containers that went through action, in order"""
+        return [event['Actor']['Attributes']['name'] for event in self.fake.event_log
+                if event['Type'] == 'container' and event['Action'] == action]
+
+    def test_start(self):
+        """The missing image is pulled, and the database starts before the api"""
+        ok, out = self.command(async_start(self.args, self.ctrl, self.client))
+        self.assertTrue(ok)
+        self.assertIn('Starting api', out)
+        self.assertEqual(self.fake.pulls, ['postgres:9.5'])
+        self.assertEqual(self.actions('start'), ['db', 'api'])
+        self.assertTrue(self.fake.container('api')['State']['Running'])
+        self.assertEqual(self.fake.container('api')['HostConfig']['Links'], ['db:db'])
+        # Already there, so this time they can't be created
+        ok, _ = self.command(async_start(self.args, self.ctrl, self.client))
+        self.assertFalse(ok)
+
+    def test_start_fails(self):
+        """A docker error starting one container fails the start, not with a traceback"""
+        self.fake.fail('containers.start', status=500,
+                       message='port is already allocated', times=1)
+        with self.assertLogs('control.functions', 'CRITICAL') as logged:
+            ok, _ = self.command(async_start(self.args, self.ctrl, self.client))
+        self.assertFalse(ok)
+        self.assertIn('db', logged.output[0])
+        self.assertIn('port is already allocated', logged.output[0])
+
+    def test_no_volumes(self):
+        """--no-volumes leaves the container's volumes out"""
+        self.command(async_start(self.args.replace(no_volumes=True), self.ctrl, self.client))
+        self.assertEqual(self.fake.container('api')['Mounts'], [])
+
+    def test_stop(self):
+        """Containers are stopped and removed, and missing ones don't matter"""
+        self.command(async_start(self.args, self.ctrl, self.client))
+        ok, _ = self.command(async_stop(self.args, self.ctrl, self.client))
+        self.assertTrue(ok)
+        self.assertEqual(self.fake.containers, {})
+        self.assertEqual(sorted(self.actions('stop')), ['api', 'db'])
+        ok, _ = self.command(async_stop(self.args, self.ctrl, self.client))
+        self.assertTrue(ok)
+
+    def test_force(self):
+        """--force kills instead"""
+        self.command(async_start(self.args, self.ctrl, self.client))
+        self.command(async_stop(self.args.replace(force=True), self.ctrl, self.client))
+        self.assertEqual(self.actions('stop'), [])
+        self.assertEqual(sorted(self.actions('kill')), ['api', 'db'])
+        self.assertEqual(self.fake.containers, {})
+
+    def test_dump(self):
+        """Dumping prints the commands without asking docker anything"""
+        ok, out = self.command(async_start(self.args.replace(dump=True), self.ctrl,
+                                           self.client))
+        self.assertTrue(ok)
+        self.assertIn('docker run', out)
+        self.assertEqual(self.fake.round_trips(), 0)
+
+
+class TestRegistry(AioTest):
+    """AsyncRegistry against the fake registry"""
+
+    def setUp(self):
+        super().setUp()
+        self.fake = FakeRegistry().start()
+        self.addCleanup(self.fake.stop)
+        self.certs = CertDir(self.fake.endpoint)
+        self.addCleanup(self.certs.cleanup)
+        # Keep AsyncRegistry away from the real ~/.docker/config.json
+        self.home = tempfile.TemporaryDirectory()
+        self.addCleanup(self.home.cleanup)
+        patcher = mock.patch.dict(os.environ, {'HOME': self.home.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def registry(self):
+        """An AsyncRegistry that trusts the fake"""
+        reg = aio.AsyncRegistry('localhost', self.fake.port, certdir=self.certs.path)
+        self.addCleanup(reg.close)
+        return reg
+
+    def repo(self, tag):
+        """The Repository for app:tag in the fake"""
+        return Repository('app', tag, 'localhost', self.fake.port)
+
+    def login(self, user, password):
+        """Leave a login in the docker config, the way docker login does"""
+        os.makedirs(join(self.home.name, '.docker'), exist_ok=True)
+        with open(join(self.home.name, '.docker', 'config.json'), 'w') as f:
+            json.dump({'auths': {'https://' + self.fake.endpoint: {
+                'auth': base64.b64encode('{}:{}'.format(user, password).encode()).decode()}}},
+                      f)
+
+    def test_dates(self):
+        """Build dates and IDs come from schema 1 manifests, asked for all at once"""
+        self.fake.push('app', 'dev', created=1000000000)
+        reg = self.registry()
+        self.assertEqual(self.run_coro(reg.get_build_date_of_repo(self.repo('dev')))[:19],
+                         '2001-09-09T01:46:40')
+        self.assertEqual(self.run_coro(reg.get_id_of_repo(self.repo('dev')))[:7], 'sha256:')
+        self.assertEqual(self.run_coro(reg.get_build_date_of_repo(self.repo('nope'))), '')
+
+        async def many():  # pylint: disable=missing-docstring
+            return await asyncio.gather(*(reg.get_build_date_of_repo(self.repo('dev'))
+                                          for _ in range(5)))
+        self.assertEqual(len(set(self.run_coro(many()))), 1)
+        self.assertEqual(self.fake.requests['registry.manifests'], 8)
+
+    def test_tags(self):
+        """Tags are followed across pages"""
+        for tag in range(7):
+            self.fake.push('app', 'v{}'.format(tag))
+        tags = self.run_coro(self.registry().get_tags_of_image('app', page_size=3))
+        self.assertEqual(tags, ['v{}'.format(tag) for tag in range(7)])
+        self.assertEqual(self.fake.requests['registry.tags'], 3)
+        self.assertEqual(self.run_coro(self.registry().get_tags_of_image('web')), [])
+
+    def test_basic_auth(self):
+        """Basic auth comes from the docker config"""
+        self.fake.auth = 'basic'
+        self.fake.users = {'ci': 'secret'}
+        self.fake.push('app')
+        self.assertEqual(self.run_coro(self.registry().get_tags_of_image('app')), [])
+        self.login('ci', 'secret')
+        self.assertEqual(self.run_coro(self.registry().get_tags_of_image('app')), ['latest'])
+
+    def test_token_auth(self):
+        """Bearer challenges are answered with a token, fetched once per scope"""
+        self.fake.auth = 'bearer'
+        self.fake.users = {'ci': 'secret'}
+        self.fake.push('app')
+        self.login('ci', 'secret')
+        reg = self.registry()
+        self.assertNotEqual(self.run_coro(reg.get_build_date_of_repo(self.repo('latest'))), '')
+        self.assertEqual(self.run_coro(reg.get_tags_of_image('app')), ['latest'])
+        self.assertEqual(self.fake.requests['registry.token'], 1)
+
+    def test_registry_dates(self):
+        """Builds ask every registry about every upstream at once"""
+        self.fake.push('app', 'dev', created=1000000000)
+        dates = self.run_coro(registry_dates([
+            self.repo('dev'), self.repo('nope'), Repository.match('busybox'),
+            Repository('app', 'dev', 'localhost', '1')], no_verify=True))
+        self.assertEqual(list(dates), [self.repo('dev').repo])
+
+
+class TestEvents(AioTest):
+    """Events run as subprocesses, in the Dockerfile's directory"""
+
+    class Service(dict):
+        """Just enough of a service to run its events"""
+
+        def __init__(self, directory, events):
+            super().__init__(name='app', dockerfile={'dev': join(directory, 'Dockerfile')})
+            self.events = events
+
+    def test_events(self):
+        """Events run where the Dockerfile is, and fail when their command does"""
+        with tempfile.TemporaryDirectory() as directory:
+            service = self.Service(directory, {
+                'prebuild': 'pwd > where', 'postbuild': {'prod': 'exit 3'}})
+            self.assertTrue(self.run_coro(aio.run_event('prebuild', 'dev', service)))
+            with open(join(directory, 'where')) as f:
+                self.assertEqual(os.path.realpath(f.read().strip()),
+                                 os.path.realpath(directory))
+            self.assertTrue(self.run_coro(aio.run_event('postbuild', 'dev', service)))
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertFalse(self.run_coro(aio.run_event('postbuild', 'prod', service)))
+
+    def test_output(self):
+        """Output goes to sys.stdout and sys.stderr even when they aren't files"""
+        with tempfile.TemporaryDirectory() as directory:
+            service = self.Service(directory, {'prebuild': 'echo out; echo err >&2'})
+            out, err = io.StringIO(), io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                self.assertTrue(self.run_coro(aio.run_event('prebuild', 'dev', service)))
+        self.assertEqual((out.getvalue(), err.getvalue()), ('out\n', 'err\n'))
+
+    def test_threads(self):
+        """The sync wrapper works from build threads, each on its own loop"""
+        results = []
+        with tempfile.TemporaryDirectory() as directory:
+            service = self.Service(directory, {'prebuild': 'true'})
+
+            def build():  # pylint: disable=missing-docstring
+                results.append(run_event('prebuild', 'dev', service))
+                aio.close()
+            threads = [threading.Thread(target=build) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        self.assertEqual(results, [True] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
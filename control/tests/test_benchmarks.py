@@ -0,0 +1,81 @@
+"""Test the benchmark suite runs offline and catches regressions"""
+
+import json
+import os
+from os.path import join
+import tempfile
+import unittest
+import unittest.mock
+
+from control.benchmarks import BENCHMARKS, compare, generate_tree, measure, run_suite
+from control.benchmarks.suite import main
+from control.controlfile import Controlfile
+from control.service import MetaService
+
+
+class TestGenerate(unittest.TestCase):
+    """Synthetic Controlfile trees"""
+
+    def test_tree(self):
+        """Every service is there, nested depth metaservices deep"""
+        with tempfile.TemporaryDirectory() as d:
+            ctrl = Controlfile(generate_tree(d, services=25, depth=5))
+        names = {n for n, s in ctrl.services.items() if not isinstance(s, MetaService)}
+        self.assertEqual(names, {'svc{}'.format(i) for i in range(25)})
+        self.assertIn('level4', ctrl.services)
+        # The innermost services get every level's transforms
+        self.assertEqual(ctrl.services['svc0']['name'], 'svc0.l4.l3.l2.l1.l0')
+        self.assertEqual(ctrl.services['svc0'].image,
+                         'registry4.example.com:5000/svc0:master-l4')
+
+
+class TestSuite(unittest.TestCase):
+    """Timing and comparing"""
+
+    def test_measure(self):
+        """Only func is timed, with fresh arguments from setup each time"""
+        ticks = iter(range(100))
+        calls = []
+        timings = measure(lambda: (len(calls),), calls.append, repeat=3,
+                          clock=lambda: next(ticks))
+        self.assertEqual(timings, [1, 1, 1])
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_run_suite(self):
+        """Every benchmark runs at a tiny size"""
+        with tempfile.TemporaryDirectory() as d:
+            results = run_suite(d, sizes=[3], depths=[2], repeat=1, images=[2])
+        self.assertEqual({r['benchmark'] for r in results.values()}, set(BENCHMARKS))
+        self.assertIn('satisfy_nested_options[2]', results)
+        self.assertIn('dump_run[3]', results)
+        # A manifest per image, over connections kept from one run to the next
+        self.assertEqual(results['registry_checks[2]']['round_trips'], 2)
+        self.assertNotIn('round_trips', results['dump_run[3]'])
+
+    def test_compare(self):
+        """Only medians past the threshold count as regressions"""
+        baseline = {'a[1]': {'median': 1.0}, 'b[1]': {'median': 1.0}}
+        results = {'a[1]': {'median': 1.2}, 'b[1]': {'median': 1.3},
+                   'c[1]': {'median': 9.0}}
+        self.assertEqual(compare(results, baseline, 0.25), [('b[1]', 1.0, 1.3)])
+
+    def test_main(self):
+        """Results are written as JSON, and a slower run fails"""
+        with tempfile.TemporaryDirectory() as d:
+            output = join(d, 'results.json')
+            args = ['--sizes', '2', '--repeat', '1', '--only', 'dump_build']
+            with open(os.devnull, 'w') as devnull, \
+                    unittest.mock.patch('sys.stdout', devnull):
+                self.assertEqual(main(args + ['--output', output]), 0)
+                with open(output) as f:
+                    data = json.load(f)
+                self.assertEqual(list(data['results']), ['dump_build[2]'])
+                data['results']['dump_build[2]']['median'] = 0.0
+                with open(output, 'w') as f:
+                    json.dump(data, f)
+                with unittest.mock.patch('sys.stderr', devnull):
+                    self.assertEqual(main(args + ['--baseline', output]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
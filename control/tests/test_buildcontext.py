@@ -0,0 +1,133 @@
+"""Test building and caching of build contexts"""
+
+import io
+import os
+from os.path import join
+import tarfile
+import tempfile
+import unittest
+
+from control.buildcontext import BuildContext, ContextCache, DockerIgnore, DOCKERFILE
+
+
+class TestDockerIgnore(unittest.TestCase):
+    """Patterns should exclude what docker would exclude"""
+
+    def test_simple(self):
+        """Names and globs match at the top of the context"""
+        ignore = DockerIgnore(['node_modules', '*.log', '# a comment', ''])
+        self.assertTrue(ignore.excluded('node_modules'))
+        self.assertTrue(ignore.excluded('node_modules/left-pad/index.js'))
+        self.assertTrue(ignore.excluded('debug.log'))
+        self.assertFalse(ignore.excluded('logs/debug.log'))
+        self.assertFalse(ignore.excluded('src/app.js'))
+
+    def test_double_star(self):
+        """** matches any number of directories"""
+        ignore = DockerIgnore(['**/*.pyc'])
+        self.assertTrue(ignore.excluded('app.pyc'))
+        self.assertTrue(ignore.excluded('a/b/c/app.pyc'))
+        self.assertFalse(ignore.excluded('a/b/c/app.py'))
+
+    def test_exceptions(self):
+        """The last matching pattern wins, and ! brings files back"""
+        ignore = DockerIgnore(['*.md', '!README.md'])
+        self.assertTrue(ignore.excluded('CHANGELOG.md'))
+        self.assertFalse(ignore.excluded('README.md'))
+        self.assertFalse(ignore.prunable('docs'))
+
+    def test_character_class(self):
+        """Character classes and negated classes"""
+        ignore = DockerIgnore(['file[0-9]', 'tmp[!a]'])
+        self.assertTrue(ignore.excluded('file1'))
+        self.assertFalse(ignore.excluded('filea'))
+        self.assertTrue(ignore.excluded('tmpb'))
+        self.assertFalse(ignore.excluded('tmpa'))
+
+
+class TestBuildContext(unittest.TestCase):
+    """Tars that come out of a build directory"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = self.temp_dir.name
+        os.makedirs(join(self.path, 'src'))
+        os.makedirs(join(self.path, 'node_modules', 'dep'))
+        with open(join(self.path, 'src', 'app.py'), 'w') as f:
+            f.write('print("hello")\n' * 1000)
+        with open(join(self.path, 'node_modules', 'dep', 'index.js'), 'w') as f:
+            f.write('module.exports = 1')
+        with open(join(self.path, '.dockerignore'), 'w') as f:
+            f.write('node_modules\n')
+        os.symlink('src/app.py', join(self.path, 'link'))
+        self.dockerfile = b'FROM busybox\nCOPY src /src\n'
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def read_tar(self, data, mode='r:'):
+        """Return {name: member, contents} of a tarball"""
+        with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as tar:
+            return {m.name: (m, tar.extractfile(m).read() if m.isfile() else None)
+                    for m in tar.getmembers()}
+
+    def test_tar(self):
+        """The tar has the Dockerfile, and everything not ignored"""
+        context = BuildContext(self.path, self.dockerfile)
+        members = self.read_tar(b''.join(context.stream()))
+        self.assertEqual(members[DOCKERFILE][1], self.dockerfile)
+        self.assertEqual(members['src/app.py'][1], b'print("hello")\n' * 1000)
+        self.assertTrue(members['src'][0].isdir())
+        self.assertTrue(members['link'][0].issym())
+        self.assertEqual(members['link'][0].linkname, 'src/app.py')
+        self.assertNotIn('node_modules', members)
+        self.assertNotIn('node_modules/dep/index.js', members)
+
+    def test_gzip(self):
+        """The compressed stream is a valid tar.gz"""
+        context = BuildContext(self.path, self.dockerfile)
+        members = self.read_tar(b''.join(context.stream(compress=True)), 'r:gz')
+        self.assertIn('src/app.py', members)
+
+    def test_streamed_in_chunks(self):
+        """The tar is produced a piece at a time, not all at once"""
+        context = BuildContext(self.path, self.dockerfile)
+        self.assertGreater(len(list(context.stream())), 3)
+
+    def test_key(self):
+        """The key changes with the Dockerfile and with file contents"""
+        key = BuildContext(self.path, self.dockerfile).key()
+        self.assertEqual(key, BuildContext(self.path, self.dockerfile).key())
+        self.assertNotEqual(key, BuildContext(self.path, b'FROM alpine\n').key())
+        with open(join(self.path, 'src', 'new.py'), 'w') as f:
+            f.write('new')
+        self.assertNotEqual(key, BuildContext(self.path, self.dockerfile).key())
+
+    def test_content_key(self):
+        """The image cache key ignores mtimes, but not contents"""
+        key = BuildContext(self.path, self.dockerfile).content_key()
+        os.utime(join(self.path, 'src', 'app.py'), ns=(0, 10 ** 9))
+        self.assertEqual(key, BuildContext(self.path, self.dockerfile).content_key())
+        with open(join(self.path, 'src', 'app.py'), 'w') as f:
+            f.write('print("hullo")\n' * 1000)
+        self.assertNotEqual(key, BuildContext(self.path, self.dockerfile).content_key())
+
+    def test_cache(self):
+        """A second service with the same context replays the first's tar"""
+        cache = ContextCache()
+        first = b''.join(cache.stream(BuildContext(self.path, self.dockerfile)))
+        second = b''.join(cache.stream(BuildContext(self.path, self.dockerfile)))
+        self.assertEqual(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_cache_skips_partial(self):
+        """An upload that was abandoned part way is not cached"""
+        cache = ContextCache()
+        stream = cache.stream(BuildContext(self.path, self.dockerfile))
+        next(stream)
+        stream.close()
+        self.assertEqual(len(cache.tarballs), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
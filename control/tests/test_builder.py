@@ -142,6 +142,35 @@ class BuildingSetterTests(unittest.TestCase):
         self.assertEqual(str(result),
                          "docker run --attach 0 busybox")
 
+    def test_empty_list(self):
+        """An empty list adds nothing, rather than the string []"""
+        result = builder('run', pretty=False).image('busybox').volume([])
+        self.assertEqual(str(result), "docker run busybox")
+
+
+class ShellTests(unittest.TestCase):
+    """Commands as argv lists and quoted lines for scripts"""
+
+    def test_argv(self):
+        """Flags come sorted, then the positionals, with commands split up"""
+        result = builder('run').image('busybox').env(['A=b c']).detach() \
+            .command("sh -c 'echo hi'")
+        self.assertEqual(result.argv(), ['docker', 'run', '--detach', '--env', 'A=b c',
+                                         'busybox', 'sh', '-c', 'echo hi'])
+        self.assertEqual(result.shell(),
+                         "docker run --detach --env 'A=b c' busybox sh -c 'echo hi'")
+        self.assertEqual(builder('rm').force().container(['a', 'b']).argv(),
+                         ['docker', 'rm', '--force', 'a', 'b'])
+
+    def test_argv_checks(self):
+        """argv complains about missing positionals like str does"""
+        with self.assertRaises(ControlException):
+            builder('run').argv()
+        with self.assertRaises(ControlException):
+            builder('exec').container('web').argv()
+        with self.assertRaises(ControlException):
+            builder('stop').argv()
+
 
 class ArgumentTests(unittest.TestCase):
     """Test Arguments on their own"""
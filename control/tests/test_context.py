@@ -0,0 +1,96 @@
+"""Test the run context, and the copies of services it overrides"""
+
+import json
+from os.path import abspath, join
+import tempfile
+import unittest
+
+from control.context import RunContext, cli_overrides, defaults
+from control.controlfile import Controlfile
+
+
+class TestRunContext(unittest.TestCase):
+    """Options come from the command line and can't be changed after"""
+
+    def test_parse(self):
+        args = RunContext.parse(['build', 'api', 'db', '--force'])
+        self.assertEqual(args.command, 'build')
+        self.assertEqual(args.services, ('api', 'db'))
+        self.assertTrue(args.force)
+        # Defaults the parser doesn't know about come from options
+        self.assertEqual(args.dump_format, 'commands')
+        self.assertEqual(defaults().services, ())
+
+    def test_read_only(self):
+        args = RunContext.parse([])
+        with self.assertRaises(AttributeError):
+            args.force = True
+        with self.assertRaises(AttributeError):
+            del args.force
+        with self.assertRaises(AttributeError):
+            args.not_an_option  # pylint: disable=pointless-statement
+
+    def test_replace(self):
+        args = RunContext.parse(['build'])
+        changed = args.replace(cache=False, services=['api'])
+        self.assertIsNone(args.cache)
+        self.assertEqual(args.services, ())
+        self.assertIs(changed.cache, False)
+        self.assertEqual(changed.services, ('api',))
+        self.assertEqual(changed.command, 'build')
+
+
+class TestOverrides(unittest.TestCase):
+    """Overridden services are copies, and the Controlfile keeps its own"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.controlfile = join(self.temp_dir.name, 'Controlfile')
+        with open(self.controlfile, 'w') as f:
+            json.dump({'services': {
+                'api': {'image': 'api', 'container': {'entrypoint': '/run.sh',
+                                                      'environment': ['A=b']}},
+                'db': {'image': 'postgres:9.5', 'container': {}},
+            }}, f)
+        self.ctrl = Controlfile(self.controlfile)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_copy(self):
+        service = self.ctrl.services['api']
+        holder = service.copy(entrypoint='/bin/cat', tty=True)
+        self.assertEqual(holder['entrypoint'], '/bin/cat')
+        self.assertTrue(holder['tty'])
+        self.assertEqual(service['entrypoint'], '/run.sh')
+        self.assertNotIn('tty', service.container)
+        holder.container['environment'].append('C=d')
+        self.assertEqual(holder['environment'], service['environment'])
+
+    def test_apply(self):
+        args = RunContext.parse(['start', 'api']).override('api', image='api:test')
+        ctrl = args.apply(self.ctrl)
+        self.assertEqual(ctrl.services['api'].image, 'api:test')
+        self.assertIs(ctrl.services['db'], self.ctrl.services['db'])
+        self.assertEqual(self.ctrl.services['api'].image, 'api')
+        # Without overrides there's nothing to copy
+        self.assertIs(RunContext.parse([]).apply(self.ctrl), self.ctrl)
+
+    def test_cli_overrides(self):
+        args = cli_overrides(RunContext.parse(
+            ['build', 'api', '--image', 'api:test', '--name', 'test', '--dockerfile', 'Df']))
+        self.assertEqual(args.overrides, {'api': {
+            'image': 'api:test',
+            'name': 'test',
+            'dockerfile': {'dev': abspath('Df'), 'prod': abspath('Df')},
+        }})
+        ctrl = args.apply(self.ctrl)
+        self.assertEqual(ctrl.services['api']['name'], 'test')
+        self.assertEqual(self.ctrl.services['api']['name'], 'api')
+        # Which service would they go to?
+        args = cli_overrides(RunContext.parse(['build', 'api', 'db', '--image', 'x']))
+        self.assertEqual(args.overrides, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Test the control daemon and the thin client that talks to it"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from os.path import join
+
+from control.client import forward
+from control.context import RunContext
+from control.daemon import ControlfileCache, make_server
+
+
+class TestControlfileCache(unittest.TestCase):
+    """Controlfiles are only read in again when they change"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.controlfile = join(self.temp_dir.name, 'Controlfile')
+        self.write_controlfile('busybox')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_controlfile(self, image):
+        """Write out a single service Controlfile using image"""
+        with open(self.controlfile, 'w') as f:
+            json.dump({"image": image, "container": {"name": "example"}}, f)
+
+    def test_cached(self):
+        """An unchanged Controlfile is not read in again"""
+        cache = ControlfileCache()
+        cache.load(self.controlfile)
+        first = list(cache.controlfiles.values())[0]
+        cache.load(self.controlfile)
+        self.assertIs(list(cache.controlfiles.values())[0], first)
+
+    def test_overrides_are_independent(self):
+        """Overrides made by one command do not leak into the next"""
+        cache = ControlfileCache()
+        ctrl = cache.load(self.controlfile)
+        applied = RunContext.parse(['build']).override('example', image='alpine').apply(ctrl)
+        self.assertEqual(applied.services['example']['image'], 'alpine')
+        self.assertIs(cache.load(self.controlfile), ctrl)
+        self.assertEqual(ctrl.services['example']['image'], 'busybox')
+
+    def test_reload_on_change(self):
+        """A modified Controlfile is read in again"""
+        cache = ControlfileCache()
+        cache.load(self.controlfile)
+        self.write_controlfile('alpine')
+        stat = os.stat(self.controlfile)
+        os.utime(self.controlfile, (stat.st_atime, stat.st_mtime + 10))
+        self.assertEqual(cache.load(self.controlfile).services['example']['image'],
+                         'alpine')
+
+
+class TestDaemon(unittest.TestCase):
+    """The client and daemon talking over a socket"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.socket = join(self.temp_dir.name, 'control.sock')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_no_daemon(self):
+        """Without a daemon, the client says to run in-process"""
+        self.assertIsNone(forward(['build'], path=self.socket))
+
+    def serve(self):
+        """Run a daemon on the socket until the test is over"""
+        server = make_server(self.socket)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_local_only_commands(self):
+        """open, and commands that run until they're interrupted, are not forwarded"""
+        self.serve()
+        for args in (['open', 'foo'], ['watch'], ['logs', '-f', 'api'], ['logs', '--follow'],
+                     ['stats']):
+            self.assertIsNone(forward(args, path=self.socket))
+        missing = join(self.temp_dir.name, 'missing')
+        for args in (['logs'], ['stats', '--no-stream']):
+            self.assertEqual(forward(['-c', missing] + args, path=self.socket,
+                                     stdout=io.StringIO(), stderr=io.StringIO()), 2)
+
+    def test_round_trip(self):
+        """The daemon runs the command and reports its output and exit code"""
+        self.serve()
+        self.assertIsNone(make_server(self.socket))
+        err = io.StringIO()
+        ret = forward(['-c', join(self.temp_dir.name, 'missing'), 'build'],
+                      path=self.socket, stdout=io.StringIO(), stderr=err)
+        self.assertEqual(ret, 2)
+        self.assertIn('No such file', err.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
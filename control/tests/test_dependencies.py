@@ -0,0 +1,107 @@
+"""Test discovery of which services are built FROM which"""
+
+import json
+import os
+from os.path import join
+import tempfile
+import unittest
+
+from control.controlfile import Controlfile
+from control.dependencies import (build_graph, build_order, build_waves, dependents,
+                                  read_dockerfile, start_graph)
+
+
+class TestDependencies(unittest.TestCase):
+    """A base image, two images built from it, and one built from those"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.controlfile = join(self.temp_dir.name, 'Controlfile')
+        services = {
+            'base': ('busybox:latest', {}),
+            'api': ('base', {}),
+            'web': ('base', {'fromline': 'FROM something:else'}),
+            'worker': ('api', {}),
+        }
+        conf = {'services': {}}
+        for name, (upstream, extra) in services.items():
+            os.mkdir(join(self.temp_dir.name, name))
+            with open(join(self.temp_dir.name, name, 'Dockerfile'), 'w') as f:
+                f.write('FROM {}\nRUN true\n'.format(upstream))
+            conf['services'][name] = dict(extra, **{
+                'image': name,
+                'dockerfile': '{}/Dockerfile'.format(name),
+                'container': {'name': name},
+            })
+        with open(self.controlfile, 'w') as f:
+            json.dump(conf, f)
+        self.ctrl = Controlfile(self.controlfile)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_read_dockerfile(self):
+        """The fromline replaces the Dockerfile's FROM"""
+        upstream, content = read_dockerfile(self.ctrl.services['web'], 'dev')
+        self.assertEqual(upstream.repo, 'something:else')
+        self.assertEqual(content, b'FROM something:else\nRUN true\n')
+
+    def test_graph(self):
+        """Only FROM lines that name another service are dependencies"""
+        graph = build_graph(self.ctrl)
+        self.assertEqual(graph, {
+            'base': set(),
+            'api': {'base'},
+            'web': set(),
+            'worker': {'api'},
+        })
+
+    def test_dependents(self):
+        """Changing the base means rebuilding everything built from it"""
+        graph = build_graph(self.ctrl)
+        self.assertEqual(dependents(graph, {'base'}), {'base', 'api', 'worker'})
+        self.assertEqual(dependents(graph, {'worker'}), {'worker'})
+
+    def test_build_order(self):
+        """Services come after the services they are built FROM"""
+        graph = build_graph(self.ctrl)
+        self.assertEqual(build_order(graph, ['worker', 'web', 'api', 'base']),
+                         ['base', 'web', 'api', 'worker'])
+
+
+    def test_build_waves(self):
+        """Services in a wave don't depend on each other"""
+        graph = build_graph(self.ctrl)
+        self.assertEqual(build_waves(graph, ['worker', 'web', 'api', 'base']),
+                         [['base', 'web'], ['api'], ['worker']])
+        self.assertEqual(build_waves(graph, ['worker', 'web']), [['web', 'worker']])
+
+
+class TestStartGraph(unittest.TestCase):
+    """Containers that link to, or borrow from, other containers"""
+
+    def test_start_graph(self):
+        """Whatever a container uses starts before it"""
+        with tempfile.TemporaryDirectory() as directory:
+            controlfile = join(directory, 'Controlfile')
+            with open(controlfile, 'w') as f:
+                json.dump({'services': {
+                    'db': {'image': 'postgres:9.5', 'container': {'name': 'database'}},
+                    'cache': {'image': 'redis', 'container': {}},
+                    'api': {'image': 'api', 'container': {
+                        'links': {'database': 'db'}, 'volumes_from': ['cache:ro']}},
+                    'worker': {'image': 'api', 'container': {
+                        'network_mode': 'container:api', 'links': ['elsewhere:x']}},
+                }}, f)
+            ctrl = Controlfile(controlfile)
+        names = ['api', 'cache', 'db', 'worker']
+        graph = start_graph(ctrl, names)
+        self.assertEqual(graph, {'api': {'cache', 'db'}, 'cache': set(), 'db': set(),
+                                 'worker': {'api'}})
+        self.assertEqual(build_waves(graph, names), [['cache', 'db'], ['api'], ['worker']])
+        self.assertEqual(start_graph(ctrl, ['api', 'worker']),
+                         {'api': set(), 'worker': {'api'}})
+
+
+if __name__ == '__main__':
+    unittest.main()
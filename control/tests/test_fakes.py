@@ -0,0 +1,387 @@
+"""Test the stand-in docker engine and registry"""
+
+import base64
+import hashlib
+import json
+import os
+from os.path import join
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.parse
+
+import requests
+
+from control.buildcontext import DOCKERFILE, BuildContext
+from control.fakes import CertDir, FakeDocker, FakeRegistry, UnixHTTPConnection
+from control.fakes.registry import CERT, SCHEMA1, SCHEMA2
+from control.registry import Registry
+from control.repository import Repository
+
+
+def call(fake, method, path, body=None, query=None, headers=None):
+    """Make one request to a fake. Returns (status, decoded body)"""
+    if query:
+        path += '?' + urllib.parse.urlencode(query)
+    conn = UnixHTTPConnection(fake.address)
+    try:
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+            headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+        conn.request(method, '/v1.21' + path, body=body, headers=headers or {},
+                     encode_chunked=not isinstance(body, (bytes, type(None))))
+        response = conn.getresponse()
+        data = response.read()
+    finally:
+        conn.close()
+    if response.getheader('Content-Type') == 'application/json':
+        if data.count(b'\n') > 1 or data.endswith(b'\r\n'):
+            return response.status, [json.loads(l) for l in data.splitlines() if l.strip()]
+        return response.status, json.loads(data.decode('utf-8')) if data else None
+    return response.status, data
+
+
+def frames(data):
+    """Split a multiplexed log stream into (stream, bytes)"""
+    found = []
+    while data:
+        stream, size = struct.unpack('>BxxxL', data[:8])
+        found.append((stream, data[8:8 + size]))
+        data = data[8 + size:]
+    return found
+
+
+class FakeDockerTest(unittest.TestCase):
+    """Runs a fake with busybox already pulled"""
+
+    def setUp(self):
+        self.fake = FakeDocker(images=['busybox:latest']).start()
+        self.addCleanup(self.fake.stop)
+
+    def create(self, name, **config):
+        """Create a container, returning its ID"""
+        status, body = call(self.fake, 'POST', '/containers/create',
+                            dict({'Image': 'busybox'}, **config), {'name': name})
+        self.assertEqual(status, 201, body)
+        return body['Id']
+
+
+class TestContainers(FakeDockerTest):
+    """Containers go through docker's states"""
+
+    def test_lifecycle(self):
+        """Create, start, stop and remove"""
+        cid = self.create('web', Labels={'control.service': 'web'})
+        self.assertEqual(call(self.fake, 'POST', '/containers/web/start')[0], 204)
+        self.assertEqual(call(self.fake, 'POST', '/containers/web/start')[0], 304)
+        status, inspect = call(self.fake, 'GET', '/containers/{}/json'.format(cid[:12]))
+        self.assertTrue(inspect['State']['Running'])
+        self.assertEqual(inspect['Name'], '/web')
+        self.assertEqual(call(self.fake, 'DELETE', '/containers/web')[0], 409)
+        self.assertEqual(call(self.fake, 'POST', '/containers/web/stop')[0], 204)
+        status, listed = call(self.fake, 'GET', '/containers/json', query={
+            'all': 1, 'filters': json.dumps({'label': ['control.service=web']})})
+        self.assertEqual([c['State'] for c in listed], ['exited'])
+        self.assertEqual(call(self.fake, 'DELETE', '/containers/web')[0], 204)
+        self.assertEqual(call(self.fake, 'GET', '/containers/web/json')[0], 404)
+
+    def test_missing_image(self):
+        """Creating from an image that isn't here is docker's 404"""
+        status, body = call(self.fake, 'POST', '/containers/create', {'Image': 'nope'})
+        self.assertEqual(status, 404)
+        self.assertIn('No such image', body['message'])
+
+    def test_name_race(self):
+        """Only one of many creates with the same name wins"""
+        statuses = []
+
+        def create():
+            statuses.append(call(self.fake, 'POST', '/containers/create',
+                                 {'Image': 'busybox'}, {'name': 'db'})[0])
+        threads = [threading.Thread(target=create) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), [201] + [409] * 9)
+
+    def test_volumes(self):
+        """Anonymous volumes go with the container, named ones stay"""
+        self.create('web', Volumes={'/data': {}, '/named': {}},
+                    HostConfig={'Binds': ['shared:/named', '/srv:/srv:ro']})
+        status, inspect = call(self.fake, 'GET', '/containers/web/json')
+        mounts = {m['Destination']: m for m in inspect['Mounts']}
+        self.assertEqual(mounts['/named']['Name'], 'shared')
+        self.assertEqual(mounts['/srv']['Type'], 'bind')
+        self.assertTrue(mounts['/data']['Source'].startswith('/var/lib/docker/volumes'))
+        self.assertEqual(call(self.fake, 'DELETE', '/volumes/shared')[0], 409)
+        self.assertEqual(call(self.fake, 'DELETE', '/containers/web', query={'v': 1})[0], 204)
+        status, volumes = call(self.fake, 'GET', '/volumes')
+        self.assertEqual([v['Name'] for v in volumes['Volumes']], ['shared'])
+
+    def test_exec(self):
+        """Exec output comes from the exec handler"""
+        self.fake.exec_handler = lambda container, cmd: (2, ' '.join(cmd).encode('utf-8'))
+        self.create('web')
+        self.assertEqual(call(self.fake, 'POST', '/containers/web/exec',
+                              {'Cmd': ['ls']})[0], 409)
+        call(self.fake, 'POST', '/containers/web/start')
+        status, body = call(self.fake, 'POST', '/containers/web/exec',
+                            {'Cmd': ['echo', 'hi'], 'AttachStdout': True})
+        status, output = call(self.fake, 'POST', '/exec/{}/start'.format(body['Id']), {})
+        self.assertEqual(frames(output), [(1, b'echo hi')])
+        status, inspect = call(self.fake, 'GET', '/exec/{}/json'.format(body['Id']))
+        self.assertEqual(inspect['ExitCode'], 2)
+
+    def test_logs(self):
+        """Followed logs end when the container stops"""
+        self.create('web')
+        call(self.fake, 'POST', '/containers/web/start')
+        self.fake.emit_log('web', 'before\n')
+        self.fake.emit_log('web', 'oops\n', stream=2)
+        timer = threading.Timer(0.2, lambda: (self.fake.emit_log('web', 'after\n'),
+                                              call(self.fake, 'POST', '/containers/web/stop')))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        status, data = call(self.fake, 'GET', '/containers/web/logs', query={
+            'stdout': 1, 'stderr': 1, 'follow': 1})
+        self.assertEqual(frames(data), [(1, b'before\n'), (2, b'oops\n'), (1, b'after\n')])
+
+
+class TestImages(FakeDockerTest):
+    """Pulling, building and removing images"""
+
+    def test_pull(self):
+        """A pull reports progress per layer and leaves the image behind"""
+        status, lines = call(self.fake, 'POST', '/images/create',
+                             query={'fromImage': 'registry.example.com/app', 'tag': '1'})
+        self.assertEqual(status, 200)
+        self.assertTrue(any(l.get('progressDetail', {}).get('total') for l in lines))
+        self.assertIn('Downloaded newer image', lines[-1]['status'])
+        status, image = call(self.fake, 'GET', '/images/registry.example.com%2Fapp:1/json')
+        self.assertEqual(status, 200)
+        status, lines = call(self.fake, 'POST', '/images/create',
+                             query={'fromImage': 'registry.example.com/app', 'tag': '1'})
+        self.assertIn('up to date', lines[-1]['status'])
+
+    def test_remote(self):
+        """With a remote, only the images in it can be pulled"""
+        self.fake.add_remote('alpine:3.4')
+        status, lines = call(self.fake, 'POST', '/images/create',
+                             query={'fromImage': 'alpine', 'tag': 'edge'})
+        self.assertIn('not found', lines[-1]['error'])
+
+    def test_build(self):
+        """A streamed, gzipped BuildContext builds and is labeled"""
+        with tempfile.TemporaryDirectory() as d:
+            with open(join(d, 'app.py'), 'w') as f:
+                f.write('print(1)\n')
+            context = BuildContext(d, b'FROM busybox\nLABEL team=infra\nCOPY app.py /\n')
+            status, lines = call(self.fake, 'POST', '/build',
+                                 body=context.stream(compress=True),
+                                 query={'t': 'app:dev', 'dockerfile': DOCKERFILE,
+                                        'labels': json.dumps({'control.service': 'app'})},
+                                 headers={'Content-Type': 'application/tar',
+                                          'Content-Encoding': 'gzip'})
+        self.assertEqual(lines[0], {'stream': 'Step 1/3 : FROM busybox\n'})
+        self.assertEqual(lines[-1], {'stream': 'Successfully tagged app:dev\n'})
+        image = self.fake.image('app:dev')
+        self.assertEqual(image['Labels'], {'team': 'infra', 'control.service': 'app'})
+        self.assertEqual(image['Parent'], self.fake.image('busybox')['Id'])
+
+    def test_build_error(self):
+        """A base image that can't be pulled fails the build in the stream"""
+        self.fake.remote = {}
+        with tempfile.TemporaryDirectory() as d:
+            context = BuildContext(d, b'FROM missing\n')
+            status, lines = call(self.fake, 'POST', '/build', body=b''.join(context.stream()),
+                                 query={'dockerfile': DOCKERFILE})
+        self.assertIn('error', lines[-1])
+
+    def test_remove(self):
+        """Images in use can't be removed, and extra tags are just untagged"""
+        call(self.fake, 'POST', '/images/busybox/tag', query={'repo': 'mine', 'tag': 'v1'})
+        self.assertEqual(call(self.fake, 'DELETE', '/images/mine:v1')[1],
+                         [{'Untagged': 'mine:v1'}])
+        self.create('web')
+        self.assertEqual(call(self.fake, 'DELETE', '/images/busybox')[0], 409)
+        status, removed = call(self.fake, 'DELETE', '/images/busybox', query={'force': 1})
+        self.assertEqual(removed[-1]['Deleted'][:7], 'sha256:')
+
+    def test_save_load(self):
+        """An image saved from one fake loads into another"""
+        status, tarball = call(self.fake, 'GET', '/images/busybox/get')
+        with FakeDocker() as other:
+            self.assertEqual(call(other, 'POST', '/images/load', tarball)[0], 200)
+            self.assertEqual(other.image('busybox')['Id'], self.fake.image('busybox')['Id'])
+
+
+class TestFaults(FakeDockerTest):
+    """Latency, injected failures and events"""
+
+    def test_latency(self):
+        """Per-endpoint latency only slows that endpoint"""
+        self.fake.latency_for['system.version'] = 0.2
+        begin = time.monotonic()
+        call(self.fake, 'GET', '/_ping')
+        self.assertLess(time.monotonic() - begin, 0.2)
+        call(self.fake, 'GET', '/version')
+        self.assertGreaterEqual(time.monotonic() - begin, 0.2)
+
+    def test_fail(self):
+        """Injected failures happen the given number of times"""
+        self.fake.fail('containers.create', status=500, message='disk full', times=2)
+        statuses = [call(self.fake, 'POST', '/containers/create', {'Image': 'busybox'})[0]
+                    for _ in range(3)]
+        self.assertEqual(statuses, [500, 500, 201])
+        self.assertEqual(self.fake.requests['containers.create'], 3)
+
+    def test_failure_rate(self):
+        """Random failures are repeatable with a seed"""
+        self.fake.failure_rate = 0.5
+        self.fake.random.seed(1)
+        first = [call(self.fake, 'GET', '/_ping')[0] for _ in range(20)]
+        self.fake.random.seed(1)
+        self.assertEqual(first, [call(self.fake, 'GET', '/_ping')[0] for _ in range(20)])
+        self.assertEqual(set(first), {200, 500})
+
+    def test_events(self):
+        """Events stream as things happen, filtered like docker's"""
+        lines = []
+        conn = UnixHTTPConnection(self.fake.address)
+        conn.request('GET', '/events?' + urllib.parse.urlencode({
+            'filters': json.dumps({'type': ['container']})}))
+        response = conn.getresponse()
+        reader = threading.Thread(target=lambda: lines.extend(
+            json.loads(response.readline()) for _ in range(2)))
+        reader.start()
+        self.create('web')
+        call(self.fake, 'POST', '/containers/web/start')
+        reader.join(5)
+        conn.close()
+        self.assertEqual([(e['Action'], e['Actor']['Attributes']['name']) for e in lines],
+                         [('create', 'web'), ('start', 'web')])
+
+    def test_socket_cleanup(self):
+        """Stopping removes the temporary socket"""
+        fake = FakeDocker().start()
+        path = fake.address
+        self.assertTrue(os.path.exists(path))
+        fake.stop()
+        self.assertFalse(os.path.exists(path))
+
+
+class TestRegistry(unittest.TestCase):
+    """The fake registry, through requests and through Registry"""
+
+    def setUp(self):
+        self.fake = FakeRegistry().start()
+        self.addCleanup(self.fake.stop)
+        self.certs = CertDir(self.fake.endpoint)
+        self.addCleanup(self.certs.cleanup)
+        # Keep Registry away from the real ~/.docker/config.json
+        self.home = tempfile.TemporaryDirectory()
+        self.addCleanup(self.home.cleanup)
+        patcher = unittest.mock.patch.dict(os.environ, {'HOME': self.home.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, path, method='GET', **kwargs):
+        """Make a request to the fake, trusting its cert"""
+        return requests.request(method, 'https://{}{}'.format(self.fake.endpoint, path),
+                                verify=CERT, **kwargs)
+
+    def test_registry(self):
+        """Registry reads schema 1 manifests, counting every round trip"""
+        self.fake.push('app', 'dev', created=1000000000)
+        reg = Registry('localhost', self.fake.port, certdir=self.certs.path)
+        self.assertTrue(reg.use_cert)
+        self.assertEqual(self.fake.round_trips(), 2)
+        repo = Repository('app', 'dev', 'localhost', self.fake.port)
+        self.assertEqual(reg.get_build_date_of_repo(repo)[:19], '2001-09-09T01:46:40')
+        self.assertEqual(reg.get_id_of_repo(repo)[:7], 'sha256:')
+        self.assertEqual(reg.get_build_date_of_repo(Repository('app', 'nope')), '')
+        self.assertEqual(self.fake.requests['registry.manifests'], 3)
+        self.assertEqual(self.fake.round_trips(), 5)
+
+    def test_manifests(self):
+        """Schema 2 is only for clients that ask, and digests match the bytes"""
+        digest = self.fake.push('app', 'dev')
+        response = self.get('/v2/app/manifests/dev', headers={'Accept': SCHEMA2})
+        self.assertEqual(response.headers['Docker-Content-Digest'], digest)
+        self.assertEqual('sha256:' + hashlib.sha256(response.content).hexdigest(), digest)
+        self.assertEqual(len(response.json()['layers']), 2)
+        old = self.get('/v2/app/manifests/dev')
+        self.assertEqual(old.headers['Content-Type'], SCHEMA1)
+        self.assertEqual(old.json()['schemaVersion'], 1)
+        head = self.get('/v2/app/manifests/dev', 'HEAD', headers={'Accept': SCHEMA2})
+        self.assertEqual((head.status_code, head.content), (200, b''))
+        self.assertEqual(head.headers['Docker-Content-Digest'], digest)
+        by_digest = self.get('/v2/app/manifests/' + digest)
+        self.assertEqual(by_digest.content, response.content)
+        config = response.json()['config']['digest']
+        self.assertEqual(self.get('/v2/app/blobs/' + config).json()['os'], 'linux')
+        missing = self.get('/v2/app/manifests/prod')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing.json()['errors'][0]['code'], 'MANIFEST_UNKNOWN')
+
+    def test_pagination(self):
+        """tags/list and _catalog are paged by Link headers"""
+        for tag in range(7):
+            self.fake.push('app', 'v{}'.format(tag))
+        self.fake.push('web')
+        tags = []
+        path = '/v2/app/tags/list?n=3'
+        while path:
+            response = self.get(path)
+            tags.extend(response.json()['tags'])
+            path = response.links.get('next', {}).get('url')
+        self.assertEqual(tags, ['v{}'.format(tag) for tag in range(7)])
+        self.assertEqual(self.fake.requests['registry.tags'], 3)
+        self.assertEqual(self.get('/v2/_catalog?n=1&last=app').json(),
+                         {'repositories': ['web']})
+
+    def test_basic_auth(self):
+        """Basic auth comes from the docker config, as docker login leaves it"""
+        self.fake.auth = 'basic'
+        self.fake.users = {'ci': 'secret'}
+        self.fake.push('app')
+        response = self.get('/v2/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.headers['WWW-Authenticate'], 'Basic realm="fake-registry"')
+        os.mkdir(join(self.home.name, '.docker'))
+        with open(join(self.home.name, '.docker', 'config.json'), 'w') as f:
+            json.dump({'auths': {'https://' + self.fake.endpoint: {
+                'auth': base64.b64encode(b'ci:secret').decode('ascii')}}}, f)
+        reg = Registry('localhost', self.fake.port, certdir=self.certs.path)
+        repo = Repository('app', 'latest', 'localhost', self.fake.port)
+        self.assertNotEqual(reg.get_build_date_of_repo(repo), '')
+
+    def test_token_auth(self):
+        """Bearer challenges point at a token service for the right scope"""
+        self.fake.auth = 'bearer'
+        self.fake.push('app')
+        challenge = self.get('/v2/app/tags/list').headers['WWW-Authenticate']
+        self.assertIn('scope="repository:app:pull"', challenge)
+        token = self.get('/token', params={'service': 'fake-registry',
+                                           'scope': 'repository:app:pull'}).json()['token']
+        headers = {'Authorization': 'Bearer ' + token}
+        self.assertEqual(self.get('/v2/app/tags/list', headers=headers).json()['tags'],
+                         ['latest'])
+        self.assertEqual(self.get('/v2/web/tags/list', headers=headers).status_code, 401)
+
+    def test_latency(self):
+        """Slow manifests slow down Registry by a round trip each"""
+        self.fake.push('app')
+        reg = Registry('localhost', self.fake.port, certdir=self.certs.path)
+        self.fake.latency_for['registry.manifests'] = 0.1
+        begin = time.monotonic()
+        reg.get_info_of_repo(Repository('app', 'latest', 'localhost', self.fake.port))
+        self.assertGreaterEqual(time.monotonic() - begin, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
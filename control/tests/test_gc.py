@@ -0,0 +1,93 @@
+"""Test removing the images rebuilds leave behind"""
+
+import unittest
+
+from control import aio, labels
+from control.fakes import FakeDocker
+from control.gc import apply_policy, collect, parse_age, remove_superseded, tagged
+from control.labels import label_dockerfile
+
+
+class FakeService:
+    """Just enough of a service to name an image"""
+
+    def __init__(self, service, image):
+        self.service = service
+        self.image = image
+
+
+def labeled(service):
+    return {labels.SERVICE: service.service, labels.IMAGE: service.image + ':latest'}
+
+
+class TestGC(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+        self.docker = FakeDocker().start()
+        self.addCleanup(self.docker.stop)
+        self.client = aio.AsyncDocker(self.docker.url)
+        self.addCleanup(self.client.close)
+        self.web = FakeService('web', 'web')
+        self.api = FakeService('api', 'api')
+
+    def build(self, service, created=None, size=100):
+        """Build an image for service the way docker does, taking its name"""
+        return self.docker.add_image(service.image, size=size, labels=labeled(service),
+                                     created=created)
+
+    def test_superseded(self):
+        """Only the image a build replaced goes"""
+        old = self.build(self.web)
+        other = self.build(self.api)
+        self.docker.add_image('busybox')
+        before = aio.run(tagged(self.client, [self.web, self.api]))
+        self.assertEqual(before, {'web:latest': old, 'api:latest': other})
+        new = self.build(self.web)
+        summary = aio.run(remove_superseded(self.client, [self.web, self.api], before))
+        self.assertEqual(summary.removed, [old])
+        self.assertEqual(summary.freed, 100)
+        self.assertNotIn(old, self.docker.images)
+        self.assertIn(new, self.docker.images)
+        self.assertIn(other, self.docker.images)
+        self.assertEqual(str(summary), 'Removed 1 image, freeing up to 100 B')
+
+    def test_in_use(self):
+        """Images a container still runs are kept"""
+        old = self.build(self.web, created=1000)
+        aio.run(self.client.create_container('web:latest', name='web'))
+        self.build(self.web, created=2000)
+        self.assertEqual(aio.run(collect(self.client, [self.web], dry_run=True)), [])
+        aio.run(self.client.remove_container('web'))
+        chosen = aio.run(collect(self.client, [self.web], dry_run=True))
+        self.assertEqual([image['Id'] for image in chosen], [old])
+        # Unlabeled images are never Control's to remove
+        self.docker.add_image('web', size=100)
+        self.build(self.web)
+        chosen = aio.run(collect(self.client, [self.web], dry_run=True))
+        self.assertEqual(len(chosen), 2)
+
+    def test_policy(self):
+        images = [{'Id': str(created), 'Created': created, 'Size': 10}
+                  for created in (400, 300, 200, 100)]
+        self.assertEqual(len(apply_policy(images, now=500)), 4)
+        self.assertEqual([i['Id'] for i in apply_policy(images, older_than=250, now=500)],
+                         ['200', '100'])
+        self.assertEqual([i['Id'] for i in apply_policy(images, keep_size=25, now=500)],
+                         ['200', '100'])
+        self.assertEqual(apply_policy(images, older_than=50, keep_size=100, now=500), [])
+
+    def test_parse_age(self):
+        self.assertEqual(parse_age('7d'), 7 * 24 * 60 * 60)
+        self.assertEqual(parse_age('90'), 90)
+        self.assertIsNone(parse_age(None))
+        with self.assertRaises(ValueError):
+            parse_age('soon')
+
+    def test_label_dockerfile(self):
+        dockerfile = label_dockerfile(b'FROM busybox', {'a.b': 'x y'})
+        self.assertEqual(dockerfile, b'FROM busybox\nLABEL "a.b"="x y"\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Test timing runs and keeping their history"""
+
+from os.path import join
+import tempfile
+import unittest
+
+from control.history import History, RunTimer, record_run
+
+
+class FakeClock:
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRunTimer(unittest.TestCase):
+    """Phases add up per service"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = RunTimer(clock=self.clock)
+
+    def test_not_running(self):
+        """Outside of a run nothing is counted"""
+        with self.timer.phase('web', 'stop'):
+            self.clock.now += 5
+        self.assertEqual(self.timer.timings, {})
+
+    def test_phases(self):
+        """Time in each phase is counted against the service"""
+        self.timer.start('build')
+        for phase, seconds in [('prebuild', 1), ('build', 30), ('build', 12)]:
+            with self.timer.phase('web', phase):
+                self.clock.now += seconds
+        with self.assertRaises(RuntimeError):
+            with self.timer.phase('db', 'pull'):
+                self.clock.now += 2
+                raise RuntimeError()
+        self.assertEqual(self.timer.stop(), 45)
+        self.assertEqual(self.timer.timings, {
+            ('web', 'prebuild'): 1, ('web', 'build'): 42, ('db', 'pull'): 2})
+        self.assertFalse(self.timer.running)
+
+    def test_table(self):
+        """Phases are in the order they happen, with totals"""
+        self.timer.start('default')
+        self.timer.add('web', 'start', 2)
+        self.timer.add('web', 'build', 75)
+        self.timer.add('db', 'start', 1.25)
+        self.assertEqual(self.timer.table(80).splitlines(), [
+            'service      build  start    total',
+            'db               -   1.2s     1.2s',
+            'web        1m15.0s   2.0s  1m17.0s',
+            'wall time                  1m20.0s',
+        ])
+
+
+class TestHistory(unittest.TestCase):
+    """Runs are kept in SQLite"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = join(self.temp_dir.name, 'control', 'history.sqlite')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_build(self, project, seconds, ok=True):
+        """Record a build run where each service took the given seconds"""
+        timer = RunTimer()
+        timer.start('build')
+        for service, secs in seconds.items():
+            timer.add(service, 'build', secs)
+        timer.stop()
+        record_run(project, timer, sum(seconds.values()), ok, path=self.path)
+
+    def test_medians(self):
+        """Medians come from successful runs of the same project"""
+        for secs in (10, 30, 20):
+            self.run_build('/a/Controlfile', {'web': secs, 'db': 1})
+        self.run_build('/a/Controlfile', {'web': 500}, ok=False)
+        self.run_build('/b/Controlfile', {'web': 1000})
+        history = History(self.path)
+        self.addCleanup(history.close)
+        self.assertEqual(history.medians('/a/Controlfile'), {'web': 20, 'db': 1})
+        self.assertEqual(history.durations('/a/Controlfile', limit=2)['web'], [20, 30])
+        self.assertEqual(history.medians('/a/Controlfile', phase='start'), {})
+
+    def test_command(self):
+        """The command that was run is what gets saved"""
+        self.run_build('/a/Controlfile', {'web': 10})
+        history = History(self.path)
+        self.addCleanup(history.close)
+        self.assertEqual(history.db.execute('SELECT command FROM runs').fetchall(),
+                         [('build',)])
+
+    def test_unwritable(self):
+        """A history that can't be written doesn't stop the run"""
+        timer = RunTimer()
+        timer.start('build')
+        timer.stop()
+        with open(join(self.temp_dir.name, 'file'), 'w'):
+            pass
+        with self.assertLogs('control.history', 'WARNING'):
+            record_run('/a/Controlfile', timer, 1, True,
+                       path=join(self.temp_dir.name, 'file', 'history.sqlite'))
+
+
+if __name__ == '__main__':
+    unittest.main()
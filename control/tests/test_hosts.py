@@ -0,0 +1,291 @@
+"""Test spreading builds over several docker hosts"""
+
+import io
+import json
+import os
+from os.path import join
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import docker
+
+from control.buildcontext import DOCKERFILE, BuildContext
+from control.exceptions import ControlException, HostUnavailable
+from control.fakes import FakeDocker
+from control.hosts import DEFAULT_HOST, DockerHost, HostPool, _tls_config, host_entries
+from control.scheduling import Scheduler
+
+GRAPH = {'base': set(), 'api': {'base'}, 'web': {'base'}, 'worker': {'api'}}
+IMAGES = {name: 'registry.example.com:5000/{}:latest'.format(name) for name in GRAPH}
+NEEDS = {name: [IMAGES[dep] for dep in deps] for name, deps in GRAPH.items()}
+
+
+class FakeClient:
+    """Just enough of docker.Client for the pool"""
+
+    def __init__(self, ncpu=2, running=0, reachable=True):
+        self.ncpu = ncpu
+        self.running = running
+        self.reachable = reachable
+        self.images = {}
+        self.pushed = []
+        self.pulled = []
+
+    def info(self):
+        if not self.reachable:
+            raise OSError('Connection refused')
+        return {'NCPU': self.ncpu, 'ContainersRunning': self.running}
+
+    def get_image(self, image):
+        return io.BytesIO(json.dumps({'image': image, 'data': self.images[image]}).encode())
+
+    def load_image(self, data):
+        loaded = json.loads(data.read().decode())
+        self.images[loaded['image']] = loaded['data']
+
+    def push(self, repository, tag=None, stream=False):
+        self.pushed.append((repository, tag))
+        return [b'{"status": "Pushed"}\r\n']
+
+    def pull(self, repository, tag=None, stream=False):
+        self.pulled.append((repository, tag))
+        if repository.endswith('missing'):
+            return [b'{"error": "not found"}\r\n']
+        return [b'{"status": "Downloaded"}\r\n']
+
+
+def _hosts(*clients):
+    return [DockerHost('tcp://build{}:2376'.format(index), client)
+            for index, client in enumerate(clients)]
+
+
+class TestEntries(unittest.TestCase):
+    """Where the list of hosts comes from"""
+
+    def test_precedence(self):
+        """The command line, then the Controlfile, then DOCKER_HOST"""
+        environ = {'DOCKER_HOST': 'tcp://a:2376, tcp://b:2376'}
+        self.assertEqual(host_entries(['unix:///a.sock,unix:///b.sock', 'tcp://c:2375'],
+                                      ['tcp://d:2376'], environ),
+                         ['unix:///a.sock', 'unix:///b.sock', 'tcp://c:2375'])
+        entry = {'url': 'tcp://d:2376', 'builds': 3}
+        self.assertEqual(host_entries(None, [entry], environ), [entry])
+        self.assertEqual(host_entries(None, [], environ), ['tcp://a:2376', 'tcp://b:2376'])
+        self.assertEqual(host_entries(None, None, {}), [DEFAULT_HOST])
+
+    def test_tls(self):
+        """TCP hosts use the certificates in their cert_path when they want TLS"""
+        with tempfile.TemporaryDirectory() as certs:
+            for name in ('cert.pem', 'key.pem', 'ca.pem'):
+                open(join(certs, name), 'w').close()
+            with mock.patch.dict(os.environ, {}, clear=True):
+                self.assertFalse(_tls_config({'url': 'tcp://a:2375'}))
+                self.assertFalse(_tls_config({'url': 'unix:///a.sock', 'tls': True}))
+                tls = _tls_config({'url': 'tcp://a:2376', 'tls': True, 'cert_path': certs})
+            self.assertEqual(tls.cert, (join(certs, 'cert.pem'), join(certs, 'key.pem')))
+            self.assertEqual(tls.ca_cert, join(certs, 'ca.pem'))
+            with mock.patch.dict(os.environ, {'DOCKER_TLS_VERIFY': '1',
+                                              'DOCKER_CERT_PATH': certs}):
+                self.assertEqual(_tls_config({'url': 'tcp://a:2376'}).ca_cert,
+                                 join(certs, 'ca.pem'))
+
+
+class TestPool(unittest.TestCase):
+    """Picking hosts, and moving images between them"""
+
+    def test_refresh(self):
+        """Hosts that can't be reached are left out, and the rest are sized up"""
+        pool = HostPool(_hosts(FakeClient(reachable=False), FakeClient(ncpu=8, running=2)))
+        pool.refresh()
+        self.assertEqual([host.name for host in pool.hosts], ['tcp://build1:2376'])
+        self.assertEqual(pool.primary.builds, 4)
+        self.assertEqual(pool.primary.busy, 2)
+        with self.assertRaises(HostUnavailable):
+            HostPool(_hosts(FakeClient(reachable=False))).refresh()
+
+    def test_acquire(self):
+        """The least loaded host wins, then the one that has the images"""
+        pool = HostPool(_hosts(FakeClient(ncpu=4), FakeClient(ncpu=4), FakeClient(ncpu=4,
+                                                                               running=4)))
+        pool.refresh()
+        first, second, busy = pool.hosts
+        pool.built('base', second)
+        self.assertIs(pool.acquire(['base']), second)
+        self.assertIs(pool.acquire(['base']), first)
+        self.assertIs(pool.acquire(), first)
+        self.assertIs(pool.acquire(), second)
+        self.assertIs(pool.acquire(), busy)
+
+    def test_acquire_waits(self):
+        """With every slot taken, acquire waits for a release"""
+        pool = HostPool(_hosts(FakeClient(ncpu=1)))
+        pool.refresh()
+        host = pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertEqual(got, [])
+        pool.release(host)
+        waiter.join(5)
+        self.assertEqual(got, [host])
+
+    def test_stream(self):
+        """Images go from docker save on one host to docker load on another, once"""
+        pool = HostPool(_hosts(FakeClient(), FakeClient()))
+        first, second = pool.hosts
+        first.client.images['base'] = 'layers'
+        self.assertFalse(pool.ensure('base', second))
+        pool.built('base', first)
+        self.assertTrue(pool.ensure('base', second))
+        self.assertFalse(pool.ensure('base', second))
+        self.assertEqual(second.client.images, {'base': 'layers'})
+        self.assertEqual(pool.transfers, [('base', first, second)])
+
+    def test_registry(self):
+        """Or they're pushed from one host and pulled on the other"""
+        pool = HostPool(_hosts(FakeClient(), FakeClient()), transfer='registry')
+        first, second = pool.hosts
+        pool.built(IMAGES['base'], first)
+        pool.ensure(IMAGES['base'], second)
+        self.assertEqual(first.client.pushed, [('registry.example.com:5000/base', 'latest')])
+        self.assertEqual(second.client.pulled, [('registry.example.com:5000/base', 'latest')])
+        pool.built('registry.example.com:5000/missing', first)
+        with self.assertRaises(ControlException):
+            pool.ensure('registry.example.com:5000/missing', second)
+        pool.built('local', first)
+        with self.assertRaises(ControlException):
+            pool.ensure('local', second)
+
+
+class TestRun(unittest.TestCase):
+    """Running a build schedule over the pool"""
+
+    def setUp(self):
+        self.pool = HostPool(_hosts(FakeClient(ncpu=2), FakeClient(ncpu=2)))
+        self.pool.refresh()
+        self.lock = threading.Lock()
+        self.builds = []
+
+    def build(self, name, host):
+        """Build by putting the image on the host, after checking what it's FROM"""
+        with self.lock:
+            self.builds.append((name, host))
+        for image in NEEDS[name]:
+            if image not in host.client.images:
+                return False
+        host.client.images[IMAGES[name]] = name
+        return True
+
+    def test_spread(self):
+        """Independent builds go to different hosts at once"""
+        started = threading.Barrier(2, timeout=5)
+
+        def build(name, host):  # pylint: disable=missing-docstring
+            if name in ('api', 'web'):
+                started.wait()
+            return self.build(name, host)
+        self.assertTrue(self.pool.run(Scheduler(GRAPH, GRAPH), build, IMAGES, NEEDS))
+        hosts = {name: host for name, host in self.builds}
+        self.assertNotEqual(hosts['api'], hosts['web'])
+        # base went to wherever it was needed, and everything ends up on the first host
+        self.assertIn((IMAGES['base'], hosts['base']),
+                      [(image, source) for image, source, _ in self.pool.transfers])
+        self.pool.gather(IMAGES[name] for name in sorted(GRAPH))
+        self.assertEqual(sorted(self.pool.primary.client.images), sorted(IMAGES.values()))
+
+    def test_parent_elsewhere(self):
+        """
+        A build on another host than its FROM image gets the image moved
+        over, even when recording where the image was built is slow
+        """
+        graph = {'base': set(), 'api': {'base'}}
+        first, second = self.pool.hosts
+        built = self.pool.built
+
+        def acquire(images=()):
+            """base goes to the first host, and api, as if it were busy, to the second"""
+            host = second if images else first
+            with self.pool.lock:
+                host.active += 1
+            return host
+
+        def slow(image, host):  # pylint: disable=missing-docstring
+            threading.Event().wait(0.1)
+            built(image, host)
+
+        with mock.patch.object(self.pool, 'acquire', acquire), \
+                mock.patch.object(self.pool, 'built', slow):
+            self.assertTrue(self.pool.run(Scheduler(graph, graph), self.build, IMAGES, NEEDS))
+        self.assertEqual(self.builds, [('base', first), ('api', second)])
+        self.assertEqual(self.pool.transfers, [(IMAGES['base'], first, second)])
+
+    def test_failure(self):
+        """A failed build stops anything else from starting"""
+        def build(name, host):  # pylint: disable=missing-docstring
+            return False if name == 'base' else self.build(name, host)
+        self.assertFalse(self.pool.run(Scheduler(GRAPH, GRAPH), build, IMAGES, NEEDS))
+        self.assertEqual([name for name, _ in self.builds], [])
+
+    def test_exception(self):
+        """An exception fails the run instead of leaving other builds waiting"""
+        def build(name, host):  # pylint: disable=missing-docstring
+            if name == 'api':
+                raise RuntimeError('docker went away')
+            return self.build(name, host)
+        self.assertFalse(self.pool.run(Scheduler(GRAPH, GRAPH), build, IMAGES, NEEDS))
+        self.assertNotIn('worker', [name for name, _ in self.builds])
+
+    def test_skipped(self):
+        """Skipped services don't hold up what comes after them"""
+        def build(name, host):  # pylint: disable=missing-docstring
+            return None if name == 'base' else True
+        self.assertTrue(self.pool.run(Scheduler(GRAPH, GRAPH), build, IMAGES, NEEDS))
+        self.assertNotIn(IMAGES['base'], self.pool.locations)
+
+
+class TestFakeDaemons(unittest.TestCase):
+    """Builds across several fake docker daemons, through docker-py"""
+
+    def setUp(self):
+        self.fakes = []
+        for index in range(3):
+            fake = FakeDocker(remote=['busybox:latest'], name='fake{}'.format(index),
+                              ncpu=2).start()
+            self.addCleanup(fake.stop)
+            self.fakes.append(fake)
+        self.pool = HostPool([DockerHost(fake.url, docker.Client(base_url=fake.url))
+                              for fake in self.fakes])
+        try:
+            self.pool.refresh()
+        except HostUnavailable:
+            self.skipTest('this docker-py cannot talk to the fake daemons')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def build(self, name, host):
+        """Build a context FROM the service's upstream on host"""
+        upstream = sorted(NEEDS[name])[0] if NEEDS[name] else 'busybox'
+        path = join(self.temp_dir.name, name)
+        os.makedirs(path, exist_ok=True)
+        context = BuildContext(path, 'FROM {}\nLABEL service={}\n'.format(
+            upstream, name).encode('utf-8'))
+        for line in host.client.build(fileobj=context.stream(), custom_context=True,
+                                      tag=IMAGES[name], dockerfile=DOCKERFILE):
+            if 'error' in json.loads(line.decode('utf-8')):
+                return False
+        return True
+
+    def test_build(self):
+        """Everything builds, and ends up on the first daemon"""
+        self.assertTrue(self.pool.run(Scheduler(GRAPH, GRAPH), self.build, IMAGES, NEEDS))
+        self.pool.gather(IMAGES[name] for name in sorted(GRAPH))
+        for image in IMAGES.values():
+            self.assertTrue(self.fakes[0].image(image))
+        self.assertGreater(len({host for _, _, host in self.pool.transfers}), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""Test sharing images through a cache directory"""
+
+import io
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from control.context import RunContext
+from control.functions import build_prod
+from control.imagecache import (DirectoryCache, load_image, open_image_cache,
+                                parse_size, save_image)
+
+
+class FakeClient:
+    """Just enough of docker.Client to save and load images"""
+
+    def __init__(self):
+        self.images = {}
+        self.loaded = []
+
+    def get_image(self, image):
+        return io.BytesIO(self.images[image])
+
+    def load_image(self, data):
+        self.loaded.append(data.read())
+
+
+class TestDirectoryCache(unittest.TestCase):
+    """The directory backend"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = DirectoryCache(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_miss(self):
+        """Nothing has been stored yet"""
+        self.assertIsNone(self.cache.fetch('a' * 64))
+
+    def test_round_trip(self):
+        """An image saved can be loaded back"""
+        client = FakeClient()
+        client.images['web:latest'] = b'tarball' * 1000
+        save_image(self.cache, 'a' * 64, 'web:latest', client)
+        self.assertTrue(load_image(self.cache, 'a' * 64, client))
+        self.assertEqual(client.loaded, [b'tarball' * 1000])
+        self.assertFalse(load_image(self.cache, 'b' * 64, client))
+
+    def test_lru_eviction(self):
+        """The images used longest ago go first"""
+        cache = DirectoryCache(self.temp_dir.name, max_size='35')
+        for i, key in enumerate(['aa', 'bb', 'cc']):
+            cache.store(key, io.BytesIO(b'x' * 10))
+            os.utime(cache.path(key), (i, i))
+        # Three images fit. Using aa makes bb the oldest, so a fourth evicts bb
+        cache.fetch('aa').close()
+        cache.store('dd', io.BytesIO(b'x' * 10))
+        self.assertIsNone(cache.fetch('bb'))
+        for key in ('aa', 'cc', 'dd'):
+            with cache.fetch(key) as f:
+                self.assertEqual(f.read(), b'x' * 10)
+
+    def test_concurrent_agents(self):
+        """Agents storing at the same time never leave half an image"""
+        caches = [DirectoryCache(self.temp_dir.name) for _ in range(4)]
+
+        def store(cache, fill):
+            for _ in range(10):
+                cache.store('shared', io.BytesIO(fill * 100000))
+                time.sleep(0.001)
+        threads = [threading.Thread(target=store, args=(cache, bytes([65 + i])))
+                   for i, cache in enumerate(caches)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with caches[0].fetch('shared') as f:
+            data = f.read()
+        self.assertEqual(len(data), 100000)
+        self.assertEqual(len(set(data)), 1)
+        self.assertEqual([n for n in os.listdir(self.temp_dir.name)
+                          if n.startswith('.incoming')], [])
+
+
+class TestHelpers(unittest.TestCase):
+    """Sizes and cache locations"""
+
+    def test_parse_size(self):
+        """Sizes are decimal like docker's"""
+        self.assertEqual(parse_size('20G'), 20 * 1000 ** 3)
+        self.assertEqual(parse_size('1.5mb'), 1500000)
+        self.assertEqual(parse_size('100'), 100)
+        self.assertIsNone(parse_size(None))
+        with self.assertRaises(ValueError):
+            parse_size('lots')
+
+    def test_open(self):
+        """Locations with and without a scheme make a directory cache"""
+        with tempfile.TemporaryDirectory() as d:
+            self.assertIsInstance(open_image_cache(d), DirectoryCache)
+            self.assertIsInstance(open_image_cache('dir://' + d), DirectoryCache)
+            self.assertIsNone(open_image_cache(None))
+            with self.assertRaises(ValueError):
+                open_image_cache('s3://bucket')
+
+    def test_bad_arguments(self):
+        """build-prod stops on a cache it can't use, instead of a traceback"""
+        for argv in (['--image-cache', 's3://bucket'], ['--image-cache-size', 'lots']):
+            args = RunContext.parse(['build-prod', '--dry-run', '--image-cache', '/tmp'] + argv)
+            with self.assertLogs('control.functions', 'CRITICAL'):
+                self.assertFalse(build_prod(args, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
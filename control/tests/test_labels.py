@@ -0,0 +1,95 @@
+"""Test the labels Control finds its own containers by"""
+
+import contextlib
+import io
+import json
+from os.path import join
+import tempfile
+import unittest
+
+from control import aio, labels
+from control.context import RunContext
+from control.controlfile import Controlfile
+from control.fakes import FakeDocker
+from control.functions import async_start, async_stop
+
+
+class TestLabels(unittest.TestCase):
+    """An api with a named volume, and a worker, started in one session"""
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+        self.fake = FakeDocker(images=['busybox:latest']).start()
+        self.addCleanup(self.fake.stop)
+        self.client = aio.AsyncDocker(self.fake.url)
+        self.addCleanup(self.client.close)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.ctrl = self.controlfile({
+            'api': {'image': 'busybox', 'container': {
+                'volumes': ['data:/data', '/cache'], 'labels': {'team': 'web'}}},
+            'worker': {'image': 'busybox', 'container': {}},
+        })
+        self.args = RunContext.parse(['start', 'api', 'worker']).replace(session='one')
+
+    def controlfile(self, services):
+        path = join(self.directory.name, 'Controlfile')
+        with open(path, 'w') as f:
+            json.dump({'services': services}, f)
+        return Controlfile(path)
+
+    def run_quietly(self, coro):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return aio.run(coro)
+
+    def test_start(self):
+        """Containers and named volumes carry the project, service and session"""
+        self.run_quietly(async_start(self.args, self.ctrl, self.client))
+        found = self.fake.container('api')['Config']['Labels']
+        self.assertEqual(found[labels.PROJECT], self.directory.name)
+        self.assertEqual(found[labels.SERVICE], 'api')
+        self.assertEqual(found[labels.CONTROLFILE], join(self.directory.name, 'Controlfile'))
+        self.assertEqual(found[labels.SESSION], 'one')
+        self.assertEqual(found[labels.CONFIG],
+                         labels.config_hash(self.ctrl.services['api'], False))
+        # The Controlfile's own labels stay
+        self.assertEqual(found['team'], 'web')
+        self.assertEqual(self.fake.volumes['data']['Labels'][labels.SERVICE], 'api')
+        containers = aio.run(labels.project_containers(self.client, self.ctrl))
+        self.assertEqual(sorted(labels.container_name(c) for c in containers),
+                         ['api', 'worker'])
+        self.assertEqual(labels.orphans(containers, self.ctrl, 'one'), [])
+
+    def test_config_hash(self):
+        """The hash follows the configuration, not what preparing the options leaves in it"""
+        api = self.ctrl.services['api']
+        before = labels.config_hash(api, False)
+        api.prepare_container_options(prod=False, client=self.client)
+        self.assertEqual(labels.config_hash(api, False), before)
+        self.assertNotEqual(labels.config_hash(api.copy(command='sh'), False), before)
+
+    def test_orphans(self):
+        """A renamed service and another session's holder are removed with --remove-orphans"""
+        self.run_quietly(async_start(self.args, self.ctrl, self.client))
+        holder = self.ctrl.services['api'].copy(name='api-holder', entrypoint='/bin/cat')
+        aio.run(self.client.create_container('busybox', name='api-holder', labels=(
+            labels.container_labels(self.ctrl, holder, self.args, role='holder'))))
+        renamed = self.controlfile({
+            'api': {'image': 'busybox', 'container': {'volumes': ['data:/data']}},
+            'jobs': {'image': 'busybox', 'container': {}},
+        })
+        containers = aio.run(labels.project_containers(self.client, renamed))
+        self.assertEqual(sorted(labels.container_name(c)
+                                for c in labels.orphans(containers, renamed, 'two')),
+                         ['api-holder', 'worker'])
+
+        args = RunContext.parse(['stop', 'api', 'jobs']).replace(session='two')
+        self.run_quietly(async_stop(args, renamed, self.client))
+        self.assertEqual(sorted(c['Name'] for c in self.fake.containers.values()),
+                         ['/api-holder', '/worker'])
+        self.run_quietly(async_stop(args.replace(remove_orphans=True), renamed, self.client))
+        self.assertEqual(self.fake.containers, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
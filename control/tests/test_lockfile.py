@@ -0,0 +1,134 @@
+"""Test Controlfile.lock, and pinning FROM images to their digests"""
+
+import contextlib
+import io
+import json
+import os
+from os.path import join
+import tempfile
+import unittest
+from unittest import mock
+
+from control import aio
+from control.context import RunContext
+from control.controlfile import Controlfile
+from control.dependencies import read_dockerfile
+from control.fakes import FakeDocker, FakeRegistry
+from control.functions import async_lock
+from control.lockfile import LOCKFILE, lockable, read_lock, write_lock
+
+
+class TestLockfile(unittest.TestCase):
+    """
+    base is built FROM busybox, api FROM base, web FROM the registry's app
+    by its fromline, and scratch FROM nothing at all
+    """
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+        self.fake = FakeRegistry().start()
+        self.addCleanup(self.fake.stop)
+        self.docker = FakeDocker(images=['busybox:latest']).start()
+        self.addCleanup(self.docker.stop)
+        self.client = aio.AsyncDocker(self.docker.url)
+        self.addCleanup(self.client.close)
+        # Keep AsyncRegistry away from the real ~/.docker/config.json
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        patcher = mock.patch.dict(os.environ, {'HOME': self.temp_dir.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.app = 'localhost:{}/app:dev'.format(self.fake.port)
+        services = {
+            'base': ('busybox', {}),
+            'api': ('base', {}),
+            'web': ('busybox', {'fromline': 'FROM {}'.format(self.app)}),
+            'scratch': ('scratch', {}),
+        }
+        conf = {'services': {}}
+        for name, (upstream, extra) in services.items():
+            os.mkdir(join(self.temp_dir.name, name))
+            with open(join(self.temp_dir.name, name, 'Dockerfile'), 'w') as f:
+                f.write('FROM {}\nRUN true\n'.format(upstream))
+            conf['services'][name] = dict(extra, image=name, container={},
+                                          dockerfile='{}/Dockerfile'.format(name))
+        with open(join(self.temp_dir.name, 'Controlfile'), 'w') as f:
+            json.dump(conf, f)
+        self.ctrl = Controlfile(join(self.temp_dir.name, 'Controlfile'))
+
+    def lock(self, *argv):
+        """Run control lock, keeping what it prints"""
+        out = io.StringIO()
+        args = RunContext.parse(['lock', '--no-verify'] + list(argv))
+        with contextlib.redirect_stdout(out):
+            ok = aio.run(async_lock(args, self.ctrl, self.client))
+        return ok, out.getvalue()
+
+    def test_lockable(self):
+        """Only images the Controlfile doesn't build are pinned"""
+        self.assertEqual(sorted(lockable(self.ctrl)), ['busybox:latest', self.app])
+
+    def test_read_write(self):
+        self.assertEqual(read_lock(self.ctrl), {})
+        path = write_lock(self.ctrl, {'busybox:latest': 'sha256:' + 'a' * 64})
+        self.assertEqual(path, join(self.temp_dir.name, LOCKFILE))
+        self.assertEqual(read_lock(self.ctrl), {'busybox:latest': 'sha256:' + 'a' * 64})
+        with open(path, 'w') as f:
+            f.write('not json')
+        self.assertEqual(read_lock(self.ctrl), {})
+
+    def test_lock(self):
+        """Registry images are pinned by the registry, and Hub images by docker"""
+        digest = self.fake.push('app', 'dev')
+        ok, out = self.lock()
+        # busybox was never pulled, so docker doesn't know its digest
+        self.assertFalse(ok)
+        self.assertIn('busybox:latest: could not find its digest', out)
+        self.assertEqual(read_lock(self.ctrl), {self.app: digest})
+
+        aio.run(self._pull('busybox'))
+        pulled = self.docker.image('busybox:latest')['RepoDigests'][0].split('@')[1]
+        manifests = self.fake.requests['registry.manifests']
+        ok, out = self.lock()
+        self.assertTrue(ok)
+        self.assertEqual(read_lock(self.ctrl), {self.app: digest, 'busybox:latest': pulled})
+        # app was pinned already
+        self.assertEqual(self.fake.requests['registry.manifests'], manifests)
+
+    def test_update(self):
+        """Pins only move with --update"""
+        old = self.fake.push('app', 'dev', created=1000000000)
+        self.lock()
+        new = self.fake.push('app', 'dev', created=2000000000)
+        self.assertNotEqual(old, new)
+        self.lock()
+        self.assertEqual(read_lock(self.ctrl)[self.app], old)
+        _, out = self.lock('--update')
+        self.assertIn('{} {}'.format(self.app, new), out)
+        self.assertEqual(read_lock(self.ctrl)[self.app], new)
+        # Gone from the registry, so the pin stays where it was
+        self.fake.remove('app', 'dev')
+        _, out = self.lock('--update')
+        self.assertIn('keeping ' + new, out)
+        self.assertEqual(read_lock(self.ctrl)[self.app], new)
+
+    def test_pinned_build(self):
+        """A pinned FROM line builds FROM the digest"""
+        digest = 'sha256:' + 'b' * 64
+        upstream, dockerfile = read_dockerfile(self.ctrl.services['web'], 'dev',
+                                               {self.app: digest})
+        self.assertEqual(upstream.digest, digest)
+        self.assertEqual(upstream.repo, self.app)
+        self.assertEqual(dockerfile.decode('utf-8').splitlines()[0],
+                         'FROM localhost:{}/app@{}'.format(self.fake.port, digest))
+        upstream, _ = read_dockerfile(self.ctrl.services['web'], 'dev')
+        self.assertIsNone(upstream.digest)
+
+    async def _pull(self, image):
+        async for _ in self.client.pull(image, tag='latest'):
+            pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""Test control logs, following many containers at once"""
+
+import asyncio
+import io
+import time
+import unittest
+
+from control import aio
+from control.fakes import FakeDocker
+from control.logs import LogLine, follow_logs, parse_timestamp, show_logs
+
+
+class TestLogs(unittest.TestCase):
+    """api and worker running, and a db with no container"""
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+        self.fake = FakeDocker(images=['busybox:latest']).start()
+        self.addCleanup(self.fake.stop)
+        self.client = aio.AsyncDocker(self.fake.url)
+        self.addCleanup(self.client.close)
+        for name in ('api', 'worker'):
+            aio.run(self.start(name))
+        self.names = {'api': 'api', 'worker': 'worker', 'db': 'db'}
+
+    async def start(self, name):
+        created = await self.client.create_container('busybox', name=name)
+        await self.client.start(created)
+
+    async def until(self, check, timeout=5):
+        """Wait for check() to be true"""
+        deadline = time.monotonic() + timeout
+        while not check():
+            self.assertLess(time.monotonic(), deadline, 'timed out')
+            await asyncio.sleep(0.01)
+
+    def test_show(self):
+        """Lines from every container are printed in the order they were written"""
+        self.fake.emit_log('api', 'one\n')
+        self.fake.emit_log('worker', 'two\n', stream=2)
+        self.fake.emit_log('api', 'three\npartial')
+        out = io.StringIO()
+        aio.run(show_logs(self.client, self.names, out=out))
+        self.assertEqual(out.getvalue().splitlines(), [
+            'api    | one', 'worker | two', 'api    | three', 'api    | partial'])
+        out = io.StringIO()
+        aio.run(show_logs(self.client, self.names, tail='1', out=out))
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['worker | two', 'api    | three', 'api    | partial'])
+
+    def test_follow(self):
+        """Following picks a restarted container up where it left off"""
+        out = io.StringIO()
+
+        async def scenario():  # pylint: disable=missing-docstring
+            stop = asyncio.Event()
+            following = asyncio.ensure_future(follow_logs(
+                self.client, self.names, out=out, window=0.01, stop=stop))
+            self.fake.emit_log('api', 'before\n')
+            await self.until(lambda: 'before' in out.getvalue())
+            await self.client.stop('api')
+            await self.client.start('api')
+            await self.start('db')
+            self.fake.emit_log('api', 'after\n')
+            self.fake.emit_log('db', 'ready\n')
+            await self.until(lambda: 'ready' in out.getvalue() and 'after' in out.getvalue())
+            stop.set()
+            await following
+        aio.run(scenario())
+        self.assertEqual(out.getvalue().splitlines(),
+                         ['api    | before', 'api    | after', 'db     | ready'])
+
+    def test_reader_gone(self):
+        """Following ends when what it prints to can't be written to any more"""
+
+        class Closed(io.StringIO):  # pylint: disable=missing-docstring
+            def write(self, text):
+                raise BrokenPipeError(32, 'Broken pipe')
+
+        self.fake.emit_log('api', 'nobody reads this\n')
+        aio.run(asyncio.wait_for(follow_logs(self.client, self.names, out=Closed(),
+                                             window=0.01), 5))
+
+    def test_parse(self):
+        self.assertEqual(parse_timestamp('2016-01-02T03:04:05.5Z'), 1451703845.5)
+        self.assertEqual(parse_timestamp('2016-01-02T03:04:05Z'), 1451703845)
+        line = LogLine.parse('api', b'2016-01-02T03:04:05.000000001Z hello\r')
+        self.assertEqual(line.line, 'hello')
+        self.assertLess(line, LogLine.parse('api', b'2016-01-02T03:04:05.1Z later'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Test images.json, the manifest of the images build-prod built"""
+
+import json
+import os
+from os.path import join
+import tempfile
+import unittest
+
+import docker
+
+from control.context import RunContext
+from control.controlfile import Controlfile
+from control.fakes import FakeDocker
+from control.functions import build_prod_service, prod_defaults
+from control.imagecache import DirectoryCache
+from control.manifest import ImageManifest, repo_digest
+from control.metrics import BuildMetrics
+from control.repository import Repository
+
+UPSTREAM = 'sha256:' + 'a' * 64
+BUILT = 'sha256:' + 'b' * 64
+
+
+class TestManifest(unittest.TestCase):
+    """api was rebuilt FROM a pinned busybox, and db came out the same as before"""
+
+    def setUp(self):
+        self.manifest = ImageManifest()
+        self.manifest.add('api', 'registry:5000/api:1', {
+            'Id': 'sha256:new', 'Size': 100,
+            'RepoDigests': ['registry:5000/other@sha256:x', 'registry:5000/api@' + BUILT],
+        }, 'sha256:old', Repository.match('busybox').pin(UPSTREAM), None, 'hash')
+        self.manifest.add('db', 'db', {'Id': 'sha256:same', 'Size': 50}, 'sha256:same',
+                          Repository.match('busybox'), {'RepoDigests': ['busybox@' + UPSTREAM]})
+
+    def test_entries(self):
+        metrics = BuildMetrics()
+        metrics.start()
+        metrics.set('api', build_seconds=1.5, cache_hit=0)
+        metrics.set('db', build_seconds=0.5, cache_hit=1)
+        images = json.loads(self.manifest.as_json(metrics))['images']
+        self.assertEqual(images['api'], {
+            'image': 'registry:5000/api:1', 'id': 'sha256:new', 'digest': BUILT,
+            'changed': True, 'upstream': 'busybox:latest', 'upstream_digest': UPSTREAM,
+            'input_hash': 'hash', 'size': 100, 'build_seconds': 1.5, 'cache_hit': False})
+        self.assertFalse(images['db']['changed'])
+        self.assertIsNone(images['db']['digest'])
+        self.assertEqual(images['db']['upstream_digest'], UPSTREAM)
+        self.assertTrue(images['db']['cache_hit'])
+        self.assertIsNone(json.loads(self.manifest.as_json())['images']['db']['build_seconds'])
+
+    def test_digest(self):
+        self.assertEqual(repo_digest({'RepoDigests': ['busybox@' + UPSTREAM]}, 'busybox'),
+                         UPSTREAM)
+        self.assertIsNone(repo_digest({'RepoDigests': ['busybox2@' + UPSTREAM]}, 'busybox'))
+        self.assertIsNone(repo_digest(None, 'busybox'))
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.manifest.write(directory)
+            self.assertEqual(os.listdir(directory), ['images.json'])
+            with open(path) as f:
+                self.assertEqual(sorted(json.load(f)['images']), ['api', 'db'])
+
+
+class TestBuildProd(unittest.TestCase):
+    """api is built FROM busybox, and empty has a Dockerfile with no FROM line"""
+
+    def setUp(self):
+        self.fake = FakeDocker(images=['busybox:latest']).start()
+        self.addCleanup(self.fake.stop)
+        self.client = docker.Client(base_url=self.fake.url)
+        try:
+            self.client.version()
+        except (docker.errors.APIError, OSError, ValueError):
+            self.skipTest('this docker-py cannot talk to the fake daemon')
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        conf = {'services': {}}
+        for name, dockerfile in (('api', 'FROM busybox\nRUN true\n'), ('empty', '# nothing\n')):
+            os.mkdir(join(self.temp_dir.name, name))
+            with open(join(self.temp_dir.name, name, 'Dockerfile'), 'w') as f:
+                f.write(dockerfile)
+            conf['services'][name] = {'image': name, 'container': {},
+                                      'dockerfile': '{}/Dockerfile'.format(name)}
+        with open(join(self.temp_dir.name, 'Controlfile'), 'w') as f:
+            json.dump(conf, f)
+        self.ctrl = Controlfile(join(self.temp_dir.name, 'Controlfile'))
+        self.args = prod_defaults(RunContext.parse(['build-prod', '--no-pull']))
+
+    def build(self, name, manifest, cache=None):
+        """Build name with build-prod"""
+        return build_prod_service(name, self.ctrl.services[name], self.args, cache,
+                                  self.client, manifest=manifest)
+
+    def test_built(self):
+        """Only what was built goes in"""
+        manifest = ImageManifest()
+        self.assertTrue(self.build('api', manifest))
+        self.assertIsNone(self.build('empty', manifest))
+        self.assertIn('api', manifest)
+        self.assertNotIn('empty', manifest)
+        entry = json.loads(manifest.as_json())['images']['api']
+        self.assertEqual(entry['id'], self.fake.image('api')['Id'])
+        self.assertTrue(entry['changed'])
+        self.assertEqual(entry['upstream'], 'busybox:latest')
+        self.assertEqual(len(entry['input_hash']), 64)
+
+
+    def test_upstream_pulled_by_build(self):
+        """An upstream the build had to pull still gets the image cached"""
+        self.client.remove_image('busybox:latest')
+        self.fake.add_remote('busybox:latest')
+        cache = DirectoryCache(join(self.temp_dir.name, 'cache'))
+        manifest = ImageManifest()
+        self.assertTrue(self.build('api', manifest, cache))
+        key = json.loads(manifest.as_json())['images']['api']['input_hash']
+        self.assertEqual(len(key), 64)
+        self.assertTrue(os.path.exists(cache.path(key)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Test the metrics build-prod writes for CI"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from control import aio
+from control.fakes import FakeRegistry
+from control.metrics import BuildMetrics, build_metrics
+from control.repository import Repository
+
+
+class FakeClock:
+    """A monotonic clock that moves a second each time it is read"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+class TestMetrics(unittest.TestCase):
+    """A run that built api, loaded db from the image cache, and asked a registry twice"""
+
+    def setUp(self):
+        self.metrics = BuildMetrics(clock=FakeClock())
+        self.metrics.start()
+        with self.metrics.timed('api'):
+            pass
+        self.metrics.set('api', context_bytes=2048, pull_bytes=100, cache_hit=0,
+                         image_bytes=4096)
+        self.metrics.set('db', cache_hit=1)
+        self.metrics.registry_request('docker.petrode.com', 0.25)
+        self.metrics.registry_request('docker.petrode.com', 0.5)
+        self.metrics.stop(True)
+
+    def test_prometheus(self):
+        text = self.metrics.prometheus()
+        lines = text.splitlines()
+        self.assertIn('# TYPE control_build_seconds gauge', lines)
+        self.assertIn('control_build_seconds{service="api"} 1', lines)
+        self.assertIn('control_build_image_bytes{service="api"} 4096', lines)
+        self.assertIn('control_build_cache_hit{service="db"} 1', lines)
+        self.assertNotIn('control_build_seconds{service="db"}', text)
+        self.assertIn('control_registry_requests_total{registry="docker.petrode.com"} 2', lines)
+        self.assertIn(
+            'control_registry_request_seconds_total{registry="docker.petrode.com"} 0.75', lines)
+        self.assertIn('control_build_success 1', lines)
+
+    def test_json(self):
+        found = json.loads(self.metrics.as_json())
+        self.assertTrue(found['ok'])
+        self.assertEqual(found['services']['api']['context_bytes'], 2048)
+        self.assertEqual(found['registries']['docker.petrode.com'],
+                         {'requests': 2, 'seconds': 0.75})
+
+    def test_escape(self):
+        self.metrics.start()
+        self.metrics.set('a"b\\c', cache_hit=0)
+        self.assertIn('control_build_cache_hit{service="a\\"b\\\\c"} 0',
+                      self.metrics.prometheus().splitlines())
+
+    def test_not_running(self):
+        """Nothing is kept outside of a build-prod"""
+        metrics = BuildMetrics()
+        metrics.set('api', cache_hit=1)
+        metrics.registry_request('docker.petrode.com', 1.0)
+        self.assertEqual((metrics.services, metrics.registries), ({}, {}))
+
+    def test_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.metrics.write(directory)
+            self.assertEqual(path, os.path.join(directory, 'metrics.prom'))
+            self.assertEqual(os.listdir(directory), ['metrics.prom'])
+            with open(path) as f:
+                self.assertEqual(f.read(), self.metrics.prometheus())
+            path = self.metrics.write(directory, 'json')
+            with open(path) as f:
+                self.assertTrue(json.load(f)['ok'])
+
+    def test_registry(self):
+        """Every request the registry client makes is counted"""
+        self.addCleanup(aio.close)
+        fake = FakeRegistry().start()
+        self.addCleanup(fake.stop)
+        fake.push('app', 'dev')
+        with tempfile.TemporaryDirectory() as home:
+            with mock.patch.dict(os.environ, {'HOME': home}):
+                reg = aio.AsyncRegistry('localhost', fake.port, no_verify=True)
+                self.addCleanup(reg.close)
+                build_metrics.start()
+                self.addCleanup(build_metrics.stop, False)
+                aio.run(reg.get_digest_of_repo(Repository('app', 'dev', 'localhost', fake.port)))
+        count, seconds = build_metrics.registries[reg.endpoint]
+        self.assertEqual(count, sum(fake.requests.values()))
+        self.assertGreater(seconds, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Test folding of Docker status streams"""
+
+import io
+import threading
+import unittest
+
+from control.progress import Progress, format_bytes
+
+
+class FakeClock:
+    """A clock that only moves when told to"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def downloading(layer, current, total):
+    """A Docker status message for a layer that is part way downloaded"""
+    return {
+        'status': 'Downloading',
+        'id': layer,
+        'progressDetail': {'current': current, 'total': total},
+        'progress': '[==>  ]',
+    }
+
+
+class TestProgressNoTTY(unittest.TestCase):
+    """Output when not writing to a terminal, like in CI"""
+
+    def setUp(self):
+        self.out = io.StringIO()
+        self.clock = FakeClock()
+        self.progress = Progress(stream=self.out, tty=False,
+                                 summary_interval=10, clock=self.clock)
+
+    def test_progress_is_folded(self):
+        """Chunk by chunk progress should not produce a line each"""
+        self.progress.feed('busybox', {'status': 'Pulling fs layer', 'id': 'aaa',
+                                       'progressDetail': {}})
+        for i in range(100):
+            self.progress.feed('busybox', downloading('aaa', i * 10, 1000))
+        self.assertEqual(self.out.getvalue(), '')
+
+    def test_periodic_summary(self):
+        """A summary line is written once the interval passes"""
+        self.progress.feed('busybox', downloading('aaa', 10, 1000))
+        self.clock.now = 11
+        self.progress.feed('busybox', downloading('aaa', 500, 1000))
+        self.assertEqual(self.out.getvalue().count('\n'), 1)
+        self.assertIn('busybox: 0/1 layers', self.out.getvalue())
+        self.assertIn('500 B/1.0 kB', self.out.getvalue())
+
+    def test_close_writes_summary(self):
+        """Finishing a pull writes the final state"""
+        self.progress.feed('busybox', downloading('aaa', 10, 1000))
+        self.progress.feed('busybox', {'status': 'Pull complete', 'id': 'aaa',
+                                       'progressDetail': {}})
+        self.progress.close('busybox')
+        self.assertIn('busybox: 1/1 layers, 1.0 kB/1.0 kB', self.out.getvalue())
+        self.assertEqual(self.progress.bytes_pulled('busybox'), 1000)
+
+    def test_messages_pass_through(self):
+        """Build output and errors are not swallowed"""
+        self.progress.feed('web', {'stream': 'Step 1 : FROM busybox\n'})
+        self.progress.feed('web', {'error': 'it broke'})
+        self.assertEqual(self.out.getvalue(), 'Step 1 : FROM busybox\nit broke\n')
+
+    def test_concurrent_sources_are_prefixed(self):
+        """When two streams are active, lines are marked with their source"""
+        self.progress.feed('web', {'stream': 'one'})
+        self.progress.feed('db', {'stream': 'two'})
+        self.assertIn('db| two', self.out.getvalue())
+
+    def test_threads(self):
+        """Feeding from many threads keeps every layer's state"""
+        def pull(source):
+            for i in range(50):
+                self.progress.feed(source, downloading('layer', i, 49))
+        threads = [threading.Thread(target=pull, args=('img{}'.format(i),))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i in range(8):
+            self.assertEqual(self.progress.bytes_pulled('img{}'.format(i)), 49)
+
+
+class TestProgressTTY(unittest.TestCase):
+    """Output when writing to a terminal"""
+
+    def setUp(self):
+        self.out = io.StringIO()
+        self.clock = FakeClock()
+        self.progress = Progress(stream=self.out, tty=True,
+                                 redraw_interval=0.5, clock=self.clock)
+
+    def test_redraw_is_throttled(self):
+        """Redraws happen at most once per interval"""
+        self.clock.now = 1
+        for i in range(20):
+            self.progress.feed('busybox', downloading('aaa', i, 100))
+        self.assertEqual(self.out.getvalue().count('busybox: 0/1 layers'), 1)
+        self.clock.now = 2
+        self.progress.feed('busybox', downloading('aaa', 50, 100))
+        self.assertEqual(self.out.getvalue().count('busybox: 0/1 layers'), 2)
+        self.assertIn('\x1b[1F\x1b[J', self.out.getvalue())
+
+
+class TestFormatBytes(unittest.TestCase):
+    """Human readable sizes"""
+
+    def test_format(self):
+        """Check the unit boundaries"""
+        self.assertEqual(format_bytes(999), '999 B')
+        self.assertEqual(format_bytes(1500), '1.5 kB')
+        self.assertEqual(format_bytes(2500000), '2.5 MB')
+
+
+if __name__ == '__main__':
+    unittest.main()
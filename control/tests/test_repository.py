@@ -89,6 +89,17 @@ class MatcherTest(unittest.TestCase):
         self.assertTrue(repository.domain == 'docker.petrode.com')
         self.assertTrue(repository.port == '5002')
 
+    def test_match_pinned(self):
+        """Create a repo pinned to a digest"""
+        digest = 'sha256:' + '0123456789abcdef' * 4
+        repository = Repository.match('docker.petrode.com:5002/ubuntu:14.04@' + digest)
+        self.assertTrue(repository.tag == '14.04')
+        self.assertTrue(repository.digest == digest)
+        self.assertTrue(repository.repo == 'docker.petrode.com:5002/ubuntu:14.04')
+        self.assertTrue(repository.reference == 'docker.petrode.com:5002/ubuntu@' + digest)
+        self.assertTrue(repository.get_pull_tag() == digest)
+        self.assertTrue(Repository.match('ubuntu').pin(digest).reference == 'ubuntu@' + digest)
+
 
 def suite():
     """Group TestCases together so all the tests run"""
@@ -0,0 +1,89 @@
+"""Test ordering builds by their longest remaining path"""
+
+from os.path import join
+import tempfile
+import unittest
+
+from control.history import RunTimer, record_run
+from control.scheduling import Scheduler, history_weights, remaining_paths
+
+
+class TestScheduler(unittest.TestCase):
+    """
+    A quick base with a slow chain built from it, and a slow service on its
+    own. The chain is the long pole even though each step is quicker.
+    """
+
+    graph = {
+        'base': set(),
+        'api': {'base'},
+        'worker': {'api'},
+        'report': set(),
+        'aardvark': set(),
+    }
+    weights = {'base': 5, 'api': 30, 'worker': 30, 'report': 50, 'aardvark': 1}
+
+    def test_remaining_paths(self):
+        """A service's path includes everything built FROM it"""
+        paths = remaining_paths(self.graph, self.graph, self.weights)
+        self.assertEqual(paths['base'], 65)
+        self.assertEqual(paths['api'], 60)
+        self.assertEqual(paths['report'], 50)
+
+    def test_order(self):
+        """The long pole goes first, and FROM order is kept"""
+        order = Scheduler(self.graph, self.graph, self.weights).order()
+        self.assertEqual(order, ['base', 'api', 'report', 'worker', 'aardvark'])
+
+    def test_default(self):
+        """With no history every service weighs the same, so ties go by name"""
+        order = Scheduler(self.graph, self.graph).order()
+        self.assertEqual(order, ['base', 'api', 'aardvark', 'report', 'worker'])
+
+    def test_subset(self):
+        """Services that aren't being built don't hold anything up"""
+        order = Scheduler(self.graph, ['worker', 'report'], self.weights).order()
+        self.assertEqual(order, ['report', 'worker'])
+
+    def test_concurrent(self):
+        """Builders wait for the services a ready service is built FROM"""
+        scheduler = Scheduler(self.graph, self.graph, self.weights)
+        self.assertEqual([scheduler.take(), scheduler.take()], ['base', 'report'])
+        self.assertEqual(scheduler.take(), 'aardvark')
+        self.assertIsNone(scheduler.take())
+        scheduler.finish('base')
+        self.assertEqual(scheduler.take(), 'api')
+        self.assertIsNone(scheduler.take())
+
+    def test_cycle(self):
+        """Services built FROM each other still all get built"""
+        graph = {'a': {'b'}, 'b': {'a'}}
+        with self.assertLogs('control.scheduling', 'WARNING'):
+            order = Scheduler(graph, graph).order()
+        self.assertEqual(sorted(order), ['a', 'b'])
+
+
+class TestHistoryWeights(unittest.TestCase):
+    """Weights come from the build history"""
+
+    def test_weights(self):
+        """Build phases add up, and new services get the typical time"""
+        with tempfile.TemporaryDirectory() as d:
+            path = join(d, 'history.sqlite')
+            for build in (10, 20, 30):
+                timer = RunTimer()
+                timer.start('build')
+                timer.add('api', 'pull', 2)
+                timer.add('api', 'build', build)
+                timer.add('api', 'start', 100)
+                timer.add('web', 'build', 40)
+                timer.add('db', 'build', 4)
+                record_run('/p/Controlfile', timer, build, True, path=path)
+            weights, default = history_weights('/p/Controlfile', path)
+            self.assertEqual(weights, {'api': 22, 'web': 40, 'db': 4})
+            self.assertEqual(default, 22)
+            self.assertEqual(history_weights('/q/Controlfile', path), ({}, 60.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""Test the shell scripts written by --dump-format script"""
+
+import json
+import os
+from os.path import join
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from control.controlfile import Controlfile
+from control.script import render_script
+
+FAKE_DOCKER = """#!/bin/sh
+echo "$*" >> "{log}"
+case "$*" in
+    "build "*" --tag {fail} "*) exit 1 ;;
+esac
+"""
+
+
+class TestScript(unittest.TestCase):
+    """A base image built FROM busybox, two services built from it, and a database"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        directory = self.temp_dir.name
+        conf = {'services': {
+            'base': {'image': 'base', 'required': False, 'dockerfile': 'base/Dockerfile',
+                     'container': {}},
+            'api': {'image': 'api', 'dockerfile': 'api/Dockerfile', 'container': {
+                'environment': ['A=b c'], 'command': "sh -c 'echo hi'"}},
+            'web': {'image': 'web', 'dockerfile': 'web/Dockerfile', 'container': {}},
+            'db': {'image': 'postgres:9.5', 'container': {}},
+        }}
+        for name, upstream in (('base', 'busybox'), ('api', 'base'), ('web', 'base')):
+            os.mkdir(join(directory, name))
+            with open(join(directory, name, 'Dockerfile'), 'w') as f:
+                f.write('FROM {}\n'.format(upstream))
+        with open(join(directory, 'Controlfile'), 'w') as f:
+            json.dump(conf, f)
+        self.ctrl = Controlfile(join(directory, 'Controlfile'))
+        self.names = sorted(self.ctrl.services['all'])
+
+    def render(self, command, pulling=lambda repo: True):
+        return render_script(self.ctrl, self.names, command, pulling, 'test', 2)
+
+    def run_script(self, script, fail=''):
+        """Run the script against a docker that only writes down what it was asked"""
+        bin_dir = join(self.temp_dir.name, 'bin')
+        log = join(self.temp_dir.name, 'docker.log')
+        os.makedirs(bin_dir, exist_ok=True)
+        docker = join(bin_dir, 'docker')
+        with open(docker, 'w') as f:
+            f.write(FAKE_DOCKER.format(log=log, fail=fail))
+        os.chmod(docker, os.stat(docker).st_mode | stat.S_IEXEC)
+        result = subprocess.run(
+            ['sh', '-c', script], cwd=self.temp_dir.name, capture_output=True,
+            env=dict(os.environ, PATH=bin_dir + os.pathsep + os.environ['PATH']))
+        with open(log) as f:
+            return result.returncode, f.read().splitlines()
+
+    def test_waves(self):
+        """The base is built on its own, before the services built from it"""
+        script = self.render('default')
+        self.assertIn('# Build wave 1 of 2: base\n', script)
+        self.assertIn('# Build wave 2 of 2: api, web\n', script)
+        self.assertIn("--env 'A=b c'", script)
+        self.assertIn("api sh -c 'echo hi'", script)
+        self.assertEqual(script, self.render('default'))
+
+    def test_pulls(self):
+        """Upstreams that aren't built here get pulled, once, if pulling says so"""
+        script = self.render('default')
+        self.assertIn("docker pull <<'IMAGES'\nbusybox:latest\npostgres:9.5\nIMAGES\n", script)
+        self.assertNotIn('docker pull', self.render('default', lambda repo: False))
+
+    def test_parts(self):
+        """Each command gets only the parts of the script it needs"""
+        stop = self.render('stop')
+        self.assertNotIn('docker build', stop)
+        self.assertNotIn('docker run', stop)
+        self.assertIn('docker rm api base db web || true', stop)
+        prod = self.render('build-prod')
+        self.assertNotIn('docker run', prod)
+        self.assertIn("cat > IMAGES.txt <<'IMAGES'\napi\nbase\npostgres:9.5\nweb\nIMAGES\n", prod)
+
+    def test_run(self):
+        """Running the script builds in order and starts everything"""
+        code, calls = self.run_script(self.render('default'))
+        self.assertEqual(code, 0)
+        builds = [os.path.basename(call.split()[-1]) for call in calls
+                  if call.startswith('build')]
+        self.assertEqual(builds[0], 'base')
+        self.assertEqual(sorted(builds[1:]), ['api', 'web'])
+        runs = [call for call in calls if call.startswith('run')]
+        self.assertEqual(len(runs), 4)
+        self.assertLess(calls.index('stop api base db web'), calls.index(runs[0]))
+
+    def test_failure(self):
+        """A failed build stops the script before the next wave"""
+        code, calls = self.run_script(self.render('default'), fail='base')
+        self.assertEqual(code, 1)
+        self.assertFalse([call for call in calls if call.startswith('run')])
+        self.assertEqual(len([call for call in calls if call.startswith('build')]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""Test control stats"""
+
+import asyncio
+import json
+from os.path import join
+import tempfile
+import unittest
+
+from control import aio
+from control.controlfile import Controlfile
+from control.fakes import FakeDocker
+from control.stats import Usage, as_json, groups, render, watch_stats
+
+
+class TestStats(unittest.TestCase):
+    """api and worker in a backend metaservice, and a required db"""
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+        self.fake = FakeDocker(images=['busybox:latest']).start()
+        self.fake.stats_interval = 0.01
+        self.addCleanup(self.fake.stop)
+        self.client = aio.AsyncDocker(self.fake.url)
+        self.addCleanup(self.client.close)
+        with tempfile.TemporaryDirectory() as directory:
+            path = join(directory, 'Controlfile')
+            with open(path, 'w') as f:
+                json.dump({'services': {
+                    'backend': {'services': {
+                        'api': {'image': 'busybox', 'container': {}},
+                        'worker': {'image': 'busybox', 'container': {}, 'required': False},
+                    }},
+                    'db': {'image': 'busybox', 'container': {}},
+                }}, f)
+            self.ctrl = Controlfile(path)
+        for name in ('api', 'worker', 'db'):
+            aio.run(self.start(name))
+
+    async def start(self, name):
+        created = await self.client.create_container('busybox', name=name)
+        await self.client.start(created)
+
+    def test_groups(self):
+        found = groups(self.ctrl, {'api', 'worker', 'db'})
+        self.assertEqual(sorted(found['backend']), ['api', 'worker'])
+        self.assertEqual(sorted(found['required']), ['api', 'db'])
+        self.assertEqual(found['optional'], ['worker'])
+        self.assertEqual(sorted(groups(self.ctrl, {'db'})), ['all', 'required'])
+
+    def test_watch(self):
+        """Each sample is added up over the metaservices"""
+        emitted = []
+        aio.run(watch_stats(self.client, self.ctrl, {'api': 'api', 'worker': 'worker'},
+                            lambda *usage: emitted.append(usage), interval=0.1, count=2))
+        self.assertEqual(len(emitted), 2)
+        services, metaservices = emitted[-1]
+        self.assertEqual(sorted(services), ['api', 'worker'])
+        self.assertEqual(sorted(metaservices), ['all', 'backend', 'optional', 'required'])
+        backend = metaservices['backend']
+        self.assertEqual(backend.containers, 2)
+        self.assertEqual(backend.memory, 2 * 50 * 1024 * 1024)
+        self.assertEqual(backend.rx, services['api'].rx + services['worker'].rx)
+        self.assertGreater(services['api'].cpu, 0)
+        self.assertIn('[backend]', render(services, metaservices))
+        scraped = json.loads(as_json(services, metaservices))
+        self.assertEqual(scraped['metaservices']['backend']['containers'], 2)
+
+    def test_emit_fails(self):
+        """Watching ends with the first sample that can't be written"""
+        def emit(*usage):  # pylint: disable=missing-docstring
+            raise BrokenPipeError(32, 'Broken pipe')
+        with self.assertRaises(BrokenPipeError):
+            aio.run(asyncio.wait_for(watch_stats(self.client, self.ctrl, {'api': 'api'}, emit,
+                                                 interval=0.05), 5))
+
+    def test_stopped(self):
+        """Watching ends when there is nothing left to watch"""
+        emitted = []
+        aio.run(watch_stats(self.client, self.ctrl, {'nothing': 'nothing'},
+                            lambda *usage: emitted.append(usage), interval=0.05))
+        self.assertEqual(emitted, [])
+
+    def test_sample(self):
+        usage = Usage.from_sample({
+            'cpu_stats': {'cpu_usage': {'total_usage': 300, 'percpu_usage': [1, 2]},
+                          'system_cpu_usage': 2000},
+            'precpu_stats': {'cpu_usage': {'total_usage': 100}, 'system_cpu_usage': 1000},
+            'memory_stats': {'usage': 10, 'limit': 100},
+            'networks': {'eth0': {'rx_bytes': 1, 'tx_bytes': 2},
+                         'eth1': {'rx_bytes': 3, 'tx_bytes': 4}},
+            'blkio_stats': {'io_service_bytes_recursive': [
+                {'op': 'Read', 'value': 5}, {'op': 'Write', 'value': 6},
+                {'op': 'Total', 'value': 11}]},
+        })
+        self.assertEqual(usage.cpu, 40.0)
+        self.assertEqual((usage.rx, usage.tx, usage.read, usage.write), (4, 6, 5, 6))
+        self.assertEqual(Usage.from_sample({}).cpu, 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
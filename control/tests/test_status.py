@@ -0,0 +1,79 @@
+"""Test control status"""
+
+import contextlib
+import io
+import json
+from os.path import join
+import tempfile
+import unittest
+
+from control import aio
+from control.context import RunContext
+from control.controlfile import Controlfile
+from control.fakes import FakeDocker
+from control.functions import async_start
+from control.status import format_uptime, gather_status, render
+
+
+class TestStatus(unittest.TestCase):
+    """api and worker started, and a db that never was"""
+
+    def setUp(self):
+        self.addCleanup(aio.close)
+        self.fake = FakeDocker(images=['busybox:latest']).start()
+        self.addCleanup(self.fake.stop)
+        self.client = aio.AsyncDocker(self.fake.url)
+        self.addCleanup(self.client.close)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.ctrl = self.controlfile({'environment': ['MODE=dev']})
+        with contextlib.redirect_stdout(io.StringIO()):
+            aio.run(async_start(RunContext.parse(['start', 'api', 'worker']),
+                                self.ctrl, self.client))
+
+    def controlfile(self, api):
+        path = join(self.directory.name, 'Controlfile')
+        with open(path, 'w') as f:
+            json.dump({'services': {
+                'api': {'image': 'busybox', 'container': api},
+                'worker': {'image': 'busybox', 'container': {}},
+                'db': {'image': 'busybox', 'container': {}},
+            }}, f)
+        return Controlfile(path)
+
+    def status(self, ctrl):
+        services = [ctrl.services[name] for name in ('api', 'db', 'worker')]
+        return {s.service: s for s in aio.run(gather_status(self.client, services))}
+
+    def test_status(self):
+        statuses = self.status(self.ctrl)
+        self.assertEqual(statuses['api'].state, 'running')
+        self.assertEqual(statuses['api'].image(), 'current')
+        self.assertEqual(statuses['api'].config(), 'ok')
+        self.assertIsNotNone(statuses['api'].uptime)
+        self.assertEqual(statuses['db'].state, 'missing')
+        self.assertEqual(statuses['db'].image(), '-')
+        self.assertEqual(self.fake.requests['containers.list'], 1)
+        self.assertEqual(self.fake.requests['images.list'], 1)
+        table = render(statuses.values()).splitlines()
+        self.assertTrue(table[0].startswith('SERVICE'))
+        self.assertEqual(len(table), 4)
+
+    def test_stale_and_drift(self):
+        """A rebuilt image makes the containers stale, and a changed Controlfile drifts"""
+        self.fake.add_image('busybox')
+        statuses = self.status(self.controlfile({'environment': ['MODE=prod']}))
+        self.assertEqual(statuses['api'].image(), 'stale')
+        self.assertEqual(statuses['api'].config(), 'drifted')
+        self.assertEqual(statuses['worker'].config(), 'ok')
+
+    def test_format_uptime(self):
+        self.assertEqual(format_uptime(None), '-')
+        self.assertEqual(format_uptime(0), '0s')
+        self.assertEqual(format_uptime(59), '59s')
+        self.assertEqual(format_uptime(3 * 3600 + 12 * 60 + 5), '3h12m')
+        self.assertEqual(format_uptime(2 * 86400 + 30), '2d0h')
+
+
+if __name__ == '__main__':
+    unittest.main()
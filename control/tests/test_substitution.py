@@ -0,0 +1,124 @@
+"""Test compiled options give the same services the old merge code did"""
+
+import copy
+import itertools
+import unittest
+
+from control.benchmarks import legacy
+from control.benchmarks.generate import nested_options, service_definition
+from control.service import create_service
+from control.substitution import (
+    CompiledOptions, compile_options, normalize_service, satisfy_nested_options)
+
+# A value of each kind an option can have
+VALUES = [None, '', 'a', ['b'], ['a', 'c'], {'shared': ['d'], 'dev': 'e'}]
+VARIABLES = {'DOMAIN': 'example.com', 'TAG': 'dev', 'REGISTRY': 'registry:5000',
+             'GIT_ROOT': '/work', 'UID': 1000, 'GID': 1000}
+
+
+def _outcome(func, *args):
+    """What calling func gives, so errors can be compared like values"""
+    try:
+        return func(*args)
+    except Exception as e:  # pylint: disable=broad-except
+        return type(e)
+
+
+def _contents(service):
+    contents = {}
+    for key in service.keys():
+        try:
+            contents[key] = service[key]
+        except KeyError:
+            continue
+    return contents
+
+
+class TestSatisfyNestedOptions(unittest.TestCase):
+    """The merge gives what it used to for every kind and op"""
+
+    def test_kinds(self):
+        """Every pairing of kinds, present or missing on either side"""
+        for op in ('replace', 'suffix', 'prefix', 'union'):
+            for outer, inner in itertools.product(VALUES + ['missing'], repeat=2):
+                outer_opts = {} if outer == 'missing' else {'name': {op: outer}}
+                inner_opts = {} if inner == 'missing' else {'name': {op: inner}}
+                self.assertEqual(
+                    _outcome(satisfy_nested_options, outer_opts, inner_opts),
+                    _outcome(legacy.satisfy_nested_options, outer_opts, inner_opts),
+                    (op, outer, inner))
+
+    def test_nested(self):
+        """Deeply nested generated options"""
+        new = old = {}
+        for level in reversed(range(12)):
+            new = satisfy_nested_options(outer=new, inner=nested_options(level))
+            old = legacy.satisfy_nested_options(outer=old, inner=nested_options(level))
+            self.assertEqual(new, old)
+
+
+class TestCompiledOptions(unittest.TestCase):
+    """Applying a plan is applying the options"""
+
+    def normalize_both(self, definition, opers):
+        """Normalize a service from definition both ways"""
+        new = create_service(copy.deepcopy(definition), '/tmp/Controlfile')
+        old = create_service(copy.deepcopy(definition), '/tmp/Controlfile')
+        variables = dict(VARIABLES, SERVICE=new.service)
+        normalize_service(new, compile_options(copy.deepcopy(opers)), dict(variables))
+        legacy.normalize_service(old, copy.deepcopy(opers), dict(variables))
+        return _contents(new), _contents(old)
+
+    def test_generated(self):
+        """Services under generated metaservices come out the same"""
+        opers = {}
+        for level in reversed(range(6)):
+            opers = satisfy_nested_options(outer=opers, inner=nested_options(level))
+        for index in range(20):
+            new, old = self.normalize_both(service_definition(index), opers)
+            self.assertEqual(new, old)
+
+    def test_kinds(self):
+        """Every op and kind of value, on services with and without the key"""
+        services = [
+            {'image': 'busybox', 'container': {'name': 'web'}},
+            {'image': 'busybox', 'container': {'name': 'web', 'dns': ['8.8.8.8'],
+                                               'hostname': 'web', 'environment': None}},
+        ]
+        for definition, op, value in itertools.product(
+                services, ('replace', 'suffix', 'prefix', 'union'), VALUES[1:]):
+            for key in ('dns', 'hostname', 'environment', 'working_dir'):
+                opers = {key: {op: value}}
+                new, old = self.normalize_both(definition, opers)
+                self.assertEqual(new, old, (definition, opers))
+
+    def test_plan(self):
+        """Unsupported ops and keys without ops don't make it into the plan"""
+        plan = CompiledOptions({'name': {'suffix': '.x', 'eval': 'rm -rf /'},
+                                'hostname': {}})
+        self.assertEqual([(key, [step[0] for step in steps]) for key, steps in plan.plan],
+                         [('name', ['suffix'])])
+        self.assertIs(compile_options(plan), plan)
+
+    def test_random(self):
+        """RANDOM is new for every string, even when it's also a variable"""
+        service = create_service({'image': 'busybox', 'container': {
+            'name': 'web', 'environment': ['A={RANDOM}'] * 30}}, '/tmp/Controlfile')
+        normalize_service(service, {}, {'RANDOM': 'fixed'})
+        values = set(service['environment'])
+        self.assertNotIn('A=fixed', values)
+        self.assertGreater(len(values), 1)
+
+    def test_random_once_per_string(self):
+        """Every RANDOM in one string is the same number"""
+        service = create_service({'image': 'busybox', 'container': {
+            'name': 'web', 'environment': ['A={RANDOM}-{RANDOM}'] * 30}}, '/tmp/Controlfile')
+        normalize_service(service, {}, {})
+        for value in service['environment']:
+            first, second = value[2:].split('-')
+            self.assertEqual(first, second)
+        self.assertGreater(len(set(service['environment'])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Test recording spans and writing Chrome traces"""
+
+import json
+from os.path import join
+import tempfile
+import threading
+import unittest
+
+from control.controlfile import Controlfile
+from control.tracing import NULL_SPAN, Tracer, traced, tracer
+
+
+class TestTracer(unittest.TestCase):
+    """Spans are only recorded while tracing"""
+
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def test_disabled(self):
+        """A disabled tracer hands out the shared do-nothing span"""
+        self.assertIs(self.tracer.span('anything', service='foo'), NULL_SPAN)
+        with self.tracer.span('anything'):
+            pass
+        self.assertEqual(self.tracer.events, [])
+
+    def test_span(self):
+        """A span records its name, attributes, duration and errors"""
+        self.tracer.start()
+        with self.tracer.span('docker.build', service='web') as span:
+            span.set(image='web:latest')
+        with self.assertRaises(KeyError):
+            with self.tracer.span('docker.pull'):
+                raise KeyError('nope')
+        build, pull = self.tracer.events
+        self.assertEqual(build['name'], 'docker.build')
+        self.assertEqual(build['cat'], 'docker')
+        self.assertEqual(build['ph'], 'X')
+        self.assertEqual(build['args'], {'service': 'web', 'image': 'web:latest'})
+        self.assertGreaterEqual(build['dur'], 0)
+        self.assertEqual(pull['args'], {'error': 'KeyError'})
+
+    def test_threads(self):
+        """Spans from different threads keep their thread ids"""
+        self.tracer.start()
+        # Keep every thread alive until all have recorded, so ids aren't reused
+        barrier = threading.Barrier(4)
+
+        def work():
+            with self.tracer.span('work'):
+                pass
+            barrier.wait()
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.tracer.events), 4)
+        self.assertEqual(len({e['tid'] for e in self.tracer.events}), 4)
+
+    def test_write(self):
+        """The file is trace_event JSON"""
+        self.tracer.start()
+        with self.tracer.span('control.run'):
+            pass
+        with tempfile.TemporaryDirectory() as d:
+            self.tracer.write(join(d, 'trace.json'))
+            with open(join(d, 'trace.json')) as f:
+                trace = json.load(f)
+        self.assertEqual([e['name'] for e in trace['traceEvents']], ['control.run'])
+
+
+class TestTraced(unittest.TestCase):
+    """The decorator uses the global tracer"""
+
+    def tearDown(self):
+        tracer.stop()
+
+    def test_traced(self):
+        """Calls are recorded with attributes pulled from the arguments"""
+        @traced('thing.do', lambda name, count=1: {'service': name})
+        def do(name, count=1):
+            return name * count
+
+        self.assertEqual(do('a', count=2), 'aa')
+        tracer.start()
+        self.assertEqual(do('b'), 'b')
+        self.assertEqual([(e['name'], e['args']) for e in tracer.events],
+                         [('thing.do', {'service': 'b'})])
+        self.assertEqual(do.__name__, 'do')
+
+    def test_controlfile(self):
+        """Reading a Controlfile records its services and the git calls"""
+        with tempfile.TemporaryDirectory() as d:
+            with open(join(d, 'Controlfile'), 'w') as f:
+                json.dump({'services': {'foo': {'image': 'busybox',
+                                                'container': {}}}}, f)
+            tracer.start()
+            Controlfile(join(d, 'Controlfile'))
+        names = {(e['name'], e['args'].get('service')) for e in tracer.events}
+        self.assertIn(('controlfile.create_service', 'foo'), names)
+        self.assertIn(('controlfile.git', None), names)
+
+
+if __name__ == '__main__':
+    unittest.main()
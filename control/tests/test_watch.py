@@ -0,0 +1,162 @@
+"""Test noticing changes to files"""
+
+import json
+import os
+from os.path import join
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from control.context import RunContext
+from control.controlfile import Controlfile
+from control import functions
+from control.watch import InotifyWatcher, PollingWatcher, drain, wait_for_changes
+
+
+class WatcherTests:
+    """Tests that both kinds of watcher must pass"""
+
+    def make_watcher(self):
+        """Return the watcher under test"""
+        raise NotImplementedError
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.mkdir(join(self.temp_dir.name, 'src'))
+        with open(join(self.temp_dir.name, 'src', 'app.py'), 'w') as f:
+            f.write('one')
+        self.watch = self.make_watcher()
+        self.watch.add(self.temp_dir.name)
+
+    def tearDown(self):
+        self.watch.close()
+        self.temp_dir.cleanup()
+
+    def test_nothing_changed(self):
+        """No changes means an empty set once the timeout passes"""
+        self.assertEqual(self.watch.changes(0.05), set())
+
+    def test_modified_file(self):
+        """Writing a file in a nested directory is noticed"""
+        path = join(self.temp_dir.name, 'src', 'app.py')
+        with open(path, 'w') as f:
+            f.write('changed')
+        self.assertIn(path, self.watch.changes(2))
+
+    def test_new_directory(self):
+        """Files in directories created after watching started are noticed"""
+        os.mkdir(join(self.temp_dir.name, 'new'))
+        self.watch.changes(2)
+        path = join(self.temp_dir.name, 'new', 'file')
+        with open(path, 'w') as f:
+            f.write('new')
+        self.assertIn(path, self.watch.changes(2))
+
+    def test_debounce(self):
+        """A burst of saves is collected into one set of changes"""
+        def save():
+            for name in ('a', 'b', 'c'):
+                with open(join(self.temp_dir.name, name), 'w') as f:
+                    f.write(name)
+                time.sleep(0.05)
+        thread = threading.Thread(target=save)
+        thread.start()
+        changed = wait_for_changes(self.watch, debounce=0.3)
+        thread.join()
+        self.assertEqual({os.path.basename(p) for p in changed} & {'a', 'b', 'c'},
+                         {'a', 'b', 'c'})
+
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    """The fallback watcher"""
+
+    def make_watcher(self):
+        # mtimes need to be able to differ between writes
+        time.sleep(0.01)
+        return PollingWatcher(interval=0.02)
+
+
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+    """The Linux watcher"""
+
+    def make_watcher(self):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError, TypeError):
+            self.skipTest('inotify is not available')
+
+
+class StopWatching(Exception):
+    """Gets the test out of control watch's loop"""
+
+
+class TestWatchCommand(unittest.TestCase):
+    """api and web are built FROM base, and other is built FROM busybox"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        services = {'base': 'busybox', 'api': 'base', 'web': 'base', 'other': 'busybox'}
+        conf = {'services': {}}
+        for name, upstream in services.items():
+            os.mkdir(join(self.temp_dir.name, name))
+            with open(join(self.temp_dir.name, name, 'Dockerfile'), 'w') as f:
+                f.write('FROM {}\n'.format(upstream))
+            conf['services'][name] = {'image': name, 'container': {'name': name},
+                                      'dockerfile': '{}/Dockerfile'.format(name)}
+        with open(join(self.temp_dir.name, 'Controlfile'), 'w') as f:
+            json.dump(conf, f)
+        self.ctrl = Controlfile(join(self.temp_dir.name, 'Controlfile'))
+        self.args = RunContext.parse(['watch']).replace(services=sorted(services))
+        self.built = []
+        self.restarted = []
+        # What gets saved before each wait for changes
+        self.edits = [['base'], ['web']]
+
+    def touch(self, name, filename='app.py'):
+        """Change a file in name's build context"""
+        # mtimes need to be able to differ between writes
+        time.sleep(0.01)
+        with open(join(self.temp_dir.name, name, filename), 'a') as f:
+            f.write('x')
+
+    def wait(self, watch):  # pylint: disable=missing-docstring
+        if not self.edits:
+            raise StopWatching()
+        for name in self.edits.pop(0):
+            self.touch(name)
+        return wait_for_changes(watch, debounce=0.1)
+
+    def build(self, args, ctrl):  # pylint: disable=missing-docstring,unused-argument
+        self.built.append(args.services[0])
+        # Like a prebuild event that writes into the build context
+        self.touch(args.services[0], 'generated')
+        return True
+
+    def restart(self, args, ctrl):  # pylint: disable=missing-docstring,unused-argument
+        self.restarted.append(list(args.services))
+
+    def test_rebuilds(self):
+        """A change rebuilds its service and what is built FROM it, once"""
+        with mock.patch('control.functions.watcher', lambda: PollingWatcher(0.02)), \
+                mock.patch('control.functions.wait_for_changes', self.wait), \
+                mock.patch('control.functions.build', self.build), \
+                mock.patch('control.functions.restart', self.restart), \
+                self.assertRaises(StopWatching):
+            functions.watch(self.args, self.ctrl)
+        self.assertEqual(self.built, ['base', 'api', 'web', 'web'])
+        self.assertEqual(self.restarted, [['base', 'api', 'web'], ['web']])
+
+    def test_drain(self):
+        """Changes that are already in are forgotten"""
+        watch = PollingWatcher(0.02)
+        watch.add(self.temp_dir.name)
+        self.touch('base')
+        drain(watch)
+        self.assertEqual(watch.changes(0), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+"""Test wiping the volumes of removed containers"""
+
+import os
+from os.path import join
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import docker
+
+from control.wipe import WipeSummary, Wiper, directory_size, wipe_targets, wipe_volumes
+
+
+class FakeClient:
+    """
+    Just enough of docker.Client to remove volumes and run the helper. The
+    helper's script really runs, on the host directories it would have had
+    mounted
+    """
+
+    def __init__(self, images=('busybox:latest',)):
+        self.images = set(images)
+        self.volumes = {}
+        self.in_use = set()
+        self.removed = []
+        self.containers = {}
+        self.pulls = []
+        self.barrier = None
+
+    def remove_volume(self, name):
+        if self.barrier:
+            self.barrier.wait()
+        if name in self.in_use:
+            raise docker.errors.APIError('409', None, explanation=(
+                'remove {}: volume is in use'.format(name)).encode('utf-8'))
+        if name not in self.volumes:
+            raise docker.errors.APIError('404', None, explanation=(
+                'get {}: no such volume'.format(name)).encode('utf-8'))
+        del self.volumes[name]
+        self.removed.append(name)
+
+    def df(self):
+        return {'Volumes': [{'Name': name, 'UsageData': {'Size': size, 'RefCount': 0}}
+                            for name, size in self.volumes.items()]}
+
+    def create_host_config(self, binds):
+        return {'Binds': binds}
+
+    def create_container(self, image, command, volumes, host_config):
+        if image not in self.images:
+            raise docker.errors.NotFound('404', None, explanation=b'No such image')
+        cid = 'helper{}'.format(len(self.containers))
+        self.containers[cid] = {'image': image, 'command': command, 'volumes': volumes,
+                                'binds': host_config['Binds'], 'output': b''}
+        return {'Id': cid, 'Warnings': None}
+
+    def pull(self, image):
+        self.pulls.append(image)
+        self.images.add(image)
+
+    def start(self, cid):
+        container = self.containers[cid]
+        inside = {bind['bind']: parent for parent, bind in container['binds'].items()}
+
+        def outside(path):  # pylint: disable=missing-docstring
+            mount, _, rest = path.rpartition('/')
+            return join(inside[mount], rest)
+        command = [outside(arg) if arg.startswith('/wipe/') else arg
+                   for arg in container['command']]
+        output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+        for mount, parent in inside.items():
+            output = output.replace(parent.encode('utf-8') + b'/', mount.encode('utf-8') + b'/')
+        container['output'] = output
+
+    def wait(self, cid):
+        return 0
+
+    def logs(self, cid, stdout=True, stderr=True):
+        return self.containers[cid]['output']
+
+    def remove_container(self, cid, force=False):
+        self.containers[cid]['removed'] = True
+
+
+def _bind(source):
+    return {'Type': 'bind', 'Source': source, 'Destination': '/data', 'RW': True}
+
+
+def _volume(name):
+    return {'Type': 'volume', 'Name': name, 'Driver': 'local', 'Destination': '/data',
+            'Source': '/var/lib/docker/volumes/{}/_data'.format(name)}
+
+
+class TestWipe(unittest.TestCase):
+    """Directories on the host, and named volumes in a fake docker"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.client = FakeClient()
+        self.client.volumes = {'db': 4096, 'cache': 1000}
+
+    def directory(self, name, files=3, size=8192):
+        """A directory of files, like a container would leave behind"""
+        path = join(self.temp_dir.name, name)
+        os.makedirs(join(path, 'sub'))
+        for index in range(files):
+            with open(join(path, 'sub', str(index)), 'wb') as f:
+                f.write(b'x' * size)
+        return path
+
+    def test_targets(self):
+        """Each volume and directory once, and nested directories with their parent"""
+        data = self.directory('data')
+        logs = self.directory('logs')
+        inspects = [
+            {'Mounts': [_volume('db'), _bind(data), _bind(join(data, 'sub'))]},
+            {'Mounts': [_volume('db'), _bind(logs + '/'), _bind('/no/such/place'),
+                        _bind('/')]},
+            # Docker before 1.10 didn't say what type a mount was
+            {'Mounts': [{'Name': 'cache', 'Source': '/var/lib/docker/volumes/cache/_data'}]},
+            {},
+        ]
+        self.assertEqual(wipe_targets(inspects), (['cache', 'db'], [data, logs]))
+
+    def test_directory_size(self):
+        """Hard links are only counted once"""
+        data = self.directory('data', files=2)
+        size = directory_size(data)
+        self.assertGreaterEqual(size, 2 * 8192)
+        os.link(join(data, 'sub', '0'), join(data, 'link'))
+        self.assertEqual(directory_size(data), size)
+
+    def test_wipe(self):
+        """Everything is removed, and what it took up is added up"""
+        data = self.directory('data')
+        logs = self.directory('logs')
+        sizes = directory_size(data) + directory_size(logs)
+        summary = wipe_volumes([{'Mounts': [_volume('db'), _bind(data)]},
+                                {'Mounts': [_volume('cache'), _bind(logs)]}], self.client)
+        self.assertFalse(os.path.exists(data))
+        self.assertFalse(os.path.exists(logs))
+        self.assertEqual(sorted(self.client.removed), ['cache', 'db'])
+        self.assertEqual(summary.freed, sizes + 5096)
+        self.assertEqual(summary.failed, {})
+        self.assertFalse(self.client.containers)
+        self.assertTrue(str(summary).startswith('Wiped 2 volumes and 2 directories, freeing'))
+
+    def test_concurrent(self):
+        """Volumes are removed at the same time, not one after another"""
+        self.client.volumes = {str(index): 0 for index in range(4)}
+        self.client.barrier = threading.Barrier(4, timeout=5)
+        summary = Wiper(self.client, workers=4).wipe(
+            [{'Mounts': [_volume(str(index))]} for index in range(4)])
+        self.assertEqual(len(summary.volumes), 4)
+
+    def test_volume_errors(self):
+        """Volumes already gone are fine, but volumes in use are failures"""
+        self.client.in_use.add('db')
+        summary = wipe_volumes([{'Mounts': [_volume('db'), _volume('gone')]}], self.client)
+        self.assertEqual(list(summary.failed), ['db'])
+        self.assertEqual(summary.volumes, [])
+        self.assertIn('Could not remove db', str(summary))
+
+    def test_helper(self):
+        """Directories we can't remove go to one helper container, pulled if need be"""
+        data = self.directory('data')
+        logs = self.directory('logs')
+        mine = self.directory('mine')
+        size = directory_size(data) + directory_size(logs) + directory_size(mine)
+        self.client.images = set()
+        rmtree = shutil.rmtree
+
+        def denied(path):  # pylint: disable=missing-docstring
+            if path != mine:
+                raise PermissionError(13, 'Permission denied', path)
+            rmtree(path)
+        with mock.patch('control.wipe.shutil.rmtree', side_effect=denied):
+            summary = wipe_volumes([{'Mounts': [_bind(data), _bind(logs), _bind(mine)]}],
+                                   self.client, helper_image='alpine:3.4',
+                                   root=self.temp_dir.name)
+        self.assertEqual(self.client.pulls, ['alpine:3.4'])
+        self.assertEqual(len(self.client.containers), 1)
+        helper = self.client.containers['helper0']
+        self.assertTrue(helper['removed'])
+        self.assertEqual(list(helper['binds']), [self.temp_dir.name])
+        self.assertFalse(os.path.exists(data))
+        self.assertFalse(os.path.exists(logs))
+        self.assertEqual(sorted(summary.helped), [data, logs])
+        self.assertEqual(summary.directories, [mine])
+        self.assertEqual(summary.freed, size)
+
+    def test_unreadable(self):
+        """Directories we can't even measure are measured by the helper"""
+        data = self.directory('data')
+        with mock.patch('control.wipe.directory_size', return_value=None):
+            summary = wipe_volumes([{'Mounts': [_bind(data)]}], self.client,
+                                   root=self.temp_dir.name)
+        self.assertFalse(os.path.exists(data))
+        self.assertEqual(summary.helped, [data])
+        self.assertGreater(summary.freed, 3 * 8192)
+        self.assertEqual(summary.unmeasured, 0)
+
+    def test_read_only(self):
+        """Directories bound read-only are left alone"""
+        data = self.directory('data')
+        mount = _bind(data)
+        mount['RW'] = False
+        summary = wipe_volumes([{'Mounts': [mount, _volume('db')]}], self.client)
+        self.assertTrue(os.path.exists(data))
+        self.assertEqual(summary.directories, [])
+        self.assertEqual(self.client.removed, ['db'])
+
+    def test_system_directories(self):
+        """Nothing that belongs to the system is ever a target"""
+        mounts = [_bind(path) for path in ('/', '/etc', '/etc/ssl/certs', '/usr/lib',
+                                           '/var', '/var/lib/docker', '/home',
+                                           os.path.expanduser('~'))]
+        self.assertEqual(wipe_targets([{'Mounts': mounts}]), ([], []))
+
+    def test_outside_project(self):
+        """The helper only removes directories in the project, unless told to"""
+        project = self.directory('project')
+        outside = self.directory('outside')
+        inspects = [{'Mounts': [_bind(outside)]}]
+        with mock.patch('control.wipe.shutil.rmtree',
+                        side_effect=PermissionError(13, 'Permission denied')):
+            summary = wipe_volumes(inspects, self.client, root=project)
+        self.assertTrue(os.path.exists(outside))
+        self.assertFalse(self.client.containers)
+        self.assertEqual(list(summary.failed), [outside])
+        with mock.patch('control.wipe.shutil.rmtree',
+                        side_effect=PermissionError(13, 'Permission denied')):
+            summary = wipe_volumes(inspects, self.client, root=project, anywhere=True)
+        self.assertFalse(os.path.exists(outside))
+        self.assertEqual(summary.helped, [outside])
+
+    def test_summary(self):
+        """The summary reads well with nothing, and with sizes nobody knew"""
+        self.assertEqual(str(WipeSummary()), 'Nothing to wipe')
+        summary = WipeSummary()
+        summary.removed('volumes', 'db', None)
+        summary.removed('directories', '/srv/data', 2000)
+        self.assertEqual(str(summary), 'Wiped 1 volume and 1 directory, freeing 2.0 kB '
+                                       'and however much 1 more took')
+
+
+if __name__ == '__main__':
+    unittest.main()
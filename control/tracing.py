@@ -0,0 +1,137 @@
+"""
+Record how long each phase of a Control run takes, and write it out in the
+Chrome trace_event format so it can be opened in chrome://tracing or
+Perfetto.
+
+Tracing is off unless --trace is given. While it is off, span() hands back
+a shared object whose __enter__ and __exit__ do nothing, and functions
+wrapped with traced() check one attribute before calling straight through,
+so instrumented code costs next to nothing.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+module_logger = logging.getLogger('control.tracing')
+module_logger.setLevel(logging.DEBUG)
+
+
+class _NullSpan:
+    """Stands in for a Span when tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        """Add attributes to the span"""
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """A named, timed piece of work with attributes"""
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.begin = 0.0
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer.record(self.name, self.begin, end, self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """Add attributes to the span"""
+        self.attrs.update(attrs)
+
+
+class Tracer:
+    """Collects spans from every thread in the process"""
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def start(self):
+        """Start recording a new trace, throwing away any previous one"""
+        with self.lock:
+            self.events = []
+            self.origin = time.perf_counter()
+            self.enabled = True
+
+    def stop(self):
+        """Stop recording"""
+        self.enabled = False
+
+    def span(self, name, **attrs):
+        """A context manager that records the time spent inside it"""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, attrs)
+
+    def record(self, name, begin, end, attrs):
+        """Add a finished span. Times are from time.perf_counter()"""
+        event = {
+            'name': name,
+            'cat': name.partition('.')[0],
+            'ph': 'X',
+            'ts': round((begin - self.origin) * 1e6, 3),
+            'dur': round((end - begin) * 1e6, 3),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': {k: str(v) for k, v in attrs.items()},
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write(self, path):
+        """Write the trace to path as Chrome trace_event JSON"""
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        module_logger.debug('wrote %i spans to %s', len(events), path)
+
+
+# Every span in this process goes here
+tracer = Tracer()
+
+
+def span(name, **attrs):
+    """Shorthand for tracer.span"""
+    return tracer.span(name, **attrs)
+
+
+def traced(name, attrs=None):
+    """
+    Decorate a function so each call is recorded as a span. attrs is called
+    with the function's arguments and returns the span's attributes.
+    """
+    def decorator(func):  # pylint: disable=missing-docstring
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):  # pylint: disable=missing-docstring
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name, attrs(*args, **kwargs) if attrs else {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,197 @@
+"""
+Watch files and directories for changes.
+
+On Linux the kernel tells us about changes through inotify, which libc
+exposes and ctypes can call. Everywhere else, or when inotify cannot be set
+up (out of watches, no libc), the watched trees are polled for changes to
+file mtimes and sizes.
+
+Either way a watcher has two methods:
+- add(path): watch a file, or a directory and everything under it
+- changes(timeout): block for up to timeout seconds, and return the set of
+  paths that changed. The set is empty if nothing changed.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+module_logger = logging.getLogger('control.watch')
+module_logger.setLevel(logging.DEBUG)
+
+# Directories that are never worth watching
+IGNORED_DIRS = {'.git', '.hg', '.svn', '__pycache__'}
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _walk_dirs(path):
+    for root, dirs, _ in os.walk(path):
+        dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+        yield root
+
+
+class InotifyWatcher:
+    """Watch paths using Linux's inotify"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+
+    def _watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                return
+            raise OSError(err, 'inotify_add_watch failed for {}'.format(path))
+        self.watches[wd] = path
+
+    def add(self, path):
+        """Watch a file, or a directory and everything under it"""
+        if os.path.isdir(path):
+            for directory in _walk_dirs(path):
+                self._watch(directory)
+        else:
+            self._watch(path)
+
+    def changes(self, timeout):
+        """Return the set of paths that changed within timeout seconds"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            base = self.watches.get(wd)
+            if base is None:
+                continue
+            path = os.path.join(base, os.fsdecode(name)) if name else base
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # New directories need watches of their own
+                self.add(path)
+            elif not name and mask & IN_DELETE_SELF:
+                # Editors that save by replacing the file leave the watch on
+                # the old file, so watch whatever is at the path now
+                self._watch(path)
+            if os.path.basename(path) not in IGNORED_DIRS:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        """Stop watching everything"""
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Watch paths by comparing the mtime and size of every file"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.paths = set()
+        self.snapshot = {}
+
+    def _scan(self):
+        found = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                for directory in _walk_dirs(path):
+                    for entry in os.scandir(directory):
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        found[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            else:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found[path] = (stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def add(self, path):
+        """Watch a file, or a directory and everything under it"""
+        self.paths.add(path)
+        self.snapshot = self._scan()
+
+    def changes(self, timeout):
+        """Return the set of paths that changed within timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            changed = {path
+                       for path in current.keys() | self.snapshot.keys()
+                       if current.get(path) != self.snapshot.get(path)}
+            self.snapshot = current
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        """Stop watching everything"""
+        self.paths = set()
+
+
+def watcher():
+    """Use inotify if the system has it, otherwise poll"""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError, TypeError) as e:
+        module_logger.debug('inotify unavailable, polling instead: %s', e)
+        return PollingWatcher()
+
+
+def drain(watch):
+    """Forget everything that has changed so far"""
+    while watch.changes(0):
+        pass
+
+
+def wait_for_changes(watch, debounce=0.5):
+    """
+    Block until something changes, then keep collecting changes until nothing
+    has changed for debounce seconds. Editors save several files at once, and
+    often write a file more than once per save.
+    """
+    changed = set()
+    while not changed:
+        changed = watch.changes(3600)
+    while True:
+        more = watch.changes(debounce)
+        if not more:
+            return changed
+        changed |= more
@@ -0,0 +1,322 @@
+"""
+Empty out the volumes of containers that have been removed.
+
+Named volumes are removed by docker, and host directories that were bound
+into the containers are removed here. Everything goes at once on a pool of
+threads, across all of the containers being wiped. Directories this user
+can't remove, which is usually because the container wrote to them as root,
+are handed to a single short-lived helper container that removes all of
+them as root. The helper only gets directories inside the project's
+directory, unless it is told otherwise. Directories bound read-only, and
+system directories, are never wiped.
+
+Sizes are taken before anything is removed: named volumes from docker's
+disk usage report, directories by walking them, and the directories the
+helper removes with du inside the helper.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import shutil
+
+import docker
+
+from control.progress import format_bytes
+
+module_logger = logging.getLogger('control.wipe')
+module_logger.setLevel(logging.DEBUG)
+
+DEFAULT_WORKERS = 8
+DEFAULT_HELPER_IMAGE = 'busybox:latest'
+DOCKER_VOLUMES = '/var/lib/docker/volumes/'
+# Never wiped, nor anything under them, whatever the Controlfile binds
+SYSTEM_DIRECTORIES = ('/bin', '/boot', '/dev', '/etc', '/lib', '/lib32', '/lib64', '/proc',
+                      '/root', '/run', '/sbin', '/sys', '/usr', '/var/cache', '/var/lib',
+                      '/var/log', '/var/run', '/var/spool')
+# Never wiped themselves, though what is under them can be
+SYSTEM_ROOTS = {'/', '/home', '/media', '/mnt', '/opt', '/srv', '/tmp', '/var'}
+# Where the helper mounts the parent of each directory it removes
+HELPER_ROOT = '/wipe'
+# Prints the size in kB of each target it removed, and the target
+HELPER_SCRIPT = """
+for target in "$@"; do
+    size=$(du -sk "$target" | cut -f1)
+    if rm -rf "$target"; then
+        echo "$size $target"
+    fi
+done
+"""
+
+
+def _is_volume(mount):
+    if 'Type' in mount:
+        return mount['Type'] == 'volume'
+    return bool(mount.get('Name')) and mount['Source'].startswith(DOCKER_VOLUMES)
+
+
+def protected(path):
+    """Whether path is a system directory that must never be wiped"""
+    for candidate in {os.path.normpath(path), os.path.realpath(path)}:
+        if candidate in SYSTEM_ROOTS or candidate == os.path.expanduser('~'):
+            return True
+        if any(candidate == system or candidate.startswith(system + '/')
+               for system in SYSTEM_DIRECTORIES):
+            return True
+    return False
+
+
+def within(path, root):
+    """Whether path is somewhere under the directory root"""
+    return os.path.realpath(path).startswith(os.path.join(os.path.realpath(root), ''))
+
+
+def wipe_targets(inspects):
+    """
+    The named volumes and host directories mounted into the inspected
+    containers, each once. Directories inside another directory being wiped
+    go along with it, and directories that are already gone are left out.
+    So are directories bound read-only, and system directories
+    """
+    volumes = set()
+    directories = set()
+    for inspect in inspects:
+        for mount in inspect.get('Mounts') or []:
+            if _is_volume(mount):
+                volumes.add(mount['Name'])
+            elif mount.get('RW') is False:
+                module_logger.debug('leaving %s, which was bound read-only', mount['Source'])
+            elif protected(mount['Source']):
+                module_logger.warning('Not wiping %s, which is a system directory',
+                                      mount['Source'])
+            elif os.path.isdir(mount['Source']):
+                directories.add(os.path.normpath(mount['Source']))
+            else:
+                module_logger.debug('docker removed volume %s', mount['Source'])
+    outermost = []
+    for path in sorted(directories):
+        if not outermost or not path.startswith(os.path.join(outermost[-1], '')):
+            outermost.append(path)
+    return sorted(volumes), outermost
+
+
+def directory_size(path):
+    """
+    Bytes the directory and everything under it take up on disk, counting
+    hard linked files once. None if some of it can't be read
+    """
+    seen = set()
+    try:
+        total = os.lstat(path).st_blocks * 512
+        stack = [path]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    st = entry.stat(follow_symlinks=False)
+                    if st.st_nlink > 1 and not entry.is_dir(follow_symlinks=False):
+                        if (st.st_dev, st.st_ino) in seen:
+                            continue
+                        seen.add((st.st_dev, st.st_ino))
+                    total += st.st_blocks * 512
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+    except PermissionError:
+        return None
+    return total
+
+
+class WipeSummary:
+    """What a wipe removed, what it couldn't, and how much space it freed"""
+
+    def __init__(self):
+        self.volumes = []
+        self.directories = []
+        # The directories the helper container removed
+        self.helped = []
+        # name or path: why it couldn't be removed
+        self.failed = {}
+        self.freed = 0
+        # Removed, but nothing could say how big they were
+        self.unmeasured = 0
+
+    def removed(self, kind, name, size):
+        """Count something as removed, with its size if it's known"""
+        getattr(self, kind).append(name)
+        if size is None:
+            self.unmeasured += 1
+        else:
+            self.freed += size
+
+    def __str__(self):
+        parts = []
+        if self.volumes:
+            parts.append('{} volume{}'.format(len(self.volumes),
+                                              '' if len(self.volumes) == 1 else 's'))
+        directories = len(self.directories) + len(self.helped)
+        if directories:
+            parts.append('{} director{}'.format(directories,
+                                                'y' if directories == 1 else 'ies'))
+        if not parts:
+            summary = 'Nothing to wipe'
+        else:
+            summary = 'Wiped {}, freeing {}'.format(' and '.join(parts),
+                                                    format_bytes(self.freed))
+            if self.unmeasured:
+                summary += ' and however much {} more took'.format(self.unmeasured)
+        if self.failed:
+            summary += '. Could not remove {}'.format(', '.join(sorted(self.failed)))
+        return summary
+
+
+class Wiper:
+    """Removes the volumes of containers, workers at a time"""
+
+    def __init__(self, client, workers=DEFAULT_WORKERS, helper_image=DEFAULT_HELPER_IMAGE,
+                 root=None, anywhere=False):
+        """
+        The helper only removes directories under root, the project's
+        directory, unless anywhere is set
+        """
+        self.client = client
+        self.workers = workers
+        self.helper_image = helper_image
+        self.root = root
+        self.anywhere = anywhere
+
+    def volume_sizes(self):
+        """The sizes docker knows for its volumes, if it is new enough to say"""
+        if not hasattr(self.client, 'df'):
+            return {}
+        try:
+            usage = self.client.df()
+        except docker.errors.APIError as e:
+            module_logger.debug('cannot get volume sizes: %s', e)
+            return {}
+        return {volume['Name']: volume['UsageData']['Size']
+                for volume in usage.get('Volumes') or []
+                if (volume.get('UsageData') or {}).get('Size', -1) >= 0}
+
+    def wipe(self, inspects):
+        """Remove every volume mounted into the inspected containers"""
+        summary = WipeSummary()
+        volumes, directories = wipe_targets(inspects)
+        if not volumes and not directories:
+            return summary
+        sizes = self.volume_sizes() if volumes else {}
+        denied = []
+        workers = max(1, min(self.workers, len(volumes) + len(directories)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            removals = [pool.submit(self._remove_volume, name) for name in volumes]
+            removals += [pool.submit(self._remove_directory, path) for path in directories]
+            for future in removals:
+                kind, name, result = future.result()
+                if kind == 'volumes':
+                    summary.removed(kind, name, sizes.get(name))
+                elif kind == 'directories':
+                    summary.removed(kind, name, result)
+                elif kind == 'denied':
+                    denied.append((name, result))
+                elif kind == 'failed':
+                    summary.failed[name] = result
+        helpable = []
+        for path, size in denied:
+            if self.anywhere or (self.root and within(path, self.root)):
+                helpable.append((path, size))
+            else:
+                module_logger.warning('Cannot remove %s, and it is outside of the project for '
+                                      'the wipe helper to remove', path)
+                summary.failed[path] = 'permission denied outside of the project'
+        if helpable:
+            self._helper_wipe(helpable, summary)
+        return summary
+
+    def _remove_volume(self, name):
+        module_logger.debug('having docker remove %s', name)
+        try:
+            self.client.remove_volume(name)
+        except docker.errors.APIError as e:
+            explanation = e.explanation.decode('utf-8')
+            if 'no such volume' in explanation:
+                # Already gone, which is what we wanted
+                return 'gone', name, None
+            module_logger.warning('cannot remove volume %s: %s', name, explanation)
+            return 'failed', name, explanation
+        return 'volumes', name, None
+
+    def _remove_directory(self, path):
+        size = directory_size(path)
+        if size is None:
+            # We can't even see all of it, so leave all of it to the helper
+            return 'denied', path, None
+        module_logger.debug('removing %s', path)
+        try:
+            shutil.rmtree(path)
+        except PermissionError as e:
+            module_logger.debug('cannot remove %s: %s', path, e)
+            return 'denied', path, size
+        except OSError as e:
+            module_logger.warning('Cannot remove directory %s: %s', path, e)
+            return 'failed', path, str(e)
+        return 'directories', path, size
+
+    def _helper_wipe(self, denied, summary):
+        """Remove the directories in one container, as root"""
+        parents = sorted({os.path.dirname(path) for path, _ in denied})
+        mounts = {parent: '{}/{}'.format(HELPER_ROOT, index)
+                  for index, parent in enumerate(parents)}
+        targets = {'{}/{}'.format(mounts[os.path.dirname(path)], os.path.basename(path)): path
+                   for path, _ in denied}
+        known = dict(denied)
+        module_logger.info('Removing %d directories owned by another user with %s',
+                           len(denied), self.helper_image)
+        try:
+            output = self._run_helper(mounts, sorted(targets))
+        except docker.errors.APIError as e:
+            explanation = e.explanation.decode('utf-8') if e.explanation else str(e)
+            module_logger.warning('Cannot run the wipe helper: %s', explanation)
+            for path, _ in denied:
+                summary.failed[path] = explanation
+            return
+        removed = {}
+        for line in output.decode('utf-8').splitlines():
+            size, _, target = line.strip().partition(' ')
+            if target in targets and size.isdigit():
+                removed[targets[target]] = int(size) * 1024
+        for path, _ in denied:
+            if path in removed:
+                # Our own measurement saw everything when there is one
+                size = known[path] if known[path] is not None else removed[path]
+                summary.removed('helped', path, size)
+            else:
+                module_logger.warning('Cannot remove directory %s', path)
+                summary.failed[path] = 'the wipe helper could not remove it'
+
+    def _run_helper(self, mounts, targets):
+        """Run the helper over the targets and return what it printed"""
+        config = dict(
+            command=['sh', '-c', HELPER_SCRIPT, 'wipe'] + targets,
+            volumes=sorted(mounts.values()),
+            host_config=self.client.create_host_config(binds={
+                parent: {'bind': inside, 'mode': 'rw'} for parent, inside in mounts.items()}),
+        )
+        try:
+            container = self.client.create_container(self.helper_image, **config)
+        except docker.errors.NotFound:
+            module_logger.debug('pulling %s', self.helper_image)
+            self.client.pull(self.helper_image)
+            container = self.client.create_container(self.helper_image, **config)
+        try:
+            self.client.start(container['Id'])
+            status = self.client.wait(container['Id'])
+            if isinstance(status, dict):
+                status = status.get('StatusCode')
+            module_logger.debug('wipe helper exited with %s', status)
+            return self.client.logs(container['Id'], stdout=True, stderr=False)
+        finally:
+            self.client.remove_container(container['Id'], force=True)
+
+
+def wipe_volumes(inspects, client, workers=DEFAULT_WORKERS, helper_image=DEFAULT_HELPER_IMAGE,
+                 root=None, anywhere=False):
+    """Wipe the volumes of the inspected containers. Returns a WipeSummary"""
+    return Wiper(client, workers, helper_image, root, anywhere).wipe(inspects)